@@ -26,4 +26,9 @@ class AccountLimitsAdmin(admin.ModelAdmin):
 @admin.register(AccountLimitOverrideRequest)
 class AccountLimitOverrideRequestAdmin(admin.ModelAdmin):
     list_display =[field.name for field in AccountLimitOverrideRequest._meta.fields]
-    search_fields = ("account", "customer")
\ No newline at end of file
+    search_fields = ("account", "customer")
+@admin.register(MpesaCallback)
+class MpesaCallbackAdmin(admin.ModelAdmin):
+    list_display = ("dedupe_key", "callback_type", "status", "result_code", "transaction", "created_at", "processed_at")
+    list_filter = ("callback_type", "status")
+    search_fields = ("dedupe_key",)
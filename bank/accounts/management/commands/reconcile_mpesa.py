@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from datetime import date, datetime, time, timedelta
+from accounts.services import mpesa_reconciliation
+
+
+class Command(BaseCommand):
+    help = 'Reconcile completed M-Pesa transactions against a downloaded M-Pesa statement CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help='Path to the statement CSV')
+        parser.add_argument('--date', type=date.fromisoformat, help='Statement day (YYYY-MM-DD), defaults to yesterday')
+        parser.add_argument('--days', type=int, default=1, help='Number of days covered by the statement')
+        parser.add_argument('--report', help='Where to write the discrepancy report, defaults to <statement>.report.csv')
+
+    def handle(self, *args, **options):
+        day = options['date'] or timezone.localdate() - timedelta(days=1)
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        end = start + timedelta(days=options['days'])
+        report_path = options['report'] or f"{options['statement']}.report.csv"
+
+        try:
+            with open(options['statement'], newline='', encoding='utf-8-sig') as statement, \
+                    open(report_path, 'w', newline='') as report:
+                summary = mpesa_reconciliation.reconcile_statement(statement, start, end, report)
+        except FileNotFoundError as e:
+            raise CommandError(str(e))
+
+        issues = sum(summary[key] for key in (
+            'missing_in_ledger', 'missing_in_statement', 'duplicate', 'ledger_duplicate', 'amount_mismatch'
+        ))
+        style = self.style.SUCCESS if not issues else self.style.WARNING
+        self.stdout.write(style(
+            f"Reconciled {summary['statement_rows']} statement rows against "
+            f"{summary['ledger_transactions']} transactions: {summary['matched']} matched, {issues} issues"
+        ))
+        for key, value in summary.items():
+            self.stdout.write(f"  {key}: {value}")
+        self.stdout.write(f"Report written to {report_path}")
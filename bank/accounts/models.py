@@ -5,8 +5,12 @@ from auth_service.models import *
 from django.db.models import Q
 from .utility import *
 import uuid
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from bank.cache import cached_query, invalidate
+
+
+ACCOUNT_TYPES_CACHE = 'account-types'
 
 
 class AccountType(BaseModel):
@@ -62,6 +66,16 @@ class AccountType(BaseModel):
     def __str__(self):
         return f"{self.get_name_display()} ({self.code})"
 
+    @classmethod
+    def cached(cls, pk=None, name=None):
+        """The account type with this id or name from the shared cache, raises AccountType.DoesNotExist"""
+        # a handful of rows, read for every account serialized or opened
+        account_types = cached_query(ACCOUNT_TYPES_CACHE, 'all', lambda: list(cls.objects.all()))
+        for account_type in account_types:
+            if account_type.pk == pk or account_type.name == name:
+                return account_type
+        raise cls.DoesNotExist(f"No account type {name or pk}")
+
     class Meta:
         db_table = 'account_type'
         indexes = [
@@ -253,6 +267,20 @@ class AccountLimit(BaseModel):
             ("can_override_account_limits", "Can override account limits"),
         ]
 
+@receiver([post_save, post_delete], sender=AccountType)
+def reload_account_types(sender, **kwargs):
+    invalidate(ACCOUNT_TYPES_CACHE)
+
+
+@receiver(post_save, sender=Account)
+def refresh_balance_snapshot(sender, instance, update_fields=None, **kwargs):
+    from .services import balances
+
+    balances.refresh_after_commit([instance.id])
+    if not update_fields or not set(update_fields) <= balances.BALANCE_FIELDS:
+        balances.forget_customer_accounts([instance.customer_id])
+
+
 @receiver(post_save, sender=AccountLimit)
 def create_transaction_limits(sender, instance, created, **kwargs):
     """Auto-create TransactionLimit tracking records"""
@@ -489,4 +517,49 @@ class BeneficiaryAccount(BaseModel):
         unique_together = ('customer', 'beneficiary_account_number')
         permissions = [
             ("can_manage_beneficiaries", "Can manage beneficiary accounts"),
-        ]
\ No newline at end of file
+        ]
+
+class MpesaCallback(BaseModel):
+    """
+    Inbox of raw Safaricom STK / B2C callbacks, stored before any processing so a
+    burst of callbacks is acknowledged immediately and posted later in batches
+    """
+    CALLBACK_TYPE_CHOICES = (
+        ('STK', 'STK Push'),
+        ('B2C', 'Business to Customer'),
+    )
+    STATUS_CHOICES = (
+        ('RECEIVED', 'Received'),
+        ('PROCESSED', 'Processed'),
+        ('UNMATCHED', 'Unmatched'),
+        ('FAILED', 'Failed'),
+    )
+
+    callback_type = models.CharField(max_length=10, choices=CALLBACK_TYPE_CHOICES)
+    # CheckoutRequestID for STK (Transaction.external_ref), OriginatorConversationID for B2C (Transaction.transaction_ref)
+    dedupe_key = models.CharField(max_length=100, unique=True)
+    payload = models.JSONField()
+    result_code = models.IntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='RECEIVED')
+    error = models.TextField(blank=True)
+    transaction = models.ForeignKey(
+        'transactions.Transaction',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='mpesa_callbacks',
+        db_constraint=False  # transactions is partitioned on Postgres
+    )
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # an unmatched callback stays RECEIVED and is retried from then on, until MPESA_CALLBACK_MATCH_WINDOW runs out
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.callback_type} callback {self.dedupe_key} - {self.status}"
+
+    class Meta:
+        db_table = 'mpesa_callback'
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
@@ -22,15 +22,11 @@ class HasAccountPermission(BasePermission):
 
         # GET method - only view permission required
         if request.method in ['GET']:
-            return user.role.permissions.filter(
-                codename='can_view_all_accounts'
-            ).exists()
+            return user.role.has_any_permission('can_view_all_accounts')
 
         # POST, PUT, PATCH, DELETE methods - manage permission required
         elif request.method in ['POST', 'DELETE', 'PUT']:
-            return user.role.permissions.filter(
-                codename__in=['can_modify_account_limits', 'can_freeze_accounts','can_close_account']
-            ).exists()
+            return user.role.has_any_permission('can_modify_account_limits', 'can_freeze_accounts','can_close_account')
 
         # For any other methods, deny by default
         return False
@@ -14,7 +14,7 @@ class AccountSerializer(serializers.ModelSerializer):
         fields = "__all__"
     
     def get_account_type(self, obj):
-        return obj.account_type.name
+        return AccountType.cached(pk=obj.account_type_id).name
 
     def get_customer(self, obj):
         if obj.customer is None:
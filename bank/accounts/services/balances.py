@@ -0,0 +1,272 @@
+"""
+Balance snapshots for polling clients.
+
+A snapshot is an account's balance, available_balance, status and the time of
+its last posted transaction. Every write that changes them calls
+refresh_after_commit() (Account saves do it from a post_save receiver); once
+the transaction commits the accounts are re-read from the primary and their
+snapshots rewritten, so AccountView.get answers balance polls from the store
+alone.
+
+Snapshots are versioned so a slow refresh never puts back an older one. Each
+refresh (and each fill after a miss) takes the account's next version from a
+counter kept with the snapshot before it reads the row, and a snapshot only
+replaces one with a lower version. The refresh holding the highest version
+read the row after every writer with a lower one had committed, so once the
+after-commit refreshes have run the stored snapshot is never older than a
+committed write.
+
+A snapshot is only served for BALANCE_SNAPSHOT_TTL seconds after it was
+written, then the next poll reloads it from the primary. After-commit refreshes
+are best effort (a store outage is logged, the write stands), so the TTL is what
+bounds how long a poll can see a balance from before a missed refresh; keep it
+short.
+
+RedisBalanceStore keeps each snapshot and its counter in one hash and compares
+versions in a Lua call. InMemoryBalanceStore is per process, for tests and
+local runs only: other processes would never see its refreshes.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from functools import partial
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from bank.cache import cached_query, invalidate
+from bank.routers import PRIMARY
+import threading
+import time
+
+# Account columns carried by a snapshot; saves touching only these leave the cached account list alone
+SNAPSHOT_FIELDS = ('balance', 'available_balance', 'status')
+BALANCE_FIELDS = frozenset(SNAPSHOT_FIELDS + ('updated_at',))
+
+
+class InMemoryBalanceStore:
+
+    def __init__(self, ttl=60, max_accounts=100000):
+        self.ttl = ttl
+        self.max_accounts = max_accounts
+        self.snapshots = OrderedDict()
+        self.expires = {}
+        self.issued = {}
+        self.lock = threading.Lock()
+
+    def reserve(self, account_ids):
+        with self.lock:
+            versions = {}
+            for account_id in account_ids:
+                versions[account_id] = self.issued[account_id] = self.issued.get(account_id, 0) + 1
+            return versions
+
+    def put(self, snapshots):
+        expires_at = time.monotonic() + self.ttl
+        with self.lock:
+            for account_id, snapshot in snapshots.items():
+                current = self.snapshots.get(account_id)
+                if current is not None and current['version'] >= snapshot['version']:
+                    continue
+                self.snapshots[account_id] = snapshot
+                self.snapshots.move_to_end(account_id)
+                self.expires[account_id] = expires_at
+                self.issued[account_id] = max(self.issued.get(account_id, 0), snapshot['version'])
+                if self.max_accounts and len(self.snapshots) > self.max_accounts:
+                    # the counter stays, so a refresh still in flight cannot outrank the next one
+                    evicted, _ = self.snapshots.popitem(last=False)
+                    del self.expires[evicted]
+
+    def get_many(self, account_ids):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                account_id: dict(self.snapshots[account_id]) for account_id in account_ids
+                if account_id in self.snapshots and self.expires[account_id] > now
+            }
+
+    def clear(self):
+        with self.lock:
+            self.snapshots.clear()
+            self.expires.clear()
+            self.issued.clear()
+
+
+# KEYS[1] snapshot hash: 'issued' counter, 'version' and the snapshot fields
+# ARGV: version, ttl, then field, value pairs
+PUT_SCRIPT = """
+local version = tonumber(ARGV[1])
+if version <= tonumber(redis.call('HGET', KEYS[1], 'version') or '0') then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'version', version, unpack(ARGV, 3))
+if tonumber(redis.call('HGET', KEYS[1], 'issued') or '0') < version then
+    redis.call('HSET', KEYS[1], 'issued', version)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class RedisBalanceStore:
+
+    def __init__(self, redis_url, ttl=60, prefix='balance:snapshot'):
+        import redis
+
+        self.client = redis.Redis.from_url(redis_url, decode_responses=True)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.script = self.client.register_script(PUT_SCRIPT)
+
+    def key(self, account_id):
+        return f"{self.prefix}:{account_id}"
+
+    def reserve(self, account_ids):
+        account_ids = list(account_ids)
+        pipe = self.client.pipeline(transaction=False)
+        for account_id in account_ids:
+            pipe.hincrby(self.key(account_id), 'issued', 1)
+            pipe.expire(self.key(account_id), self.ttl)
+        return dict(zip(account_ids, pipe.execute()[::2]))
+
+    def put(self, snapshots):
+        pipe = self.client.pipeline(transaction=False)
+        for account_id, snapshot in snapshots.items():
+            last = snapshot['last_transaction_at']
+            args = [
+                snapshot['version'], self.ttl,
+                'balance', str(snapshot['balance']),
+                'available_balance', str(snapshot['available_balance']),
+                'status', snapshot['status'],
+                'last_transaction_at', last.isoformat() if last else '',
+            ]
+            self.script(keys=[self.key(account_id)], args=args, client=pipe)
+        pipe.execute()
+
+    def parse(self, values):
+        return {
+            'balance': Decimal(values['balance']),
+            'available_balance': Decimal(values['available_balance']),
+            'status': values['status'],
+            'last_transaction_at': datetime.fromisoformat(values['last_transaction_at']) if values['last_transaction_at'] else None,
+            'version': int(values['version']),
+        }
+
+    def get_many(self, account_ids):
+        account_ids = list(account_ids)
+        pipe = self.client.pipeline(transaction=False)
+        for account_id in account_ids:
+            pipe.hgetall(self.key(account_id))
+        return {
+            account_id: self.parse(values)
+            for account_id, values in zip(account_ids, pipe.execute())
+            # a hash with only a reserved counter has no snapshot yet
+            if 'version' in values
+        }
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}:*"):
+            self.client.delete(key)
+
+
+def build_snapshot_store():
+    if settings.BALANCE_SNAPSHOT_REDIS_URL:
+        return RedisBalanceStore(settings.BALANCE_SNAPSHOT_REDIS_URL, ttl=settings.BALANCE_SNAPSHOT_TTL)
+    return InMemoryBalanceStore(ttl=settings.BALANCE_SNAPSHOT_TTL)
+
+
+snapshot_store = build_snapshot_store()
+
+
+def load_snapshots(account_ids):
+    """Snapshots of the accounts as committed on the primary, keyed by account id string, without versions"""
+    from ..models import Account
+    from transactions.models import LedgerEntry
+
+    rows = Account.objects.using(PRIMARY).filter(id__in=account_ids).values('id', *SNAPSHOT_FIELDS)
+    last_entries = dict(
+        LedgerEntry.objects.using(PRIMARY).filter(account_id__in=account_ids).values('account_id').annotate(
+            last=Max('created_at')
+        ).order_by().values_list('account_id', 'last')
+    )
+    return {
+        str(row['id']): {
+            'balance': row['balance'],
+            'available_balance': row['available_balance'],
+            'status': row['status'],
+            'last_transaction_at': last_entries.get(row['id']),
+        }
+        for row in rows
+    }
+
+
+def refresh(account_ids):
+    """Rewrite the accounts' snapshots from the primary, returns them"""
+    account_ids = sorted({str(account_id) for account_id in account_ids})
+    # versions first: a row read after taking version n includes every write committed before n was taken
+    versions = snapshot_store.reserve(account_ids)
+    snapshots = load_snapshots(account_ids)
+    for account_id, snapshot in snapshots.items():
+        snapshot['version'] = versions[account_id]
+    snapshot_store.put(snapshots)
+    return snapshots
+
+
+def refresh_after_commit(account_ids):
+    """Refresh the accounts' snapshots once the current transaction commits (right away outside one)"""
+    account_ids = {account_id for account_id in account_ids if account_id}
+    if account_ids:
+        # robust: a store outage is logged, the committed write stands
+        transaction.on_commit(partial(refresh, account_ids), using=PRIMARY, robust=True)
+
+
+def get_snapshots(account_ids):
+    """Snapshots keyed by account id string, the missing ones loaded from the primary"""
+    account_ids = [str(account_id) for account_id in account_ids]
+    snapshots = snapshot_store.get_many(account_ids)
+    missing = [account_id for account_id in account_ids if account_id not in snapshots]
+    if missing:
+        snapshots.update(refresh(missing))
+    return snapshots
+
+
+def customer_accounts_namespace(customer_id):
+    return f"customer-accounts:{customer_id}"
+
+
+def forget_customer_accounts(customer_ids):
+    """Drop the cached account lists of these customers, after a change other than to balances or status"""
+    for customer_id in {customer_id for customer_id in customer_ids if customer_id}:
+        invalidate(customer_accounts_namespace(customer_id))
+
+
+def customer_accounts(user_id):
+    """
+    The user's accounts, primary first, as AccountSerializer data with the
+    balance fields taken from the snapshots. Served from the cache when warm.
+    """
+    from ..models import Account, CustomerProfile
+    from ..serializers import AccountSerializer
+
+    customer_id = cached_query(
+        'customer-profiles', user_id,
+        lambda: CustomerProfile.objects.values_list('id', flat=True).get(user_id=user_id)
+    )
+    accounts = cached_query(
+        customer_accounts_namespace(customer_id), 'list',
+        lambda: [
+            dict(account) for account in
+            AccountSerializer(Account.objects.filter(customer_id=customer_id).order_by('-is_primary'), many=True).data
+        ]
+    )
+    snapshots = get_snapshots([account['id'] for account in accounts])
+    for account in accounts:
+        snapshot = snapshots.get(str(account['id']))
+        if snapshot is not None:
+            account.update(
+                balance=str(snapshot['balance']),
+                available_balance=str(snapshot['available_balance']),
+                status=snapshot['status'],
+                last_transaction_at=snapshot['last_transaction_at'],
+                balance_version=snapshot['version'],
+            )
+    return accounts
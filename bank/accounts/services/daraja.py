@@ -0,0 +1,353 @@
+"""
+Pooled Daraja (M-Pesa) gateway.
+
+One gateway per shortcode is shared by every request in the process. It keeps
+a requests.Session with a keep-alive connection pool, caches the OAuth token
+(in memory and in the Django cache so workers share it) and refreshes it ahead
+of expiry, and throttles calls with a token bucket plus a bounded number of
+in-flight requests so bulk payouts go out at the rate Safaricom allows.
+Async views use apost()/astk_push(), which share the token and rate limit but
+send through an httpx client on the event loop.
+"""
+from asgiref.sync import sync_to_async
+from bank.async_views import http_client
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import asyncio
+import base64
+import httpx
+import logging
+import requests
+import threading
+import time
+import uuid
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+# refresh the token this many seconds before Safaricom expires it
+TOKEN_REFRESH_MARGIN = 300
+DEFAULT_TIMEOUT = (3.05, 30)
+
+
+class DarajaError(Exception):
+    """Raised when Daraja rejects a request or cannot be reached"""
+
+
+class DarajaOutcomeUnknown(DarajaError):
+    """
+    Raised when a request may have reached Daraja but no answer came back: a
+    transport error, a timeout, a server error or an unreadable response
+    """
+
+
+class RateLimiter:
+    """
+    Token bucket, `rate` requests per second with bursts of up to `capacity`
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    async def aacquire(self):
+        """acquire() that waits on the event loop instead of blocking it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+class DarajaGateway:
+
+    def __init__(self, base_url=None, consumer_key=None, consumer_secret=None, shortcode=None,
+                 passkey=None, initiator_name=None, security_credential=None,
+                 max_concurrency=None, rate_per_second=None, timeout=DEFAULT_TIMEOUT):
+        self.base_url = (base_url or mpesa_base_url()).rstrip('/') + '/'
+        self.consumer_key = consumer_key or settings.MPESA_CONSUMER_KEY
+        self.consumer_secret = consumer_secret or settings.MPESA_CONSUMER_SECRET
+        self.shortcode = str(shortcode or settings.MPESA_SHORTCODE)
+        self.passkey = passkey or settings.MPESA_PASSKEY
+        self.initiator_name = initiator_name or settings.MPESA_INITIATOR_USERNAME
+        self._security_credential = security_credential
+        self.max_concurrency = max_concurrency or settings.MPESA_MAX_CONCURRENCY
+        self.timeout = timeout
+
+        self.rate_limiter = RateLimiter(rate_per_second or settings.MPESA_RATE_LIMIT_PER_SECOND)
+        self.in_flight = threading.BoundedSemaphore(self.max_concurrency)
+
+        # pool sized to the concurrency limit so every in-flight call reuses a warm connection
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.max_concurrency,
+            max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._token = None
+        self._token_expires_at = 0
+        self._token_lock = threading.Lock()
+
+    @property
+    def token_cache_key(self):
+        return f"mpesa:token:{self.shortcode}"
+
+    def access_token(self):
+        """Return a valid OAuth token, fetching one only when the cached token is close to expiry"""
+        if self._token and time.time() < self._token_expires_at - TOKEN_REFRESH_MARGIN:
+            return self._token
+
+        with self._token_lock:
+            # another thread may have refreshed while we waited
+            if self._token and time.time() < self._token_expires_at - TOKEN_REFRESH_MARGIN:
+                return self._token
+
+            cached = cache.get(self.token_cache_key)
+            if cached and time.time() < cached['expires_at'] - TOKEN_REFRESH_MARGIN:
+                self._token, self._token_expires_at = cached['token'], cached['expires_at']
+                return self._token
+
+            self._fetch_token()
+            return self._token
+
+    def _fetch_token(self):
+        try:
+            response = self.session.get(
+                self.base_url + 'oauth/v1/generate',
+                params={'grant_type': 'client_credentials'},
+                auth=(self.consumer_key, self.consumer_secret),
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise DarajaError(f"Unable to reach Daraja for an access token: {str(e)}")
+
+        if response.status_code != 200:
+            raise DarajaError(f"Unable to generate access token: {response.status_code} {response.text}")
+
+        data = response.json()
+        self._token = data['access_token']
+        self._token_expires_at = time.time() + int(data.get('expires_in', 3599))
+        cache.set(
+            self.token_cache_key,
+            {'token': self._token, 'expires_at': self._token_expires_at},
+            timeout=int(data.get('expires_in', 3599))
+        )
+        logger.info(f"Fetched new M-Pesa access token for shortcode {self.shortcode}")
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token, self._token_expires_at = None, 0
+            cache.delete(self.token_cache_key)
+
+    @property
+    def security_credential(self):
+        """Encrypted initiator credential, the RSA encryption only runs once per gateway"""
+        if self._security_credential is None:
+            from django_daraja.mpesa.utils import encrypt_security_credential
+            self._security_credential = encrypt_security_credential(settings.MPESA_INITIATOR_SECURITY_CREDENTIAL)
+        return self._security_credential
+
+    def post(self, path, payload):
+        """POST to Daraja through the rate limiter and the in-flight bound, retrying once on an expired token"""
+        self.rate_limiter.acquire()
+        with self.in_flight:
+            for attempt in range(2):
+                try:
+                    response = self.session.post(
+                        self.base_url + path,
+                        json=payload,
+                        headers={'Authorization': f"Bearer {self.access_token()}"},
+                        timeout=self.timeout
+                    )
+                except requests.RequestException as e:
+                    raise DarajaOutcomeUnknown(f"Daraja request to {path} failed: {str(e)}")
+
+                if response.status_code == 401 and attempt == 0:
+                    logger.warning(f"M-Pesa token rejected for shortcode {self.shortcode}, refreshing")
+                    self.invalidate_token()
+                    continue
+                break
+
+        try:
+            data = response.json()
+        except ValueError:
+            raise DarajaOutcomeUnknown(f"Invalid response from Daraja {path}: {response.status_code} {response.text}")
+
+        if response.status_code >= 500:
+            raise DarajaOutcomeUnknown(data.get('errorMessage') or f"Daraja {path} returned {response.status_code}")
+        if response.status_code != 200:
+            raise DarajaError(data.get('errorMessage') or f"Daraja {path} returned {response.status_code}")
+        return data
+
+    async def apost(self, path, payload):
+        """
+        post() for async views: the call is awaited on the event loop through the
+        loop's pooled client (sized to max_concurrency), only a token refresh
+        goes to a thread
+        """
+        await self.rate_limiter.aacquire()
+        client = http_client(
+            f"daraja:{self.shortcode}",
+            base_url=self.base_url,
+            timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+            limits=httpx.Limits(max_connections=self.max_concurrency)
+        )
+        for attempt in range(2):
+            token = self._token
+            if not token or time.time() >= self._token_expires_at - TOKEN_REFRESH_MARGIN:
+                token = await sync_to_async(self.access_token, thread_sensitive=False)()
+            try:
+                response = await client.post(path, json=payload, headers={'Authorization': f"Bearer {token}"})
+            except httpx.HTTPError as e:
+                raise DarajaOutcomeUnknown(f"Daraja request to {path} failed: {str(e)}")
+
+            if response.status_code == 401 and attempt == 0:
+                logger.warning(f"M-Pesa token rejected for shortcode {self.shortcode}, refreshing")
+                await sync_to_async(self.invalidate_token, thread_sensitive=False)()
+                continue
+            break
+
+        try:
+            data = response.json()
+        except ValueError:
+            raise DarajaOutcomeUnknown(f"Invalid response from Daraja {path}: {response.status_code} {response.text}")
+
+        if response.status_code >= 500:
+            raise DarajaOutcomeUnknown(data.get('errorMessage') or f"Daraja {path} returned {response.status_code}")
+        if response.status_code != 200:
+            raise DarajaError(data.get('errorMessage') or f"Daraja {path} returned {response.status_code}")
+        return data
+
+    def stk_push_request(self, phone_number, amount, account_reference, transaction_desc, callback_url):
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        password = base64.b64encode(f"{self.shortcode}{self.passkey}{timestamp}".encode('ascii')).decode('utf-8')
+        phone_number = format_phone_number(phone_number)
+
+        return {
+            'BusinessShortCode': self.shortcode,
+            'Password': password,
+            'Timestamp': timestamp,
+            'TransactionType': 'CustomerPayBillOnline',
+            'Amount': int(amount),
+            'PartyA': phone_number,
+            'PartyB': self.shortcode,
+            'PhoneNumber': phone_number,
+            'CallBackURL': callback_url,
+            'AccountReference': account_reference,
+            'TransactionDesc': transaction_desc,
+        }
+
+    def stk_push(self, phone_number, amount, account_reference, transaction_desc, callback_url):
+        return self.post('mpesa/stkpush/v1/processrequest', self.stk_push_request(
+            phone_number, amount, account_reference, transaction_desc, callback_url
+        ))
+
+    async def astk_push(self, phone_number, amount, account_reference, transaction_desc, callback_url):
+        return await self.apost('mpesa/stkpush/v1/processrequest', self.stk_push_request(
+            phone_number, amount, account_reference, transaction_desc, callback_url
+        ))
+
+    def b2c_payment(self, phone_number, amount, remarks, callback_url, occasion='',
+                    command_id='BusinessPayment', originator_conversation_id=None):
+        return self.post('mpesa/b2c/v3/paymentrequest', {
+            'OriginatorConversationID': originator_conversation_id or str(uuid.uuid4()),
+            'InitiatorName': self.initiator_name,
+            'SecurityCredential': self.security_credential,
+            'CommandID': command_id,
+            'Amount': int(amount),
+            'PartyA': self.shortcode,
+            'PartyB': format_phone_number(phone_number),
+            'Remarks': remarks,
+            'QueueTimeOutURL': callback_url,
+            'ResultURL': callback_url,
+            'Occassion': occasion,
+        })
+
+    def bulk_b2c(self, payouts, callback_url):
+        """
+        Send many B2C payouts concurrently, at most `max_concurrency` in flight and
+        throttled to the gateway rate. Each payout is a dict with phone_number,
+        amount, remarks and optionally occasion / originator_conversation_id.
+        Returns {OriginatorConversationID: {'ok', 'response' | 'error', 'unknown'}},
+        `unknown` set when the payout may have gone out without Daraja saying so.
+        """
+        for payout in payouts:
+            payout.setdefault('originator_conversation_id', str(uuid.uuid4()))
+
+        def send(payout):
+            try:
+                response = self.b2c_payment(
+                    payout['phone_number'],
+                    payout['amount'],
+                    payout.get('remarks', 'Payout'),
+                    callback_url,
+                    occasion=payout.get('occasion', ''),
+                    originator_conversation_id=payout['originator_conversation_id']
+                )
+                return payout['originator_conversation_id'], {'ok': response.get('ResponseCode') == '0', 'response': response}
+            except DarajaError as e:
+                logger.error(f"B2C payout {payout['originator_conversation_id']} failed: {str(e)}")
+                return payout['originator_conversation_id'], {
+                    'ok': False, 'error': str(e), 'unknown': isinstance(e, DarajaOutcomeUnknown)
+                }
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return dict(executor.map(send, payouts))
+
+
+def mpesa_base_url():
+    if getattr(settings, 'MPESA_BASE_URL', ''):
+        return settings.MPESA_BASE_URL
+    from django_daraja.mpesa.utils import api_base_url
+    return api_base_url()
+
+
+def format_phone_number(phone_number):
+    """2547XXXXXXXX from 07.., +2547.. or 2547.. numbers"""
+    phone_number = str(phone_number).strip().lstrip('+')
+    if len(phone_number) < 9:
+        raise DarajaError(f"Phone number {phone_number} is too short")
+    return '254' + phone_number[-9:]
+
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(shortcode=None):
+    """Process wide gateway for a shortcode, created on first use"""
+    shortcode = str(shortcode or settings.MPESA_SHORTCODE)
+    gateway = _gateways.get(shortcode)
+    if gateway is None:
+        with _gateways_lock:
+            gateway = _gateways.get(shortcode)
+            if gateway is None:
+                gateway = _gateways[shortcode] = DarajaGateway(shortcode=shortcode)
+    return gateway
@@ -0,0 +1,244 @@
+"""
+Posting of M-Pesa callbacks from the MpesaCallback inbox.
+
+The callback views only append to the inbox. Workers claim RECEIVED rows with
+SKIP LOCKED, so several of them can drain the inbox in parallel. Each callback
+is matched to its open MPESA_DEPOSIT / MPESA_WITHDRAWAL transaction: an STK
+callback through external_ref (the CheckoutRequestID), a B2C result through
+transaction_ref (sent as the OriginatorConversationID). A whole batch is posted
+in one database transaction against the SYSTEM_MPESA_ACCOUNT settlement account.
+
+A callback can arrive before its transaction is committed. Unmatched callbacks
+stay RECEIVED and are retried every MPESA_CALLBACK_RETRY_DELAY seconds; they
+only become UNMATCHED once MPESA_CALLBACK_MATCH_WINDOW has passed since they
+arrived.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from ..models import Account, MpesaCallback
+from .balances import refresh_after_commit
+from .mpesa_withdrawals import release_holds
+from transactions.models import Transaction, LedgerEntry, LedgerEntryType, TransactionType, TransactionStatus
+from transactions.services.posting import SYSTEM_MPESA_ACCOUNT, get_internal_account, lock_accounts
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BATCH_SIZE = 500
+
+# a withdrawal is PROCESSING from the moment it is claimed for sending
+OPEN_STATUSES = [TransactionStatus.PENDING, TransactionStatus.PROCESSING]
+
+
+def match_key(txn):
+    """The dedupe_key of the callback settling the transaction, with its callback type"""
+    if txn.transaction_type == TransactionType.MPESA_DEPOSIT:
+        return 'STK', txn.external_ref
+    return 'B2C', txn.transaction_ref
+
+
+def customer_account_id(txn):
+    """Customer side of an M-Pesa transaction, credited on deposit and debited on withdrawal"""
+    if txn.transaction_type == TransactionType.MPESA_DEPOSIT:
+        return txn.destination_account_id
+    return txn.source_account_id
+
+
+def callback_details(callback):
+    """Pull the result description, amount and receipt out of a raw STK / B2C payload"""
+    if callback.callback_type == 'STK':
+        body = callback.payload.get('Body', {}).get('stkCallback', {})
+        items = {
+            item.get('Name'): item.get('Value')
+            for item in body.get('CallbackMetadata', {}).get('Item', [])
+        }
+        amount, receipt = items.get('Amount'), items.get('MpesaReceiptNumber')
+    else:
+        body = callback.payload.get('Result', {})
+        params = {
+            param.get('Key'): param.get('Value')
+            for param in body.get('ResultParameters', {}).get('ResultParameter', [])
+        }
+        amount, receipt = params.get('TransactionAmount'), body.get('TransactionID')
+
+    try:
+        amount = Decimal(str(amount)) if amount is not None else None
+    except InvalidOperation:
+        amount = None
+
+    return {'result_desc': body.get('ResultDesc', ''), 'amount': amount, 'receipt': receipt}
+
+
+def process_callback_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Claim and post one batch of RECEIVED callbacks.
+    A withdrawal's amount was held out of available_balance when it was recorded:
+    posting it takes the amount off balance and releases the hold, a failed
+    result gives the held amount back.
+    """
+    summary = {'claimed': 0, 'posted': 0, 'failed': 0, 'unmatched': 0, 'deferred': 0}
+
+    with transaction.atomic():
+        now = timezone.now()
+        callbacks = list(
+            MpesaCallback.objects.select_for_update(skip_locked=True)
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now), status='RECEIVED')
+            .order_by('created_at')[:batch_size]
+        )
+        if not callbacks:
+            return summary
+        summary['claimed'] = len(callbacks)
+
+        keys = defaultdict(list)
+        for callback in callbacks:
+            keys[callback.callback_type].append(callback.dedupe_key)
+        pending = {
+            match_key(txn): txn
+            for txn in Transaction.objects.select_for_update().filter(
+                Q(transaction_type=TransactionType.MPESA_DEPOSIT, external_ref__in=keys['STK'])
+                | Q(transaction_type=TransactionType.MPESA_WITHDRAWAL, transaction_ref__in=keys['B2C']),
+                trans_status__in=OPEN_STATUSES
+            )
+        }
+
+        match_window = timedelta(seconds=settings.MPESA_CALLBACK_MATCH_WINDOW)
+        to_post = []
+        transactions_to_update = []
+        failed_withdrawals = []
+
+        for callback in callbacks:
+            txn = pending.pop((callback.callback_type, callback.dedupe_key), None)
+            if not txn:
+                if now - callback.created_at < match_window:
+                    # the transaction may not be committed yet
+                    callback.next_attempt_at = now + timedelta(seconds=settings.MPESA_CALLBACK_RETRY_DELAY)
+                    summary['deferred'] += 1
+                    continue
+                callback.status = 'UNMATCHED'
+                callback.processed_at = now
+                summary['unmatched'] += 1
+                continue
+
+            callback.processed_at = now
+
+            callback.transaction = txn
+            details = callback_details(callback)
+
+            if callback.result_code != 0:
+                # cancelled / timed out on the customer's phone, nothing was moved
+                callback.status = 'PROCESSED'
+                txn.trans_status = TransactionStatus.FAILED
+                txn.last_error = details['result_desc']
+                transactions_to_update.append(txn)
+                if txn.transaction_type == TransactionType.MPESA_WITHDRAWAL:
+                    failed_withdrawals.append(txn)
+                summary['failed'] += 1
+            elif details['amount'] is not None and details['amount'] != txn.amount:
+                # leave the transaction PENDING for investigation
+                callback.status = 'FAILED'
+                callback.error = f"Amount mismatch: callback {details['amount']}, transaction {txn.amount}"
+                summary['failed'] += 1
+            elif not customer_account_id(txn):
+                callback.status = 'FAILED'
+                callback.error = f"Transaction {txn.transaction_ref} has no customer account"
+                summary['failed'] += 1
+            else:
+                callback.status = 'PROCESSED'
+                to_post.append((txn, details))
+
+        if to_post or failed_withdrawals:
+            settlement = get_internal_account(SYSTEM_MPESA_ACCOUNT)
+            customer_ids = [customer_account_id(txn) for txn, _ in to_post]
+            # every account this batch writes, in one ordered pass
+            locked = lock_accounts(settlement.id, *customer_ids, *[txn.source_account_id for txn in failed_withdrawals])
+
+        if to_post:
+            balances = {account_id: account.balance for account_id, account in locked.items()}
+            deltas = defaultdict(Decimal)
+            available_deltas = defaultdict(Decimal)
+            entries = []
+
+            for (txn, details), customer_id in zip(to_post, customer_ids):
+                if txn.transaction_type == TransactionType.MPESA_DEPOSIT:
+                    debit_id, credit_id = settlement.id, customer_id
+                    txn.source_account_id = settlement.id
+                else:
+                    debit_id, credit_id = customer_id, settlement.id
+                    txn.destination_account_id = settlement.id
+
+                txn.source_balance_before = balances[debit_id]
+                txn.destination_balance_before = balances[credit_id]
+                balances[debit_id] -= txn.amount
+                balances[credit_id] += txn.amount
+                txn.source_balance_after = balances[debit_id]
+                txn.destination_balance_after = balances[credit_id]
+                deltas[debit_id] -= txn.amount
+                deltas[credit_id] += txn.amount
+                available_deltas[credit_id] += txn.amount
+                if txn.transaction_type == TransactionType.MPESA_DEPOSIT:
+                    available_deltas[debit_id] -= txn.amount
+                # a withdrawal's amount left available_balance with its hold
+
+                txn.trans_status = TransactionStatus.COMPLETED
+                txn.completed_at = now
+                txn.metadata = {**txn.metadata, 'mpesa_receipt': details['receipt']}
+                transactions_to_update.append(txn)
+
+                description = f"M-Pesa {details['receipt'] or txn.external_ref}"
+                entries.append(LedgerEntry(
+                    transaction=txn,
+                    account_id=debit_id,
+                    entry_type=LedgerEntryType.DEBIT,
+                    amount=txn.amount,
+                    balance_after=txn.source_balance_after,
+                    description=description
+                ))
+                entries.append(LedgerEntry(
+                    transaction=txn,
+                    account_id=credit_id,
+                    entry_type=LedgerEntryType.CREDIT,
+                    amount=txn.amount,
+                    balance_after=txn.destination_balance_after,
+                    description=description
+                ))
+
+            LedgerEntry.objects.bulk_create(entries)
+            for account_id, delta in deltas.items():
+                Account.objects.filter(id=account_id).update(
+                    balance=F('balance') + delta,
+                    available_balance=F('available_balance') + available_deltas[account_id],
+                    updated_at=now
+                )
+            refresh_after_commit(deltas)
+            release_holds(
+                [txn for txn, _ in to_post if txn.transaction_type == TransactionType.MPESA_WITHDRAWAL], now, refund=False
+            )
+            summary['posted'] = len(to_post)
+
+        if failed_withdrawals:
+            release_holds(failed_withdrawals, now, refund=True)
+
+        for txn in transactions_to_update:
+            txn.updated_at = now
+            txn.version = F('version') + 1
+        Transaction.objects.bulk_update(transactions_to_update, [
+            'trans_status', 'completed_at', 'last_error', 'metadata', 'version', 'updated_at',
+            'source_account', 'destination_account',
+            'source_balance_before', 'source_balance_after',
+            'destination_balance_before', 'destination_balance_after',
+        ])
+
+        for callback in callbacks:
+            callback.updated_at = now
+        MpesaCallback.objects.bulk_update(
+            callbacks, ['status', 'transaction', 'error', 'processed_at', 'next_attempt_at', 'updated_at']
+        )
+
+    logger.info(f"M-Pesa callback batch: {summary}")
+    return summary
@@ -0,0 +1,139 @@
+"""
+Reconciliation of completed M-Pesa transactions against a Safaricom statement.
+
+The ledger side is loaded with one range query into a dict keyed by the M-Pesa
+receipt (falling back to external_ref), holding only (id, amount, type). The
+statement CSV is then streamed row by row and every discrepancy is written out
+as it is found, so memory is bounded by the number of ledger transactions in
+the period and not by the size of the statement.
+"""
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db.models import CharField, F
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Coalesce
+from transactions.models import Transaction, TransactionType, TransactionStatus
+from transactions.services.partitions import date_bounded
+import csv
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# column names as exported from the M-Pesa org portal
+RECEIPT_COLUMN = 'Receipt No.'
+PAID_IN_COLUMN = 'Paid In'
+WITHDRAWN_COLUMN = 'Withdrawn'
+STATUS_COLUMN = 'Transaction Status'
+
+REPORT_FIELDS = ['issue', 'reference', 'transaction_id', 'ledger_amount', 'statement_amount', 'statement_line']
+
+
+def parse_amount(value):
+    """'1,250.00' / '-1,250.00' / '' -> Decimal or None"""
+    value = (value or '').replace(',', '').strip()
+    if not value:
+        return None
+    try:
+        return abs(Decimal(value))
+    except InvalidOperation:
+        return None
+
+
+def build_ledger_index(start, end):
+    """
+    receipt -> (transaction id, amount, transaction type) for completed M-Pesa
+    transactions in [start, end). Receipts seen twice in the ledger are returned separately.
+    """
+    completed = Transaction.objects.using(settings.DATABASE_EXPORT_ALIAS).filter(
+        transaction_type__in=[TransactionType.MPESA_DEPOSIT, TransactionType.MPESA_WITHDRAWAL],
+        trans_status=TransactionStatus.COMPLETED,
+        completed_at__gte=start,
+        completed_at__lt=end,
+    )
+    # nothing completes before it is created, so later months' partitions are skipped
+    rows = date_bounded(completed, end=end).annotate(
+        reference=Coalesce(KeyTextTransform('mpesa_receipt', 'metadata'), F('external_ref'), output_field=CharField())
+    ).values_list('reference', 'id', 'amount', 'transaction_type')
+
+    index = {}
+    ledger_duplicates = []
+    for reference, txn_id, amount, txn_type in rows.iterator(chunk_size=5000):
+        if reference in index:
+            ledger_duplicates.append((reference, txn_id, amount))
+        else:
+            index[reference] = (txn_id, amount, txn_type)
+    return index, ledger_duplicates
+
+
+def reconcile_statement(statement_file, start, end, report_file):
+    """
+    Reconcile one statement (an open text file) against the ledger for [start, end)
+    and write every issue to `report_file` as CSV. Returns the summary counts.
+    Issues: missing_in_ledger, missing_in_statement, duplicate, ledger_duplicate, amount_mismatch.
+    """
+    index, ledger_duplicates = build_ledger_index(start, end)
+    matched = {}
+    writer = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS)
+    writer.writeheader()
+    summary = {
+        'ledger_transactions': len(index) + len(ledger_duplicates),
+        'statement_rows': 0,
+        'matched': 0,
+        'missing_in_ledger': 0,
+        'missing_in_statement': 0,
+        'duplicate': 0,
+        'ledger_duplicate': 0,
+        'amount_mismatch': 0,
+    }
+
+    def report(issue, reference, txn_id=None, ledger_amount=None, statement_amount=None, line=None):
+        summary[issue] += 1
+        writer.writerow({
+            'issue': issue,
+            'reference': reference,
+            'transaction_id': txn_id or '',
+            'ledger_amount': ledger_amount if ledger_amount is not None else '',
+            'statement_amount': statement_amount if statement_amount is not None else '',
+            'statement_line': line or '',
+        })
+
+    for reference, txn_id, amount in ledger_duplicates:
+        report('ledger_duplicate', reference, txn_id, amount)
+
+    reader = csv.DictReader(statement_file)
+    for row in reader:
+        if STATUS_COLUMN in row and row[STATUS_COLUMN] and row[STATUS_COLUMN].strip().lower() != 'completed':
+            continue
+
+        reference = (row.get(RECEIPT_COLUMN) or '').strip()
+        if not reference:
+            continue
+
+        summary['statement_rows'] += 1
+        line = reader.line_num
+        statement_amount = parse_amount(row.get(PAID_IN_COLUMN)) or parse_amount(row.get(WITHDRAWN_COLUMN))
+
+        if reference in matched:
+            txn_id, ledger_amount = matched[reference]
+            report('duplicate', reference, txn_id, ledger_amount, statement_amount, line)
+            continue
+
+        entry = index.pop(reference, None)
+        if entry is None:
+            report('missing_in_ledger', reference, statement_amount=statement_amount, line=line)
+            continue
+
+        txn_id, ledger_amount, _ = entry
+        # matched refs move out of the index so the index ends up holding only what the statement lacks
+        matched[reference] = (txn_id, ledger_amount)
+        if statement_amount != ledger_amount:
+            report('amount_mismatch', reference, txn_id, ledger_amount, statement_amount, line)
+        else:
+            summary['matched'] += 1
+
+    for reference, (txn_id, ledger_amount, _) in index.items():
+        report('missing_in_statement', reference, txn_id, ledger_amount)
+
+    logger.info(f"M-Pesa reconciliation {start} - {end}: {summary}")
+    return summary
@@ -0,0 +1,174 @@
+"""
+B2C disbursement of M-Pesa withdrawals.
+
+record_withdrawal() holds the amount (an AccountHold, taken out of
+available_balance) and creates the PENDING MPESA_WITHDRAWAL; once it commits
+disburse_mpesa_withdrawals_task sends it. The hold stays until the outcome is
+known: a successful result callback turns it into the debit, a rejection or a
+failed result releases it back to available_balance. disburse_batch()
+claims PENDING withdrawals by moving them to PROCESSING in a transaction of its
+own, skipping rows another worker holds, and only then calls Daraja, so a
+withdrawal is sent at most once however often the task runs.
+
+The transaction_ref goes out as the OriginatorConversationID, which the B2C
+result callback carries back and is matched on. Only an explicit rejection
+fails a withdrawal: when Daraja cannot say whether the payout went out (a
+timeout, a dropped connection, a server error) the withdrawal stays PROCESSING
+with the error recorded and its amount held, for the result callback or the
+statement reconciliation to settle. It is never sent again.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from decouple import config
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from ..models import Account, AccountHold
+from .balances import refresh_after_commit
+from .daraja import get_gateway
+from transactions.models import Transaction, TransactionType, TransactionStatus
+from transactions.services.utility import generate_transaction_ref
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BATCH_SIZE = 100
+
+
+class MpesaWithdrawalError(Exception):
+    """Raised when a withdrawal cannot be accepted"""
+
+
+def record_withdrawal(user, account, amount, phone_number):
+    """The PENDING withdrawal from `account` to `phone_number`, queued for disbursement once committed"""
+    from ..tasks import disburse_mpesa_withdrawals_task
+
+    now = timezone.now()
+    transaction_ref = generate_transaction_ref()
+    with transaction.atomic():
+        # conditional, so concurrent withdrawals can never hold more than is available
+        updated = Account.objects.filter(
+            id=account.id, status='ACTIVE', allow_debit=True, available_balance__gte=amount
+        ).update(available_balance=F('available_balance') - amount, updated_at=now)
+        if not updated:
+            raise MpesaWithdrawalError("Insufficient funds")
+        refresh_after_commit([account.id])
+
+        AccountHold.objects.create(
+            account_id=account.id,
+            hold_type='TRANSACTION',
+            amount=amount,
+            reason=f"M-Pesa withdrawal {transaction_ref}",
+            reference_id=transaction_ref
+        )
+        withdrawal = Transaction.objects.create(
+            transaction_ref=transaction_ref,
+            transaction_type=TransactionType.MPESA_WITHDRAWAL,
+            trans_status=TransactionStatus.PENDING,
+            source_account_id=account.id,
+            amount=amount,
+            description=f"M-Pesa withdrawal to {phone_number}",
+            metadata={'phone_number': phone_number},
+            initiated_by=user,
+            idempotency_key=f"b2c-{transaction_ref}"
+        )
+        transaction.on_commit(lambda: disburse_mpesa_withdrawals_task.delay([str(withdrawal.id)]))
+    return withdrawal
+
+
+def release_holds(withdrawals, now, refund):
+    """
+    Release the holds of settled withdrawals, inside the transaction settling them.
+    With `refund` (the payout failed) the held amounts go back to available_balance;
+    otherwise the posted debit has already taken them off balance.
+    """
+    refs = [withdrawal.transaction_ref for withdrawal in withdrawals]
+    holds = list(
+        AccountHold.objects.select_for_update()
+        .filter(reference_id__in=refs, hold_type='TRANSACTION', is_released=False)
+        .order_by('id')
+    )
+    if not holds:
+        return
+    AccountHold.objects.filter(id__in=[hold.id for hold in holds]).update(
+        is_released=True, released_at=now, updated_at=now
+    )
+    if refund:
+        refunds = defaultdict(Decimal)
+        for hold in holds:
+            refunds[hold.account_id] += hold.amount
+        for account_id in sorted(refunds):
+            Account.objects.filter(id=account_id).update(
+                available_balance=F('available_balance') + refunds[account_id], updated_at=now
+            )
+        refresh_after_commit(refunds)
+
+
+def claim_withdrawals(transaction_ids=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Move PENDING withdrawals to PROCESSING and return them, committed before anything is sent"""
+    pending = Transaction.objects.filter(
+        transaction_type=TransactionType.MPESA_WITHDRAWAL,
+        trans_status=TransactionStatus.PENDING
+    )
+    if transaction_ids is not None:
+        pending = pending.filter(id__in=transaction_ids)
+
+    with transaction.atomic():
+        claimed = list(pending.select_for_update(skip_locked=True).order_by('created_at')[:batch_size])
+        Transaction.objects.filter(id__in=[txn.id for txn in claimed]).update(
+            trans_status=TransactionStatus.PROCESSING, updated_at=timezone.now()
+        )
+    return claimed
+
+
+def disburse_batch(transaction_ids=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Claim and send one batch of withdrawals (all PENDING ones when no ids are given) as concurrent B2C requests"""
+    summary = {'sent': 0, 'failed': 0, 'unknown': 0}
+
+    claimed = {txn.transaction_ref: txn for txn in claim_withdrawals(transaction_ids, batch_size)}
+    if not claimed:
+        return summary
+
+    payouts = [
+        {
+            'phone_number': txn.metadata.get('phone_number'),
+            'amount': txn.amount,
+            'remarks': txn.description or 'Withdrawal',
+            'originator_conversation_id': ref,
+        }
+        for ref, txn in claimed.items()
+    ]
+    results = get_gateway().bulk_b2c(payouts, callback_url=config('MPESA_B2C_CALLBACK_URL'))
+
+    now = timezone.now()
+    in_flight = []
+    for ref, result in results.items():
+        txn = claimed[ref]
+        txn.trans_status = TransactionStatus.PROCESSING
+        txn.updated_at = now
+        if result['ok']:
+            txn.external_ref = result['response'].get('ConversationID', '')
+            in_flight.append(txn)
+            summary['sent'] += 1
+        elif result.get('unknown'):
+            # the payout may have gone out: the hold stays until the result callback or the reconciliation
+            txn.last_error = result['error']
+            in_flight.append(txn)
+            summary['unknown'] += 1
+        else:
+            error = result.get('error') or result['response'].get('ResponseDescription', '')
+            with transaction.atomic():
+                # still PROCESSING only: a result callback settled in the meantime keeps its status
+                if Transaction.objects.filter(id=txn.id, trans_status=TransactionStatus.PROCESSING).update(
+                    trans_status=TransactionStatus.FAILED, last_error=error, updated_at=now
+                ):
+                    release_holds([txn], now, refund=True)
+            summary['failed'] += 1
+
+    Transaction.objects.filter(trans_status=TransactionStatus.PROCESSING).bulk_update(
+        in_flight, ['external_ref', 'last_error', 'updated_at']
+    )
+
+    logger.info(f"M-Pesa withdrawal batch sent: {summary}")
+    return summary
@@ -1,117 +1,178 @@
-from django_daraja.mpesa.core import MpesaClient
 from ..utility import *
+from .daraja import DarajaError, get_gateway
+from .mpesa_withdrawals import MpesaWithdrawalError, record_withdrawal
+from asgiref.sync import sync_to_async
+from bank.async_views import AsyncAPIView
+from decimal import Decimal, InvalidOperation
 from decouple import config
+from django.db import transaction
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework import status
+from transactions.services.utility import generate_transaction_ref
 import logging
 import requests
 import xml.etree.ElementTree as ET
 from django.shortcuts import redirect
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 import json
 from django.views.decorators.csrf import csrf_exempt
 
 
 logger = logging.getLogger(__name__)
 
-def initiate_stk_push(self):
+MPESA_CALLBACK_ACK = {"ResultCode": 0, "ResultDesc": "Accepted"}
+
+
+async def astore_mpesa_callback(callback_type, dedupe_key, result_code, payload):
+    """
+    Append a callback to the inbox with a single INSERT. Safaricom retries the
+    same CheckoutRequestID / OriginatorConversationID, duplicates are dropped by the unique key.
+    """
+    from ..models import MpesaCallback
+
+    await MpesaCallback.objects.abulk_create([
+        MpesaCallback(
+            callback_type=callback_type,
+            dedupe_key=dedupe_key,
+            result_code=result_code,
+            payload=payload
+        )
+    ], ignore_conflicts=True)
+
+
+def active_customer_account(user, account_number):
+    from ..models import Account
+
+    return Account.objects.filter(account_number=account_number, customer__user=user, status='ACTIVE').first()
+
+
+def record_stk_deposit(user, account, amount, checkout_id):
+    """The PENDING deposit process_mpesa_callbacks_task matches the STK callback to"""
+    from transactions.models import Transaction, TransactionStatus, TransactionType
+
+    with transaction.atomic():
+        return Transaction.objects.create(
+            transaction_ref=generate_transaction_ref(),
+            transaction_type=TransactionType.MPESA_DEPOSIT,
+            trans_status=TransactionStatus.PENDING,
+            destination_account=account,
+            amount=amount,
+            external_ref=checkout_id,
+            initiated_by=user,
+            idempotency_key=f"stk-{checkout_id}"
+        )
+
+
+class InitiateStkPush(AsyncAPIView):
+    """
+    STK push deposit into one of the customer's accounts. Daraja is awaited on
+    the event loop, the account lookup and the PENDING deposit run in a thread.
+    """
+    permission_classes = [IsAuthenticated]
+
+    async def post(self, request):
+        account_number = request.data.get('account_number')
+        phone_number = request.data.get('phone_number')
+
+        if not phone_number:
+            return Response({"error": "Please provide phone number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # M-Pesa only takes whole shillings
         try:
-            cl = MpesaClient()
-            phone_number = "254705960166"
-            amount = 10
-
-            print("phone",phone_number)
-            print("amount",amount)
-            
-            if not phone_number:
-                return Response({"error": "Please provide phone number"}, status=status.HTTP_400_BAD_REQUEST)
-            
-            if not amount:
-                return Response({"error": "Please provide amount"}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # handle the phone number format
-            if phone_number.startswith("0"):
-                phone_number = '254' + phone_number[1:] 
-            elif phone_number.startswith("+"):
-                phone_number = phone_number[1:]
-
-            # convert the amount to integer
-            try:
-                amount = int(float(amount))
-            except Exception as e:
-                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-            
-
-            # generate unque transaction 
-            account_reference = "account_reference"
-            transaction_desc = 'Payment for account opening'
-            callback_url = config('MPESA_STK_CALLBACK_URL') 
-
-
-            # initiate stk push 
-            try:
-                response = cl.stk_push(
-                    phone_number=phone_number,
-                    amount=amount,
-                    account_reference=account_reference,
-                    transaction_desc=transaction_desc,
-                    callback_url=callback_url,
-                )
-            except Exception as e:
-                logger.error(f"STK Push initiation failed: {str(e)}")
-                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-
-            # check if the response ois successfull
-
-            if response.response_code == "0":
-                # stk push initiated successfully
-
-                ""
-                {
-                    "message": "stk push initiated successfully",
-                    "checkout_request_id": "ws_CO_25042025011224490705960166",
-                    "customer_message": "Success. Request accepted for processing",
-                    "merchant_request_id": "75f4-4e91-aa3c-79e4611bbc5828498",
-                    "response_code": "0",
-                    "response_description": "Success. Request accepted for processing"
-                }
-                ""
-                return {
-                    "checkout_request_id":response.checkout_request_id,
-                    "customer_message":response.customer_message,
-                    "merchant_request_id":response.merchant_request_id,
-                    "response_code":response.response_code,
-                    "response_description":response.response_description
-                }
-            
-
-        
-        except Exception as e:
-            logger.error(f"Unexpected error in initiate_stk_push: {str(e)}")
-            return {"success": False, "error": str(e)}
-        
+            amount = int(Decimal(str(request.data.get('amount'))))
+        except (InvalidOperation, ValueError):
+            return Response({"error": "Please provide amount"}, status=status.HTTP_400_BAD_REQUEST)
+        if amount <= 0:
+            return Response({"error": "Invalid amount"}, status=status.HTTP_400_BAD_REQUEST)
+
+        account = await sync_to_async(active_customer_account)(request.user, account_number)
+        if not account:
+            return Response({"error": "Account not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            response = await get_gateway().astk_push(
+                phone_number=phone_number,
+                amount=amount,
+                account_reference=account.account_number,
+                transaction_desc=f"Deposit to {account.account_number}",
+                callback_url=config('MPESA_STK_CALLBACK_URL'),
+            )
+        except DarajaError as e:
+            logger.error(f"STK Push initiation failed: {str(e)}")
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+
+        if response.get("ResponseCode") != "0":
+            logger.error(f"STK Push rejected: {response}")
+            return Response({"error": response.get("ResponseDescription", "STK push rejected")}, status=status.HTTP_502_BAD_GATEWAY)
+
+        deposit = await sync_to_async(record_stk_deposit)(request.user, account, amount, response.get("CheckoutRequestID"))
+        return Response({
+            "transaction_id": deposit.id,
+            "checkout_request_id": response.get("CheckoutRequestID"),
+            "customer_message": response.get("CustomerMessage"),
+            "merchant_request_id": response.get("MerchantRequestID"),
+            "response_code": response.get("ResponseCode"),
+            "response_description": response.get("ResponseDescription")
+        }, status=status.HTTP_200_OK)
+
+
+class InitiateMpesaWithdrawal(APIView):
+    """
+    Withdrawal from one of the customer's accounts to an M-Pesa number. Only the
+    PENDING withdrawal is recorded here, the B2C request is sent by
+    disburse_mpesa_withdrawals_task and the result callback posts it.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        phone_number = request.data.get('phone_number')
+
+        if not phone_number:
+            return Response({"error": "Please provide phone number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # M-Pesa only pays out whole shillings
+        try:
+            amount = int(Decimal(str(request.data.get('amount'))))
+        except (InvalidOperation, ValueError):
+            return Response({"error": "Please provide amount"}, status=status.HTTP_400_BAD_REQUEST)
+        if amount <= 0:
+            return Response({"error": "Invalid amount"}, status=status.HTTP_400_BAD_REQUEST)
+
+        account = active_customer_account(request.user, request.data.get('account_number'))
+        if not account:
+            return Response({"error": "Account not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            withdrawal = record_withdrawal(request.user, account, Decimal(amount), phone_number)
+        except MpesaWithdrawalError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "transaction_id": withdrawal.id,
+            "transaction_ref": withdrawal.transaction_ref,
+            "status": withdrawal.trans_status,
+        }, status=status.HTTP_202_ACCEPTED)
+
 
 @csrf_exempt
-def safaricom_stk_callback(request):
+async def safaricom_stk_callback(request):
+    """
+    Store the callback in the inbox and acknowledge straight away,
+    the transaction is posted by process_mpesa_callbacks_task
+    """
     try:
         callback_data = json.loads(request.body)
-        logger.info(f"M-Pesa callback received: {callback_data}")
-        
-        result_code = callback_data.get('Body', {}).get('stkCallback', {}).get('ResultCode')
-        checkout_id = callback_data.get('Body', {}).get('stkCallback', {}).get('CheckoutRequestID')
-        callback_metadata = callback_data.get('Body', {}).get('stkCallback', {}).get('CallbackMetadata', {}).get('Item', [])
-        
-        if result_code == 0:
-            # Payment was successful
-            logger.info(f"Payment successful for CheckoutRequestID: {callback_data}")
-            # Process the payment details as needed
-            return HttpResponse(status=200)
-        else:
-            # Payment failed or was cancelled
-            logger.warning(f"Payment failed or cancelled for CheckoutRequestID: {checkout_id} with ResultCode: {result_code}, {callback_data}")
-            return HttpResponse(status=200)
-        
+        stk_callback = callback_data.get('Body', {}).get('stkCallback', {})
+        checkout_id = stk_callback.get('CheckoutRequestID')
+
+        if not checkout_id:
+            logger.error(f"STK callback without CheckoutRequestID: {callback_data}")
+            return HttpResponse(status=400)
+
+        await astore_mpesa_callback('STK', checkout_id, stk_callback.get('ResultCode'), callback_data)
+        return JsonResponse(MPESA_CALLBACK_ACK)
 
     except Exception as e:
         logger.error(f"Error parsing M-Pesa callback data: {str(e)}")
@@ -120,7 +181,7 @@ def safaricom_stk_callback(request):
 
 def businessTocustomer(self):
     try:
-        cl = MpesaClient()
+        gateway = get_gateway()
         """
         { 
                 "OriginatorConversationID": "600997_Test_32et3241ed8yu", 
@@ -146,12 +207,12 @@ def businessTocustomer(self):
             }
         """
         try:
-            response = cl.b2c_payment(
+            response = gateway.b2c_payment(
                 amount=10,
                 callback_url=config('MPESA_B2C_CALLBACK_URL'),
                 command_id='BusinessPayment',
-                transaction_desc='Business to customer payment',
-                occassion='TestPayment',
+                remarks='Business to customer payment',
+                occasion='TestPayment',
                 phone_number = "254705912645"
 
             )
@@ -159,14 +220,14 @@ def businessTocustomer(self):
             logger.error(f"Business to customer payment failed: {str(e)}")
             return {"error": str(e)} 
        
-        if response.response_code == "0":
+        if response.get("ResponseCode") == "0":
             logger.info(f"Business to customer payment initiated successfully, {response}")
             return {
                 "message": "Business to customer payment initiated successfully",
-                "conversation_id":response.conversation_id,
-                "originator_conversation_id":response.originator_conversation_id,
-                "response_code":response.response_code,
-                "response_description":response.response_description
+                "conversation_id":response.get("ConversationID"),
+                "originator_conversation_id":response.get("OriginatorConversationID"),
+                "response_code":response.get("ResponseCode"),
+                "response_description":response.get("ResponseDescription")
             }
 
 
@@ -177,25 +238,23 @@ def businessTocustomer(self):
     
 
 @csrf_exempt
-def safaricom_b2c_callback(request):
+async def safaricom_b2c_callback(request):
+    """
+    Store the B2C result in the inbox and acknowledge straight away
+    """
     try:
         data = json.loads(request.body)
         result = data.get("Result", {})
+        # our transaction_ref, known before the request went out
+        originator_id = result.get("OriginatorConversationID")
 
-        result_code = result.get("ResultCode")
-        result_desc = result.get("ResultDesc")
-        conversation_id = result.get("ConversationID")
-        transaction_id = result.get("TransactionID")
-
-        if result_code == 0:
-            logger.info(f"B2C payment successful: {transaction_id}")
-        else:
-            logger.warning(
-                f"B2C payment failed: {result_code} - {result}"
-            )
+        if not originator_id:
+            logger.error(f"B2C callback without OriginatorConversationID: {data}")
+            return JsonResponse(MPESA_CALLBACK_ACK)
 
-        return {"ResultCode": 0, "ResultDesc": "Accepted"}
+        await astore_mpesa_callback('B2C', originator_id, result.get("ResultCode"), data)
+        return JsonResponse(MPESA_CALLBACK_ACK)
 
     except Exception as e:
         logger.error(f"B2C callback error: {str(e)}")
-        return {"ResultCode": 0, "ResultDesc": "Accepted"}
+        return JsonResponse(MPESA_CALLBACK_ACK)
@@ -0,0 +1,57 @@
+from celery import shared_task
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+from .services import mpesa_callbacks, mpesa_reconciliation, mpesa_withdrawals
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def process_mpesa_callbacks_task(batch_size=mpesa_callbacks.DEFAULT_BATCH_SIZE, max_batches=20):
+    """
+    Drain the M-Pesa callback inbox, scheduled every few seconds through celery beat.
+    Several workers can run this at once, each claims its own rows.
+    """
+    totals = {'claimed': 0, 'posted': 0, 'failed': 0, 'unmatched': 0, 'deferred': 0}
+
+    for _ in range(max_batches):
+        summary = mpesa_callbacks.process_callback_batch(batch_size=batch_size)
+        for key in totals:
+            totals[key] += summary[key]
+        if summary['claimed'] < batch_size:
+            break
+
+    return totals
+
+
+@shared_task
+def disburse_mpesa_withdrawals_task(transaction_ids=None, batch_size=mpesa_withdrawals.DEFAULT_BATCH_SIZE):
+    """
+    Send PENDING M-Pesa withdrawals as concurrent B2C batches. Queued for each new
+    withdrawal, and run without ids through celery beat for any whose queueing was lost.
+    """
+    totals = {'sent': 0, 'failed': 0, 'unknown': 0}
+
+    while True:
+        summary = mpesa_withdrawals.disburse_batch(transaction_ids, batch_size=batch_size)
+        for key in totals:
+            totals[key] += summary[key]
+        if sum(summary.values()) < batch_size:
+            break
+
+    return totals
+
+
+@shared_task
+def reconcile_mpesa_statement_task(statement_path, day=None):
+    """
+    Daily float reconciliation for a downloaded statement, `day` as YYYY-MM-DD (defaults to yesterday).
+    The discrepancy report is written next to the statement.
+    """
+    day = datetime.strptime(day, '%Y-%m-%d').date() if day else timezone.localdate() - timedelta(days=1)
+    start = timezone.make_aware(datetime.combine(day, time.min))
+
+    with open(statement_path, newline='', encoding='utf-8-sig') as statement, \
+            open(f"{statement_path}.report.csv", 'w', newline='') as report:
+        return mpesa_reconciliation.reconcile_statement(statement, start, start + timedelta(days=1), report)
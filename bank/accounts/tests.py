@@ -1,3 +1,528 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from django.test import TestCase, SimpleTestCase
+from rest_framework.test import APIClient
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import csv
+import io
+import json
+import threading
+import time
 
-# Create your tests here.
+from auth_service.models import Role, User, CustomerProfile
+from transactions.models import Transaction, TransactionType, TransactionStatus, LedgerEntryType
+from . import tasks
+from .models import Account, AccountHold, AccountType, MpesaCallback
+from .services import balances, mpesa_callbacks, mpesa_reconciliation, mpesa_withdrawals
+from .services.daraja import DarajaGateway
+
+
+def stk_payload(checkout_id, result_code=0, amount=500, receipt='RKT1234567'):
+    callback = {
+        'MerchantRequestID': 'merchant-1',
+        'CheckoutRequestID': checkout_id,
+        'ResultCode': result_code,
+        'ResultDesc': 'The service request is processed successfully.' if result_code == 0 else 'Request cancelled by user',
+    }
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': amount},
+            {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+            {'Name': 'PhoneNumber', 'Value': 254700000000},
+        ]}
+    return {'Body': {'stkCallback': callback}}
+
+
+class MpesaCallbackPipelineTest(TestCase):
+    """Test suite for the M-Pesa callback inbox and batch posting"""
+
+    def setUp(self):
+        role = Role.objects.create(role_name='Customer', category='Customer')
+        self.user = User.objects.create_user(email='mpesa@test.com', password='testpass123', role=role)
+        customer = CustomerProfile.objects.create(user=self.user, customer_id='CUST-MPESA', phone_number='+254700000000')
+        account_type = AccountType.objects.create(name='SAVINGS', code='SAV', description='Savings')
+        self.account = Account.objects.create(
+            customer=customer, account_type=account_type, status='ACTIVE',
+            balance=Decimal('100.00'), available_balance=Decimal('100.00')
+        )
+        self.settlement = Account.objects.create(
+            account_number='SYSTEM_MPESA_ACCOUNT', category='INTERNAL', account_type=account_type,
+            status='ACTIVE', balance=Decimal('100000.00'), available_balance=Decimal('100000.00')
+        )
+
+    def create_pending_deposit(self, checkout_id, amount=Decimal('500.00')):
+        return Transaction.objects.create(
+            transaction_ref=f"TXN-{checkout_id}",
+            transaction_type=TransactionType.MPESA_DEPOSIT,
+            destination_account=self.account,
+            amount=amount,
+            external_ref=checkout_id,
+            initiated_by=self.user,
+            idempotency_key=f"stk-{checkout_id}"
+        )
+
+    def test_callback_is_stored_once(self):
+        """Test the callback is acknowledged and retries are deduplicated"""
+        for _ in range(2):
+            response = self.client.post(
+                '/api/v1.0/accounts/stk-callback/',
+                data=json.dumps(stk_payload('ws_CO_1')),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['ResultCode'], 0)
+
+        self.assertEqual(MpesaCallback.objects.filter(dedupe_key='ws_CO_1').count(), 1)
+
+    def test_batch_posts_deposits_and_failures(self):
+        """Test successful callbacks credit the account and failed ones fail the transaction"""
+        deposit = self.create_pending_deposit('ws_CO_1')
+        cancelled = self.create_pending_deposit('ws_CO_2')
+        for checkout_id, result_code in (('ws_CO_1', 0), ('ws_CO_2', 1032), ('ws_CO_3', 0)):
+            MpesaCallback.objects.create(
+                callback_type='STK', dedupe_key=checkout_id, result_code=result_code,
+                payload=stk_payload(checkout_id, result_code)
+            )
+
+        summary = mpesa_callbacks.process_callback_batch()
+        self.assertEqual(summary, {'claimed': 3, 'posted': 1, 'failed': 1, 'unmatched': 0, 'deferred': 1})
+
+        deposit.refresh_from_db()
+        cancelled.refresh_from_db()
+        self.account.refresh_from_db()
+        self.settlement.refresh_from_db()
+        self.assertEqual(deposit.trans_status, TransactionStatus.COMPLETED)
+        self.assertEqual(deposit.metadata['mpesa_receipt'], 'RKT1234567')
+        self.assertEqual(cancelled.trans_status, TransactionStatus.FAILED)
+        self.assertEqual(self.account.balance, Decimal('600.00'))
+        self.assertEqual(self.settlement.balance, Decimal('99500.00'))
+        self.assertEqual(deposit.ledger_entries.get(entry_type=LedgerEntryType.CREDIT).account, self.account)
+        self.assertEqual(MpesaCallback.objects.get(dedupe_key='ws_CO_3').status, 'RECEIVED')
+
+        # nothing left to claim until the unmatched callback's next attempt
+        self.assertEqual(mpesa_callbacks.process_callback_batch()['claimed'], 0)
+
+    def test_unmatched_callback_is_retried_within_window(self):
+        """Test a callback that beats its transaction is posted on a later attempt, and given up on after the window"""
+        MpesaCallback.objects.create(callback_type='STK', dedupe_key='ws_CO_1', result_code=0, payload=stk_payload('ws_CO_1'))
+        MpesaCallback.objects.create(callback_type='STK', dedupe_key='ws_CO_2', result_code=0, payload=stk_payload('ws_CO_2'))
+        self.assertEqual(mpesa_callbacks.process_callback_batch()['deferred'], 2)
+
+        deposit = self.create_pending_deposit('ws_CO_1')
+        MpesaCallback.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        MpesaCallback.objects.filter(dedupe_key='ws_CO_2').update(created_at=timezone.now() - timedelta(hours=1))
+
+        summary = mpesa_callbacks.process_callback_batch()
+        self.assertEqual((summary['posted'], summary['unmatched'], summary['deferred']), (1, 1, 0))
+        deposit.refresh_from_db()
+        self.assertEqual(deposit.trans_status, TransactionStatus.COMPLETED)
+        self.assertEqual(MpesaCallback.objects.get(dedupe_key='ws_CO_2').status, 'UNMATCHED')
+
+    def test_amount_mismatch_leaves_transaction_pending(self):
+        """Test a callback for a different amount is not posted"""
+        deposit = self.create_pending_deposit('ws_CO_1', amount=Decimal('400.00'))
+        MpesaCallback.objects.create(
+            callback_type='STK', dedupe_key='ws_CO_1', result_code=0, payload=stk_payload('ws_CO_1')
+        )
+
+        mpesa_callbacks.process_callback_batch()
+        deposit.refresh_from_db()
+        self.assertEqual(deposit.trans_status, TransactionStatus.PENDING)
+        self.assertEqual(MpesaCallback.objects.get(dedupe_key='ws_CO_1').status, 'FAILED')
+
+
+class DarajaStubHandler(BaseHTTPRequestHandler):
+    """Minimal local Daraja: OAuth, STK push and B2C payment request"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.stats['connections'] += 1
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status_code, body):
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.stats['tokens'] += 1
+            token = f"token-{self.server.stats['tokens']}"
+        self.respond(200, {'access_token': token, 'expires_in': '3599'})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.headers.get('Authorization') == 'Bearer stale':
+            return self.respond(401, {'errorMessage': 'Invalid Access Token'})
+
+        if self.path.startswith('/mpesa/stkpush'):
+            return self.respond(200, {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_stub'})
+
+        # B2C amounts picked by the tests: 98 is rejected, 99 fails with an unknown outcome
+        if payload.get('Amount') == 98:
+            return self.respond(400, {'errorMessage': 'Invalid PartyB'})
+        if payload.get('Amount') == 99:
+            return self.respond(503, {'errorMessage': 'Service unavailable'})
+
+        with self.server.lock:
+            self.server.stats['b2c'] += 1
+            self.server.stats['in_flight'] += 1
+            self.server.stats['max_in_flight'] = max(self.server.stats['max_in_flight'], self.server.stats['in_flight'])
+        time.sleep(0.02)
+        with self.server.lock:
+            self.server.stats['in_flight'] -= 1
+        self.respond(200, {
+            'ResponseCode': '0',
+            'ConversationID': f"AG_{payload['OriginatorConversationID']}",
+            'OriginatorConversationID': payload['OriginatorConversationID'],
+        })
+
+
+class DarajaGatewayTest(SimpleTestCase):
+    """Test suite for the pooled M-Pesa gateway against a local Daraja stub"""
+
+    def setUp(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), DarajaStubHandler)
+        self.server.lock = threading.Lock()
+        self.server.stats = {'connections': 0, 'tokens': 0, 'in_flight': 0, 'max_in_flight': 0, 'b2c': 0}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.gateway = DarajaGateway(
+            base_url=f"http://127.0.0.1:{self.server.server_port}/",
+            consumer_key='key', consumer_secret='secret', shortcode='600000', passkey='passkey',
+            initiator_name='testapi', security_credential='credential',
+            max_concurrency=4, rate_per_second=1000
+        )
+
+    def tearDown(self):
+        self.gateway.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_token_and_connection_are_reused(self):
+        """Test sequential calls share one token and one keep-alive connection"""
+        for _ in range(5):
+            response = self.gateway.stk_push('0700000000', 10, 'ref', 'desc', 'https://example.com/cb')
+            self.assertEqual(response['ResponseCode'], '0')
+
+        self.assertEqual(self.server.stats['tokens'], 1)
+        self.assertEqual(self.server.stats['connections'], 1)
+
+    def test_token_refreshed_ahead_of_expiry(self):
+        """Test a token inside the refresh margin is replaced before use"""
+        first = self.gateway.access_token()
+        self.gateway._token_expires_at = time.time() + 60
+        cache.clear()
+
+        self.assertNotEqual(self.gateway.access_token(), first)
+        self.assertEqual(self.server.stats['tokens'], 2)
+
+    def test_rejected_token_is_refreshed_once(self):
+        """Test a 401 invalidates the cached token and the call is retried"""
+        self.gateway._token, self.gateway._token_expires_at = 'stale', time.time() + 3600
+
+        response = self.gateway.stk_push('0700000000', 10, 'ref', 'desc', 'https://example.com/cb')
+        self.assertEqual(response['ResponseCode'], '0')
+        self.assertEqual(self.server.stats['tokens'], 1)
+
+    def test_async_stk_push_reuses_token_and_connection(self):
+        """Test async STK pushes share the gateway token and one pooled connection of the event loop"""
+        async def push():
+            return [
+                await self.gateway.astk_push('0700000000', 10, 'ref', 'desc', 'https://example.com/cb')
+                for _ in range(3)
+            ]
+
+        responses = async_to_sync(push)()
+        self.assertTrue(all(response['ResponseCode'] == '0' for response in responses))
+        self.assertEqual(self.server.stats['tokens'], 1)
+        # one for the token request, one kept alive by the async client
+        self.assertEqual(self.server.stats['connections'], 2)
+
+    def test_bulk_b2c_is_bounded_and_tracked(self):
+        """Test bulk payouts run concurrently within the limit and are keyed by OriginatorConversationID"""
+        payouts = [
+            {'phone_number': '0700000000', 'amount': 100, 'originator_conversation_id': f"TXN-{i}"}
+            for i in range(20)
+        ]
+        results = self.gateway.bulk_b2c(payouts, callback_url='https://example.com/b2c')
+
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(result['ok'] for result in results.values()))
+        self.assertEqual(results['TXN-3']['response']['ConversationID'], 'AG_TXN-3')
+        self.assertLessEqual(self.server.stats['max_in_flight'], 4)
+        self.assertGreater(self.server.stats['max_in_flight'], 1)
+        self.assertLessEqual(self.server.stats['connections'], 4)
+        self.assertEqual(self.server.stats['tokens'], 1)
+
+
+class MpesaWithdrawalTest(TestCase):
+    """Test suite for M-Pesa withdrawals sent through B2C against a local Daraja stub"""
+
+    def setUp(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), DarajaStubHandler)
+        self.server.lock = threading.Lock()
+        self.server.stats = {'connections': 0, 'tokens': 0, 'in_flight': 0, 'max_in_flight': 0, 'b2c': 0}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.gateway = DarajaGateway(
+            base_url=f"http://127.0.0.1:{self.server.server_port}/",
+            consumer_key='key', consumer_secret='secret', shortcode='600000', passkey='passkey',
+            initiator_name='testapi', security_credential='credential',
+            max_concurrency=4, rate_per_second=1000
+        )
+        for name, value in (('get_gateway', self.gateway), ('config', 'https://example.com/b2c')):
+            patcher = mock.patch.object(mpesa_withdrawals, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        role = Role.objects.create(role_name='Customer', category='Customer')
+        self.user = User.objects.create_user(email='b2c@test.com', password='testpass123', role=role)
+        customer = CustomerProfile.objects.create(user=self.user, customer_id='CUST-B2C', phone_number='+254700000000')
+        account_type = AccountType.objects.create(name='SAVINGS', code='SAV', description='Savings')
+        self.account = Account.objects.create(
+            customer=customer, account_type=account_type, status='ACTIVE',
+            balance=Decimal('1000.00'), available_balance=Decimal('1000.00')
+        )
+        Account.objects.create(
+            account_number='SYSTEM_MPESA_ACCOUNT', category='INTERNAL', account_type=account_type,
+            status='ACTIVE', balance=Decimal('100000.00'), available_balance=Decimal('100000.00')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        self.gateway.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def withdraw(self, amount):
+        with mock.patch('accounts.tasks.disburse_mpesa_withdrawals_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/v1.0/accounts/mpesa-withdraw/', {
+                    'account_number': self.account.account_number, 'phone_number': '0700000000', 'amount': amount
+                }, format='json')
+        self.assertEqual(response.status_code, 202)
+        withdrawal = Transaction.objects.get(id=response.data['transaction_id'])
+        delay.assert_called_once_with([str(withdrawal.id)])
+        return withdrawal
+
+    def test_withdrawal_is_sent_once_and_posted_from_result(self):
+        """Test a queued withdrawal is paid out once however often the task runs, then posted by its B2C result"""
+        withdrawal = self.withdraw(200)
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.balance, self.account.available_balance), (Decimal('1000.00'), Decimal('800.00')))
+        self.assertEqual(AccountHold.objects.get(reference_id=withdrawal.transaction_ref).amount, Decimal('200.00'))
+
+        self.assertEqual(tasks.disburse_mpesa_withdrawals_task([str(withdrawal.id)])['sent'], 1)
+        self.assertEqual(tasks.disburse_mpesa_withdrawals_task([str(withdrawal.id)])['sent'], 0)
+        self.assertEqual(tasks.disburse_mpesa_withdrawals_task()['sent'], 0)
+        self.assertEqual(self.server.stats['b2c'], 1)
+        withdrawal.refresh_from_db()
+        self.assertEqual(withdrawal.trans_status, TransactionStatus.PROCESSING)
+        self.assertEqual(withdrawal.external_ref, f"AG_{withdrawal.transaction_ref}")
+
+        result = {'Result': {
+            'ResultCode': 0, 'ResultDesc': 'The service request is processed successfully.',
+            'OriginatorConversationID': withdrawal.transaction_ref, 'ConversationID': withdrawal.external_ref,
+            'TransactionID': 'RKB1234567',
+            'ResultParameters': {'ResultParameter': [{'Key': 'TransactionAmount', 'Value': 200}]},
+        }}
+        response = self.client.post('/api/v1.0/accounts/b2c-callback/', data=json.dumps(result), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(mpesa_callbacks.process_callback_batch()['posted'], 1)
+        withdrawal.refresh_from_db()
+        self.account.refresh_from_db()
+        self.assertEqual(withdrawal.trans_status, TransactionStatus.COMPLETED)
+        self.assertEqual(withdrawal.metadata['mpesa_receipt'], 'RKB1234567')
+        self.assertEqual((self.account.balance, self.account.available_balance), (Decimal('800.00'), Decimal('800.00')))
+        self.assertTrue(AccountHold.objects.get(reference_id=withdrawal.transaction_ref).is_released)
+
+    def test_only_rejections_fail_the_withdrawal(self):
+        """Test a rejected payout fails while one with an unknown outcome stays open and is not resent"""
+        rejected, unknown = self.withdraw(98), self.withdraw(99)
+
+        summary = tasks.disburse_mpesa_withdrawals_task([str(rejected.id), str(unknown.id)])
+        self.assertEqual(summary, {'sent': 0, 'failed': 1, 'unknown': 1})
+        rejected.refresh_from_db()
+        unknown.refresh_from_db()
+        self.assertEqual(rejected.trans_status, TransactionStatus.FAILED)
+        self.assertEqual(unknown.trans_status, TransactionStatus.PROCESSING)
+        self.assertIn('Service unavailable', unknown.last_error)
+        # the rejected amount is released, the one that may have gone out stays held
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.balance, self.account.available_balance), (Decimal('1000.00'), Decimal('901.00')))
+        self.assertTrue(AccountHold.objects.get(reference_id=rejected.transaction_ref).is_released)
+        self.assertFalse(AccountHold.objects.get(reference_id=unknown.transaction_ref).is_released)
+
+        self.assertEqual(tasks.disburse_mpesa_withdrawals_task(), {'sent': 0, 'failed': 0, 'unknown': 0})
+
+    def test_failed_result_releases_hold(self):
+        """Test a failed B2C result fails the withdrawal and gives the held amount back"""
+        withdrawal = self.withdraw(300)
+        tasks.disburse_mpesa_withdrawals_task([str(withdrawal.id)])
+        MpesaCallback.objects.create(callback_type='B2C', dedupe_key=withdrawal.transaction_ref, result_code=2001, payload={
+            'Result': {'ResultCode': 2001, 'ResultDesc': 'The initiator information is invalid.'}
+        })
+
+        self.assertEqual(mpesa_callbacks.process_callback_batch()['failed'], 1)
+        withdrawal.refresh_from_db()
+        self.account.refresh_from_db()
+        self.assertEqual(withdrawal.trans_status, TransactionStatus.FAILED)
+        self.assertEqual((self.account.balance, self.account.available_balance), (Decimal('1000.00'), Decimal('1000.00')))
+        self.assertTrue(AccountHold.objects.get(reference_id=withdrawal.transaction_ref).is_released)
+
+    def test_insufficient_funds_are_refused(self):
+        """Test a withdrawal above the available balance is not recorded, held amounts included"""
+        self.withdraw(900)
+        response = self.client.post('/api/v1.0/accounts/mpesa-withdraw/', {
+            'account_number': self.account.account_number, 'phone_number': '0700000000', 'amount': 200
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.filter(transaction_type=TransactionType.MPESA_WITHDRAWAL).count(), 1)
+
+
+class MpesaReconciliationTest(TestCase):
+    """Test suite for M-Pesa statement reconciliation"""
+
+    def setUp(self):
+        role = Role.objects.create(role_name='Customer', category='Customer')
+        self.user = User.objects.create_user(email='recon@test.com', password='testpass123', role=role)
+        self.start = timezone.now() - timedelta(hours=1)
+        self.end = timezone.now() + timedelta(hours=1)
+        for receipt, amount in (('RKA001', '100.00'), ('RKA002', '250.00'), ('RKA003', '75.00'), ('RKA004', '10.00')):
+            Transaction.objects.create(
+                transaction_ref=f"TXN-{receipt}",
+                transaction_type=TransactionType.MPESA_DEPOSIT,
+                trans_status=TransactionStatus.COMPLETED,
+                amount=Decimal(amount),
+                external_ref=f"ws_CO_{receipt}",
+                metadata={'mpesa_receipt': receipt},
+                initiated_by=self.user,
+                idempotency_key=f"recon-{receipt}",
+                completed_at=timezone.now()
+            )
+
+    def test_reports_every_issue_in_one_pass(self):
+        """Test matched, mismatched, duplicate and missing items are all reported"""
+        statement = io.StringIO(
+            "Receipt No.,Completion Time,Details,Transaction Status,Paid In,Withdrawn,Balance\n"
+            "RKA001,2026-01-01 10:00:00,Deposit,Completed,100.00,,1000.00\n"
+            "RKA002,2026-01-01 10:01:00,Deposit,Completed,\"2,500.00\",,3500.00\n"
+            "RKA003,2026-01-01 10:02:00,Deposit,Completed,75.00,,3575.00\n"
+            "RKA003,2026-01-01 10:02:00,Deposit,Completed,75.00,,3575.00\n"
+            "RKZ999,2026-01-01 10:03:00,Deposit,Completed,50.00,,3625.00\n"
+            "RKF000,2026-01-01 10:04:00,Deposit,Failed,20.00,,3625.00\n"
+        )
+        report = io.StringIO()
+
+        summary = mpesa_reconciliation.reconcile_statement(statement, self.start, self.end, report)
+        self.assertEqual(summary['statement_rows'], 5)
+        self.assertEqual(summary['matched'], 2)
+        self.assertEqual(summary['amount_mismatch'], 1)
+        self.assertEqual(summary['duplicate'], 1)
+        self.assertEqual(summary['missing_in_ledger'], 1)
+        self.assertEqual(summary['missing_in_statement'], 1)
+
+        issues = {(row['issue'], row['reference']) for row in csv.DictReader(io.StringIO(report.getvalue()))}
+        self.assertEqual(issues, {
+            ('amount_mismatch', 'RKA002'),
+            ('duplicate', 'RKA003'),
+            ('missing_in_ledger', 'RKZ999'),
+            ('missing_in_statement', 'RKA004'),
+        })
+
+
+class BalanceSnapshotTest(TestCase):
+    """Test suite for cached balance snapshots"""
+
+    def setUp(self):
+        cache.clear()
+        balances.snapshot_store.clear()
+        # committed, so the cache invalidations of the setup writes have run
+        with self.captureOnCommitCallbacks(execute=True):
+            role = Role.objects.create(role_name='Customer', category='Customer')
+            self.user = User.objects.create_user(email='poll@test.com', password='testpass123', role=role)
+            customer = CustomerProfile.objects.create(user=self.user, customer_id='CUST-POLL', phone_number='+254700000001')
+            account_type = AccountType.objects.create(name='SAVINGS', code='SAV', description='Savings')
+            self.account = Account.objects.create(
+                customer=customer, account_type=account_type, status='ACTIVE',
+                balance=Decimal('100.00'), available_balance=Decimal('100.00')
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def poll(self):
+        response = self.client.get('/api/v1.0/accounts/create/account/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()[0]
+
+    def test_polling_served_from_cache(self):
+        """Test balance polls skip the database and follow committed balance writes"""
+        self.assertEqual(self.poll()['balance'], '100.00')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.poll()['balance'], '100.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.account.balance = F('balance') - Decimal('40.00')
+            self.account.available_balance = F('available_balance') - Decimal('40.00')
+            self.account.save(update_fields=['balance', 'available_balance', 'updated_at'])
+
+        # refreshed after commit, the cached account list is still good
+        with self.assertNumQueries(0):
+            account = self.poll()
+        self.assertEqual(account['balance'], '60.00')
+        self.assertEqual(account['available_balance'], '60.00')
+
+    def test_writes_before_commit_are_not_visible(self):
+        """Test snapshots are only refreshed once the write commits"""
+        self.poll()
+        with self.captureOnCommitCallbacks() as callbacks:
+            Account.objects.filter(id=self.account.id).update(status='FROZEN')
+            balances.refresh_after_commit([self.account.id])
+            self.assertEqual(self.poll()['status'], 'ACTIVE')
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(self.poll()['status'], 'FROZEN')
+
+    def test_snapshot_expires_after_ttl(self):
+        """Test a snapshot whose refresh was lost is only served until its TTL runs out"""
+        account_id = str(self.account.id)
+        store = balances.InMemoryBalanceStore(ttl=60)
+        with mock.patch.object(balances, 'snapshot_store', store), mock.patch.object(balances.time, 'monotonic') as monotonic:
+            monotonic.return_value = 1000.0
+            balances.get_snapshots([account_id])
+            # a committed write whose after-commit refresh never ran
+            Account.objects.filter(id=self.account.id).update(balance=Decimal('250.00'), available_balance=Decimal('250.00'))
+            self.assertEqual(balances.get_snapshots([account_id])[account_id]['balance'], Decimal('100.00'))
+
+            monotonic.return_value = 1061.0
+            self.assertEqual(balances.get_snapshots([account_id])[account_id]['balance'], Decimal('250.00'))
+
+    def test_stale_refresh_never_overwrites(self):
+        """Test a snapshot read before a newer refresh is not stored over it"""
+        account_id = str(self.account.id)
+        slow = balances.snapshot_store.reserve([account_id])[account_id]
+        stale = balances.load_snapshots([account_id])
+
+        Account.objects.filter(id=self.account.id).update(balance=Decimal('250.00'), available_balance=Decimal('250.00'))
+        balances.refresh([account_id])
+
+        stale[account_id]['version'] = slow
+        balances.snapshot_store.put(stale)
+        snapshot = balances.get_snapshots([account_id])[account_id]
+        self.assertEqual(snapshot['balance'], Decimal('250.00'))
+        self.assertGreater(snapshot['version'], slow)
@@ -17,7 +17,8 @@ urlpatterns = [
     path('limit/override/request/<str:account_id>/', HandleRequestOverride.as_view(), name='limit-override-request'),
     path('holds/<str:account_id>/', HandleAccountHold.as_view(), name='account-holds'),
     path('mpesa-b2c/', businessTocustomer, name='mpesa-callback'),
-    path('mpesa-stk-push/', initiate_stk_push, name='mpesa-stk-push'),
+    path('mpesa-stk-push/', InitiateStkPush.as_view(), name='mpesa-stk-push'),
+    path('mpesa-withdraw/', InitiateMpesaWithdrawal.as_view(), name='mpesa-withdraw'),
     path('stk-callback/', safaricom_stk_callback, name='safaricom-callback'),
     path('b2c-callback/', safaricom_b2c_callback, name='safaricom-callback'),
 
@@ -19,6 +19,8 @@ from django.db.models import Q, Sum
 from decimal import Decimal
 from .metrics import *
 from .documentation import v1
+from bank.routers import ReplicaReadMixin
+from .services import balances
 
 
 #getorcreate
@@ -38,11 +40,8 @@ class AccountView(APIView):
     permission_classes = [IsAuthenticated, IsCustomer]
 
     def get(self, request):
-        customer = CustomerProfile.objects.get(user=request.user)
-        accounts = Account.objects.filter(customer=customer).order_by('-is_primary')
-
-        serializer = AccountSerializer(accounts, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # polled by the apps for balances: answered from the cached list and balance snapshots
+        return Response(balances.customer_accounts(request.user.id), status=status.HTTP_200_OK)
     
     def post(self,request):
         try:
@@ -55,7 +54,7 @@ class AccountView(APIView):
             
             customer = CustomerProfile.objects.get(user = user)
 
-            account_type = get_object_or_404(AccountType, name = account_type)
+            account_type = AccountType.cached(name=account_type)
 
             # check if customer verification status in kyc
             try:
@@ -145,7 +144,7 @@ class AccountView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ManageAccounts(APIView):
+class ManageAccounts(ReplicaReadMixin, APIView):
     permission_classes = [IsAuthenticated, HasAccountPermission]
 
     def get(self,request):
@@ -615,7 +614,7 @@ class HandleRequestOverride(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
 
-class HandleAccountHold(APIView):
+class HandleAccountHold(ReplicaReadMixin, APIView):
     """
     staff can get all accounts on hhold with the respecctive reasons 
     """
@@ -697,7 +696,7 @@ class HandleAccountHold(APIView):
                 )
 
                 account.available_balance -= Decimal(amount)
-                account.save()
+                account.save(update_fields=['available_balance', 'updated_at'])
 
                 return Response({
                     "message": "Account hold placed successfully",
@@ -63,3 +63,15 @@ class RoleAdmin(admin.ModelAdmin):
 class DepartmentAdmin(admin.ModelAdmin):
     list_display = [field.name for field in Department._meta.fields]
 
+
+@admin.register(RevokedSession)
+class RevokedSessionAdmin(admin.ModelAdmin):
+    list_display = ("key", "user", "reason", "revoked_at", "expires_at")
+    search_fields = ("key", "user__email")
+    list_filter = ("reason",)
+
+@admin.register(KycUpload)
+class KycUploadAdmin(admin.ModelAdmin):
+    list_display = ("id", "kyc_profile", "document_type", "file_name", "status", "received_bytes", "total_size", "created_at")
+    list_filter = ("status", "document_type")
+    search_fields = ("kyc_profile__user__email", "file_name")
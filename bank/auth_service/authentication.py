@@ -0,0 +1,106 @@
+from django.utils.functional import LazyObject, empty
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from .models import User, Role
+from .services.tokens import SESSION_CLAIM, is_session_revoked
+
+
+class ClaimsUser(LazyObject):
+    """
+    request.user built from token claims. id, role, staff flags and customer_id
+    come straight from the token; anything else (email, profiles, saving the user,
+    using it as a foreign key value) loads the real User once, on first access.
+    Filtering by it (`filter(user=request.user)`) only needs the id and stays lazy.
+    """
+
+    _meta = User._meta
+
+    def __init__(self, claims):
+        self.__dict__['_claims'] = claims
+        super().__init__()
+
+    def _setup(self):
+        self._wrapped = User.objects.select_related('role').get(pk=self.pk)
+
+    @property
+    def __class__(self):
+        return User
+
+    @property
+    def pk(self):
+        return User._meta.pk.to_python(self._claims[api_settings.USER_ID_CLAIM])
+
+    id = pk
+
+    @property
+    def role_id(self):
+        role_id = self._claims.get('role_id')
+        return Role._meta.pk.to_python(role_id) if role_id else None
+
+    @property
+    def role(self):
+        """Unsaved Role carrying the id, name and category, enough for role.permissions lookups"""
+        if self._wrapped is not empty:
+            return self._wrapped.role
+        if '_role' not in self.__dict__ and self.role_id:
+            role = Role(
+                id=self.role_id,
+                role_name=self._claims.get('role_name') or '',
+                category=self._claims.get('role_category') or ''
+            )
+            role._state.adding = False
+            self.__dict__['_role'] = role
+        return self.__dict__.get('_role')
+
+    @property
+    def is_staff(self):
+        return bool(self._claims.get('is_staff'))
+
+    @property
+    def is_superuser(self):
+        return bool(self._claims.get('is_superuser'))
+
+    @property
+    def customer_id(self):
+        return self._claims.get('customer_id')
+
+    # saving a user with a changed is_active, staff flag or role revokes their sessions (User post_save),
+    # so a valid token means an active user with these claims
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __bool__(self):
+        return True
+
+    def __eq__(self, other):
+        return isinstance(other, User) and other.pk == self.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __copy__(self):
+        return type(self)(self._claims)
+
+    def __deepcopy__(self, memo):
+        result = type(self)(dict(self._claims))
+        memo[id(self)] = result
+        return result
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without the per request User query. Tokens issued by
+    issue_tokens() are checked against the revoked session filter and turned
+    into a ClaimsUser; older tokens without a session claim load the user as before.
+    """
+
+    def get_user(self, validated_token):
+        if SESSION_CLAIM not in validated_token or api_settings.USER_ID_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        if is_session_revoked(validated_token):
+            raise AuthenticationFailed("Session has been revoked", code="session_revoked")
+
+        return ClaimsUser(validated_token.payload)
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+import time
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with the iteration count taken from settings.PASSWORD_HASH_ITERATIONS.
+    It keeps the pbkdf2_sha256 algorithm name, so existing hashes verify as before and
+    must_update() flags any hash made with a different count for a rehash.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', 0) or PBKDF2PasswordHasher.iterations
+
+
+# OWASP's floor for PBKDF2-HMAC-SHA256, tuning never goes below it
+MIN_ITERATIONS = 600_000
+
+
+def benchmark_iterations(target_ms, probe_iterations=100_000, rounds=5):
+    """
+    Iteration count whose hash takes about `target_ms` on this machine. PBKDF2 cost
+    is linear in the iteration count, so the fastest of a few probe runs is scaled
+    up, rounded to 10k and floored at MIN_ITERATIONS.
+    """
+    hasher = PBKDF2PasswordHasher()
+    salt = hasher.salt()
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        hasher.encode('benchmark-password', salt, probe_iterations)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    per_iteration_ms = best * 1000 / probe_iterations
+    iterations = int(target_ms / per_iteration_ms) // 10_000 * 10_000
+    return max(iterations, MIN_ITERATIONS), per_iteration_ms
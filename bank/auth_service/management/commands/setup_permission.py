@@ -36,7 +36,7 @@ class Command(BaseCommand):
             "can_manage_users", "can_view_user_profiles", "view_account_balance",
             "transfer_funds", "approve_transfer", "view_transaction_history",
             "manage_accounts", "override_limits", "view_audit_log", "process_kyc",
-            "can_manage_system_settings", "can_view_system_logs",
+            "process_card_payments", "review_fraud_alerts", "can_manage_system_settings", "can_view_system_logs",
             
             # From EmployeeProfile.Meta  
             "can_manage_employees", "can_view_employee_details",
@@ -170,7 +170,7 @@ class Command(BaseCommand):
             'FINANCE_MANAGER': [
                 'view_account_balance', 'transfer_funds', 'approve_transfer', 
                 'view_transaction_history', 'manage_accounts', 'override_limits',
-                'view_audit_log', 'can_view_customer_accounts'
+                'view_audit_log', 'can_view_customer_accounts', 'process_card_payments'
             ],
             
             'FINANCE_OFFICER': [
@@ -216,11 +216,11 @@ class Command(BaseCommand):
             
             'RISK_MANAGER': [
                 'process_kyc', 'view_audit_log', 'view_account_balance', 
-                'view_transaction_history', 'can_view_customer_accounts'
+                'view_transaction_history', 'can_view_customer_accounts', 'review_fraud_alerts'
             ],
             
             'RISK_STAFF': [
-                'process_kyc', 'view_audit_log', 'view_transaction_history'
+                'process_kyc', 'view_audit_log', 'view_transaction_history', 'review_fraud_alerts'
             ],
             
             'CUSTOMER': [
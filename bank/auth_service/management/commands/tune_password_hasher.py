@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand, CommandError
+from auth_service.hashers import MIN_ITERATIONS, benchmark_iterations
+
+
+class Command(BaseCommand):
+    help = 'Benchmark PBKDF2 on this machine and suggest PASSWORD_HASH_ITERATIONS for a target hash time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=250, help='Time one password hash should take, in ms')
+        parser.add_argument('--rounds', type=int, default=5, help='Benchmark runs, the fastest one is used')
+
+    def handle(self, *args, **options):
+        if options['target_ms'] <= 0:
+            raise CommandError('--target-ms must be positive')
+
+        iterations, per_iteration_ms = benchmark_iterations(options['target_ms'], rounds=options['rounds'])
+        current = get_hasher().iterations
+
+        self.stdout.write(f"One PBKDF2 iteration takes {per_iteration_ms * 1000:.3f}us on this machine")
+        self.stdout.write(f"Current iterations: {current} (~{current * per_iteration_ms:.0f}ms per login)")
+        if iterations == MIN_ITERATIONS:
+            self.stdout.write(self.style.WARNING(
+                f"Target of {options['target_ms']:.0f}ms is below the {MIN_ITERATIONS} iteration floor"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"PASSWORD_HASH_ITERATIONS={iterations} (~{iterations * per_iteration_ms:.0f}ms per login)"
+        ))
+        self.stdout.write(
+            f"With PASSWORD_CHECK_WORKERS={settings.PASSWORD_CHECK_WORKERS} a process verifies about "
+            f"{settings.PASSWORD_CHECK_WORKERS * 1000 / (iterations * per_iteration_ms):.0f} logins/s. "
+            f"Existing hashes are rehashed on their next login."
+        )
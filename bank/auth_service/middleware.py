@@ -1,3 +1,4 @@
+from asgiref.sync import sync_to_async
 import json
 import logging
 from django.utils.deprecation import MiddlewareMixin
@@ -19,6 +20,21 @@ class SimpleAuditMiddleware(MiddlewareMixin):
         super().__init__(get_response)
     
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        self.keep_body(request)
+        response = self.get_response(request)
+        return self.audit(request, response)
+
+    async def __acall__(self, request):
+        # async views keep their event loop, only writes go to a thread for the audit log
+        self.keep_body(request)
+        response = await self.get_response(request)
+        if request.method not in ['POST', 'PUT', 'PATCH', 'DELETE']:
+            return response
+        return await sync_to_async(self.audit)(request, response)
+
+    def keep_body(self, request):
         # Store original request body for audit logging
         if request.method in ['POST', 'PUT', 'PATCH', 'DELETE']:
             # Read and store the request body
@@ -26,9 +42,8 @@ class SimpleAuditMiddleware(MiddlewareMixin):
             # Create a copy for potential re-reading
             if hasattr(request, '_body'):
                 request._original_body = request._body
-        
-        response = self.get_response(request)
-        
+
+    def audit(self, request, response):
         # Log if authenticated and modifying data
         if (request.user and request.user.is_authenticated and  request.user.is_staff and
             request.method in ['POST', 'PUT', 'PATCH', 'DELETE'] and
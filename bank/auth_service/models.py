@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from .manager import CustomUserManager
 from django.contrib.auth.models import AbstractUser, Permission
 from django.utils import timezone
@@ -7,6 +9,7 @@ from .utility import *
 from django.contrib.contenttypes.models import ContentType
 import secrets
 from encrypted_model_fields.fields import EncryptedTextField
+from bank.cache import cached_query, invalidate
 
 
 
@@ -38,6 +41,9 @@ class Department(BaseModel):
     def __str__(self):
         return self.name
 
+ROLE_PERMISSIONS_CACHE = 'role-permissions'
+
+
 class Role(BaseModel):
     """Enhanced role model with hierarchical support"""
     
@@ -62,11 +68,26 @@ class Role(BaseModel):
     def __str__(self):
         return self.role_name 
 
+    def permission_codenames(self):
+        """Codenames the role grants, from the shared cache (checked on every staff request)"""
+        return cached_query(
+            ROLE_PERMISSIONS_CACHE,
+            self.id,
+            lambda: frozenset(Permission.objects.filter(roles__id=self.id).values_list('codename', flat=True))
+        )
+
+    def has_any_permission(self, *codenames):
+        return not self.permission_codenames().isdisjoint(codenames)
+
     class Meta:
         db_table = 'auth_role'
         indexes = [
             models.Index(fields=['category', 'is_active']),
         ]
+# User columns copied into token claims (services/tokens.session_claims), saving a change revokes the user's sessions
+SESSION_CLAIM_FIELDS = ('is_active', 'is_staff', 'is_superuser', 'role_id')
+
+
 class User(AbstractUser,BaseModel):
     role = models.ForeignKey(Role, on_delete=models.PROTECT,related_name="users")
     email = models.EmailField(unique=True)
@@ -120,6 +141,20 @@ class User(AbstractUser,BaseModel):
         return False
 
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_session_claims()
+        return instance
+
+    def remember_session_claims(self):
+        """Keep the loaded SESSION_CLAIM_FIELDS so a save can tell whether issued tokens went stale"""
+        self._session_claims = {field: self.__dict__[field] for field in SESSION_CLAIM_FIELDS if field in self.__dict__}
+
+    def changed_session_claims(self):
+        loaded = getattr(self, '_session_claims', {})
+        return [field for field, value in loaded.items() if self.__dict__.get(field) != value]
+
     def __str__(self):
         return f"{self.first_name} - {self.role} - {self.last_name} - {self.email}"
     
@@ -142,6 +177,8 @@ class User(AbstractUser,BaseModel):
             ("override_limits", "Can override transaction limits"),
             ("view_audit_log", "Can view audit logs"),
             ("process_kyc", "Can process KYC verification"),
+            ("process_card_payments", "Can authorize and settle card payments"),
+            ("review_fraud_alerts", "Can review fraud alerts and act on fraud cases"),
             
             # System Administration
             ("can_manage_system_settings", "Can manage system settings"),
@@ -256,12 +293,17 @@ class KycProfile(BaseModel):
     verified_at = models.DateTimeField(null=True, blank=True)
     verified_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="verified_kyc_profiles")
     review_notes = models.TextField(blank=True, null=True)
+    # reviewer currently working the application, see services/kyc_review.py
+    assigned_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="assigned_kyc_profiles")
+    assigned_at = models.DateTimeField(null=True, blank=True)
 
 
     class Meta:
         indexes = [
             models.Index(fields=['user', 'verification_status']),
             models.Index(fields=['verification_status']),
+            models.Index(fields=['verification_status', 'updated_at', 'id']),  # review queue keyset
+            models.Index(fields=['assigned_to', 'verification_status']),
         ]
 
     def __str__(self):
@@ -308,6 +350,52 @@ class KycDocument(BaseModel):
 
 
 
+class KycUpload(BaseModel):
+    """
+    Resumable, chunked upload of one KYC document. Chunks are appended to a
+    staging file outside the database; the KycDocument row is only written once
+    the whole file has been checked, processed and moved to storage.
+    """
+
+    UPLOAD_STATUS = (
+        ('UPLOADING', 'Uploading'),
+        ('PROCESSING', 'Processing'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed')
+    )
+
+    kyc_profile = models.ForeignKey(KycProfile, on_delete=models.CASCADE, related_name="uploads")
+    document_type = models.CharField(max_length=30)
+    file_name = models.CharField(max_length=255)
+    total_size = models.PositiveIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    received_bytes = models.PositiveIntegerField(default=0)
+    next_chunk = models.PositiveIntegerField(default=0)
+    checksum = models.CharField(max_length=64, blank=True)  # sha256 of the whole file, when the client sends one
+    content_type = models.CharField(max_length=20, blank=True)  # sniffed from the magic bytes
+    status = models.CharField(max_length=20, choices=UPLOAD_STATUS, default='UPLOADING')
+    page_count = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail = models.FileField(upload_to='kyc_documents/thumbnails/', null=True, blank=True)
+    document = models.ForeignKey(KycDocument, on_delete=models.SET_NULL, null=True, blank=True, related_name="uploads")
+    error = models.TextField(blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'kyc_upload'
+        indexes = [
+            models.Index(fields=['kyc_profile', 'status']),
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    @property
+    def chunk_count(self):
+        return max((self.total_size + self.chunk_size - 1) // self.chunk_size, 1)
+
+    def __str__(self):
+        return f"{self.document_type} upload {self.id} - {self.status}"
+
+
+
 class SessionLogs(BaseModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="session_logs")
     login_time = models.DateTimeField(auto_now_add=True)
@@ -394,3 +482,47 @@ class AuditLog(BaseModel):
     
     def __str__(self):
         return f"{self.user.email} - {self.action} - {self.endpoint}"
+
+
+class RevokedSession(BaseModel):
+    """
+    Revoked login sessions and users, checked by ClaimsJWTAuthentication.
+    key is "sid:<session id>" for one session (logout) or "user:<user id>" for
+    every session of a user (deactivation, role change). Only tokens issued before
+    revoked_at are refused, and rows are only needed until the last of those expires.
+    """
+    key = models.CharField(max_length=100, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='revoked_sessions')
+    reason = models.CharField(max_length=50, blank=True)
+    revoked_at = models.DateTimeField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'auth_revoked_session'
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.reason})"
+
+
+@receiver(post_save, sender=User)
+def revoke_stale_sessions(sender, instance, created, **kwargs):
+    # queryset .update() sends no signal, callers changing these columns that way call revoke_user themselves
+    changed = [] if created else instance.changed_session_claims()
+    instance.remember_session_claims()
+    if changed:
+        from .services.tokens import revoke_user
+
+        reason = 'deactivated' if not instance.is_active else 'role_changed' if 'role_id' in changed else 'claims_changed'
+        revoke_user(instance.id, reason=reason)
+
+
+@receiver(m2m_changed, sender=Role.permissions.through)
+@receiver(post_delete, sender=Role)
+@receiver(post_delete, sender=Permission)
+def reload_role_permissions(sender, action=None, **kwargs):
+    # one namespace for every role: grants change rarely and a reload is one small query per role
+    if action is None or action.startswith('post_'):
+        invalidate(ROLE_PERMISSIONS_CACHE)
@@ -21,9 +21,7 @@ class HasRolePermission(BasePermission): #for global routes
             return False
         
         # Check if user has ANY of the specified permissions
-        return user.role.permissions.filter(
-            codename__in=self.permissions
-        ).exists()
+        return user.role.has_any_permission(*self.permissions)
 
 
 class EmployeeAccessPermission(BasePermission):
@@ -46,15 +44,11 @@ class EmployeeAccessPermission(BasePermission):
         
         # GET method - only view permission required
         if request.method in ['GET','PUT', 'PATCH']:
-            return user.role.permissions.filter(
-                codename='can_view_employee_details'
-            ).exists()
+            return user.role.has_any_permission('can_view_employee_details')
         
         # POST, PUT, PATCH, DELETE methods - manage permission required
         elif request.method in ['POST', 'DELETE']:
-            return user.role.permissions.filter(
-                codename='can_manage_employees'
-            ).exists()
+            return user.role.has_any_permission('can_manage_employees')
         
         # For any other methods, deny by default
         return False
@@ -74,6 +68,4 @@ class ReviewKycPermissions(BasePermission):
             return False
 
         # Check if user has the required permission
-        return user.role.permissions.filter(
-            codename__in=self.required_permissions
-        ).exists()
+        return user.role.has_any_permission(*self.required_permissions)
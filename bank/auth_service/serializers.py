@@ -1,6 +1,10 @@
 # handle serializer for auth 
 from .models import *
 from rest_framework import serializers
+from rest_framework_simplejwt import exceptions as jwt_exceptions
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from .services.tokens import SESSION_CLAIM, is_session_revoked, session_claims
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -68,3 +72,71 @@ class KycProfileSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
     
+
+
+class SessionTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that refuses revoked sessions and re-reads the session claims
+    (role, staff flags, customer id) so role changes reach the next access token.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+
+        user = User.objects.select_related('role', 'customer_profile').filter(
+            **{api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise jwt_exceptions.AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+
+        if SESSION_CLAIM in refresh:
+            if is_session_revoked(refresh):
+                raise jwt_exceptions.InvalidToken("Session has been revoked")
+            for claim, value in session_claims(user).items():
+                refresh[claim] = value
+
+        data = {"access": str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+
+            data["refresh"] = str(refresh)
+
+        return data
+
+
+class KycUploadSerializer(serializers.ModelSerializer):
+    chunk_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = KycUpload
+        fields = [
+            'id', 'document_type', 'file_name', 'total_size', 'chunk_size', 'chunk_count',
+            'received_bytes', 'next_chunk', 'content_type', 'status', 'page_count',
+            'thumbnail', 'document', 'error', 'created_at', 'completed_at'
+        ]
+
+
+class KycQueueSerializer(serializers.ModelSerializer):
+    """Review queue row, documents come from the cached metadata passed in the context"""
+    user_email = serializers.EmailField(source='user.email', read_only=True)
+    user_full_name = serializers.CharField(source='user.get_full_name', read_only=True)
+    assigned_to_email = serializers.EmailField(source='assigned_to.email', read_only=True, default=None)
+    documents = serializers.SerializerMethodField()
+
+    class Meta:
+        model = KycProfile
+        fields = [
+            'id', 'user', 'user_email', 'user_full_name', 'verification_status',
+            'assigned_to', 'assigned_to_email', 'assigned_at', 'documents',
+            'created_at', 'updated_at'
+        ]
+
+    def get_documents(self, obj):
+        return self.context.get('documents', {}).get(obj.id, [])
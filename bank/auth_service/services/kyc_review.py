@@ -0,0 +1,200 @@
+"""
+KYC review queue.
+
+The queue is read with keyset pagination over (verification_status, updated_at,
+id), so deep pages cost the same as the first one. Reviewers claim batches of
+applications with SELECT ... FOR UPDATE SKIP LOCKED, which hands concurrent
+reviewers disjoint rows instead of making them wait on (or double-review) the
+same ones. Decisions are applied in bulk with one bulk_update for the profiles
+and one for their documents. Document metadata for a page comes from the cache,
+keyed on the profile's updated_at so any change to the application misses it.
+"""
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from ..models import KycDocument, KycProfile
+import base64
+import json
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+DECISION_STATUSES = ('APPROVED', 'REJECTED')
+DOCUMENT_FIELDS = ('id', 'document_type', 'file_name', 'file_size', 'status', 'expiry_date', 'updated_at')
+
+
+class KycReviewError(Exception):
+    """Raised when a review request cannot be applied"""
+
+
+def encode_cursor(profile):
+    cursor_data = {'updated_at': profile.updated_at.isoformat(), 'id': str(profile.id)}
+    return base64.urlsafe_b64encode(json.dumps(cursor_data).encode()).decode()
+
+
+def decode_cursor(cursor_string):
+    try:
+        cursor_data = json.loads(base64.urlsafe_b64decode(cursor_string.encode()).decode())
+        return datetime.fromisoformat(cursor_data['updated_at']), cursor_data['id']
+    except (ValueError, KeyError, TypeError):
+        raise KycReviewError("Invalid cursor")
+
+
+def review_queue(verification_status='PENDING', cursor=None, page_size=50, user_email=None, assigned_to=None):
+    """
+    One page of the queue, oldest first. Returns (profiles, documents by profile id, next cursor).
+    """
+    queryset = KycProfile.objects.select_related('user', 'assigned_to').filter(
+        verification_status=verification_status
+    ).order_by('updated_at', 'id')
+
+    if user_email:
+        queryset = queryset.filter(user__email__icontains=user_email)
+    if assigned_to is not None:
+        queryset = queryset.filter(assigned_to=assigned_to)
+    if cursor:
+        updated_at, profile_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=profile_id))
+
+    profiles = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(profiles[page_size - 1]) if len(profiles) > page_size else None
+    profiles = profiles[:page_size]
+    return profiles, document_metadata(profiles), next_cursor
+
+
+def document_cache_key(profile):
+    return f"kyc:documents:{profile.id}:{profile.updated_at.timestamp()}"
+
+
+def document_metadata(profiles):
+    """Document dicts per profile id, one cache round trip plus one query for the misses"""
+    keys = {document_cache_key(profile): profile.id for profile in profiles}
+    cached = cache.get_many(list(keys))
+    documents = {keys[key]: value for key, value in cached.items()}
+
+    missing = [profile_id for key, profile_id in keys.items() if key not in cached]
+    if missing:
+        fetched = {profile_id: [] for profile_id in missing}
+        for row in KycDocument.objects.filter(kyc_profile_id__in=missing).order_by('document_type').values(
+            'kyc_profile_id', *DOCUMENT_FIELDS
+        ):
+            fetched[row.pop('kyc_profile_id')].append(row)
+        cache.set_many(
+            {key: fetched[profile_id] for key, profile_id in keys.items() if profile_id in fetched},
+            timeout=settings.KYC_DOCUMENT_CACHE_TIMEOUT
+        )
+        documents.update(fetched)
+
+    return documents
+
+
+def profile_uuid(value):
+    """KycProfile id string of `value`, raises KycReviewError when it is not a UUID"""
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        raise KycReviewError(f"Invalid kyc_profile_id: {value}")
+
+
+def claimable():
+    """Pending applications plus ones claimed so long ago the reviewer is assumed gone"""
+    stale = timezone.now() - timedelta(minutes=settings.KYC_ASSIGNMENT_TIMEOUT_MINUTES)
+    return KycProfile.objects.filter(
+        Q(verification_status='PENDING') |
+        Q(verification_status='UNDER_REVIEW', assigned_at__lt=stale)
+    )
+
+
+def claim_profiles(reviewer, limit=20):
+    """
+    Assign up to `limit` of the oldest claimable applications to `reviewer` and
+    move them to UNDER_REVIEW. Rows locked by another reviewer's claim are skipped.
+    """
+    with transaction.atomic():
+        claimed_ids = list(
+            claimable().select_for_update(skip_locked=True).order_by('updated_at', 'id').values_list('id', flat=True)[:limit]
+        )
+        KycProfile.objects.filter(id__in=claimed_ids).update(
+            verification_status='UNDER_REVIEW',
+            assigned_to=reviewer,
+            assigned_at=timezone.now()
+        )
+
+    logger.info(f"{len(claimed_ids)} KYC applications claimed by {reviewer.id}")
+    return claimed_ids
+
+
+def release_profiles(reviewer, profile_ids):
+    """Hand claimed applications back to the queue untouched"""
+    if not isinstance(profile_ids, list):
+        raise KycReviewError("release must be a list of ids")
+    return KycProfile.objects.filter(
+        id__in=[profile_uuid(profile_id) for profile_id in profile_ids],
+        assigned_to=reviewer,
+        verification_status='UNDER_REVIEW'
+    ).update(verification_status='PENDING', assigned_to=None, assigned_at=None)
+
+
+def bulk_review(reviewer, decisions):
+    """
+    Apply [{'kyc_profile_id', 'status', 'notes'}] decisions for applications
+    claimed by `reviewer`. Profiles and their documents are written with one
+    bulk_update each. Returns (reviewed ids, skipped [{'kyc_profile_id', 'error'}]).
+    """
+    by_id = {}
+    skipped = []
+    for decision in decisions:
+        if not isinstance(decision, dict):
+            raise KycReviewError("Each decision must be an object")
+        profile_id = profile_uuid(decision.get('kyc_profile_id'))
+        if decision.get('status') not in DECISION_STATUSES:
+            skipped.append({'kyc_profile_id': profile_id, 'error': f"Status must be one of: {', '.join(DECISION_STATUSES)}"})
+            continue
+        by_id[profile_id] = decision
+
+    if not by_id:
+        return [], skipped
+
+    now = timezone.now()
+    with transaction.atomic():
+        profiles = list(
+            KycProfile.objects.select_for_update().filter(
+                id__in=list(by_id), assigned_to=reviewer, verification_status='UNDER_REVIEW'
+            )
+        )
+        found = {str(profile.id) for profile in profiles}
+        skipped.extend(
+            {'kyc_profile_id': profile_id, 'error': 'Not claimed by you or already reviewed'}
+            for profile_id in by_id if profile_id not in found
+        )
+
+        for profile in profiles:
+            decision = by_id[str(profile.id)]
+            profile.verification_status = decision['status']
+            profile.review_notes = decision.get('notes', '')
+            profile.verified_by = reviewer
+            profile.verified_at = now
+            profile.assigned_to = None
+            profile.assigned_at = None
+            profile.updated_at = now
+        KycProfile.objects.bulk_update(profiles, [
+            'verification_status', 'review_notes', 'verified_by', 'verified_at',
+            'assigned_to', 'assigned_at', 'updated_at'
+        ], batch_size=500)
+
+        statuses = {profile.id: profile.verification_status for profile in profiles}
+        documents = list(KycDocument.objects.filter(kyc_profile_id__in=list(statuses)))
+        for document in documents:
+            document.status = statuses[document.kyc_profile_id]
+            document.reviewed_by = reviewer
+            document.reviewed_at = now
+            document.updated_at = now
+        KycDocument.objects.bulk_update(documents, ['status', 'reviewed_by', 'reviewed_at', 'updated_at'], batch_size=500)
+
+    logger.info(f"{len(profiles)} KYC applications reviewed by {reviewer.id}, {len(skipped)} skipped")
+    return [str(profile.id) for profile in profiles], skipped
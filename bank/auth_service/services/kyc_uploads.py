@@ -0,0 +1,274 @@
+"""
+Chunked, resumable KYC document uploads.
+
+A client starts an upload, then PUTs the file in fixed size chunks in order.
+Each chunk is streamed straight into a staging file (never into memory or the
+database), checked against its sha256 and acknowledged with one UPDATE of the
+upload row, so a dropped mobile connection resumes from `next_chunk` and no DB
+transaction is ever open while bytes arrive. The file type is sniffed from the
+magic bytes of the first chunk. Once the last chunk lands a celery worker
+verifies the whole file, extracts a thumbnail or the PDF page count, moves the
+file to storage and only then writes the KycDocument.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from ..models import KycDocument, KycProfile, KycUpload
+import fcntl
+import hashlib
+import io
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+
+READ_BLOCK_SIZE = 64 * 1024
+THUMBNAIL_SIZE = (320, 320)
+
+# file type -> extensions it may be uploaded with
+ALLOWED_TYPES = {
+    'pdf': ('.pdf',),
+    'jpeg': ('.jpg', '.jpeg'),
+    'png': ('.png',),
+    'doc': ('.doc',),
+    'docx': ('.docx',),
+}
+
+MAGIC_BYTES = [
+    (b'%PDF-', 'pdf'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'doc'),  # OLE2 compound file
+    (b'PK\x03\x04', 'docx'),  # zip container, only accepted with a .docx name
+]
+
+PDF_PAGE_PATTERN = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+PDF_PAGE_OVERLAP = 64
+
+
+class KycUploadError(Exception):
+    """Raised when an upload or one of its chunks is rejected"""
+
+
+def sniff_file_type(head, file_name):
+    """File type from the first bytes of the file, None unless it matches the extension too"""
+    extension = os.path.splitext(file_name)[1].lower()
+    for magic, file_type in MAGIC_BYTES:
+        if head.startswith(magic):
+            return file_type if extension in ALLOWED_TYPES[file_type] else None
+    return None
+
+
+def staging_path(upload):
+    return os.path.join(settings.KYC_UPLOAD_STAGING_DIR, f"{upload.id}.part")
+
+
+def start_upload(kyc_profile, document_type, file_name, total_size, checksum=''):
+    extension = os.path.splitext(file_name or '')[1].lower()
+    if not any(extension in extensions for extensions in ALLOWED_TYPES.values()):
+        allowed = sorted(ext for extensions in ALLOWED_TYPES.values() for ext in extensions)
+        raise KycUploadError(f"File type not allowed. Allowed types: {', '.join(allowed)}")
+
+    if total_size <= 0:
+        raise KycUploadError("File is empty")
+    if total_size > settings.KYC_UPLOAD_MAX_SIZE:
+        raise KycUploadError(f"File size exceeds {settings.KYC_UPLOAD_MAX_SIZE // (1024 * 1024)}MB limit")
+
+    return KycUpload.objects.create(
+        kyc_profile=kyc_profile,
+        document_type=document_type,
+        file_name=os.path.basename(file_name),
+        total_size=total_size,
+        chunk_size=settings.KYC_UPLOAD_CHUNK_SIZE,
+        checksum=(checksum or '').lower(),
+    )
+
+
+def write_chunk(upload, index, stream, checksum):
+    """
+    Append chunk `index` read from `stream` to the staging file.
+    Chunks must arrive in order; resending one that was already stored is a no-op.
+    Returns the refreshed upload, PROCESSING once the last chunk is in.
+    """
+    if index < upload.next_chunk:
+        return upload
+    if upload.status != 'UPLOADING':
+        raise KycUploadError(f"Upload is {upload.status.lower()}")
+    if index > upload.next_chunk:
+        raise KycUploadError(f"Expected chunk {upload.next_chunk}, got {index}")
+
+    offset = index * upload.chunk_size
+    expected = min(upload.chunk_size, upload.total_size - offset)
+    digest = hashlib.sha256()
+    received = 0
+    content_type = upload.content_type
+
+    os.makedirs(settings.KYC_UPLOAD_STAGING_DIR, exist_ok=True)
+    fd = os.open(staging_path(upload), os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(fd, 'r+b') as staging:
+        # a retried chunk racing the original must not interleave writes
+        fcntl.flock(staging, fcntl.LOCK_EX)
+        staging.seek(offset)
+        while received <= expected:
+            block = stream.read(min(READ_BLOCK_SIZE, expected + 1 - received))
+            if not block:
+                break
+            if received == 0 and index == 0:
+                content_type = sniff_file_type(block, upload.file_name)
+                if content_type is None:
+                    raise KycUploadError("File content does not match an allowed document type")
+            digest.update(block)
+            staging.write(block)
+            received += len(block)
+
+        problem = None
+        if received != expected:
+            problem = f"Chunk {index} should be {expected} bytes, got {received}"
+        elif checksum and digest.hexdigest() != checksum.lower():
+            problem = f"Checksum mismatch for chunk {index}"
+        if problem:
+            staging.truncate(offset)
+            raise KycUploadError(problem)
+        staging.truncate(offset + received)
+
+    complete = offset + received == upload.total_size
+    updated = KycUpload.objects.filter(id=upload.id, status='UPLOADING', next_chunk=index).update(
+        next_chunk=index + 1,
+        received_bytes=offset + received,
+        content_type=content_type,
+        status='PROCESSING' if complete else 'UPLOADING',
+        updated_at=timezone.now()
+    )
+    upload.refresh_from_db()
+    if not updated and upload.next_chunk <= index:
+        raise KycUploadError(f"Chunk {index} could not be stored, upload is {upload.status.lower()}")
+    return upload
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(READ_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def count_pdf_pages(path):
+    """
+    Count /Type /Page objects, streamed block by block. PDFs that keep their
+    page objects inside compressed object streams report None.
+    """
+    pages = 0
+    tail = b''
+    with open(path, 'rb') as fh:
+        while True:
+            block = fh.read(READ_BLOCK_SIZE)
+            data = tail + block
+            if not block:
+                pages += len(PDF_PAGE_PATTERN.findall(data))
+                break
+            # matches starting in the last few bytes are counted with the next block
+            cut = max(len(data) - PDF_PAGE_OVERLAP, 0)
+            pages += sum(1 for match in PDF_PAGE_PATTERN.finditer(data) if match.start() < cut)
+            tail = data[cut:]
+    return pages or None
+
+
+def make_thumbnail(path):
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.thumbnail(THUMBNAIL_SIZE)
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, format='JPEG', quality=80)
+    return ContentFile(buffer.getvalue())
+
+
+def process_upload(upload_id):
+    """
+    Verify a fully received upload, extract its preview data, move it to storage
+    and write the KycDocument. Runs in a celery worker.
+    """
+    upload = KycUpload.objects.select_related('kyc_profile').get(id=upload_id)
+    if upload.status != 'PROCESSING':
+        return upload
+
+    path = staging_path(upload)
+    document_field = KycDocument._meta.get_field('document_upload')
+    stored_name = None
+    try:
+        if os.path.getsize(path) != upload.total_size:
+            raise KycUploadError(f"Staged file is {os.path.getsize(path)} bytes, expected {upload.total_size}")
+
+        with open(path, 'rb') as fh:
+            content_type = sniff_file_type(fh.read(16), upload.file_name)
+        if content_type is None:
+            raise KycUploadError("File content does not match an allowed document type")
+
+        if upload.checksum and file_sha256(path) != upload.checksum:
+            raise KycUploadError("Checksum mismatch for the complete file")
+
+        page_count = count_pdf_pages(path) if content_type == 'pdf' else None
+        thumbnail = make_thumbnail(path) if content_type in ('jpeg', 'png') else None
+
+        with open(path, 'rb') as fh:
+            stored_name = document_field.storage.save(
+                document_field.generate_filename(None, upload.file_name), File(fh)
+            )
+        if thumbnail is not None:
+            upload.thumbnail.save(f"{upload.id}.jpg", thumbnail, save=False)
+
+        # storage is done, the DB work is a handful of short writes
+        with transaction.atomic():
+            document, _ = KycDocument.objects.update_or_create(
+                kyc_profile=upload.kyc_profile,
+                document_type=upload.document_type,
+                defaults={'document_upload': stored_name, 'status': 'PENDING'}
+            )
+            KycProfile.objects.filter(id=upload.kyc_profile_id).update(
+                verification_status='PENDING',
+                updated_at=timezone.now()
+            )
+            upload.status = 'COMPLETED'
+            upload.content_type = content_type
+            upload.page_count = page_count
+            upload.document = document
+            upload.completed_at = timezone.now()
+            upload.save(update_fields=[
+                'status', 'content_type', 'page_count', 'thumbnail', 'document', 'completed_at', 'updated_at'
+            ])
+    except Exception as e:
+        logger.error(f"KYC upload {upload.id} failed processing: {str(e)}")
+        if stored_name:
+            document_field.storage.delete(stored_name)
+        if upload.thumbnail:
+            upload.thumbnail.delete(save=False)
+        KycUpload.objects.filter(id=upload.id).update(status='FAILED', error=str(e), updated_at=timezone.now())
+        upload.status, upload.error = 'FAILED', str(e)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    return upload
+
+
+def purge_stale_uploads():
+    """Fail uploads abandoned for KYC_UPLOAD_EXPIRY_HOURS and delete their staging files"""
+    cutoff = timezone.now() - timedelta(hours=settings.KYC_UPLOAD_EXPIRY_HOURS)
+    stale = list(KycUpload.objects.filter(status='UPLOADING', updated_at__lt=cutoff))
+    for upload in stale:
+        path = staging_path(upload)
+        if os.path.exists(path):
+            os.remove(path)
+
+    KycUpload.objects.filter(id__in=[upload.id for upload in stale], status='UPLOADING').update(
+        status='FAILED',
+        error='Upload expired',
+        updated_at=timezone.now()
+    )
+    return len(stale)
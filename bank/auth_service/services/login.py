@@ -0,0 +1,108 @@
+"""
+Login path helpers.
+
+The user, role and every profile the login response needs are fetched in one
+select_related query. last_login is buffered in process and written by a
+background flush with one bulk UPDATE, and the serialized user blob is cached
+under a key derived from the rows' updated_at, so any profile change produces a
+new key instead of needing an explicit invalidation.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+from ..models import User
+import atexit
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+LOGIN_RELATED = ('role', 'customer_profile', 'employee_profile', 'kyc_profile')
+
+
+def get_login_user(email):
+    """User with role and profiles in a single query, raises User.DoesNotExist"""
+    return User.objects.select_related(*LOGIN_RELATED).get(email=email)
+
+
+def profile_version(user):
+    """Short hash of the updated_at of the user and every related row the blob is built from"""
+    stamps = [user.updated_at, user.role.updated_at]
+    for relation in ('customer_profile', 'employee_profile', 'kyc_profile'):
+        related = getattr(user, relation, None)
+        stamps.append(related.updated_at if related else None)
+    return hashlib.sha1('|'.join(str(stamp) for stamp in stamps).encode()).hexdigest()[:12]
+
+
+def get_profile_blob(user, serializer):
+    """
+    Serialized user for the login response, cached per user id and profile version.
+    `serializer` builds the blob on a miss (serialize_full_user).
+    """
+    key = f"auth:profile:{user.id}:{profile_version(user)}"
+    blob = cache.get(key)
+    if blob is None:
+        blob = serializer(user)
+        cache.set(key, blob, timeout=settings.LOGIN_PROFILE_CACHE_TIMEOUT)
+    return blob
+
+
+class LastLoginBuffer:
+    """
+    Collects last_login timestamps and writes them in one bulk UPDATE, either every
+    `interval` seconds from a daemon thread or as soon as `max_size` users are pending.
+    A lost buffer only loses login timestamps, never auth state.
+    """
+
+    def __init__(self, interval, max_size=500):
+        self.interval = interval
+        self.max_size = max_size
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def record(self, user_id, when=None):
+        with self.lock:
+            self.pending[user_id] = when or timezone.now()
+            size = len(self.pending)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='last-login-flush', daemon=True)
+                self.thread.start()
+        if size >= self.max_size:
+            self.wakeup.set()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+
+        users = [User(id=user_id, last_login=when) for user_id, when in pending.items()]
+        try:
+            User.objects.bulk_update(users, ['last_login'], batch_size=self.max_size)
+        except Exception as e:
+            logger.error(f"Failed to flush last_login for {len(users)} users: {str(e)}")
+            return 0
+        return len(users)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+
+last_login_buffer = LastLoginBuffer(interval=settings.LAST_LOGIN_FLUSH_INTERVAL)
+atexit.register(last_login_buffer.flush)
+
+
+def record_login(user):
+    """Replacement for update_last_login that does not write on the request path"""
+    now = timezone.now()
+    user.last_login = now
+    last_login_buffer.record(user.id, now)
@@ -0,0 +1,126 @@
+"""
+Password verification off the request thread.
+
+PBKDF2 releases the GIL while hashing, so checks run on a small per-process
+thread pool sized to the cores we want to spend on it. The number of checks
+queued or running is capped; past the cap a login is refused straight away
+with PasswordCheckBusy instead of waiting behind hundreds of other hashes, which
+is what keeps login latency bounded during a login storm. Hashes made with old
+parameters are verified as they are and rehashed on the same pool after the
+response, never inline.
+
+The async login views await averify_password, so the event loop keeps serving
+other requests while the hash runs instead of parking a thread on the result.
+"""
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.db import close_old_connections
+from ..models import User
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordCheckBusy(Exception):
+    """Raised when the password pool is saturated or a check does not finish in time"""
+
+
+class PasswordPool:
+
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.rehashing = set()
+        self.rehashing_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-check')
+
+    def submit(self, user, raw_password):
+        """Queue a check of `raw_password` against the user's stored hash, raises PasswordCheckBusy when full"""
+        if not self.slots.acquire(blocking=False):
+            raise PasswordCheckBusy("Too many password checks in progress")
+        try:
+            future = self.executor.submit(self._check, user.id, user.password, raw_password)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def check(self, user, raw_password):
+        future = self.submit(user, raw_password)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise PasswordCheckBusy(f"Password check did not finish within {self.timeout}s")
+
+    async def acheck(self, user, raw_password):
+        future = self.submit(user, raw_password)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise PasswordCheckBusy(f"Password check did not finish within {self.timeout}s")
+
+    def _check(self, user_id, encoded, raw_password):
+        # no setter: Django's setter would rehash and save on this thread before we return
+        if not check_password(raw_password, encoded):
+            return False
+        if needs_rehash(encoded):
+            with self.rehashing_lock:
+                # a user logging in repeatedly before the rehash lands only needs it once
+                if user_id in self.rehashing:
+                    return True
+                self.rehashing.add(user_id)
+            self.executor.submit(self._rehash, user_id, encoded, raw_password)
+        return True
+
+    def _rehash(self, user_id, encoded, raw_password):
+        try:
+            rehash_password(user_id, encoded, raw_password)
+        finally:
+            with self.rehashing_lock:
+                self.rehashing.discard(user_id)
+            close_old_connections()
+
+
+def needs_rehash(encoded):
+    try:
+        return identify_hasher(encoded).must_update(encoded)
+    except ValueError:
+        return False
+
+
+def rehash_password(user_id, encoded, raw_password):
+    """
+    Store a hash made with the current hasher settings. The update only applies
+    while the stored hash is still `encoded`, so a password change made in the
+    meantime is never overwritten.
+    """
+    try:
+        updated = User.objects.filter(id=user_id, password=encoded).update(password=make_password(raw_password))
+        if updated:
+            logger.info(f"Rehashed password for user {user_id}")
+        return bool(updated)
+    except Exception as e:
+        logger.error(f"Failed to rehash password for user {user_id}: {str(e)}")
+        return False
+
+
+password_pool = PasswordPool(
+    workers=settings.PASSWORD_CHECK_WORKERS,
+    max_pending=settings.PASSWORD_CHECK_MAX_PENDING,
+    timeout=settings.PASSWORD_CHECK_TIMEOUT,
+)
+
+
+def verify_password(user, raw_password):
+    """Drop-in for user.check_password on the login path"""
+    return password_pool.check(user, raw_password)
+
+
+async def averify_password(user, raw_password):
+    """verify_password for async views, awaited on the event loop"""
+    return await password_pool.acheck(user, raw_password)
@@ -0,0 +1,218 @@
+"""
+JWT sessions without a database hit per request.
+
+Tokens carry the claims authorization needs (role, staff flags, customer id)
+and a session id ("sid", the jti of the refresh token issued at login, kept
+through rotation). Revoked sessions and users live in RevokedSession and every
+process keeps a Bloom filter of their keys, rebuilt from the table every
+REVOCATION_SYNC_INTERVAL seconds and, when REVOCATION_REDIS_URL is set, pushed
+to immediately over Redis pub/sub. A key the filter has never seen cannot be
+revoked, so only the rare filter hit costs a query to confirm.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from ..models import RevokedSession
+import hashlib
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+SESSION_CLAIM = 'sid'
+REVOCATION_CHANNEL = 'auth:revocations'
+
+
+def session_claims(user):
+    """Claims ClaimsUser is built from, refreshed from the DB on every token refresh"""
+    customer_profile = getattr(user, 'customer_profile', None)
+    return {
+        'role_id': str(user.role_id) if user.role_id else None,
+        'role_name': user.role.role_name if user.role_id else None,
+        'role_category': user.role.category if user.role_id else None,
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+        'customer_id': customer_profile.customer_id if customer_profile else None,
+    }
+
+
+def issue_tokens(user):
+    """Refresh token for a new login session, use instead of RefreshToken.for_user"""
+    refresh = RefreshToken.for_user(user)
+    refresh[SESSION_CLAIM] = refresh[api_settings.JTI_CLAIM]
+    for claim, value in session_claims(user).items():
+        refresh[claim] = value
+    return refresh
+
+
+def session_key(sid):
+    return f"sid:{sid}"
+
+
+def user_key(user_id):
+    return f"user:{user_id}"
+
+
+class BloomFilter:
+    """Fixed size Bloom filter over strings, sized for `capacity` keys at `error_rate`"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationList:
+    """
+    Per-process view of RevokedSession. is_revoked() costs no query unless a key
+    hits the filter; the filter is rebuilt by whichever request first finds it
+    older than `interval`, the others keep using the current one meanwhile.
+    """
+
+    def __init__(self, interval, capacity, redis_url=''):
+        self.interval = interval
+        self.capacity = capacity
+        self.redis_url = redis_url
+        self.filter = None
+        self.synced_at = 0
+        self.sync_lock = threading.Lock()
+        self.listener = None
+
+    def sync(self):
+        keys = list(RevokedSession.objects.filter(expires_at__gt=timezone.now()).values_list('key', flat=True))
+        bloom = BloomFilter(max(self.capacity, len(keys) * 2))
+        for key in keys:
+            bloom.add(key)
+        self.filter = bloom
+        self.synced_at = time.monotonic()
+        return len(keys)
+
+    def ensure_fresh(self):
+        if self.filter is None:
+            # nothing to fall back on yet, every caller waits for the first load
+            with self.sync_lock:
+                if self.filter is None:
+                    self.sync()
+                    self.start_listener()
+            return
+
+        if time.monotonic() - self.synced_at > self.interval and self.sync_lock.acquire(blocking=False):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Failed to sync revoked sessions, keeping the previous filter: {str(e)}")
+            finally:
+                self.sync_lock.release()
+
+    def add(self, key):
+        if self.filter is not None:
+            self.filter.add(key)
+
+    def is_revoked(self, session, user, issued_at):
+        """
+        True when the `session` key was revoked, or the `user` key was after a
+        token issued at `issued_at`. A revoked session never gets new tokens, so
+        all of its tokens are refused; a user can log in again right away.
+        """
+        self.ensure_fresh()
+        candidates = [key for key in (session, user) if key in self.filter]
+        if not candidates:
+            return False
+        return RevokedSession.objects.filter(
+            Q(key=session) | Q(key=user, revoked_at__gt=issued_at),
+            key__in=candidates,
+            expires_at__gt=timezone.now()
+        ).exists()
+
+    def start_listener(self):
+        if not self.redis_url or (self.listener and self.listener.is_alive()):
+            return
+        self.listener = threading.Thread(target=self._listen, name='revocation-listener', daemon=True)
+        self.listener.start()
+
+    def _listen(self):
+        import redis
+
+        while True:
+            try:
+                pubsub = redis.Redis.from_url(self.redis_url).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REVOCATION_CHANNEL)
+                for message in pubsub.listen():
+                    self.add(message['data'].decode())
+            except Exception as e:
+                logger.warning(f"Revocation listener disconnected, retrying: {str(e)}")
+                time.sleep(5)
+
+
+revocation_list = RevocationList(
+    interval=settings.REVOCATION_SYNC_INTERVAL,
+    capacity=settings.REVOCATION_BLOOM_CAPACITY,
+    redis_url=settings.REVOCATION_REDIS_URL,
+)
+
+
+def publish_revocation(key):
+    revocation_list.add(key)
+    if not settings.REVOCATION_REDIS_URL:
+        return
+    try:
+        import redis
+        redis.Redis.from_url(settings.REVOCATION_REDIS_URL).publish(REVOCATION_CHANNEL, key)
+    except Exception as e:
+        # the other processes still pick it up on their next sync
+        logger.warning(f"Failed to publish revocation {key}: {str(e)}")
+
+
+def revocation_expiry():
+    """Long enough to outlive every token issued before the revocation"""
+    return timezone.now() + max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+
+
+def revoke(key, user_id, reason):
+    now = timezone.now()
+    RevokedSession.objects.update_or_create(
+        key=key,
+        defaults={'user_id': user_id, 'reason': reason, 'revoked_at': now, 'expires_at': revocation_expiry()}
+    )
+    publish_revocation(key)
+
+
+def revoke_session(refresh, reason='logout'):
+    """Blacklist a refresh token and revoke the session it belongs to, access tokens included"""
+    refresh.blacklist()
+    sid = refresh.get(SESSION_CLAIM)
+    if sid:
+        revoke(session_key(sid), refresh[api_settings.USER_ID_CLAIM], reason)
+
+
+def revoke_user(user_id, reason='deactivated'):
+    """Revoke every session the user has open, logging in again afterwards works as usual"""
+    revoke(user_key(user_id), user_id, reason)
+
+
+def is_session_revoked(token):
+    # iat is whole seconds: only a revocation after the end of that second certainly came after the
+    # token, so a login in the same second as revoke_user is not refused
+    issued_at = datetime.fromtimestamp(token['iat'], tz=dt_timezone.utc) + timedelta(seconds=1)
+    return revocation_list.is_revoked(
+        session_key(token[SESSION_CLAIM]), user_key(token[api_settings.USER_ID_CLAIM]), issued_at
+    )
@@ -3,21 +3,26 @@ from django.core.mail import send_mail
 from django.conf import settings
 
 
-# @shared_task
+# queues the notification, the notification workers send it once registration commits
 def send_verification_email(user_id):
-    from auth_service.models import User  
+    from auth_service.models import User
+    from notification.services.dispatch import notify
     user = User.objects.get(id=user_id)
 
     # generate token
     token = user.generate_email_token()
 
     verification_url = f"{settings.FRONTEND_URL}/verify-email?token={token}&uid={user.id}"
-    
-    print(verification_url)
+
+    # the link has to go to the address being verified, whatever the preferred channel
+    notify(user, 'verify_email', {'verification_url': verification_url}, channel='EMAIL')
 
 
 def send_onboarding_email(user_id):
-    pass
+    from auth_service.models import User
+    from notification.services.dispatch import notify
+    notify(User.objects.get(id=user_id), 'welcome')
+
 
 def send_new_kyc(kyc_id):
     pass
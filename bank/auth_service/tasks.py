@@ -0,0 +1,21 @@
+from celery import shared_task
+from .services import kyc_uploads
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def process_kyc_upload_task(upload_id):
+    """Verify, preview and store a fully received KYC upload"""
+    upload = kyc_uploads.process_upload(upload_id)
+    return {'upload_id': str(upload.id), 'status': upload.status}
+
+
+@shared_task
+def purge_stale_kyc_uploads_task():
+    """Expire abandoned chunked uploads, scheduled hourly through celery beat"""
+    purged = kyc_uploads.purge_stale_uploads()
+    if purged:
+        logger.info(f"Expired {purged} abandoned KYC uploads")
+    return purged
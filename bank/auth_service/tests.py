@@ -5,14 +5,19 @@ Comprehensive unit tests for the authentication app
 Run with: python manage.py test authentication.tests
 """
 
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
 from datetime import timedelta
 from decimal import Decimal
+import hashlib
+import io
+import os
 import secrets
+import time
+from unittest import mock
 
 from .models import *
 
@@ -120,6 +125,26 @@ class RoleModelTest(TestCase):
         )
         self.assertIsNone(role.department_name)
 
+    def test_permission_checks_follow_grants(self):
+        """Test cached role permissions are reloaded when grants change"""
+        from django.contrib.auth.models import Permission
+
+        role = Role.objects.create(**self.role_data)
+        self.assertFalse(role.has_any_permission('approve_transfer'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            role.permissions.add(Permission.objects.get(codename='approve_transfer'))
+            # the granting transaction reads its own write
+            self.assertTrue(role.has_any_permission('approve_transfer'))
+        self.assertTrue(role.has_any_permission('transfer_funds', 'approve_transfer'))
+        # a token's unsaved role copy reads the same cache entry
+        claims_role = Role(id=role.id, role_name=role.role_name, category=role.category)
+        with self.assertNumQueries(0):
+            self.assertTrue(claims_role.has_any_permission('approve_transfer'))
+
+        role.permissions.clear()
+        self.assertFalse(role.has_any_permission('approve_transfer'))
+
 
 class UserModelTest(TestCase):
     """Test suite for User model"""
@@ -828,4 +853,581 @@ class IntegrationTest(TransactionTestCase):
         # Verify relationships
         self.assertEqual(employee.department, department)
         self.assertEqual(user.role.department_name, department)
-        self.assertIn(employee, department.employees.all())
\ No newline at end of file
+        self.assertIn(employee, department.employees.all())
+
+class LoginServiceTest(TestCase):
+    """Test suite for the fused login query, profile cache and last_login buffer"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.role = Role.objects.create(role_name='Customer', category='Customer')
+        self.user = User.objects.create_user(
+            email='login@test.com',
+            password='testpass123',
+            role=self.role,
+            is_active=True
+        )
+        self.customer = CustomerProfile.objects.create(
+            user=self.user,
+            customer_id='CUST_LOGIN',
+            phone_number='+254722000111'
+        )
+        KycProfile.objects.create(user=self.user, verification_status='APPROVED')
+
+    def test_login_user_fetched_in_one_query(self):
+        """Test role and profiles come back with the user"""
+        from .services.login import get_login_user
+
+        with self.assertNumQueries(1):
+            user = get_login_user('login@test.com')
+            self.assertEqual(user.role.category, 'Customer')
+            self.assertEqual(user.customer_profile.customer_id, 'CUST_LOGIN')
+            self.assertEqual(user.kyc_profile.verification_status, 'APPROVED')
+
+    def test_profile_blob_cached_until_profile_changes(self):
+        """Test the blob is served from cache and rebuilt after a profile update"""
+        from .services.login import get_login_user, get_profile_blob
+
+        calls = []
+        def serializer(user):
+            calls.append(user.id)
+            return {'phone': user.customer_profile.phone_number}
+
+        get_profile_blob(get_login_user('login@test.com'), serializer)
+        get_profile_blob(get_login_user('login@test.com'), serializer)
+        self.assertEqual(len(calls), 1)
+
+        self.customer.phone_number = '+254722000222'
+        self.customer.save()
+        blob = get_profile_blob(get_login_user('login@test.com'), serializer)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(blob['phone'], '+254722000222')
+
+    def test_last_login_buffer_flushes_in_bulk(self):
+        """Test buffered logins are written with one bulk update"""
+        from .services.login import LastLoginBuffer
+
+        other = User.objects.create_user(email='login2@test.com', password='testpass123', role=self.role)
+        buffer = LastLoginBuffer(interval=3600)
+        first_login = timezone.now() - timedelta(minutes=1)
+        buffer.record(self.user.id, first_login)
+        buffer.record(self.user.id)
+        buffer.record(other.id)
+
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_login)
+
+        self.assertEqual(buffer.flush(), 2)
+        self.user.refresh_from_db()
+        other.refresh_from_db()
+        self.assertGreater(self.user.last_login, first_login)
+        self.assertIsNotNone(other.last_login)
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_customer_login(self):
+        """Test the customer login endpoint with the cached path"""
+        response = self.client.post(
+            '/api/v1.0/auth/login/customer/',
+            {'email': 'login@test.com', 'password': 'testpass123'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['kyc_status'], 'APPROVED')
+        self.assertEqual(response.json()['user']['email'], 'login@test.com')
+
+        from .services.login import last_login_buffer
+        last_login_buffer.flush()
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class PasswordHashingTest(TestCase):
+    """Test suite for the tuned hasher, the password pool and background rehash"""
+
+    def setUp(self):
+        self.role = Role.objects.create(role_name='Customer', category='Customer')
+        self.user = User.objects.create_user(
+            email='hash@test.com',
+            password='testpass123',
+            role=self.role,
+            is_active=True
+        )
+
+    def test_hasher_uses_configured_iterations(self):
+        """Test new hashes use PASSWORD_HASH_ITERATIONS and others are flagged for rehash"""
+        from .services.passwords import needs_rehash
+
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertFalse(needs_rehash(self.user.password))
+        with self.settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertTrue(needs_rehash(self.user.password))
+
+    def test_verify_password(self):
+        """Test passwords are checked on the pool"""
+        from .services.passwords import verify_password
+
+        self.assertTrue(verify_password(self.user, 'testpass123'))
+        self.assertFalse(verify_password(self.user, 'wrongpass'))
+
+    def test_averify_password(self):
+        """Test the async path awaits the pool check and keeps its timeout"""
+        from asgiref.sync import async_to_sync
+        from .services.passwords import PasswordCheckBusy, PasswordPool, averify_password
+
+        self.assertTrue(async_to_sync(averify_password)(self.user, 'testpass123'))
+        self.assertFalse(async_to_sync(averify_password)(self.user, 'wrongpass'))
+
+        pool = PasswordPool(workers=1, max_pending=4, timeout=0.01)
+        with mock.patch.object(pool, '_check', side_effect=lambda *args: time.sleep(0.5)):
+            with self.assertRaises(PasswordCheckBusy):
+                async_to_sync(pool.acheck)(self.user, 'testpass123')
+
+    def test_saturated_pool_refuses_checks(self):
+        """Test a full pool raises PasswordCheckBusy instead of queueing"""
+        from .services.passwords import PasswordCheckBusy, PasswordPool
+
+        pool = PasswordPool(workers=1, max_pending=1, timeout=5)
+        pool.slots.acquire()
+        with self.assertRaises(PasswordCheckBusy):
+            pool.check(self.user, 'testpass123')
+        pool.slots.release()
+        self.assertTrue(pool.check(self.user, 'testpass123'))
+
+    def test_outdated_hash_rehashed_in_background(self):
+        """Test a successful check schedules a rehash instead of saving inline"""
+        from .services.passwords import PasswordPool
+
+        pool = PasswordPool(workers=1, max_pending=4, timeout=5)
+        with self.settings(PASSWORD_HASH_ITERATIONS=2000), mock.patch.object(pool.executor, 'submit') as submit:
+            self.assertTrue(pool._check(self.user.id, self.user.password, 'testpass123'))
+            self.assertTrue(pool._check(self.user.id, self.user.password, 'testpass123'))
+        submit.assert_called_once_with(pool._rehash, self.user.id, self.user.password, 'testpass123')
+
+        self.assertFalse(pool._check(self.user.id, self.user.password, 'wrongpass'))
+
+    def test_rehash_skips_changed_password(self):
+        """Test the rehash only replaces the hash it was computed for"""
+        from .services.passwords import rehash_password
+
+        old_hash = self.user.password
+        with self.settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertTrue(rehash_password(self.user.id, old_hash, 'testpass123'))
+            self.assertFalse(rehash_password(self.user.id, old_hash, 'testpass123'))
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertTrue(self.user.check_password('testpass123'))
+
+    def test_login_returns_503_when_busy(self):
+        """Test the login view sheds load when the pool is saturated"""
+        from .services.passwords import PasswordCheckBusy
+
+        with mock.patch('auth_service.views.averify_password', side_effect=PasswordCheckBusy):
+            response = self.client.post(
+                '/api/v1.0/auth/login/customer/',
+                {'email': 'hash@test.com', 'password': 'testpass123'},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class TokenSessionTest(TestCase):
+    """Test suite for claim based JWT authentication and session revocation"""
+
+    def setUp(self):
+        from .services.tokens import revocation_list
+        revocation_list.filter = None
+
+        self.role = Role.objects.create(role_name='Customer', category='Customer')
+        self.user = User.objects.create_user(
+            email='token@test.com',
+            password='testpass123',
+            role=self.role,
+            is_active=True
+        )
+        CustomerProfile.objects.create(user=self.user, customer_id='CUST_TOKEN', phone_number='+254722000333')
+
+    def authenticate(self, token):
+        from .authentication import ClaimsJWTAuthentication
+        return ClaimsJWTAuthentication().get_user(token)
+
+    def test_bloom_filter(self):
+        """Test added keys are always found and others rarely are"""
+        from .services.tokens import BloomFilter
+
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"sid:{i}")
+        self.assertTrue(all(f"sid:{i}" in bloom for i in range(1000)))
+        false_positives = sum(f"other:{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_claims_user_needs_no_queries(self):
+        """Test request.user is built from the token without touching the DB"""
+        from .services.tokens import issue_tokens, revocation_list
+
+        access = issue_tokens(self.user).access_token
+        revocation_list.sync()
+
+        with self.assertNumQueries(0):
+            user = self.authenticate(access)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(user.id, self.user.id)
+            self.assertTrue(user.is_authenticated)
+            self.assertFalse(user.is_staff)
+            self.assertEqual(user.role.category, 'Customer')
+            self.assertEqual(user.role.role_name, 'Customer')
+            self.assertEqual(user.customer_id, 'CUST_TOKEN')
+            self.assertIsInstance(user, User)
+            self.assertEqual(user, self.user)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'token@test.com')
+
+    def test_logout_revokes_access_token(self):
+        """Test access tokens of a logged out session stop working"""
+        from .services.tokens import issue_tokens
+
+        refresh = issue_tokens(self.user)
+        headers = {'HTTP_AUTHORIZATION': f"Bearer {refresh.access_token}"}
+
+        response = self.client.post('/api/v1.0/auth/logout/', {'refresh': str(refresh)},
+                                    content_type='application/json', **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(RevokedSession.objects.filter(key=f"sid:{refresh['sid']}").exists())
+
+        response = self.client.post('/api/v1.0/auth/logout/', {'refresh': str(refresh)},
+                                    content_type='application/json', **headers)
+        # 403 rather than 401 because SessionAuthentication comes first and sends no challenge
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['code'], 'session_revoked')
+
+    def test_revoke_user_only_affects_older_tokens(self):
+        """Test a user revocation refuses tokens issued before it and not after"""
+        from rest_framework_simplejwt.exceptions import AuthenticationFailed as JWTAuthenticationFailed
+        from .services.tokens import issue_tokens, revoke_user
+
+        old_access = issue_tokens(self.user).access_token
+        old_access.set_iat(at_time=timezone.now() - timedelta(minutes=5))
+
+        revoke_user(self.user.id)
+        RevokedSession.objects.filter(user=self.user).update(revoked_at=timezone.now() - timedelta(minutes=1))
+
+        with self.assertRaises(JWTAuthenticationFailed):
+            self.authenticate(old_access)
+        self.assertEqual(self.authenticate(issue_tokens(self.user).access_token).pk, self.user.pk)
+
+    def test_saving_claim_changes_revokes_sessions(self):
+        """Test saving a user revokes their tokens only when a column carried in the claims changed"""
+        from rest_framework_simplejwt.exceptions import AuthenticationFailed as JWTAuthenticationFailed
+        from .services.tokens import issue_tokens
+
+        access = issue_tokens(self.user).access_token
+        access.set_iat(at_time=timezone.now() - timedelta(minutes=5))
+
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Renamed'
+        user.save()
+        self.assertFalse(RevokedSession.objects.filter(user=self.user).exists())
+        self.assertEqual(self.authenticate(access).pk, self.user.pk)
+
+        user.role = Role.objects.create(role_name='Teller', category='STAFF')
+        user.save()
+        self.assertEqual(RevokedSession.objects.get(user=self.user).reason, 'role_changed')
+        with self.assertRaises(JWTAuthenticationFailed):
+            self.authenticate(access)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(RevokedSession.objects.get(user=self.user).reason, 'deactivated')
+
+    def test_login_right_after_revoke_user(self):
+        """Test a token issued in the same second as a user revocation is accepted"""
+        from .services.tokens import issue_tokens, revoke_user
+
+        revoke_user(self.user.id)
+        access = issue_tokens(self.user).access_token
+        self.assertEqual(self.authenticate(access).pk, self.user.pk)
+
+    def test_refresh_updates_claims_and_rejects_revoked_session(self):
+        """Test token refresh re-reads the role and refuses revoked sessions"""
+        from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+        from .services.tokens import issue_tokens, revoke_session
+
+        refresh = issue_tokens(self.user)
+        self.role.category = 'STAFF'
+        self.role.save()
+
+        response = self.client.post('/api/v1.0/auth/token/refresh/', {'refresh': str(refresh)},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        access = AccessToken(response.json()['access'])
+        rotated = response.json()['refresh']
+        self.assertEqual(access['role_category'], 'STAFF')
+        self.assertEqual(access['sid'], refresh['sid'])
+
+        # a refresh token of the same session that was never presented at logout
+        sibling = RefreshToken(rotated)
+        sibling.set_jti()
+        sibling.outstand()
+        revoke_session(RefreshToken(rotated))
+
+        response = self.client.post('/api/v1.0/auth/token/refresh/', {'refresh': str(sibling)},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+
+class KycUploadTest(TestCase):
+    """Test suite for chunked KYC uploads"""
+
+    def setUp(self):
+        import tempfile
+        from .services.tokens import issue_tokens, revocation_list
+
+        self.media_root = tempfile.mkdtemp()
+        overrides = self.settings(
+            MEDIA_ROOT=self.media_root,
+            KYC_UPLOAD_STAGING_DIR=os.path.join(self.media_root, 'staging'),
+            KYC_UPLOAD_CHUNK_SIZE=1024,
+            PASSWORD_HASH_ITERATIONS=1000,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        revocation_list.filter = None
+        self.role = Role.objects.create(role_name='Customer', category='Customer')
+        self.user = User.objects.create_user(email='upload@test.com', password='testpass123', role=self.role, is_active=True)
+        CustomerProfile.objects.create(user=self.user, customer_id='CUST_UPLOAD', phone_number='+254722000444')
+        self.kyc_profile = KycProfile.objects.create(user=self.user)
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {issue_tokens(self.user).access_token}"}
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def png_bytes(self):
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', (64, 64), os.urandom(64 * 64 * 3)).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def start(self, file_name, content, **extra):
+        return self.client.post('/api/v1.0/auth/kyc/uploads/', {
+            'document_type': 'NATIONAL_ID',
+            'file_name': file_name,
+            'total_size': len(content),
+            **extra
+        }, content_type='application/json', **self.auth)
+
+    def put_chunk(self, upload_id, index, chunk, checksum=None):
+        return self.client.put(
+            f'/api/v1.0/auth/kyc/uploads/{upload_id}/chunks/{index}/',
+            chunk,
+            content_type='application/octet-stream',
+            HTTP_X_CHUNK_SHA256=checksum if checksum is not None else hashlib.sha256(chunk).hexdigest(),
+            **self.auth
+        )
+
+    def test_sniff_file_type(self):
+        """Test file types come from the magic bytes and must match the extension"""
+        from .services.kyc_uploads import sniff_file_type
+
+        self.assertEqual(sniff_file_type(b'%PDF-1.7\n', 'id.pdf'), 'pdf')
+        self.assertEqual(sniff_file_type(self.png_bytes()[:16], 'id.png'), 'png')
+        self.assertIsNone(sniff_file_type(self.png_bytes()[:16], 'id.pdf'))
+        self.assertEqual(sniff_file_type(b'PK\x03\x04rest', 'cv.docx'), 'docx')
+        self.assertIsNone(sniff_file_type(b'PK\x03\x04rest', 'cv.pdf'))
+        self.assertIsNone(sniff_file_type(b'MZ\x90\x00', 'id.pdf'))
+
+    def test_chunked_upload_processed_into_document(self):
+        """Test an upload sent in chunks ends up as a KycDocument with a thumbnail"""
+        from .services.kyc_uploads import process_upload, staging_path
+
+        content = self.png_bytes()
+        response = self.start('id_front.png', content, checksum=hashlib.sha256(content).hexdigest())
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.json()['id']
+        chunks = [content[i:i + 1024] for i in range(0, len(content), 1024)]
+        self.assertEqual(response.json()['chunk_count'], len(chunks))
+
+        for index, chunk in enumerate(chunks[:-1]):
+            self.assertEqual(self.put_chunk(upload_id, index, chunk).status_code, 200)
+        # resending a stored chunk is harmless
+        response = self.put_chunk(upload_id, 0, chunks[0])
+        self.assertEqual(response.json()['next_chunk'], len(chunks) - 1)
+        self.assertFalse(KycDocument.objects.filter(kyc_profile=self.kyc_profile).exists())
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.put_chunk(upload_id, len(chunks) - 1, chunks[-1])
+        self.assertEqual(response.json()['status'], 'PROCESSING')
+        self.assertEqual(response.json()['content_type'], 'png')
+        self.assertEqual(len(callbacks), 1)
+
+        upload = process_upload(upload_id)
+        self.assertEqual(upload.status, 'COMPLETED')
+        self.assertTrue(upload.thumbnail)
+        self.assertFalse(os.path.exists(staging_path(upload)))
+
+        document = KycDocument.objects.get(kyc_profile=self.kyc_profile, document_type='NATIONAL_ID')
+        self.assertEqual(document.file_size, len(content))
+        with document.document_upload.open('rb') as stored:
+            self.assertEqual(stored.read(), content)
+        self.kyc_profile.refresh_from_db()
+        self.assertEqual(self.kyc_profile.verification_status, 'PENDING')
+
+    def test_bad_chunk_can_be_resent(self):
+        """Test a chunk failing its checksum is discarded and can be retried"""
+        content = b'%PDF-1.4\n' + b'x' * 1500
+        upload_id = self.start('statement.pdf', content).json()['id']
+
+        response = self.put_chunk(upload_id, 0, content[:1024], checksum='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f'/api/v1.0/auth/kyc/uploads/{upload_id}/', **self.auth).json()['next_chunk'], 0)
+
+        self.assertEqual(self.put_chunk(upload_id, 1, content[1024:]).status_code, 400)
+        self.assertEqual(self.put_chunk(upload_id, 0, content[:1024]).status_code, 200)
+        self.assertEqual(self.put_chunk(upload_id, 1, content[1024:]).json()['status'], 'PROCESSING')
+
+    def test_disguised_file_rejected(self):
+        """Test content that does not match the extension is refused on the first chunk"""
+        content = self.png_bytes()
+        upload_id = self.start('id_front.pdf', content).json()['id']
+
+        response = self.put_chunk(upload_id, 0, content[:1024])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.start('setup.exe', b'MZ' * 10).status_code, 400)
+
+    def test_count_pdf_pages(self):
+        """Test page objects are counted across read blocks"""
+        from .services.kyc_uploads import count_pdf_pages
+
+        path = os.path.join(self.media_root, 'pages.pdf')
+        with open(path, 'wb') as fh:
+            fh.write(b'%PDF-1.4\n1 0 obj << /Type /Pages /Count 3 >> endobj\n')
+            for number in range(3):
+                fh.write(b' ' * (64 * 1024 - 20))
+                fh.write(b'<< /Type /Page /Parent 1 0 R >>\n')
+        self.assertEqual(count_pdf_pages(path), 3)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class KycReviewQueueTest(TestCase):
+    """Test suite for the KYC review queue, claims and bulk review"""
+
+    def setUp(self):
+        from django.contrib.auth.models import Permission
+        from django.core.cache import cache
+        from .services.tokens import revocation_list
+
+        cache.clear()
+        revocation_list.filter = None
+        officer_role = Role.objects.create(role_name='KYC Officer', category='STAFF')
+        officer_role.permissions.add(Permission.objects.get(codename='process_kyc'))
+        self.reviewer = User.objects.create_user(email='officer1@test.com', password='testpass123', role=officer_role, is_staff=True)
+        self.other_reviewer = User.objects.create_user(email='officer2@test.com', password='testpass123', role=officer_role, is_staff=True)
+
+        customer_role = Role.objects.create(role_name='Customer', category='Customer')
+        base = timezone.now() - timedelta(days=1)
+        self.profiles = []
+        for i in range(5):
+            user = User.objects.create_user(email=f'applicant{i}@test.com', password='testpass123', role=customer_role)
+            profile = KycProfile.objects.create(user=user, verification_status='PENDING')
+            # bulk_create skips KycDocument.save, which stats the file
+            KycDocument.objects.bulk_create([
+                KycDocument(kyc_profile=profile, document_type='NATIONAL_ID', document_upload=f'kyc_documents/id{i}.png')
+            ])
+            KycProfile.objects.filter(id=profile.id).update(updated_at=base + timedelta(minutes=i))
+            self.profiles.append(profile)
+
+    def auth(self, user):
+        from .services.tokens import issue_tokens
+        return {'HTTP_AUTHORIZATION': f"Bearer {issue_tokens(user).access_token}"}
+
+    def test_queue_keyset_pagination(self):
+        """Test pages follow the oldest-first keyset order without overlap"""
+        seen = []
+        cursor = None
+        while True:
+            params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get('/api/v1.0/auth/employee/kyc/queue/', params, **self.auth(self.reviewer))
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.json()['results'])
+            self.assertEqual(response.json()['results'][0]['documents'][0]['document_type'], 'NATIONAL_ID')
+            cursor = response.json()['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [str(profile.id) for profile in self.profiles])
+
+    def test_document_metadata_cached(self):
+        """Test document metadata is only queried on a cache miss"""
+        from .services.kyc_review import review_queue
+
+        review_queue(page_size=5)
+        with self.assertNumQueries(1):
+            profiles, documents, _ = review_queue(page_size=5)
+        self.assertEqual(len(documents[profiles[0].id]), 1)
+
+    def test_claims_are_disjoint(self):
+        """Test concurrent reviewers never get the same applications"""
+        from .services.kyc_review import claim_profiles
+
+        first = claim_profiles(self.reviewer, limit=3)
+        second = claim_profiles(self.other_reviewer, limit=3)
+        self.assertEqual(first, [profile.id for profile in self.profiles[:3]])
+        self.assertEqual(second, [profile.id for profile in self.profiles[3:]])
+        self.assertEqual(claim_profiles(self.other_reviewer), [])
+
+        # an abandoned claim goes back to the queue
+        KycProfile.objects.filter(id=first[0]).update(assigned_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(claim_profiles(self.other_reviewer), [first[0]])
+
+    def test_bulk_review(self):
+        """Test decisions update claimed profiles and their documents in bulk"""
+        from .services.kyc_review import claim_profiles
+
+        claim_profiles(self.reviewer, limit=2)
+        claim_profiles(self.other_reviewer, limit=1)
+        approved, rejected, not_mine = self.profiles[0], self.profiles[1], self.profiles[2]
+
+        response = self.client.post('/api/v1.0/auth/employee/kyc/review/bulk/', {'decisions': [
+            {'kyc_profile_id': str(approved.id), 'status': 'APPROVED'},
+            {'kyc_profile_id': str(rejected.id), 'status': 'REJECTED', 'notes': 'Blurred ID'},
+            {'kyc_profile_id': str(not_mine.id), 'status': 'APPROVED'},
+            {'kyc_profile_id': str(not_mine.id), 'status': 'MAYBE'},
+        ]}, content_type='application/json', **self.auth(self.reviewer))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()['reviewed']), sorted([str(approved.id), str(rejected.id)]))
+        self.assertEqual(len(response.json()['skipped']), 2)
+
+        approved.refresh_from_db()
+        rejected.refresh_from_db()
+        self.assertEqual(approved.verification_status, 'APPROVED')
+        self.assertEqual(approved.verified_by, self.reviewer)
+        self.assertIsNone(approved.assigned_to)
+        self.assertEqual(rejected.review_notes, 'Blurred ID')
+        self.assertEqual(approved.documents.get().status, 'APPROVED')
+        self.assertEqual(rejected.documents.get().status, 'REJECTED')
+        self.assertEqual(KycProfile.objects.get(id=not_mine.id).verification_status, 'UNDER_REVIEW')
+
+    def test_bulk_review_rejects_malformed_ids(self):
+        """Test ids that are not UUIDs are a 400 and nothing is reviewed"""
+        from .services.kyc_review import claim_profiles
+
+        claimed = claim_profiles(self.reviewer, limit=1)
+        for decisions in (
+            [{'kyc_profile_id': str(claimed[0]), 'status': 'APPROVED'}, {'kyc_profile_id': 'not-a-uuid', 'status': 'APPROVED'}],
+            [{'status': 'APPROVED'}],
+            ['not-a-decision'],
+        ):
+            response = self.client.post('/api/v1.0/auth/employee/kyc/review/bulk/', {'decisions': decisions},
+                                        content_type='application/json', **self.auth(self.reviewer))
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(KycProfile.objects.get(id=claimed[0]).verification_status, 'UNDER_REVIEW')
+
+        response = self.client.post('/api/v1.0/auth/employee/kyc/claim/', {'release': ['not-a-uuid']},
+                                    content_type='application/json', **self.auth(self.reviewer))
+        self.assertEqual(response.status_code, 400)
@@ -11,6 +11,9 @@ urlpatterns = [
     path('verify/email/', VerifyEmailView.as_view(), name='verify-email'),
     path('login/customer/', CustomerLoginView.as_view(), name = "login customer" ),
     path('kyc/', HandleKYC.as_view(), name='kyc upload'),
+    path('kyc/uploads/', KycUploadView.as_view(), name='kyc chunked upload'),
+    path('kyc/uploads/<uuid:upload_id>/', KycUploadDetailView.as_view(), name='kyc upload detail'),
+    path('kyc/uploads/<uuid:upload_id>/chunks/<int:index>/', KycUploadChunkView.as_view(), name='kyc upload chunk'),
     path('logout/', HandleLogoutView.as_view(), name='logout'),
     path('forget-password/', ForgetpasswordView.as_view(), name='forget password'),
     path('confirm-otp/', ConfirmOtpView.as_view(), name='confirm otp'),
@@ -21,7 +24,10 @@ urlpatterns = [
     path('logout/staff/', StaffLogoutView.as_view(), name='staff logout'),
     path('employee/creation/', HandleEmployeeAccount.as_view(), name='employee account creation'),
     path('employee/manage/<str:id>/', ManageEmployeeAccount.as_view(), name='manage employees'),
-    path('employee/kyc/review/', KYCReviewView.as_view(), name='kyc review')
+    path('employee/kyc/review/', KYCReviewView.as_view(), name='kyc review'),
+    path('employee/kyc/queue/', KycReviewQueueView.as_view(), name='kyc review queue'),
+    path('employee/kyc/claim/', KycClaimView.as_view(), name='kyc claim'),
+    path('employee/kyc/review/bulk/', KycBulkReviewView.as_view(), name='kyc bulk review'),
     
 
 
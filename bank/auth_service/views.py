@@ -1,6 +1,7 @@
 # will handle all authentication here .
 
 from django.shortcuts import render,get_object_or_404
+from asgiref.sync import sync_to_async
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -12,6 +13,7 @@ from .utility import *
 from rest_framework.permissions import IsAuthenticated,BasePermission
 from django.db import transaction
 from rest_framework_simplejwt.tokens import RefreshToken
+import io
 import logging
 import os
 import re
@@ -25,7 +27,15 @@ from django.template.loader import render_to_string
 from django.template import TemplateDoesNotExist
 from django.contrib.auth.hashers import check_password
 from accounts.models import Account
-from django.contrib.auth.models import update_last_login
+from .services.login import get_login_user, get_profile_blob, record_login
+from .services.passwords import PasswordCheckBusy, averify_password
+from .services.tokens import issue_tokens, revoke_session
+from .services.kyc_uploads import KycUploadError, start_upload, write_chunk
+from .services.kyc_review import KycReviewError, bulk_review, claim_profiles, release_profiles, review_queue
+from .tasks import process_kyc_upload_task
+from notification.services.dispatch import notify
+from bank.async_views import AsyncAPIView
+from bank.routers import ReplicaReadMixin
 
 
 
@@ -169,7 +179,7 @@ class VerifyEmailView(APIView):
 
                 if user.verify_email(token):
                     # send onboarding email
-                    # send_onboarding_email.delay(user.id)
+                    send_onboarding_email(user.id)
 
                     return Response({"message": "Email verified successfully"},status=status.HTTP_200_OK)
                 else:
@@ -183,9 +193,9 @@ class VerifyEmailView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class CustomerLoginView(APIView):
+class CustomerLoginView(AsyncAPIView):
 
-    def post(self, request):
+    async def post(self, request):
         try:
             data = request.data
             email = data.get("email").lower()
@@ -196,41 +206,47 @@ class CustomerLoginView(APIView):
                 return Response({"error": "Email and password are required"},status=status.HTTP_400_BAD_REQUEST)
 
             try:
-                user = User.objects.get(email=email) #might opt to login with customerid
-                print(user.is_active)
+                user = await sync_to_async(get_login_user)(email) #might opt to login with customerid
 
 
-                if not user.check_password(password):
+                if not await averify_password(user, password):
                     return Response({"error": "Invalid email or password"},
                                     status=status.HTTP_401_UNAUTHORIZED)
 
-                if user.role.category != "Customer":
-                    return Response({"error": "Access denied. Not a customer."}, #change to a more generic response 
-                                    status=status.HTTP_403_FORBIDDEN)
-
-                if not user.is_active:
-                    return Response({"error": "Account is inactive. Please verify your email."}, #change to a more generic response 
-                                    status=status.HTTP_403_FORBIDDEN)
-
-
-                update_last_login(None, user)
-
-                refresh = RefreshToken.for_user(user)
-                user_data = serialize_full_user(user)
-
-                return Response({
-                    "message": "Login successful",
-                    "user": user_data,
-                    "kyc_status": user.kyc_profile.verification_status,
-                    "refresh": str(refresh),
-                    "access": str(refresh.access_token),
-                }, status=status.HTTP_200_OK)
+                return await sync_to_async(self.login)(user)
 
             except User.DoesNotExist:
                 return Response({"error": "Invalid email or password"},status=status.HTTP_401_UNAUTHORIZED)
+
+            except PasswordCheckBusy:
+                return Response({"error": "Login is busy, please try again shortly"},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
         
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def login(self, user):
+        if user.role.category != "Customer":
+            return Response({"error": "Access denied. Not a customer."}, #change to a more generic response 
+                            status=status.HTTP_403_FORBIDDEN)
+
+        if not user.is_active:
+            return Response({"error": "Account is inactive. Please verify your email."}, #change to a more generic response 
+                            status=status.HTTP_403_FORBIDDEN)
+
+
+        record_login(user)
+
+        refresh = issue_tokens(user)
+        user_data = get_profile_blob(user, serialize_full_user)
+
+        return Response({
+            "message": "Login successful",
+            "user": user_data,
+            "kyc_status": user.kyc_profile.verification_status,
+            "refresh": str(refresh),
+            "access": str(refresh.access_token),
+        }, status=status.HTTP_200_OK)
         
 class HandleSecurityQuestions(APIView):
     permission_classes = [IsAuthenticated]
@@ -261,28 +277,8 @@ class ForgetpasswordView(APIView):
                 user.set_otp()
                 otp = user.otp
 
-                # context = {
-                #     "first_name":user.first_name,
-                #     "otp":otp
-                # }
-
-                # html_content = None
-
-                # try:
-                #     html_content = render_to_string("emails/reset_password.html", context)
-                # except TemplateDoesNotExist as e:
-                #     print(f"Template not found: {e}")
-                
-                # # render html content
-                # html_content = render_to_string("emails/reset_password.html", context)
-
-                # send_email_task.delay(
-                #     subject = "Reset your password",
-                #     recipient_email = user.email,
-                #     html_content = html_content,
-                #     context = context,
-                #     template_name = "emails/reset_password.html"
-                # )
+                # sent on the customer's preferred channel by the notification workers
+                notify(user, 'password_reset', {'otp': otp})
         except User.DoesNotExist:
             # Fail silently if email not found
             pass
@@ -420,6 +416,36 @@ class HandleKYC(APIView):
             if not documents_data:
                 return Response({"error": "At least one document is required"}, status=status.HTTP_400_BAD_REQUEST)
 
+            # Validate and store the files first, so no DB transaction is open during file I/O
+            stored_documents = []
+            errors = []
+            document_field = KycDocument._meta.get_field('document_upload')
+
+            for doc_data in documents_data:
+                document_type = doc_data['document_type']
+                file_obj = doc_data['file']
+
+                error = self._validate_document(file_obj, document_type)
+                if error:
+                    errors.append({
+                        "document_type": document_type,
+                        "error": error
+                    })
+                    continue
+
+                try:
+                    stored_name = document_field.storage.save(
+                        document_field.generate_filename(None, file_obj.name), file_obj
+                    )
+                    stored_documents.append((document_type, file_obj.name, stored_name))
+
+                except Exception as e:
+                    errors.append({
+                        'document_type': document_type,
+                        'file_name': file_obj.name,
+                        'error': str(e)
+                    })
+
             with transaction.atomic():
                 # Update customer profile
                 customer_profile = CustomerProfile.objects.get(user=user)
@@ -434,45 +460,23 @@ class HandleKYC(APIView):
                 # Create or get KYC profile
                 kyc_profile = KycProfile.objects.get(user=user)
 
-                # Handle document uploads
                 saved_documents = []
-                errors = []
-
-                for doc_data in documents_data:
-                    document_type = doc_data['document_type']
-                    file_obj = doc_data['file']
-
-                    error = self._validate_document(file_obj, document_type)
-                    if error:
-                        errors.append({
-                            "document_type": document_type,
-                            "error": error
-                        })
-                        continue
-
-                    try:
-                        # Create or update KYC document
-                        kyc_doc, created = KycDocument.objects.update_or_create(
-                            kyc_profile=kyc_profile,
-                            document_type=document_type,
-                            defaults={
-                                'document_upload': file_obj,
-                                'status': 'PENDING'
-                            }
-                        )
-                        
-                        saved_documents.append({
-                            "document_type": document_type,
-                            "file_name": file_obj.name,
-                            "status": "uploaded"
-                        })
-
-                    except Exception as e:
-                        errors.append({
-                            'document_type': document_type,
-                            'file_name': file_obj.name,
-                            'error': str(e)
-                        })
+                for document_type, file_name, stored_name in stored_documents:
+                    # Create or update KYC document
+                    KycDocument.objects.update_or_create(
+                        kyc_profile=kyc_profile,
+                        document_type=document_type,
+                        defaults={
+                            'document_upload': stored_name,
+                            'status': 'PENDING'
+                        }
+                    )
+
+                    saved_documents.append({
+                        "document_type": document_type,
+                        "file_name": file_name,
+                        "status": "uploaded"
+                    })
 
                 # Update KYC profile status if documents were uploaded
                 if saved_documents:
@@ -554,6 +558,97 @@ class HandleKYC(APIView):
             return f"File type not allowed. Allowed types: {', '.join(allowed_extensions)}"
         
         return None  
+
+
+class KycUploadView(APIView):
+    """
+    Chunked, resumable KYC uploads for slow connections.
+    POST starts an upload, the file is then sent with KycUploadChunkView.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if request.user.role.role_name != "Customer":
+            return Response({"error": "Access for KYC denied"}, status=status.HTTP_403_FORBIDDEN)
+
+        uploads = KycUpload.objects.filter(kyc_profile__user=request.user).order_by('-created_at')[:20]
+        return Response(KycUploadSerializer(uploads, many=True).data, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        user = request.user
+        if user.role.role_name != "Customer":
+            return Response({"error": "Access for KYC denied"}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            document_type = request.data.get("document_type")
+            file_name = request.data.get("file_name")
+            total_size = request.data.get("total_size")
+
+            if not document_type or not file_name or not total_size:
+                return Response({"error": "document_type, file_name and total_size are required"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            try:
+                total_size = int(total_size)
+            except (TypeError, ValueError):
+                return Response({"error": "total_size must be a number of bytes"}, status=status.HTTP_400_BAD_REQUEST)
+
+            kyc_profile = KycProfile.objects.get(user=user)
+            upload = start_upload(kyc_profile, document_type, file_name, total_size, request.data.get("checksum", ""))
+
+            return Response(KycUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+        except KycProfile.DoesNotExist:
+            return Response({"error": "KYC profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        except KycUploadError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"KYC upload start failed for user {user.id}: {str(e)}")
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class KycUploadDetailView(APIView):
+    """Progress of one upload, next_chunk is where a client resumes"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        try:
+            upload = KycUpload.objects.get(id=upload_id, kyc_profile__user=request.user)
+            return Response(KycUploadSerializer(upload).data, status=status.HTTP_200_OK)
+        except KycUpload.DoesNotExist:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+
+
+class KycUploadChunkView(APIView):
+    """
+    PUT one chunk as the raw request body (application/octet-stream) with its
+    sha256 in the X-Chunk-SHA256 header. The body is streamed to the staging
+    file, never parsed into request.data.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, upload_id, index):
+        try:
+            upload = KycUpload.objects.get(id=upload_id, kyc_profile__user=request.user)
+            expected_chunk = upload.next_chunk
+
+            stream = request.stream or io.BytesIO()
+            upload = write_chunk(upload, index, stream, request.headers.get("X-Chunk-SHA256", ""))
+
+            if upload.status == 'PROCESSING' and index == expected_chunk:
+                upload_id = str(upload.id)
+                transaction.on_commit(lambda: process_kyc_upload_task.delay(upload_id))
+
+            return Response(KycUploadSerializer(upload).data, status=status.HTTP_200_OK)
+
+        except KycUpload.DoesNotExist:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        except KycUploadError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"KYC chunk {index} of upload {upload_id} failed: {str(e)}")
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class HandleLogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -563,8 +658,7 @@ class HandleLogoutView(APIView):
             if not refresh_token:
                 return Response({"error": "Refresh token is required"}, status=status.HTTP_400_BAD_REQUEST)
             
-            token = RefreshToken(refresh_token)
-            token.blacklist()
+            revoke_session(RefreshToken(refresh_token))
 
             return Response(
                 {"message": "Successfully logged out."},
@@ -578,9 +672,9 @@ class HandleLogoutView(APIView):
 
 #task 1. admin creating account for employesss 2. employees login 3. employees reset their password 4. login 2fa for security 
 
-class StaffLoginView(APIView):
+class StaffLoginView(AsyncAPIView):
 
-    def post(self, request):
+    async def post(self, request):
         try:
             data = request.data
             email = data.get("email").lower()
@@ -591,48 +685,54 @@ class StaffLoginView(APIView):
                 return Response({"error": "Email and password are required"},status=status.HTTP_400_BAD_REQUEST)
 
             try:
-                user = User.objects.get(email=email) #might opt to login with customerid
-                print(user.is_active)
+                user = await sync_to_async(get_login_user)(email) #might opt to login with customerid
 
 
-                if not user.check_password(password):
+                if not await averify_password(user, password):
                     return Response({"error": "Invalid email or password"},status=status.HTTP_401_UNAUTHORIZED)
-                
-                # check for staff category
-                if user.role.category != "STAFF":
-                    return Response({"error": "Access denied. Only staff can login."}, status=status.HTTP_403_FORBIDDEN)
-
-
-                if not user.is_active:
-                    return Response({"error": "Account is inactive. Please contact Admin."}, #change to a more generic response 
-                                    status=status.HTTP_403_FORBIDDEN)
-                
-                # session logs for auditing
-                session_logs = SessionLogs.objects.create(
-                    user=user,
-                    ip_address=request.META.get('REMOTE_ADDR'),
-                    browser_agent=request.META.get('HTTP_USER_AGENT')
-                )
-                # update lastlogin
-                update_last_login(None, user)
 
-                refresh = RefreshToken.for_user(user)
-                user_data = serialize_full_user(user)
-
-                return Response({
-                    "message": "Login successful",
-                    "user": user_data,
-                    "refresh": str(refresh),
-                    "access": str(refresh.access_token),
-                    "session_id": str(session_logs.id)
-                }, status=status.HTTP_200_OK)
+                return await sync_to_async(self.login)(request, user)
 
             except User.DoesNotExist:
                 return Response({"error": "Invalid email or password"},status=status.HTTP_401_UNAUTHORIZED)
+
+            except PasswordCheckBusy:
+                return Response({"error": "Login is busy, please try again shortly"},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
         
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def login(self, request, user):
+        # check for staff category
+        if user.role.category != "STAFF":
+            return Response({"error": "Access denied. Only staff can login."}, status=status.HTTP_403_FORBIDDEN)
+
+
+        if not user.is_active:
+            return Response({"error": "Account is inactive. Please contact Admin."}, #change to a more generic response 
+                            status=status.HTTP_403_FORBIDDEN)
+        
+        # session logs for auditing
+        session_logs = SessionLogs.objects.create(
+            user=user,
+            ip_address=request.META.get('REMOTE_ADDR'),
+            browser_agent=request.META.get('HTTP_USER_AGENT')
+        )
+        # update lastlogin
+        record_login(user)
+
+        refresh = issue_tokens(user)
+        user_data = get_profile_blob(user, serialize_full_user)
+
+        return Response({
+            "message": "Login successful",
+            "user": user_data,
+            "refresh": str(refresh),
+            "access": str(refresh.access_token),
+            "session_id": str(session_logs.id)
+        }, status=status.HTTP_200_OK)
+
 class StaffLogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -653,7 +753,7 @@ class StaffLogoutView(APIView):
                     logout_time=timezone.now()
                 )
 
-            RefreshToken(refresh).blacklist()
+            revoke_session(RefreshToken(refresh))
             return Response({"message": "Logged out"})
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -821,6 +921,7 @@ class ManageEmployeeAccount(APIView):
                     if role.category == "SYSTEM":
                         return Response({"error": "Invalid role for employee"}, status=status.HTTP_400_BAD_REQUEST)
                     user.role = role
+                    # open sessions carry the old role in their claims, saving revokes them
                     user.save()
 
                     # update the employee wit the deparrtment
@@ -841,7 +942,7 @@ class ManageEmployeeAccount(APIView):
         try:
             employee = EmployeeProfile.objects.get(id=id)
             user = employee.user
-            user.is_active = False  # Soft delete by deactivating the user
+            user.is_active = False  # Soft delete by deactivating the user, saving revokes the user's sessions
             user.save()
 
             return Response({"message": "Employee account deactivated successfully"}, status=status.HTTP_200_OK)
@@ -853,7 +954,7 @@ class ManageEmployeeAccount(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     
-class KYCReviewView(APIView):
+class KYCReviewView(ReplicaReadMixin, APIView):
     permission_classes = [IsAuthenticated, ReviewKycPermissions]
 
     def get(self, request):
@@ -917,6 +1018,9 @@ class KYCReviewView(APIView):
                 kyc_profile.review_notes = notes
                 kyc_profile.verified_by = request.user
                 kyc_profile.verified_at = timezone.now()
+                if new_status in ['APPROVED', 'REJECTED']:
+                    kyc_profile.assigned_to = None
+                    kyc_profile.assigned_at = None
                 kyc_profile.save() 
                              
 
@@ -951,4 +1055,77 @@ class KYCReviewView(APIView):
                 status=document_status_map[status],
                 reviewed_by=reviewed_by,
                 reviewed_at=timezone.now()
-            )
\ No newline at end of file
+            )
+
+class KycReviewQueueView(APIView):
+    """
+    Review queue with keyset pagination, oldest application first.
+    ?status=PENDING|UNDER_REVIEW|..., ?mine=true for applications claimed by me, ?cursor= from next_cursor.
+    """
+    permission_classes = [IsAuthenticated, ReviewKycPermissions]
+
+    def get(self, request):
+        try:
+            page_size = min(int(request.query_params.get('page_size', 50)), 200)
+            profiles, documents, next_cursor = review_queue(
+                verification_status=request.query_params.get('status', 'PENDING'),
+                cursor=request.query_params.get('cursor'),
+                page_size=page_size,
+                user_email=request.query_params.get('user_email'),
+                assigned_to=request.user if request.query_params.get('mine') == 'true' else None,
+            )
+            return Response({
+                "results": KycQueueSerializer(profiles, many=True, context={'documents': documents}).data,
+                "next_cursor": next_cursor,
+            }, status=status.HTTP_200_OK)
+
+        except (KycReviewError, ValueError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error fetching KYC review queue: {str(e)}")
+            return Response({"error": "Unable to fetch KYC review queue"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class KycClaimView(APIView):
+    """POST {"limit": n} claims the oldest pending applications, {"release": [ids]} hands them back"""
+    permission_classes = [IsAuthenticated, ReviewKycPermissions]
+
+    def post(self, request):
+        try:
+            release_ids = request.data.get('release')
+            if release_ids:
+                released = release_profiles(request.user, release_ids)
+                return Response({"released": released}, status=status.HTTP_200_OK)
+
+            limit = min(int(request.data.get('limit', 20)), 100)
+            claimed_ids = claim_profiles(request.user, limit)
+            return Response({"claimed": [str(profile_id) for profile_id in claimed_ids]}, status=status.HTTP_200_OK)
+
+        except (KycReviewError, ValueError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error claiming KYC applications: {str(e)}")
+            return Response({"error": "Unable to claim KYC applications"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class KycBulkReviewView(APIView):
+    """POST {"decisions": [{"kyc_profile_id", "status": APPROVED|REJECTED, "notes"}]} for claimed applications"""
+    permission_classes = [IsAuthenticated, ReviewKycPermissions]
+
+    def post(self, request):
+        try:
+            decisions = request.data.get('decisions')
+            if not decisions or not isinstance(decisions, list):
+                return Response({"error": "decisions must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+
+            reviewed, skipped = bulk_review(request.user, decisions)
+            return Response({
+                "reviewed": reviewed,
+                "skipped": skipped,
+            }, status=status.HTTP_200_OK)
+
+        except KycReviewError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error applying KYC decisions: {str(e)}")
+            return Response({"error": "Unable to apply KYC decisions"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,58 @@
+"""
+Async views for network-bound endpoints, served by the uvicorn workers on bank.asgi.
+
+AsyncAPIView is a DRF APIView whose handlers are coroutines. Authentication,
+permissions and throttling touch the database, so they run in one
+sync_to_async hop before the handler; the handler itself awaits its HTTP calls
+on the event loop and only hands the database work to a thread. Under WSGI
+the same views still work, each request then runs in its own event loop.
+"""
+from asgiref.sync import sync_to_async
+from django.utils.functional import classproperty
+from rest_framework.views import APIView
+import asyncio
+import httpx
+import weakref
+
+
+class AsyncAPIView(APIView):
+
+    # as_view() marks the view a coroutine function, DRF's csrf_exempt keeps it one
+    @classproperty
+    def view_is_async(cls):
+        return True
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+# one client per event loop: httpx clients and their pooled connections cannot move between loops
+_clients = weakref.WeakKeyDictionary()
+
+
+def http_client(name, **options):
+    """Keep-alive httpx.AsyncClient shared by every request on the running event loop"""
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(name)
+    if client is None or client.is_closed:
+        client = clients[name] = httpx.AsyncClient(**options)
+    return client
@@ -0,0 +1,145 @@
+"""
+Read-through cache for hot reads of rarely changing data.
+
+cached_query(namespace, key, loader) returns loader()'s result from the shared
+cache (Redis when CACHE_REDIS_URL is set, per-process memory otherwise):
+  - versioned keys: each namespace has a generation counter and every entry
+    records the generation it was loaded under. invalidate(namespace) bumps the
+    counter once the write commits, so all of the namespace's entries go stale
+    at once without looking them up. Entry and counter are fetched in one round trip.
+  - probabilistic early expiration (XFetch): a reader recomputes before expiry
+    with a probability that grows as expiry nears and with how long the loader
+    took, so a hot key is refreshed by one early reader instead of every reader
+    at the moment it expires.
+  - single-flight: only the reader that takes the key's lock runs the loader.
+    The others keep serving the previous value, or, when there is none, wait up
+    to CACHE_LOCK_WAIT seconds for the lock holder's result.
+Entries are kept CACHE_STALE_GRACE seconds past their expiry so there is a
+value to serve while one reader refreshes it.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+import logging
+import math
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# how eagerly readers refresh before expiry, 1.0 is the XFetch paper's default
+EARLY_EXPIRY_BETA = 1.0
+LOCK_POLL_INTERVAL = 0.05
+
+
+def generation_key(namespace):
+    return f"cq:{namespace}:generation"
+
+
+def entry_key(namespace, key):
+    return f"cq:{namespace}:{key}"
+
+
+def new_generation(namespace):
+    """Start a generation for a namespace whose counter is missing (never set or evicted)"""
+    # nanoseconds, so it never matches a generation an entry left behind by the evicted counter carries
+    cache.add(generation_key(namespace), time.time_ns(), timeout=None)
+    return cache.get(generation_key(namespace))
+
+
+def bump_generation(namespace):
+    try:
+        cache.incr(generation_key(namespace))
+    except ValueError:
+        new_generation(namespace)
+
+
+def invalidate(namespace):
+    """
+    Make every entry of the namespace stale once the writing transaction
+    commits (right away outside one). Until then the transaction's own reads of
+    the namespace skip the cache, so it sees its writes while nothing loaded
+    from uncommitted rows is ever cached; a rollback leaves the entries valid.
+    """
+    transaction.on_commit(Invalidation(namespace))
+
+
+class Invalidation:
+    """on_commit callback bumping a namespace, pending until it has run"""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        bump_generation(self.namespace)
+
+
+def pending_invalidation(namespace):
+    """True while the current transaction has invalidated the namespace and not committed"""
+    connection = transaction.get_connection()
+    # a rollback drops the callback from run_on_commit along with the writes
+    return connection.in_atomic_block and any(
+        isinstance(callback, Invalidation) and callback.namespace == namespace and not callback.done
+        for _, callback, _ in connection.run_on_commit
+    )
+
+
+def fresh(entry, generation):
+    """XFetch: stale once now - delta * beta * ln(random) reaches the expiry"""
+    if entry is None or entry['generation'] != generation:
+        return False
+    return time.time() - entry['delta'] * EARLY_EXPIRY_BETA * math.log(1.0 - random.random()) < entry['expires']
+
+
+def load(namespace, key, loader, timeout, generation):
+    started = time.time()
+    value = loader()
+    delta = time.time() - started
+    cache.set(
+        entry_key(namespace, key),
+        {'value': value, 'generation': generation, 'delta': delta, 'expires': time.time() + timeout},
+        timeout=timeout + settings.CACHE_STALE_GRACE
+    )
+    return value
+
+
+def cached_query(namespace, key, loader, timeout=None):
+    """loader()'s result cached under namespace/key for `timeout` seconds (CACHE_QUERY_TIMEOUT)"""
+    if pending_invalidation(namespace):
+        return loader()
+
+    timeout = settings.CACHE_QUERY_TIMEOUT if timeout is None else timeout
+    name = entry_key(namespace, key)
+    found = cache.get_many([name, generation_key(namespace)])
+    entry = found.get(name)
+    generation = found.get(generation_key(namespace))
+    if generation is None:
+        generation = new_generation(namespace)
+
+    if fresh(entry, generation):
+        return entry['value']
+
+    lock = f"{name}:lock"
+    if cache.add(lock, True, timeout=settings.CACHE_LOCK_TIMEOUT):
+        try:
+            return load(namespace, key, loader, timeout, generation)
+        finally:
+            cache.delete(lock)
+
+    # someone else is loading: serve what we have unless it was invalidated
+    if entry is not None and entry['generation'] == generation:
+        return entry['value']
+
+    deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(name)
+        if entry is not None and entry['generation'] == generation:
+            return entry['value']
+        if cache.get(lock) is None:
+            break
+
+    logger.debug(f"Cache lock on {name} not released in time, loading without it")
+    return load(namespace, key, loader, timeout, generation)
@@ -0,0 +1,173 @@
+"""
+Read replica routing.
+
+Everything reads from and writes to the primary ('default') unless a view opts
+in with ReplicaReadMixin or @replica_reads: then the safe-method reads of that
+request go to one of DATABASE_REPLICAS. The opt-in is skipped, and the request
+reads from the primary, when
+  - the user wrote something in the last READ_YOUR_WRITES_SECONDS (pinned by
+    ReadYourWritesMiddleware in the shared cache), so they see their own writes;
+  - every replica lags more than DATABASE_REPLICA_MAX_LAG seconds;
+  - the read runs inside a transaction on the primary, so locks and money paths
+    never read stale rows.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'default'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# replica alias the current request reads from, None = primary
+read_alias = ContextVar('read_alias', default=None)
+
+
+class ReplicaLag:
+    """Replication lag per replica, measured at most every DATABASE_REPLICA_LAG_CHECK_INTERVAL seconds per process"""
+
+    def __init__(self):
+        self.lags = {}
+        self.lock = threading.Lock()
+
+    def measure(self, alias):
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            return 0.0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+            )
+            return float(cursor.fetchone()[0])
+
+    def lag(self, alias):
+        measured_at, lag = self.lags.get(alias, (0, 0.0))
+        if time.monotonic() - measured_at < settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL:
+            return lag
+        with self.lock:
+            try:
+                lag = self.measure(alias)
+            except Exception as e:
+                logger.warning(f"Replica {alias} lag check failed, skipping it: {str(e)}")
+                lag = float('inf')
+            self.lags[alias] = (time.monotonic(), lag)
+        return lag
+
+    def clear(self):
+        self.lags.clear()
+
+
+replica_lag = ReplicaLag()
+
+
+def pin_key(user_id):
+    return f"db:read-your-writes:{user_id}"
+
+
+def pin_to_primary(user):
+    """Send this user's reads to the primary for READ_YOUR_WRITES_SECONDS"""
+    if settings.DATABASE_REPLICAS and user is not None and user.is_authenticated:
+        cache.set(pin_key(user.id), True, timeout=settings.READ_YOUR_WRITES_SECONDS)
+
+
+def pinned_to_primary(user):
+    return user is not None and user.is_authenticated and bool(cache.get(pin_key(user.id)))
+
+
+def choose_replica(user=None):
+    """A replica fresh enough to read from, or None for the primary"""
+    if not settings.DATABASE_REPLICAS or pinned_to_primary(user):
+        return None
+    fresh = [alias for alias in settings.DATABASE_REPLICAS if replica_lag.lag(alias) <= settings.DATABASE_REPLICA_MAX_LAG]
+    return random.choice(fresh) if fresh else None
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = read_alias.get()
+        if alias is None or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every alias is a copy of the same database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+class ReplicaReadMixin:
+    """
+    DRF views whose GET/HEAD/OPTIONS may read from a replica. The replica is
+    chosen after authentication so the user's read-your-writes pin is known.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            self.read_alias_token = read_alias.set(choose_replica(request.user))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'read_alias_token', None)
+        if token is not None:
+            read_alias.reset(token)
+            self.read_alias_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def replica_reads(view_func):
+    """Function based views (or plain methods taking the request) that only read"""
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        request = next((arg for arg in args if hasattr(arg, 'method')), None)
+        if request is None or request.method not in SAFE_METHODS:
+            return view_func(*args, **kwargs)
+        token = read_alias.set(choose_replica(getattr(request, 'user', None)))
+        try:
+            return view_func(*args, **kwargs)
+        finally:
+            read_alias.reset(token)
+    return wrapper
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pin the user to the primary after a successful write. DRF authenticates in
+    the view, so the user is only known once the response is back.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(getattr(request, 'user', None))
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            # a session user is still lazy here and loads from the database
+            await sync_to_async(pin_to_primary)(getattr(request, 'user', None))
+        return response
@@ -12,8 +12,10 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-from decouple import config
+import sys
+from decouple import Csv, config
 from datetime import timedelta
+from kombu import Exchange, Queue
 
 
 
@@ -59,6 +61,7 @@ INSTALLED_APPS = [
     'accounts',
     'notification',
     'transactions',
+    'card',
     'fraud_service',
     'ledger_service',
     'audit',
@@ -96,6 +99,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # 'defender.middleware.FailedLoginMiddleware',  # Add Defender middleware
     'auth_service.middleware.SimpleAuditMiddleware',  # Audit logging middleware
+    'bank.routers.ReadYourWritesMiddleware',  # keeps a user's reads on the primary right after their writes
     "django_prometheus.middleware.PrometheusAfterMiddleware", #should be last
 
 
@@ -119,31 +123,139 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'bank.wsgi.application'
+ASGI_APPLICATION = 'bank.asgi.application'
+
+# uvicorn workers on bank.asgi serve the async views (fraud check, M-Pesa) without a thread per request;
+# set with them, under WSGI each async request would run its own event loop
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'bank_db.sqlite3',
+# DB_ENGINE=postgres in production, SQLite stays the default for local runs and tests.
+# POSTGRES_HOST is what the app connects through (pgbouncer when DB_PGBOUNCER=True);
+# POSTGRES_DIRECT_HOST reaches the server itself, for exports and long scans that
+# need server-side cursors, which transaction pooling cannot carry between statements.
+DB_ENGINE = config('DB_ENGINE', default='sqlite')
+DB_PGBOUNCER = config('DB_PGBOUNCER', default=False, cast=bool)  # transaction pooling in front of POSTGRES_HOST
+DB_POOL = config('DB_POOL', default=False, cast=bool)  # psycopg pool in each process, when not behind pgbouncer
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)  # seconds a connection is reused, 0 closes per request
+
+if DB_ENGINE == 'postgres':
+    def postgres_database(host, port, **extra):
+        return {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('POSTGRES_NAME'),
+            'USER': config('POSTGRES_USER'),
+            'PASSWORD': config('POSTGRES_PASSWORD'),
+            'HOST': host,
+            'PORT': port,
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,  # a dropped persistent connection is replaced instead of failing the request
+            'OPTIONS': {
+                # TLS when offered, the compose db and pgbouncer have none; set require or verify-full for a remote database
+                'sslmode': config('POSTGRES_SSLMODE', default='prefer'),
+                'connect_timeout': config('POSTGRES_CONNECT_TIMEOUT', default=5, cast=int),
+                'application_name': config('POSTGRES_APPLICATION_NAME', default='bank'),
+            },
+            **extra
+        }
+
+    POSTGRES_HOST = config('POSTGRES_HOST')
+    POSTGRES_PORT = config('POSTGRES_PORT', default=5432, cast=int)
+    DATABASES = {
+        'default': postgres_database(
+            POSTGRES_HOST,
+            POSTGRES_PORT,
+            # pgbouncer may hand the next FETCH to another server connection
+            DISABLE_SERVER_SIDE_CURSORS=DB_PGBOUNCER
+        ),
+        'direct': postgres_database(
+            config('POSTGRES_DIRECT_HOST', default=POSTGRES_HOST),
+            config('POSTGRES_DIRECT_PORT', default=POSTGRES_PORT, cast=int),
+            CONN_MAX_AGE=0,  # occasional jobs, not worth a server connection held per process
+            TEST={'MIRROR': 'default'}
+        ),
     }
-}
+    if DB_POOL and not DB_PGBOUNCER:
+        from psycopg_pool import ConnectionPool
+
+        # psycopg 3 pool, replaces persistent connections (Django refuses both)
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+            'check': ConnectionPool.check_connection,  # checked when handed out
+        }
+    # streaming replicas, read by history, listing and review views (bank.routers)
+    POSTGRES_REPLICA_HOSTS = config('POSTGRES_REPLICA_HOSTS', default='', cast=Csv())
+    for number, host in enumerate(POSTGRES_REPLICA_HOSTS, start=1):
+        DATABASES[f"replica_{number}"] = postgres_database(
+            host,
+            config('POSTGRES_REPLICA_PORT', default=POSTGRES_PORT, cast=int),
+            DISABLE_SERVER_SIDE_CURSORS=DB_PGBOUNCER,
+            TEST={'MIRROR': 'default'}
+        )
+    # reports and backtests stream through server-side cursors on the direct connection
+    DATABASE_EXPORT_ALIAS = 'direct'
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'bank_db.sqlite3',
+        }
+    }
+    # a second SQLite file stands in for a replica locally (copy bank_db.sqlite3 to it)
+    SQLITE_REPLICA_NAME = config('SQLITE_REPLICA_NAME', default='')
+    if SQLITE_REPLICA_NAME:
+        DATABASES['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / SQLITE_REPLICA_NAME,
+            'TEST': {'MIRROR': 'default'},
+        }
+    DATABASE_EXPORT_ALIAS = 'default'
+
+DATABASE_ROUTERS = ['bank.routers.PrimaryReplicaRouter']
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica')]
+DATABASE_REPLICA_MAX_LAG = config('DATABASE_REPLICA_MAX_LAG', default=5, cast=float)  # seconds behind before reads go back to the primary
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = config('DATABASE_REPLICA_LAG_CHECK_INTERVAL', default=10, cast=int)
+READ_YOUR_WRITES_SECONDS = config('READ_YOUR_WRITES_SECONDS', default=5, cast=int)  # reads stay on the primary this long after a user's write
+
+# monthly partitions of transactions and ledger_entries on Postgres (manage.py partition_tables)
+PARTITION_MONTHS_AHEAD = config('PARTITION_MONTHS_AHEAD', default=3, cast=int)  # months created ahead of inserts
+PARTITION_ARCHIVE_AFTER_MONTHS = config('PARTITION_ARCHIVE_AFTER_MONTHS', default=24, cast=int)
+PARTITION_ARCHIVE_DIR = config('PARTITION_ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))  # Parquet archives
+PARTITION_ARCHIVE_TABLESPACE = config('PARTITION_ARCHIVE_TABLESPACE', default='')  # e.g. on cheaper storage, for table archives
+
+# shared cache (bank/cache.py): Redis when configured, per-process memory otherwise and under manage.py test
+CACHE_REDIS_URL = config('CACHE_REDIS_URL', default='')
+if sys.argv[1:2] == ['test']:
+    CACHE_REDIS_URL = ''
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+            'KEY_PREFIX': 'bank',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'bank',
+        }
+    }
+CACHE_QUERY_TIMEOUT = config('CACHE_QUERY_TIMEOUT', default=300, cast=int)  # seconds a cached_query result is fresh
+CACHE_STALE_GRACE = config('CACHE_STALE_GRACE', default=60, cast=int)  # seconds an expired result is still served while one reader reloads it
+CACHE_LOCK_TIMEOUT = config('CACHE_LOCK_TIMEOUT', default=10, cast=int)  # seconds a reader may hold a key's reload lock
+CACHE_LOCK_WAIT = config('CACHE_LOCK_WAIT', default=2, cast=float)  # seconds a reader with nothing to serve waits for the reload
 
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.postgresql',
-#         'NAME': config('POSTGRES_NAME'),  # Read DB_NAME from .env
-#         'USER': config('POSTGRES_USER'),  # Read DB_USER from .env
-#         'PASSWORD': config('POSTGRES_PASSWORD'),  # Read DB_PASSWORD from .env
-#         'HOST': config('POSTGRES_HOST'),  # Read DB_HOST from .env
-#         'PORT': 5432,  # Default PostgreSQL port
-#         'OPTIONS': {
-#             'sslmode': 'require',  # Enforce SSL encryption
-#         },
-#     }
-# }
+# balance snapshots for polling (accounts/services/balances.py), in the cache's Redis; per process without it
+BALANCE_SNAPSHOT_REDIS_URL = CACHE_REDIS_URL
+BALANCE_SNAPSHOT_TTL = config('BALANCE_SNAPSHOT_TTL', default=60, cast=int)  # seconds a snapshot is served, bounds staleness after a missed refresh
 
 
 
@@ -165,6 +277,20 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# TunedPBKDF2PasswordHasher reads its iteration count from PASSWORD_HASH_ITERATIONS
+# (pick one with `manage.py tune_password_hasher`). Hashes made with another count
+# still verify and are rehashed in the background on the next successful login.
+# It replaces Django's PBKDF2PasswordHasher rather than sitting next to it, hashers
+# are looked up by algorithm name and both are pbkdf2_sha256.
+PASSWORD_HASHERS = [
+    'auth_service.hashers.TunedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = config('PASSWORD_HASH_ITERATIONS', default=0, cast=int)  # 0 = Django's default
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -187,6 +313,15 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# chunked KYC uploads (auth_service/services/kyc_uploads.py), the staging dir must be shared with the celery workers
+KYC_UPLOAD_STAGING_DIR = config('KYC_UPLOAD_STAGING_DIR', default=os.path.join(MEDIA_ROOT, 'kyc_staging'))
+KYC_UPLOAD_CHUNK_SIZE = config('KYC_UPLOAD_CHUNK_SIZE', default=512 * 1024, cast=int)  # below DATA_UPLOAD_MAX_MEMORY_SIZE
+KYC_UPLOAD_MAX_SIZE = config('KYC_UPLOAD_MAX_SIZE', default=5 * 1024 * 1024, cast=int)
+KYC_UPLOAD_EXPIRY_HOURS = config('KYC_UPLOAD_EXPIRY_HOURS', default=24, cast=int)
+# KYC review queue (auth_service/services/kyc_review.py)
+KYC_ASSIGNMENT_TIMEOUT_MINUTES = config('KYC_ASSIGNMENT_TIMEOUT_MINUTES', default=30, cast=int)  # claimed but untouched applications return to the queue
+KYC_DOCUMENT_CACHE_TIMEOUT = config('KYC_DOCUMENT_CACHE_TIMEOUT', default=300, cast=int)
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -208,7 +343,7 @@ AUTHENTICATION_BACKENDS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'auth_service.authentication.ClaimsJWTAuthentication',
 
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -222,11 +357,48 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,  # Returns new refresh token on refresh
     'BLACKLIST_AFTER_ROTATION': True,
     'UPDATE_LAST_LOGIN': True,  # Update last login time on login
-    'REFRESH_TOKEN_GRACE_PERIOD':timedelta(hours=1) # grace period for refresh token
+    'REFRESH_TOKEN_GRACE_PERIOD':timedelta(hours=1), # grace period for refresh token
+    'TOKEN_REFRESH_SERIALIZER': 'auth_service.serializers.SessionTokenRefreshSerializer',
 }
 
+# revoked JWT sessions (auth_service/services/tokens.py)
+REVOCATION_SYNC_INTERVAL = config('REVOCATION_SYNC_INTERVAL', default=30, cast=int)  # seconds between filter rebuilds
+REVOCATION_BLOOM_CAPACITY = config('REVOCATION_BLOOM_CAPACITY', default=100000, cast=int)
+REVOCATION_REDIS_URL = config('REVOCATION_REDIS_URL', default='')  # pub/sub for instant revocation, empty = sync only
+
 FRONTEND_URL = "localhost:3000"
 
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=587, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=10, cast=int)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='EverGreen Bank <no-reply@evergreen.bank>')
+
+# SMS provider (notification/services/sms.py), empty SMS_API_URL fails SMS notifications
+SMS_API_URL = config('SMS_API_URL', default='')
+SMS_API_KEY = config('SMS_API_KEY', default='')
+SMS_SENDER_ID = config('SMS_SENDER_ID', default='EVERGREEN')
+
+# notification dispatch (notification/services/dispatch.py)
+NOTIFICATION_BATCH_SIZE = config('NOTIFICATION_BATCH_SIZE', default=200, cast=int)  # messages per claimed batch
+NOTIFICATION_DISPATCH_PARALLELISM = config('NOTIFICATION_DISPATCH_PARALLELISM', default=4, cast=int)  # workers a bulk send fans out to per channel
+NOTIFICATION_EMAIL_RATE_PER_SECOND = config('NOTIFICATION_EMAIL_RATE_PER_SECOND', default=50, cast=float)  # per worker process
+NOTIFICATION_SMS_RATE_PER_SECOND = config('NOTIFICATION_SMS_RATE_PER_SECOND', default=20, cast=float)  # per worker process
+NOTIFICATION_MAX_ATTEMPTS = config('NOTIFICATION_MAX_ATTEMPTS', default=5, cast=int)
+NOTIFICATION_RETRY_BASE_DELAY = config('NOTIFICATION_RETRY_BASE_DELAY', default=30, cast=int)  # seconds, doubled per attempt
+NOTIFICATION_RETRY_MAX_DELAY = config('NOTIFICATION_RETRY_MAX_DELAY', default=3600, cast=int)  # seconds
+NOTIFICATION_SENDING_TIMEOUT = config('NOTIFICATION_SENDING_TIMEOUT', default=600, cast=int)  # seconds before a claimed batch is reclaimed
+
+# login path (auth_service/services/login.py)
+LAST_LOGIN_FLUSH_INTERVAL = config('LAST_LOGIN_FLUSH_INTERVAL', default=5, cast=int)  # seconds
+LOGIN_PROFILE_CACHE_TIMEOUT = config('LOGIN_PROFILE_CACHE_TIMEOUT', default=3600, cast=int)
+PASSWORD_CHECK_WORKERS = config('PASSWORD_CHECK_WORKERS', default=4, cast=int)  # threads hashing passwords per process
+PASSWORD_CHECK_MAX_PENDING = config('PASSWORD_CHECK_MAX_PENDING', default=32, cast=int)  # checks queued or running before logins get a 503
+PASSWORD_CHECK_TIMEOUT = config('PASSWORD_CHECK_TIMEOUT', default=5, cast=float)  # seconds
+
 CELERY_BROKER_URL = f"{config('CELERY_BROKER_URL')}"  # DB 1 for Celery tasks
 CELERY_RESULT_BACKEND = f"{config('CELERY_BROKER_URL')}"  # Same DB for results
 CELERY_ACCEPT_CONTENT = ['application/json']
@@ -240,6 +412,74 @@ CELERY_TASK_TRACK_STARTED = True  # Useful for progress tracking
 CELERYD_MAX_MEMORY_PER_CHILD = 100000  # 100MB
 CELERYD_MAX_TASKS_PER_CHILD = 50
 
+# transfers are hashed by source account onto a fixed number of lanes (transfers.lane.<n>),
+# each lane is consumed by a single worker process so one account's transfers run in order
+TRANSFER_LANES = config('TRANSFER_LANES', default=8, cast=int)
+TRANSFER_EXCHANGE = Exchange('transfers', type='topic')
+CELERY_TASK_QUEUES = (
+    Queue('celery', Exchange('celery'), routing_key='celery'),
+    *(
+        Queue(f'transfers.lane.{lane}', TRANSFER_EXCHANGE, routing_key=f'transfers.lane.{lane}')
+        for lane in range(TRANSFER_LANES)
+    ),
+)
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+
+# synced into django_celery_beat by the DatabaseScheduler on startup
+CELERY_BEAT_SCHEDULE = {
+    'process-mpesa-callbacks': {
+        'task': 'accounts.tasks.process_mpesa_callbacks_task',
+        'schedule': 5.0,
+    },
+    'disburse-mpesa-withdrawals': {
+        'task': 'accounts.tasks.disburse_mpesa_withdrawals_task',
+        'schedule': 60.0,  # withdrawals whose own task was never queued
+    },
+    'purge-stale-kyc-uploads': {
+        'task': 'auth_service.tasks.purge_stale_kyc_uploads_task',
+        'schedule': 3600.0,
+    },
+    'dispatch-notifications': {
+        'task': 'notification.tasks.dispatch_notifications_task',
+        'schedule': 30.0,
+    },
+    'settle-card-captures': {
+        'task': 'card.tasks.settle_card_captures_task',
+        'schedule': 300.0,
+    },
+    'expire-card-authorizations': {
+        'task': 'card.tasks.expire_card_authorizations_task',
+        'schedule': 3600.0,
+    },
+    'rollup-fraud-checks': {
+        'task': 'fraud_service.tasks.rollup_fraud_checks_task',
+        'schedule': 900.0,  # risk summaries lag the check log by at most this
+    },
+    'ensure-transaction-partitions': {
+        'task': 'transactions.tasks.ensure_partitions_task',
+        'schedule': 86400.0,
+    },
+}
+
+# fraud checks: 'local' scores in-process (fraud_service/services/engine.py), 'remote' asks the
+# Go service first and falls back to the local engine when it errors or times out
+FRAUD_ENGINE_MODE = config('FRAUD_ENGINE_MODE', default='local')
+FRAUD_SERVICE_URL = config('FRAUD_SERVICE_URL', default='http://localhost:8080/api/v1.0/fraud/check')
+FRAUD_SERVICE_TIMEOUT = config('FRAUD_SERVICE_TIMEOUT', default=0.1, cast=float)  # seconds
+FRAUD_RULES_REFRESH_INTERVAL = config('FRAUD_RULES_REFRESH_INTERVAL', default=60, cast=int)  # seconds
+FRAUD_VELOCITY_REDIS_URL = config('FRAUD_VELOCITY_REDIS_URL', default=CACHE_REDIS_URL)  # shared counters, empty = per process
+if sys.argv[1:2] == ['test']:
+    FRAUD_VELOCITY_REDIS_URL = ''
+FRAUD_VELOCITY_MAX_WINDOW = config('FRAUD_VELOCITY_MAX_WINDOW', default=3600, cast=int)  # seconds, longest rule window
+
+# card authorizations (card/services/authorization.py)
+CARD_STATE_CACHE_TTL = config('CARD_STATE_CACHE_TTL', default=30, cast=int)  # seconds a process trusts its copy of a card
+CARD_STATE_CACHE_SIZE = config('CARD_STATE_CACHE_SIZE', default=100000, cast=int)
+CARD_AUTHORIZATION_HOLD_DAYS = config('CARD_AUTHORIZATION_HOLD_DAYS', default=7, cast=int)  # uncaptured holds are released after this
+
+# 'sync' executes transfers in the request, 'queued' persists them PENDING and returns 202
+TRANSFER_EXECUTION_MODE = config('TRANSFER_EXECUTION_MODE', default='sync')
+
 
 SPECTACULAR_SETTINGS = {
     'TITLE': 'EverGreen Bank Documentation',
@@ -276,6 +516,13 @@ MPESA_SHORTCODE = config("MPESA_EXPRESS_SHORTCODE")
 MPESA_PASSKEY = config("MPESA_PASSKEY")
 MPESA_INITIATOR_USERNAME= config("MPESA_INITIATOR_USERNAME")
 MPESA_INITIATOR_SECURITY_CREDENTIAL = config("MPESA_INITIATOR_SECURITY_CREDENTIAL")
+# gateway tuning (accounts/services/daraja.py), MPESA_BASE_URL overrides the environment url
+MPESA_BASE_URL = config("MPESA_BASE_URL", default="")
+MPESA_MAX_CONCURRENCY = config("MPESA_MAX_CONCURRENCY", default=10, cast=int)
+MPESA_RATE_LIMIT_PER_SECOND = config("MPESA_RATE_LIMIT_PER_SECOND", default=20, cast=float)
+# callbacks matching no transaction yet are retried this long before they are left UNMATCHED (accounts/services/mpesa_callbacks.py)
+MPESA_CALLBACK_MATCH_WINDOW = config("MPESA_CALLBACK_MATCH_WINDOW", default=900, cast=int)  # seconds from arrival
+MPESA_CALLBACK_RETRY_DELAY = config("MPESA_CALLBACK_RETRY_DELAY", default=30, cast=int)  # seconds between attempts
 
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:4000",
@@ -13,6 +13,7 @@ urlpatterns = [
    path('api/v1.0/auth/', include('auth_service.urls')),
    path('api/v1.0/transactions/', include('transactions.urls')),
    path('api/v1.0/fraud/', include('fraud_service.urls')),
+   path('api/v1.0/card/', include('card.urls')),
 
 
    
@@ -1,3 +1,16 @@
 from django.contrib import admin
+from .models import Card, CardAuthorization
 
-# Register your models here.
+
+@admin.register(Card)
+class CardAdmin(admin.ModelAdmin):
+    list_display = ('last_four', 'card_type', 'account', 'status', 'expiry_date', 'per_transaction_limit', 'daily_limit')
+    list_filter = ('status', 'card_type')
+    search_fields = ('card_token', 'last_four', 'account__account_number')
+
+
+@admin.register(CardAuthorization)
+class CardAuthorizationAdmin(admin.ModelAdmin):
+    list_display = ('processor_ref', 'authorization_code', 'amount', 'currency', 'status', 'decline_reason', 'created_at')
+    list_filter = ('status', 'decline_reason')
+    search_fields = ('processor_ref', 'authorization_code', 'merchant_name')
@@ -0,0 +1,16 @@
+from prometheus_client import Counter, Histogram
+
+
+# authorization decisions, approved or the decline reason
+card_authorizations_total = Counter(
+    'card_authorizations_total',
+    'Card authorization decisions',
+    ['decision']
+)
+
+# time to decide an authorization, the processor's budget is 10ms
+card_authorization_seconds = Histogram(
+    'card_authorization_seconds',
+    'Time spent deciding a card authorization',
+    buckets=(0.001, 0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
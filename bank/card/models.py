@@ -1,3 +1,102 @@
 from django.db import models
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from decimal import Decimal
+from auth_service.models import BaseModel
 
-# Create your models here.
+
+class Card(BaseModel):
+    """
+    Payment card linked to an account. Only the processor's token and the last
+    four digits are kept, the PAN never reaches this system. daily_spent is the
+    running total of today's authorizations (spend_date), enforced in the same
+    UPDATE that approves an authorization.
+    """
+    CARD_TYPE_CHOICES = (
+        ('DEBIT', 'Debit'),
+        ('VIRTUAL', 'Virtual'),
+    )
+    STATUS_CHOICES = (
+        ('ACTIVE', 'Active'),
+        ('FROZEN', 'Frozen'),
+        ('BLOCKED', 'Blocked'),
+        ('EXPIRED', 'Expired'),
+    )
+
+    account = models.ForeignKey('accounts.Account', on_delete=models.PROTECT, related_name='cards')
+    card_token = models.CharField(max_length=64, unique=True)
+    last_four = models.CharField(max_length=4)
+    card_type = models.CharField(max_length=20, choices=CARD_TYPE_CHOICES, default='DEBIT')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ACTIVE')
+    expiry_date = models.DateField()
+    per_transaction_limit = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('50000.00'))
+    daily_limit = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('100000.00'))
+    daily_spent = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    spend_date = models.DateField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.card_type} card ****{self.last_four} - {self.status}"
+
+    class Meta:
+        db_table = 'card'
+        indexes = [
+            models.Index(fields=['account', 'status']),
+        ]
+
+
+class CardAuthorization(BaseModel):
+    """
+    One authorization request from the card processor and its lifecycle:
+    APPROVED (funds held) -> CAPTURED (amount confirmed) -> SETTLED (posted to
+    the ledger), or APPROVED -> VOIDED / EXPIRED (hold released). Declines are
+    kept too. processor_ref is unique, so a retried request gets the original decision.
+    """
+    STATUS_CHOICES = (
+        ('APPROVED', 'Approved'),
+        ('DECLINED', 'Declined'),
+        ('CAPTURED', 'Captured'),
+        ('SETTLED', 'Settled'),
+        ('VOIDED', 'Voided'),
+        ('EXPIRED', 'Expired'),
+    )
+
+    card = models.ForeignKey(Card, on_delete=models.PROTECT, related_name='authorizations')
+    account = models.ForeignKey('accounts.Account', on_delete=models.PROTECT, related_name='card_authorizations')
+    processor_ref = models.CharField(max_length=100, unique=True)
+    authorization_code = models.CharField(max_length=12, unique=True, null=True, blank=True)
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    currency = models.CharField(max_length=3, default='KES')
+    merchant_name = models.CharField(max_length=100, blank=True)
+    merchant_category_code = models.CharField(max_length=4, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    decline_reason = models.CharField(max_length=50, blank=True)
+    hold = models.OneToOneField(
+        'accounts.AccountHold', on_delete=models.SET_NULL, null=True, blank=True, related_name='card_authorization'
+    )
+    captured_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+    captured_at = models.DateTimeField(null=True, blank=True)
+    settled_at = models.DateTimeField(null=True, blank=True)
+    released_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    transaction = models.ForeignKey(
+        'transactions.Transaction', on_delete=models.SET_NULL, null=True, blank=True, related_name='card_authorizations',
+        db_constraint=False  # transactions is partitioned on Postgres
+    )
+
+    def __str__(self):
+        return f"{self.processor_ref} - {self.amount} {self.currency} - {self.status}"
+
+    class Meta:
+        db_table = 'card_authorization'
+        indexes = [
+            models.Index(fields=['status', 'captured_at']),
+            models.Index(fields=['status', 'expires_at']),
+            models.Index(fields=['card', 'created_at']),
+        ]
+
+
+@receiver(post_save, sender=Card)
+def invalidate_card_state(sender, instance, **kwargs):
+    # only this process's copy, the others expire theirs within CARD_STATE_CACHE_TTL
+    from .services.authorization import card_states
+    card_states.invalidate(instance.card_token)
@@ -0,0 +1,22 @@
+from rest_framework.permissions import BasePermission
+
+
+class CanProcessCardPayments(BasePermission):
+    """
+    the card processor's service account (and staff with process_card_payments)
+    can authorize, capture, void and upload capture files
+    """
+    required_permissions = ['process_card_payments']
+
+    def has_permission(self, request, view):
+        user = request.user
+
+        # Allow superuser
+        if user.is_superuser:
+            return True
+
+        # Ensure the user has a role
+        if not user.role:
+            return False
+
+        return user.role.has_any_permission(*self.required_permissions)
@@ -0,0 +1,16 @@
+from rest_framework import serializers
+from .models import CardAuthorization
+
+
+class CardAuthorizationSerializer(serializers.ModelSerializer):
+    approved = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CardAuthorization
+        fields = [
+            'approved', 'status', 'authorization_code', 'decline_reason', 'processor_ref',
+            'amount', 'currency', 'captured_amount', 'expires_at'
+        ]
+
+    def get_approved(self, obj):
+        return obj.status in ('APPROVED', 'CAPTURED', 'SETTLED')
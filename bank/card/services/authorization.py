@@ -0,0 +1,376 @@
+"""
+Card authorization, capture and void.
+
+Authorizations are on the processor's clock, so the hot path avoids every query
+it can. Card status, expiry, limits and the linked account come from a per
+process cache (CardStateCache) and obvious declines are answered from it alone.
+An approval is then three writes in one short transaction: a conditional UPDATE
+of the card (still ACTIVE, within the per transaction and daily limits), a
+conditional UPDATE of the account (still ACTIVE, enough available balance) and
+the inserts of the AccountHold and the CardAuthorization. The conditions re-check
+everything the cache said, so a stale entry can turn an approval into a decline
+but never the other way round, and no row is locked longer than the UPDATE.
+"""
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from accounts.models import Account, AccountHold
+from accounts.services.balances import refresh_after_commit
+from ..models import Card, CardAuthorization
+import logging
+import secrets
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+AUTHORIZATION_CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+
+# decline reasons returned to the processor
+CARD_NOT_FOUND = 'CARD_NOT_FOUND'
+CARD_INACTIVE = 'CARD_INACTIVE'
+CARD_EXPIRED = 'CARD_EXPIRED'
+ACCOUNT_INACTIVE = 'ACCOUNT_INACTIVE'
+CURRENCY_MISMATCH = 'CURRENCY_MISMATCH'
+OVER_TRANSACTION_LIMIT = 'OVER_TRANSACTION_LIMIT'
+OVER_DAILY_LIMIT = 'OVER_DAILY_LIMIT'
+INSUFFICIENT_FUNDS = 'INSUFFICIENT_FUNDS'
+
+
+class CardAuthorizationError(Exception):
+    """Raised when a capture or void cannot be applied"""
+
+
+class Declined(Exception):
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CardStateCache:
+    """
+    card_token -> what an authorization decision needs, kept for `ttl` seconds.
+    Bounded LRU so a card testing attack cannot grow it without limit.
+    """
+
+    FIELDS = (
+        'id', 'account_id', 'status', 'expiry_date', 'per_transaction_limit', 'daily_limit',
+        'account__status', 'account__currency', 'account__allow_debit'
+    )
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, card_token):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(card_token)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(card_token)
+                return entry[1]
+
+        state = Card.objects.filter(card_token=card_token).values(*self.FIELDS).first()
+        if state is not None:
+            with self.lock:
+                self.entries[card_token] = (now + self.ttl, state)
+                self.entries.move_to_end(card_token)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return state
+
+    def invalidate(self, card_token):
+        with self.lock:
+            self.entries.pop(card_token, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+card_states = CardStateCache(ttl=settings.CARD_STATE_CACHE_TTL, max_size=settings.CARD_STATE_CACHE_SIZE)
+
+
+def generate_authorization_code():
+    return ''.join(secrets.choice(AUTHORIZATION_CODE_ALPHABET) for _ in range(8))
+
+
+def check_card_state(state, amount, currency, today):
+    """Declines that need nothing but the cached card state"""
+    if state is None:
+        raise Declined(CARD_NOT_FOUND)
+    if state['status'] != 'ACTIVE':
+        raise Declined(CARD_INACTIVE)
+    if state['expiry_date'] < today:
+        raise Declined(CARD_EXPIRED)
+    if state['account__status'] != 'ACTIVE' or not state['account__allow_debit']:
+        raise Declined(ACCOUNT_INACTIVE)
+    if currency != state['account__currency']:
+        raise Declined(CURRENCY_MISMATCH)
+    if amount > state['per_transaction_limit']:
+        raise Declined(OVER_TRANSACTION_LIMIT)
+    if amount > state['daily_limit']:
+        raise Declined(OVER_DAILY_LIMIT)
+
+
+def card_decline_reason(card_id, amount, today):
+    """Why the conditional card UPDATE matched nothing, only read on the decline path"""
+    card = Card.objects.get(id=card_id)
+    if card.status != 'ACTIVE':
+        return CARD_INACTIVE
+    if amount > card.per_transaction_limit:
+        return OVER_TRANSACTION_LIMIT
+    return OVER_DAILY_LIMIT
+
+
+def account_decline_reason(account_id):
+    account = Account.objects.only('status', 'allow_debit').get(id=account_id)
+    if account.status != 'ACTIVE' or not account.allow_debit:
+        return ACCOUNT_INACTIVE
+    return INSUFFICIENT_FUNDS
+
+
+def place_authorization(state, processor_ref, amount, currency, merchant_name, merchant_category_code, today):
+    """The approval writes. Raises Declined, rolling back whatever was already updated."""
+    now = timezone.now()
+    with transaction.atomic():
+        spent_today = Q(spend_date=today, daily_spent__lte=F('daily_limit') - amount)
+        first_today = ~Q(spend_date=today) | Q(spend_date__isnull=True)
+        updated = Card.objects.filter(
+            Q(spent_today) | Q(first_today, daily_limit__gte=amount),
+            id=state['id'], status='ACTIVE', per_transaction_limit__gte=amount
+        ).update(
+            daily_spent=Case(When(spend_date=today, then=F('daily_spent') + amount), default=Value(amount)),
+            spend_date=today,
+            updated_at=now
+        )
+        if not updated:
+            raise Declined(card_decline_reason(state['id'], amount, today))
+
+        updated = Account.objects.filter(
+            id=state['account_id'], status='ACTIVE', allow_debit=True, available_balance__gte=amount
+        ).update(available_balance=F('available_balance') - amount, updated_at=now)
+        if not updated:
+            raise Declined(account_decline_reason(state['account_id']))
+        refresh_after_commit([state['account_id']])
+
+        code = generate_authorization_code()
+        expires_at = now + timedelta(days=settings.CARD_AUTHORIZATION_HOLD_DAYS)
+        hold = AccountHold.objects.create(
+            account_id=state['account_id'],
+            hold_type='TRANSACTION',
+            amount=amount,
+            reason=f"Card authorization {code} {merchant_name}".strip(),
+            reference_id=code,
+            expiry_date=expires_at
+        )
+        return CardAuthorization.objects.create(
+            card_id=state['id'],
+            account_id=state['account_id'],
+            processor_ref=processor_ref,
+            authorization_code=code,
+            amount=amount,
+            currency=currency,
+            merchant_name=merchant_name,
+            merchant_category_code=merchant_category_code,
+            status='APPROVED',
+            hold=hold,
+            expires_at=expires_at
+        )
+
+
+def authorize(card_token, processor_ref, amount, currency='KES', merchant_name='', merchant_category_code=''):
+    """
+    Approve or decline a card payment, holding the funds on approval. Returns the
+    CardAuthorization; a repeated processor_ref returns the original one. Unknown
+    cards are declined without a record (there is no card to attach it to), in
+    which case None is returned.
+    """
+    try:
+        amount = Decimal(str(amount))
+    except ArithmeticError:
+        raise CardAuthorizationError("Invalid amount")
+    # NaN and Infinity would not survive the comparison or the quantize
+    if not amount.is_finite():
+        raise CardAuthorizationError("Invalid amount")
+    if amount <= 0:
+        raise CardAuthorizationError("Amount must be positive")
+    try:
+        amount = amount.quantize(Decimal('0.01'))
+    except ArithmeticError:
+        raise CardAuthorizationError("Invalid amount")
+    today = timezone.localdate()
+    state = card_states.get(card_token)
+
+    for attempt in range(3):
+        try:
+            check_card_state(state, amount, currency, today)
+            authorization = place_authorization(
+                state, processor_ref, amount, currency, merchant_name, merchant_category_code, today
+            )
+            return authorization
+        except Declined as declined:
+            if declined.reason == CARD_NOT_FOUND:
+                return None
+            if declined.reason in (CARD_INACTIVE, OVER_TRANSACTION_LIMIT, ACCOUNT_INACTIVE):
+                # the cache may be behind a change, the next request reloads it
+                card_states.invalidate(card_token)
+            try:
+                # savepoint: inside a caller's transaction a duplicate must not break it
+                with transaction.atomic():
+                    return CardAuthorization.objects.create(
+                        card_id=state['id'],
+                        account_id=state['account_id'],
+                        processor_ref=processor_ref,
+                        amount=amount,
+                        currency=currency,
+                        merchant_name=merchant_name,
+                        merchant_category_code=merchant_category_code,
+                        status='DECLINED',
+                        decline_reason=declined.reason
+                    )
+            except IntegrityError:
+                pass
+        except IntegrityError:
+            pass
+
+        existing = CardAuthorization.objects.filter(processor_ref=processor_ref).first()
+        if existing is not None:
+            return existing
+        # authorization code collision, try again with a new one
+
+    raise CardAuthorizationError(f"Could not record authorization {processor_ref}")
+
+
+def capture(authorization_code, amount=None):
+    """Confirm the final amount of an approved authorization, settled later in bulk"""
+    captured, errors = capture_many([{'authorization_code': authorization_code, 'amount': amount}])
+    if errors:
+        raise CardAuthorizationError(errors[0]['error'])
+    return captured[0]
+
+
+def capture_many(rows):
+    """
+    Capture [{'authorization_code', 'amount'}] rows (amount None = the authorized
+    amount) with one locking read and one bulk_update. Capturing again with the
+    same amount is a no-op. Returns (captured authorizations, [{'authorization_code', 'error'}]).
+    """
+    errors = []
+    requested = {}
+    for row in rows:
+        code = str(row.get('authorization_code') or '').strip().upper()
+        try:
+            amount = Decimal(str(row['amount'])).quantize(Decimal('0.01')) if row.get('amount') not in (None, '') else None
+        except ArithmeticError:
+            errors.append({'authorization_code': code, 'error': 'Invalid amount'})
+            continue
+        if amount is not None and not amount.is_finite():
+            errors.append({'authorization_code': code, 'error': 'Invalid amount'})
+            continue
+        if amount is not None and amount <= 0:
+            errors.append({'authorization_code': code, 'error': 'Amount must be positive'})
+            continue
+        requested[code] = amount
+
+    now = timezone.now()
+    with transaction.atomic():
+        authorizations = {
+            authorization.authorization_code: authorization
+            for authorization in CardAuthorization.objects.select_for_update().filter(authorization_code__in=list(requested))
+        }
+        to_update = []
+        captured = []
+        for code, amount in requested.items():
+            authorization = authorizations.get(code)
+            if authorization is None:
+                errors.append({'authorization_code': code, 'error': 'Unknown authorization'})
+                continue
+            amount = authorization.amount if amount is None else amount
+            if authorization.status == 'CAPTURED' and authorization.captured_amount == amount:
+                captured.append(authorization)
+                continue
+            if authorization.status != 'APPROVED':
+                errors.append({'authorization_code': code, 'error': f"Authorization is {authorization.status.lower()}"})
+                continue
+            if amount > authorization.amount:
+                errors.append({'authorization_code': code, 'error': 'Capture exceeds the authorized amount'})
+                continue
+            authorization.status = 'CAPTURED'
+            authorization.captured_amount = amount
+            authorization.captured_at = now
+            authorization.updated_at = now
+            to_update.append(authorization)
+            captured.append(authorization)
+        CardAuthorization.objects.bulk_update(
+            to_update, ['status', 'captured_amount', 'captured_at', 'updated_at'], batch_size=500
+        )
+
+    return captured, errors
+
+
+def release_authorizations(authorizations, status, now):
+    """
+    Give the held funds of APPROVED authorizations back and undo their daily spend.
+    Runs inside the caller's transaction with the authorizations locked.
+    """
+    by_account = {}
+    by_card = {}
+    hold_ids = []
+    for authorization in authorizations:
+        by_account[authorization.account_id] = by_account.get(authorization.account_id, Decimal('0.00')) + authorization.amount
+        if timezone.localdate(authorization.created_at) == timezone.localdate(now):
+            by_card[authorization.card_id] = by_card.get(authorization.card_id, Decimal('0.00')) + authorization.amount
+        if authorization.hold_id:
+            hold_ids.append(authorization.hold_id)
+        authorization.status = status
+        authorization.released_at = now
+        authorization.updated_at = now
+
+    for account_id, amount in by_account.items():
+        Account.objects.filter(id=account_id).update(available_balance=F('available_balance') + amount, updated_at=now)
+    refresh_after_commit(by_account)
+    for card_id, amount in by_card.items():
+        Card.objects.filter(id=card_id, spend_date=timezone.localdate(now)).update(
+            daily_spent=F('daily_spent') - amount, updated_at=now
+        )
+    AccountHold.objects.filter(id__in=hold_ids).update(is_released=True, released_at=now, updated_at=now)
+    CardAuthorization.objects.bulk_update(authorizations, ['status', 'released_at', 'updated_at'], batch_size=500)
+
+
+def void(authorization_code):
+    """Cancel an approved authorization and release its hold"""
+    with transaction.atomic():
+        authorization = CardAuthorization.objects.select_for_update().filter(
+            authorization_code=(authorization_code or '').strip().upper()
+        ).first()
+        if authorization is None:
+            raise CardAuthorizationError("Unknown authorization")
+        if authorization.status == 'VOIDED':
+            return authorization
+        if authorization.status != 'APPROVED':
+            raise CardAuthorizationError(f"Authorization is {authorization.status.lower()}")
+        release_authorizations([authorization], 'VOIDED', timezone.now())
+    return authorization
+
+
+def expire_authorizations(batch_size=500):
+    """Release holds of approvals the merchant never captured within CARD_AUTHORIZATION_HOLD_DAYS"""
+    now = timezone.now()
+    with transaction.atomic():
+        expired = list(
+            CardAuthorization.objects.select_for_update(skip_locked=True).filter(
+                status='APPROVED', expires_at__lte=now
+            ).order_by('expires_at')[:batch_size]
+        )
+        if expired:
+            release_authorizations(expired, 'EXPIRED', now)
+    return len(expired)
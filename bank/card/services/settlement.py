@@ -0,0 +1,163 @@
+"""
+Batch settlement of captured card authorizations.
+
+Workers claim CAPTURED authorizations with SKIP LOCKED and post a whole batch in
+one database transaction: a CARD_TRANSACTION per authorization from the card's
+account to the SYSTEM_CARD_ACCOUNT settlement account, written with bulk_create
+together with its two ledger entries, one balance UPDATE per account touched,
+and the holds released. Capture files from the processor are applied with
+capture_many and then settled the same way.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from accounts.models import Account, AccountHold
+from accounts.services.balances import refresh_after_commit
+from transactions.models import Transaction, LedgerEntry, LedgerEntryType, TransactionType
+from transactions.services.posting import (
+    SYSTEM_CARD_ACCOUNT, get_internal_account, get_system_user, lock_accounts, system_transaction
+)
+from ..models import CardAuthorization
+from .authorization import capture_many
+import csv
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BATCH_SIZE = 500
+CAPTURE_FILE_COLUMNS = ('authorization_code', 'amount')
+
+
+class CaptureFileError(Exception):
+    """Raised when a capture file cannot be read"""
+
+
+def settle_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """Claim and post one batch of CAPTURED authorizations. Returns the number settled."""
+    with transaction.atomic():
+        authorizations = list(
+            CardAuthorization.objects.select_for_update(skip_locked=True)
+            .filter(status='CAPTURED')
+            .order_by('captured_at')[:batch_size]
+        )
+        if not authorizations:
+            return 0
+
+        now = timezone.now()
+        system_user = get_system_user()
+        settlement = get_internal_account(SYSTEM_CARD_ACCOUNT)
+        locked = lock_accounts(settlement.id, *[authorization.account_id for authorization in authorizations])
+        balances = {account_id: account.balance for account_id, account in locked.items()}
+        balance_deltas = defaultdict(Decimal)
+        available_deltas = defaultdict(Decimal)
+        transactions = []
+        entries = []
+
+        for authorization in authorizations:
+            amount = authorization.captured_amount
+            account_id = authorization.account_id
+            txn = system_transaction(
+                TransactionType.CARD_TRANSACTION,
+                amount,
+                f"card-settlement-{authorization.id}",
+                system_user,
+                source_account_id=account_id,
+                destination_account_id=settlement.id,
+                currency=authorization.currency,
+                card_id=authorization.card_id,
+                external_ref=authorization.processor_ref,
+                description=authorization.merchant_name or 'Card payment',
+                metadata={
+                    'authorization_code': authorization.authorization_code,
+                    'merchant_category_code': authorization.merchant_category_code,
+                    'authorized_amount': str(authorization.amount),
+                },
+                source_balance_before=balances[account_id],
+                destination_balance_before=balances[settlement.id],
+            )
+            balances[account_id] -= amount
+            balances[settlement.id] += amount
+            txn.source_balance_after = balances[account_id]
+            txn.destination_balance_after = balances[settlement.id]
+            transactions.append(txn)
+
+            # the hold already took the authorized amount out of available, give back what was not captured
+            balance_deltas[account_id] -= amount
+            available_deltas[account_id] += authorization.amount - amount
+            balance_deltas[settlement.id] += amount
+            available_deltas[settlement.id] += amount
+
+            description = f"Card {authorization.authorization_code} {authorization.merchant_name}".strip()
+            entries.append(LedgerEntry(
+                transaction=txn,
+                account_id=account_id,
+                entry_type=LedgerEntryType.DEBIT,
+                amount=amount,
+                balance_after=txn.source_balance_after,
+                description=description
+            ))
+            entries.append(LedgerEntry(
+                transaction=txn,
+                account_id=settlement.id,
+                entry_type=LedgerEntryType.CREDIT,
+                amount=amount,
+                balance_after=txn.destination_balance_after,
+                description=description
+            ))
+
+            authorization.transaction = txn
+            authorization.status = 'SETTLED'
+            authorization.settled_at = now
+            authorization.updated_at = now
+
+        Transaction.objects.bulk_create(transactions)
+        LedgerEntry.objects.bulk_create(entries)
+        for account_id, delta in balance_deltas.items():
+            Account.objects.filter(id=account_id).update(
+                balance=F('balance') + delta,
+                available_balance=F('available_balance') + available_deltas[account_id],
+                updated_at=now
+            )
+        refresh_after_commit(balance_deltas)
+        AccountHold.objects.filter(
+            id__in=[authorization.hold_id for authorization in authorizations if authorization.hold_id]
+        ).update(is_released=True, released_at=now, updated_at=now)
+        CardAuthorization.objects.bulk_update(
+            authorizations, ['transaction', 'status', 'settled_at', 'updated_at'], batch_size=DEFAULT_BATCH_SIZE
+        )
+
+    logger.info(f"Settled {len(authorizations)} card authorizations")
+    return len(authorizations)
+
+
+def settle_captures(batch_size=DEFAULT_BATCH_SIZE, max_batches=50):
+    settled = 0
+    for _ in range(max_batches):
+        count = settle_batch(batch_size=batch_size)
+        settled += count
+        if count < batch_size:
+            break
+    return settled
+
+
+def read_capture_file(uploaded_file):
+    """[{'authorization_code', 'amount'}] rows from a CSV capture file with a header row"""
+    try:
+        reader = csv.DictReader(io.TextIOWrapper(uploaded_file, encoding='utf-8-sig'))
+        missing = [column for column in CAPTURE_FILE_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise CaptureFileError(f"Capture file is missing columns: {', '.join(missing)}")
+        return [{column: row.get(column) for column in CAPTURE_FILE_COLUMNS} for row in reader]
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise CaptureFileError(f"Unreadable capture file: {str(e)}")
+
+
+def apply_capture_file(uploaded_file):
+    """Capture every row of a processor capture file. Returns (captured count, row errors)."""
+    captured, errors = capture_many(read_capture_file(uploaded_file))
+    logger.info(f"Capture file applied: {len(captured)} captured, {len(errors)} rejected")
+    return len(captured), errors
@@ -0,0 +1,20 @@
+from celery import shared_task
+from .services import authorization, settlement
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def settle_card_captures_task(batch_size=settlement.DEFAULT_BATCH_SIZE):
+    """Post captured card authorizations to the ledger, scheduled through celery beat and after capture files"""
+    return settlement.settle_captures(batch_size=batch_size)
+
+
+@shared_task
+def expire_card_authorizations_task():
+    """Release holds of authorizations that were never captured"""
+    expired = authorization.expire_authorizations()
+    if expired:
+        logger.info(f"Expired {expired} card authorizations")
+    return expired
@@ -1,3 +1,185 @@
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from auth_service.models import Role, User, CustomerProfile
+from auth_service.services.tokens import issue_tokens, revocation_list
+from accounts.models import Account, AccountType, AccountHold
+from transactions.models import Transaction, LedgerEntry, TransactionType
+from .models import Card, CardAuthorization
+from .services import authorization as card_authorization
+from .services import settlement
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class CardAuthorizationTest(TestCase):
+    """Test suite for card authorization, capture, void and batch settlement"""
+
+    def setUp(self):
+        revocation_list.filter = None
+        card_authorization.card_states.clear()
+
+        admin_role = Role.objects.create(role_name='Administrator', category='SYSTEM')
+        self.admin = User.objects.create_superuser(email='admin@test.com', password='testpass123', role=admin_role)
+        role = Role.objects.create(role_name='Customer', category='Customer')
+        self.user = User.objects.create_user(email='card@test.com', password='testpass123', role=role)
+        customer = CustomerProfile.objects.create(user=self.user, customer_id='CUST-CARD', phone_number='+254700000001')
+        account_type = AccountType.objects.create(name='SAVINGS', code='SAV', description='Savings')
+        self.account = Account.objects.create(
+            customer=customer, account_type=account_type, status='ACTIVE',
+            balance=Decimal('1000.00'), available_balance=Decimal('1000.00')
+        )
+        self.settlement = Account.objects.create(
+            account_number='SYSTEM_CARD_ACCOUNT', category='INTERNAL', account_type=account_type,
+            status='ACTIVE', balance=Decimal('0.00'), available_balance=Decimal('0.00')
+        )
+        self.card = Card.objects.create(
+            account=self.account, card_token='tok_card_1', last_four='4242',
+            expiry_date=date.today() + timedelta(days=365),
+            per_transaction_limit=Decimal('500.00'), daily_limit=Decimal('800.00')
+        )
+
+    def authorize(self, processor_ref, amount):
+        return card_authorization.authorize('tok_card_1', processor_ref, amount, merchant_name='Coffee Shop')
+
+    def test_approval_places_hold(self):
+        """Test an approval holds the amount and counts towards the daily spend"""
+        auth = self.authorize('ref-1', '200.00')
+
+        self.assertEqual(auth.status, 'APPROVED')
+        self.assertEqual(len(auth.authorization_code), 8)
+        self.account.refresh_from_db()
+        self.card.refresh_from_db()
+        self.assertEqual(self.account.available_balance, Decimal('800.00'))
+        self.assertEqual(self.account.balance, Decimal('1000.00'))
+        self.assertEqual(self.card.daily_spent, Decimal('200.00'))
+        self.assertEqual(auth.hold.amount, Decimal('200.00'))
+        self.assertFalse(auth.hold.is_released)
+
+    def test_repeated_request_returns_original_decision(self):
+        """Test a retried processor_ref is not authorized twice"""
+        first = self.authorize('ref-1', '200.00')
+        second = self.authorize('ref-1', '200.00')
+
+        self.assertEqual(first.id, second.id)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.available_balance, Decimal('800.00'))
+        self.assertEqual(AccountHold.objects.count(), 1)
+
+        # a retried decline runs inside the test's transaction, which must stay usable
+        declined = self.authorize('ref-2', '600.00')
+        self.assertEqual(self.authorize('ref-2', '600.00').id, declined.id)
+        self.assertEqual(CardAuthorization.objects.filter(processor_ref='ref-2', status='DECLINED').count(), 1)
+
+    def test_declines_are_recorded(self):
+        """Test limit and balance declines leave balances untouched and are kept with their reason"""
+        self.assertEqual(self.authorize('ref-1', '600.00').decline_reason, card_authorization.OVER_TRANSACTION_LIMIT)
+
+        self.authorize('ref-2', '450.00')
+        self.assertEqual(self.authorize('ref-3', '400.00').decline_reason, card_authorization.OVER_DAILY_LIMIT)
+
+        Account.objects.filter(id=self.account.id).update(available_balance=Decimal('100.00'))
+        self.assertEqual(self.authorize('ref-4', '150.00').decline_reason, card_authorization.INSUFFICIENT_FUNDS)
+
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.daily_spent, Decimal('450.00'))
+        self.assertEqual(CardAuthorization.objects.filter(status='DECLINED').count(), 3)
+        self.assertIsNone(card_authorization.authorize('tok_unknown', 'ref-5', '10.00'))
+
+    def test_invalid_amounts_are_rejected(self):
+        """Test NaN, infinite and non-positive amounts raise CardAuthorizationError before anything is held"""
+        for amount in ('NaN', 'Infinity', '-Infinity', 'sNaN', '0', '-5.00'):
+            with self.assertRaises(card_authorization.CardAuthorizationError):
+                self.authorize(f"ref-{amount}", amount)
+        self.assertFalse(CardAuthorization.objects.exists())
+
+        auth = self.authorize('ref-1', '10.00')
+        with self.assertRaises(card_authorization.CardAuthorizationError):
+            card_authorization.capture(auth.authorization_code, 'NaN')
+
+    def test_stale_cache_cannot_approve_frozen_card(self):
+        """Test a card frozen behind the cache's back is still declined by the conditional update"""
+        self.authorize('ref-1', '10.00')
+        Card.objects.filter(id=self.card.id).update(status='FROZEN')
+
+        auth = self.authorize('ref-2', '10.00')
+        self.assertEqual(auth.status, 'DECLINED')
+        self.assertEqual(auth.decline_reason, card_authorization.CARD_INACTIVE)
+
+    def test_void_releases_hold(self):
+        """Test voiding gives the held funds and daily spend back"""
+        auth = self.authorize('ref-1', '200.00')
+        card_authorization.void(auth.authorization_code)
+
+        auth.refresh_from_db()
+        self.account.refresh_from_db()
+        self.card.refresh_from_db()
+        self.assertEqual(auth.status, 'VOIDED')
+        self.assertTrue(auth.hold.is_released)
+        self.assertEqual(self.account.available_balance, Decimal('1000.00'))
+        self.assertEqual(self.card.daily_spent, Decimal('0.00'))
+        with self.assertRaises(card_authorization.CardAuthorizationError):
+            card_authorization.capture(auth.authorization_code)
+
+    def test_partial_capture_settles_in_batch(self):
+        """Test captured authorizations are posted with their ledger entries and the uncaptured rest released"""
+        first = self.authorize('ref-1', '200.00')
+        second = self.authorize('ref-2', '100.00')
+        card_authorization.capture(first.authorization_code, '150.00')
+        card_authorization.capture(second.authorization_code)
+        with self.assertRaises(card_authorization.CardAuthorizationError):
+            card_authorization.capture(self.authorize('ref-3', '50.00').authorization_code, '60.00')
+
+        self.assertEqual(settlement.settle_captures(), 2)
+
+        self.account.refresh_from_db()
+        self.settlement.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('750.00'))
+        # 50 of the 200 hold is back, the 50 authorization still holds its funds
+        self.assertEqual(self.account.available_balance, Decimal('700.00'))
+        self.assertEqual(self.settlement.balance, Decimal('250.00'))
+
+        txn = Transaction.objects.get(external_ref='ref-1')
+        self.assertEqual(txn.transaction_type, TransactionType.CARD_TRANSACTION)
+        self.assertEqual(txn.card_id, self.card.id)
+        self.assertEqual(LedgerEntry.objects.filter(transaction__card=self.card).count(), 4)
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'SETTLED')
+        self.assertTrue(first.hold.is_released)
+        self.assertEqual(settlement.settle_captures(), 0)
+
+    def test_expired_authorizations_are_released(self):
+        """Test uncaptured authorizations past their hold period give the funds back"""
+        auth = self.authorize('ref-1', '200.00')
+        CardAuthorization.objects.filter(id=auth.id).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(card_authorization.expire_authorizations(), 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.available_balance, Decimal('1000.00'))
+
+    def test_api_authorize_and_capture_file(self):
+        """Test the processor endpoints: authorize, then capture through a capture file"""
+        headers = {'HTTP_AUTHORIZATION': f"Bearer {issue_tokens(self.admin).access_token}"}
+        response = self.client.post('/api/v1.0/card/authorize/', {
+            'card_token': 'tok_card_1', 'processor_ref': 'ref-api', 'amount': '120.00', 'currency': 'KES'
+        }, content_type='application/json', **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['approved'])
+        code = response.data['authorization_code']
+
+        capture_file = SimpleUploadedFile(
+            'captures.csv', f"authorization_code,amount\n{code},120.00\nNOPE0000,5.00\n".encode(), content_type='text/csv'
+        )
+        response = self.client.post('/api/v1.0/card/captures/', {'file': capture_file}, **headers)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['captured'], 1)
+        self.assertEqual(response.data['rejected'][0]['authorization_code'], 'NOPE0000')
+        self.assertEqual(CardAuthorization.objects.get(authorization_code=code).status, 'CAPTURED')
+
+        customer_headers = {'HTTP_AUTHORIZATION': f"Bearer {issue_tokens(self.user).access_token}"}
+        response = self.client.post('/api/v1.0/card/authorize/', {
+            'card_token': 'tok_card_1', 'processor_ref': 'ref-denied', 'amount': '1.00'
+        }, content_type='application/json', **customer_headers)
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,10 @@
+from django.urls import path
+from .views import *
+
+
+urlpatterns = [
+    path('authorize/', CardAuthorizeView.as_view(), name='card-authorize'),
+    path('authorizations/<str:authorization_code>/capture/', CardCaptureView.as_view(), name='card-capture'),
+    path('authorizations/<str:authorization_code>/void/', CardVoidView.as_view(), name='card-void'),
+    path('captures/', CardCaptureFileView.as_view(), name='card-capture-file'),
+]
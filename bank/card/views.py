@@ -1,3 +1,111 @@
-from django.shortcuts import render
+from django.db import transaction
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from decimal import Decimal, InvalidOperation
+import logging
+import time
 
-# Create your views here.
+from .metrics import card_authorization_seconds, card_authorizations_total
+from .permissions import CanProcessCardPayments
+from .serializers import CardAuthorizationSerializer
+from .services.authorization import CARD_NOT_FOUND, CardAuthorizationError, authorize, capture, void
+from .services.settlement import CaptureFileError, apply_capture_file
+from .tasks import settle_card_captures_task
+
+logger = logging.getLogger(__name__)
+
+
+class CardAuthorizeView(APIView):
+    """
+    card processor asks whether to approve a payment, approved funds are held
+    on the account until the payment is captured and settled
+    """
+    permission_classes = [IsAuthenticated, CanProcessCardPayments]
+
+    def post(self, request):
+        data = request.data
+        card_token = data.get('card_token')
+        processor_ref = data.get('processor_ref')
+
+        if not card_token or not processor_ref:
+            return Response({"error": "card_token and processor_ref are required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            amount = Decimal(str(data.get('amount')))
+        except (InvalidOperation, TypeError):
+            return Response({"error": "A valid amount is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        started = time.perf_counter()
+        try:
+            authorization = authorize(
+                card_token,
+                processor_ref,
+                amount,
+                currency=data.get('currency', 'KES'),
+                merchant_name=data.get('merchant_name', ''),
+                merchant_category_code=data.get('merchant_category_code', '')
+            )
+        except CardAuthorizationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            card_authorization_seconds.observe(time.perf_counter() - started)
+
+        if authorization is None:
+            card_authorizations_total.labels(decision=CARD_NOT_FOUND).inc()
+            return Response({"approved": False, "status": "DECLINED", "decline_reason": CARD_NOT_FOUND}, status=status.HTTP_200_OK)
+
+        card_authorizations_total.labels(decision=authorization.decline_reason or 'APPROVED').inc()
+        return Response(CardAuthorizationSerializer(authorization).data, status=status.HTTP_200_OK)
+
+
+class CardCaptureView(APIView):
+    """
+    confirm the final amount of an authorization, posted to the ledger by the next settlement run
+    """
+    permission_classes = [IsAuthenticated, CanProcessCardPayments]
+
+    def post(self, request, authorization_code):
+        try:
+            authorization = capture(authorization_code, request.data.get('amount'))
+        except CardAuthorizationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(CardAuthorizationSerializer(authorization).data, status=status.HTTP_200_OK)
+
+
+class CardVoidView(APIView):
+    """
+    cancel an authorization that will not be captured and release its hold
+    """
+    permission_classes = [IsAuthenticated, CanProcessCardPayments]
+
+    def post(self, request, authorization_code):
+        try:
+            authorization = void(authorization_code)
+        except CardAuthorizationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(CardAuthorizationSerializer(authorization).data, status=status.HTTP_200_OK)
+
+
+class CardCaptureFileView(APIView):
+    """
+    processor capture file (CSV with authorization_code,amount), captured in bulk and settled by a worker
+    """
+    permission_classes = [IsAuthenticated, CanProcessCardPayments]
+
+    def post(self, request):
+        capture_file = request.FILES.get('file')
+        if not capture_file:
+            return Response({"error": "A capture file is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            captured, errors = apply_capture_file(capture_file)
+        except CaptureFileError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if captured:
+            transaction.on_commit(lambda: settle_card_captures_task.delay())
+
+        return Response({"captured": captured, "rejected": errors}, status=status.HTTP_202_ACCEPTED)
@@ -11,3 +11,26 @@ class FraudDetectionAdmin(admin.ModelAdmin):
     def has_add_permission(self, request): #prevents manual data adding
         return False
 
+
+
+@admin.register(FraudRule)
+class FraudRuleAdmin(admin.ModelAdmin):
+    list_display = ("name", "rule_type", "flag", "priority", "is_active", "updated_at")
+    list_filter = ("rule_type", "is_active")
+    search_fields = ("name", "flag")
+
+
+@admin.register(FraudCase)
+class FraudCaseAdmin(admin.ModelAdmin):
+    list_display = ("id", "account", "status", "assigned_to", "resolution", "created_at", "closed_at")
+    list_filter = ("status", "resolution")
+    search_fields = ("account__account_number",)
+
+
+@admin.register(AccountRiskRollup)
+class AccountRiskRollupAdmin(admin.ModelAdmin):
+    list_display = ("account_number", "day", "checks", "flagged", "blocked", "max_score")
+    search_fields = ("account_number",)
+
+    def has_add_permission(self, request): #rebuilt by rollup_fraud_checks_task
+        return False
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from datetime import date, timedelta
+import json
+import os
+from fraud_service.services import backtest
+from fraud_service.services.rules import RuleConfigError, compile_rules
+
+
+def load_rules(path):
+    try:
+        with open(path) as rules_file:
+            definitions = json.load(rules_file)
+    except (OSError, ValueError) as e:
+        raise CommandError(f"Cannot read rules from {path}: {str(e)}")
+    try:
+        compile_rules(definitions)
+    except KeyError as e:
+        raise CommandError(f"Invalid rules in {path}: every rule needs {str(e)}")
+    except (RuleConfigError, TypeError) as e:
+        raise CommandError(f"Invalid rules in {path}: {str(e)}")
+    return definitions
+
+
+class Command(BaseCommand):
+    help = 'Re-score historical transactions with candidate fraud rules and report decisions that would change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('rules', help='JSON list of candidate rules ({"name", "rule_type", "flag", "params"})')
+        parser.add_argument('--baseline', help='JSON rules to compare against, defaults to the active rules')
+        parser.add_argument('--start', type=date.fromisoformat, help='First day (YYYY-MM-DD), defaults to 30 days ago')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day (YYYY-MM-DD), defaults to yesterday')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Scoring processes, 1 scores in this process')
+        parser.add_argument('--batch-size', type=int, default=backtest.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--report', help='Where to write changed decisions, defaults to <rules>.backtest.csv')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.localdate() - timedelta(days=1)
+        start = options['start'] or end - timedelta(days=29)
+        if start > end:
+            raise CommandError("--start must not be after --end")
+
+        candidate = load_rules(options['rules'])
+        baseline = load_rules(options['baseline']) if options['baseline'] else None
+        report_path = options['report'] or f"{options['rules']}.backtest.csv"
+
+        with open(report_path, 'w', newline='') as report:
+            summary = backtest.run_backtest(
+                candidate, start, end, report,
+                baseline=baseline,
+                workers=options['workers'],
+                batch_size=options['batch_size']
+            )
+
+        style = self.style.SUCCESS if not summary['changed'] else self.style.WARNING
+        self.stdout.write(style(
+            f"Re-scored {summary['transactions']} transactions from {start} to {end}: "
+            f"{summary['changed']} decisions would change"
+        ))
+        for transition, count in sorted(summary['transitions'].items()):
+            self.stdout.write(f"  {transition}: {count}")
+        self.stdout.write(f"Report written to {report_path}")
@@ -1,11 +1,13 @@
 from django.db import models
-from auth_service.models import BaseModel
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from auth_service.models import BaseModel, User
 from transactions.models import  Transaction
 
 
 
 class FraudDetection(BaseModel):
-    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name = 'fraud_check', null=True, blank=True)
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name = 'fraud_check', null=True, blank=True, db_constraint=False)
     account_number = models.CharField(max_length = 50)
     amount = models.DecimalField(max_digits = 50, decimal_places = 2)
     transaction_type = models.CharField(max_length = 50)
@@ -15,15 +17,130 @@ class FraudDetection(BaseModel):
     flags = models.JSONField(default=list)
     checked_at = models.DateTimeField(auto_now_add=True)
     processing_time_ms = models.IntegerField(null=True, blank=True)
+    # set once an analyst takes the alert into a case, see services/cases.py
+    case = models.ForeignKey('FraudCase', on_delete=models.SET_NULL, null=True, blank=True, related_name='alerts')
 
 
-    class meta:
+    class Meta:
         db_table = 'fraud_detection_logs'
         ordering = ['-checked_at']
+        indexes = [
+            models.Index(fields=['decision', '-checked_at']),
+            models.Index(fields=['account_number', '-checked_at']),
+            models.Index(fields=['checked_at']),
+            # the alert queue: FLAG/BLOCK checks nobody has taken yet, newest first
+            models.Index(
+                fields=['-checked_at', '-id'],
+                condition=models.Q(decision__in=['FLAG', 'BLOCK'], case__isnull=True),
+                name='fraud_alert_queue_idx'
+            ),
+        ]
 
 
     def __str__(self):
         return f"{self.transaction} - {self.decision}  - {self.account_number}"
 
 
+class FraudRule(BaseModel):
+    """
+    One scoring rule of the in-process fraud engine (fraud_service/services/rules.py).
+    params depend on rule_type:
+      AMOUNT, ROUND_AMOUNT            {"tiers": [[threshold, score], ...]}
+      TIME_OF_DAY                     {"windows": [[from_hour, to_hour, score], ...]}, first match wins
+      TRANSACTION_TYPE                {"scores": {"WITHDRAWAL": 10, ...}}
+      VELOCITY_COUNT, VELOCITY_AMOUNT,
+      UNIQUE_RECIPIENTS               {"window": seconds, "tiers": [[threshold, score, flag], ...]}
+    Only the highest tier that matches scores.
+    """
+    RULE_TYPE_CHOICES = (
+        ('AMOUNT', 'Amount'),
+        ('ROUND_AMOUNT', 'Round amount'),
+        ('TIME_OF_DAY', 'Time of day'),
+        ('TRANSACTION_TYPE', 'Transaction type'),
+        ('VELOCITY_COUNT', 'Transaction count in window'),
+        ('VELOCITY_AMOUNT', 'Amount sum in window'),
+        ('UNIQUE_RECIPIENTS', 'Unique recipients in window'),
+    )
 
+    name = models.CharField(max_length=100, unique=True)
+    rule_type = models.CharField(max_length=30, choices=RULE_TYPE_CHOICES)
+    flag = models.CharField(max_length=50, blank=True)
+    params = models.JSONField(default=dict)
+    priority = models.IntegerField(default=100)
+
+    class Meta:
+        db_table = 'fraud_rule'
+        ordering = ['priority', 'name']
+
+    def __str__(self):
+        return f"{self.name} ({self.rule_type})"
+
+
+class FraudCase(BaseModel):
+    """
+    An analyst's investigation of one account, grouping the alerts taken into it.
+    Holds placed from the case carry its id as reference_id.
+    """
+    STATUS_CHOICES = (
+        ('OPEN', 'Open'),
+        ('CLOSED', 'Closed'),
+    )
+    RESOLUTION_CHOICES = (
+        ('CONFIRMED_FRAUD', 'Confirmed fraud'),
+        ('FALSE_POSITIVE', 'False positive'),
+    )
+
+    account = models.ForeignKey('accounts.Account', on_delete=models.CASCADE, related_name='fraud_cases')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='OPEN')
+    assigned_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='fraud_cases')
+    assigned_at = models.DateTimeField(null=True, blank=True)
+    opened_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='opened_fraud_cases')
+    resolution = models.CharField(max_length=20, choices=RESOLUTION_CHOICES, blank=True)
+    notes = models.TextField(blank=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'fraud_case'
+        indexes = [
+            models.Index(fields=['status', 'assigned_to', '-created_at']),
+            models.Index(fields=['account', 'status']),
+        ]
+
+    def __str__(self):
+        return f"Fraud case {self.id} - {self.account_id} - {self.status}"
+
+
+class AccountRiskRollup(BaseModel):
+    """
+    Fraud checks per account per day, rebuilt from FraudDetection by
+    rollup_fraud_checks_task so risk summaries never scan the check log
+    """
+    account_number = models.CharField(max_length=50)
+    day = models.DateField()
+    checks = models.IntegerField(default=0)
+    challenged = models.IntegerField(default=0)
+    flagged = models.IntegerField(default=0)
+    blocked = models.IntegerField(default=0)
+    score_total = models.BigIntegerField(default=0)
+    max_score = models.IntegerField(default=0)
+    amount_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    last_checked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'fraud_account_risk_rollup'
+        constraints = [
+            models.UniqueConstraint(fields=['account_number', 'day'], name='fraud_rollup_account_day_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'account_number']),
+        ]
+
+    def __str__(self):
+        return f"{self.account_number} {self.day}: {self.flagged} flagged, {self.blocked} blocked"
+
+
+@receiver([post_save, post_delete], sender=FraudRule)
+def reload_fraud_rules(sender, **kwargs):
+    # this process recompiles on its next check, the others within FRAUD_RULES_REFRESH_INTERVAL
+    from .services.engine import fraud_engine
+    fraud_engine.invalidate()
@@ -0,0 +1,22 @@
+from rest_framework.permissions import BasePermission
+
+
+class CanReviewFraudAlerts(BasePermission):
+    """
+    risk staff with review_fraud_alerts can work the alert queue, open cases
+    and hold, freeze or close them
+    """
+    required_permissions = ['review_fraud_alerts']
+
+    def has_permission(self, request, view):
+        user = request.user
+
+        # Allow superuser
+        if user.is_superuser:
+            return True
+
+        # Ensure the user has a role
+        if not user.role:
+            return False
+
+        return user.role.has_any_permission(*self.required_permissions)
@@ -0,0 +1,24 @@
+from rest_framework import serializers
+from .models import FraudCase, FraudDetection
+
+
+class FraudAlertSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = FraudDetection
+        fields = [
+            'id', 'account_number', 'amount', 'transaction_type', 'risk_score', 'decision',
+            'reason', 'flags', 'checked_at', 'transaction', 'case'
+        ]
+
+
+class FraudCaseSerializer(serializers.ModelSerializer):
+    account_number = serializers.CharField(source='account.account_number', read_only=True)
+    assigned_to_email = serializers.EmailField(source='assigned_to.email', read_only=True, default=None)
+
+    class Meta:
+        model = FraudCase
+        fields = [
+            'id', 'account', 'account_number', 'status', 'assigned_to', 'assigned_to_email',
+            'assigned_at', 'resolution', 'notes', 'created_at', 'closed_at'
+        ]
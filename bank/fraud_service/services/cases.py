@@ -0,0 +1,231 @@
+"""
+Fraud alert queue and case handling.
+
+The queue holds FLAG/BLOCK checks no analyst has taken yet. It is read with
+keyset pagination over (checked_at, id), newest first, on a partial index that
+only covers those rows, so it stays as fast with millions of APPROVE checks in
+the log as with none. Taking alerts groups them into one open case per account.
+Bulk actions lock the cases, then apply the same change to all of them: FRAUD
+holds, account freezes or closing, with one statement per table where the
+amounts allow it.
+"""
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from accounts.models import Account, AccountHold
+from accounts.services.balances import forget_customer_accounts, refresh_after_commit
+from transactions.services.posting import lock_accounts
+from ..models import FraudCase, FraudDetection
+import base64
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+ALERT_DECISIONS = ('FLAG', 'BLOCK')
+CASE_ACTIONS = ('HOLD', 'FREEZE', 'CLOSE')
+
+
+class FraudCaseError(Exception):
+    """Raised when a queue or case request cannot be applied"""
+
+
+def encode_cursor(alert):
+    cursor_data = {'checked_at': alert.checked_at.isoformat(), 'id': str(alert.id)}
+    return base64.urlsafe_b64encode(json.dumps(cursor_data).encode()).decode()
+
+
+def decode_cursor(cursor_string):
+    try:
+        cursor_data = json.loads(base64.urlsafe_b64decode(cursor_string.encode()).decode())
+        return datetime.fromisoformat(cursor_data['checked_at']), cursor_data['id']
+    except (ValueError, KeyError, TypeError):
+        raise FraudCaseError("Invalid cursor")
+
+
+def alert_queue(decision=None, cursor=None, page_size=50, account_number=None, include_taken=False):
+    """One page of alerts, newest first. Returns (alerts, next cursor)."""
+    if decision and decision not in ALERT_DECISIONS:
+        raise FraudCaseError(f"Decision must be one of: {', '.join(ALERT_DECISIONS)}")
+
+    queryset = FraudDetection.objects.filter(decision__in=ALERT_DECISIONS).order_by('-checked_at', '-id')
+    if not include_taken:
+        queryset = queryset.filter(case__isnull=True)
+    if decision:
+        queryset = queryset.filter(decision=decision)
+    if account_number:
+        queryset = queryset.filter(account_number=account_number)
+    if cursor:
+        checked_at, alert_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(checked_at__lt=checked_at) | Q(checked_at=checked_at, id__lt=alert_id))
+
+    alerts = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(alerts[page_size - 1]) if len(alerts) > page_size else None
+    return alerts[:page_size], next_cursor
+
+
+def open_cases(analyst, alert_ids, assigned_to=None):
+    """
+    Take alerts out of the queue into one open case per account, reusing the
+    account's open case if there is one. Returns (cases, skipped [{'alert_id', 'error'}]).
+    """
+    assigned_to = assigned_to or analyst
+    alert_ids = [str(alert_id) for alert_id in alert_ids]
+    now = timezone.now()
+
+    with transaction.atomic():
+        alerts = list(
+            FraudDetection.objects.select_for_update().filter(
+                id__in=alert_ids, decision__in=ALERT_DECISIONS, case__isnull=True
+            ).only('id', 'account_number')
+        )
+        found = {str(alert.id) for alert in alerts}
+        skipped = [
+            {'alert_id': alert_id, 'error': 'Not an alert or already taken'}
+            for alert_id in alert_ids if alert_id not in found
+        ]
+
+        by_number = {}
+        # cases come back in the order their first alert was given
+        position = {alert_id: index for index, alert_id in enumerate(alert_ids)}
+        alerts.sort(key=lambda alert: position[str(alert.id)])
+        for alert in alerts:
+            by_number.setdefault(alert.account_number, []).append(alert.id)
+        accounts = {account.account_number: account for account in Account.objects.filter(account_number__in=list(by_number))}
+        for number in [number for number in by_number if number not in accounts]:
+            skipped.extend({'alert_id': str(alert_id), 'error': 'Account not found'} for alert_id in by_number.pop(number))
+
+        cases = {
+            case.account_id: case
+            for case in FraudCase.objects.select_for_update().filter(
+                account__in=list(accounts.values()), status='OPEN'
+            )
+        }
+        new_cases = [
+            FraudCase(account=account, opened_by=analyst, assigned_to=assigned_to, assigned_at=now)
+            for number, account in accounts.items() if number in by_number and account.id not in cases
+        ]
+        FraudCase.objects.bulk_create(new_cases)
+        cases.update({case.account_id: case for case in new_cases})
+
+        for number, ids in by_number.items():
+            FraudDetection.objects.filter(id__in=ids).update(case=cases[accounts[number].id], updated_at=now)
+
+    logger.info(f"{len(found)} fraud alerts taken into {len(by_number)} cases by {analyst.id}")
+    return [cases[accounts[number].id] for number in by_number], skipped
+
+
+def assign_cases(case_ids, assignee):
+    """Hand open cases to `assignee`, returns how many were assigned"""
+    return FraudCase.objects.filter(id__in=case_ids, status='OPEN').update(
+        assigned_to=assignee, assigned_at=timezone.now(), updated_at=timezone.now()
+    )
+
+
+def place_holds(cases, analyst, reason, amount, now):
+    """
+    FRAUD hold of `amount` (or everything available when None) on each case's
+    account, capped at what is available. Accounts are locked by the caller.
+    """
+    holds = []
+    for case in cases:
+        available = case.account.available_balance
+        held = available if amount is None else min(amount, available)
+        if held <= 0:
+            continue
+        Account.objects.filter(id=case.account_id).update(available_balance=F('available_balance') - held, updated_at=now)
+        holds.append(AccountHold(
+            account_id=case.account_id,
+            hold_type='FRAUD',
+            amount=held,
+            reason=reason,
+            reference_id=str(case.id),
+            placed_by=analyst
+        ))
+    AccountHold.objects.bulk_create(holds)
+    refresh_after_commit([hold.account_id for hold in holds])
+    return holds
+
+
+def release_holds(cases, analyst, now):
+    """Give back the FRAUD holds the cases placed"""
+    holds = list(AccountHold.objects.filter(
+        hold_type='FRAUD', is_released=False, reference_id__in=[str(case.id) for case in cases]
+    ))
+    by_account = {}
+    for hold in holds:
+        by_account[hold.account_id] = by_account.get(hold.account_id, Decimal('0.00')) + hold.amount
+    for account_id, amount in by_account.items():
+        Account.objects.filter(id=account_id).update(available_balance=F('available_balance') + amount, updated_at=now)
+    AccountHold.objects.filter(id__in=[hold.id for hold in holds]).update(
+        is_released=True, released_by=analyst, released_at=now, updated_at=now
+    )
+    refresh_after_commit(by_account)
+    return holds
+
+
+def bulk_action(analyst, case_ids, action, reason='', amount=None, resolution=None, notes=''):
+    """
+    Apply one action to many open cases:
+      HOLD    FRAUD hold of `amount` on each account (everything available without an amount)
+      FREEZE  freeze the accounts, no debits or credits
+      CLOSE   close with a resolution, a FALSE_POSITIVE also releases the case's holds
+    Returns (applied case ids, skipped [{'case_id', 'error'}]).
+    """
+    if action not in CASE_ACTIONS:
+        raise FraudCaseError(f"Action must be one of: {', '.join(CASE_ACTIONS)}")
+    if action in ('HOLD', 'FREEZE') and not reason:
+        raise FraudCaseError("A reason is required")
+    if action == 'CLOSE' and resolution not in dict(FraudCase.RESOLUTION_CHOICES):
+        raise FraudCaseError(f"Resolution must be one of: {', '.join(dict(FraudCase.RESOLUTION_CHOICES))}")
+    if amount is not None:
+        try:
+            amount = Decimal(str(amount))
+        except InvalidOperation:
+            raise FraudCaseError("Invalid amount")
+        if amount <= 0:
+            raise FraudCaseError("Amount must be positive")
+
+    case_ids = [str(case_id) for case_id in case_ids]
+    now = timezone.now()
+    with transaction.atomic():
+        cases = list(FraudCase.objects.select_for_update().filter(id__in=case_ids, status='OPEN'))
+        found = {str(case.id) for case in cases}
+        skipped = [{'case_id': case_id, 'error': 'Not an open case'} for case_id in case_ids if case_id not in found]
+
+        account_ids = {case.account_id for case in cases}
+        # in primary key order, like every posting, so this cannot deadlock against one
+        accounts = lock_accounts(*account_ids)
+        for case in cases:
+            case.account = accounts[case.account_id]
+
+        if action == 'HOLD':
+            place_holds(cases, analyst, reason, amount, now)
+        elif action == 'FREEZE':
+            Account.objects.filter(id__in=account_ids).update(
+                status='FROZEN',
+                allow_debit=False,
+                allow_credit=False,
+                closed_by=analyst,
+                closed_at=now,
+                closure_reason=reason,
+                updated_at=now
+            )
+            refresh_after_commit(account_ids)
+            forget_customer_accounts([account.customer_id for account in accounts.values()])
+        else:
+            if resolution == 'FALSE_POSITIVE':
+                release_holds(cases, analyst, now)
+            for case in cases:
+                case.status = 'CLOSED'
+                case.resolution = resolution
+                case.closed_at = now
+                case.notes = notes or case.notes
+                case.updated_at = now
+            FraudCase.objects.bulk_update(cases, ['status', 'resolution', 'closed_at', 'notes', 'updated_at'], batch_size=500)
+
+    logger.info(f"Fraud action {action} applied to {len(cases)} cases by {analyst.id}, {len(skipped)} skipped")
+    return [str(case.id) for case in cases], skipped
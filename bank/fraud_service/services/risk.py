@@ -0,0 +1,116 @@
+"""
+Per-account risk rollup.
+
+rollup_checks() aggregates the fraud check log into one AccountRiskRollup row
+per account and day, upserted in batches. Each run recomputes from the newest
+day already rolled up (which may have been partial), so it is idempotent and
+only touches recent checks. Summaries sum a handful of rollup rows instead of
+scanning the check log; they lag it by at most the rollup interval, so they
+are cached until the next run.
+"""
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from bank.cache import cached_query, invalidate
+from ..models import AccountRiskRollup, FraudDetection
+import logging
+
+logger = logging.getLogger(__name__)
+
+RISK_SUMMARY_CACHE = 'account-risk'
+
+ROLLUP_FIELDS = ['checks', 'challenged', 'flagged', 'blocked', 'score_total', 'max_score', 'amount_total', 'last_checked_at']
+
+
+def rollup_checks(since=None, batch_size=1000):
+    """Rebuild rollup rows for every day from `since` (default: the newest rolled up day). Returns rows written."""
+    if since is None:
+        since = AccountRiskRollup.objects.aggregate(latest=Max('day'))['latest']
+    checks = FraudDetection.objects.using(settings.DATABASE_EXPORT_ALIAS)
+    if since:
+        checks = checks.filter(checked_at__gte=timezone.make_aware(datetime.combine(since, time.min)))
+
+    rows = checks.annotate(day=TruncDate('checked_at')).values('account_number', 'day').annotate(
+        checks=Count('id'),
+        challenged=Count('id', filter=Q(decision='CHALLENGE')),
+        flagged=Count('id', filter=Q(decision='FLAG')),
+        blocked=Count('id', filter=Q(decision='BLOCK')),
+        score_total=Sum('risk_score'),
+        max_score=Max('risk_score'),
+        amount_total=Sum('amount'),
+        last_checked_at=Max('checked_at'),
+    ).order_by()
+
+    written = 0
+    batch = []
+    now = timezone.now()
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(AccountRiskRollup(updated_at=now, **row))
+        if len(batch) >= batch_size:
+            written += upsert(batch)
+            batch = []
+    if batch:
+        written += upsert(batch)
+    invalidate(RISK_SUMMARY_CACHE)
+
+    logger.info(f"Fraud risk rollup wrote {written} account days since {since}")
+    return written
+
+
+def upsert(rollups):
+    AccountRiskRollup.objects.bulk_create(
+        rollups,
+        update_conflicts=True,
+        unique_fields=['account_number', 'day'],
+        update_fields=ROLLUP_FIELDS + ['updated_at']
+    )
+    return len(rollups)
+
+
+def summary_fields():
+    return {
+        'checks': Sum('checks'),
+        'challenged': Sum('challenged'),
+        'flagged': Sum('flagged'),
+        'blocked': Sum('blocked'),
+        'score_total': Sum('score_total'),
+        'max_score': Max('max_score'),
+        'amount_total': Sum('amount_total'),
+        'last_checked_at': Max('last_checked_at'),
+    }
+
+
+def with_average(summary):
+    summary['average_score'] = round(summary['score_total'] / summary['checks'], 2) if summary.get('checks') else 0
+    return summary
+
+
+def account_risk_summary(account_number, days=30):
+    """Totals of the account's fraud checks over the last `days` days"""
+    first_day = timezone.localdate() - timedelta(days=days - 1)
+
+    def load():
+        summary = AccountRiskRollup.objects.filter(account_number=account_number, day__gte=first_day).aggregate(**summary_fields())
+        summary = {key: value or 0 for key, value in summary.items()}
+        summary['last_checked_at'] = summary['last_checked_at'] or None
+        summary.update({'account_number': account_number, 'days': days})
+        return with_average(summary)
+
+    return cached_query(RISK_SUMMARY_CACHE, f"{account_number}:{first_day}:{days}", load)
+
+
+def riskiest_accounts(days=7, limit=50):
+    """Accounts with the most blocks, then flags, then total score over the last `days` days"""
+    first_day = timezone.localdate() - timedelta(days=days - 1)
+    # annotations may not reuse the rollup's field names
+    rows = AccountRiskRollup.objects.filter(day__gte=first_day).values('account_number').annotate(
+        **{f"sum_{key}": value for key, value in summary_fields().items()}
+    ).filter(Q(sum_flagged__gt=0) | Q(sum_blocked__gt=0)).order_by(
+        '-sum_blocked', '-sum_flagged', '-sum_score_total', 'account_number'
+    )[:limit]
+    return [
+        with_average({key.removeprefix('sum_'): value for key, value in row.items()})
+        for row in rows
+    ]
@@ -0,0 +1,241 @@
+"""
+Per-account velocity for the fraud rules: transaction count, amount
+sum and distinct counterparties over the last N seconds.
+
+Activity is kept in per-minute buckets on a fixed ring (one slot per minute of
+max_window), so recording is O(1), memory per account is bounded and any
+window up to max_window is answered by walking at most max_window / 60 slots.
+Windows are rounded up to whole minutes, the current minute included.
+
+InMemoryVelocityStore keeps the rings in the process, so with several web
+processes each sees only its own share of an account's activity; it is meant
+for development and tests. RedisVelocityStore keeps
+the same ring in a hash per account (plus a set per slot for counterparties)
+and reads and updates it with one Lua call, so a check costs one round trip
+and several accounts can be answered in one pipeline.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+COUNT = 'count'
+AMOUNT = 'amount'
+RECIPIENTS = 'recipients'
+
+BUCKET_SECONDS = 60
+
+
+def window_buckets(window):
+    return max(1, -(-int(window) // BUCKET_SECONDS))
+
+
+class VelocityRing:
+    """Minute buckets of one account, slot = minute % size"""
+    __slots__ = ('minutes', 'counts', 'amounts', 'counterparties', 'latest')
+
+    def __init__(self, size):
+        self.minutes = [-1] * size
+        self.counts = [0] * size
+        self.amounts = [0.0] * size
+        self.counterparties = [None] * size
+        self.latest = -1
+
+    def add(self, minute, amount, counterparty):
+        slot = minute % len(self.minutes)
+        if self.minutes[slot] != minute:
+            if minute < self.minutes[slot]:
+                # older than the ring reaches back
+                return
+            self.minutes[slot] = minute
+            self.counts[slot] = 0
+            self.amounts[slot] = 0.0
+            self.counterparties[slot] = None
+        self.counts[slot] += 1
+        self.amounts[slot] += amount
+        if counterparty:
+            if self.counterparties[slot] is None:
+                self.counterparties[slot] = set()
+            self.counterparties[slot].add(counterparty)
+        if minute > self.latest:
+            self.latest = minute
+
+    def summarize(self, queries, minute):
+        result = {}
+        for metric, window in queries:
+            oldest = minute - window_buckets(window) + 1
+            slots = [
+                slot for slot, bucket_minute in enumerate(self.minutes)
+                if oldest <= bucket_minute <= minute
+            ]
+            if metric == COUNT:
+                result[(metric, window)] = sum(self.counts[slot] for slot in slots)
+            elif metric == AMOUNT:
+                result[(metric, window)] = sum(self.amounts[slot] for slot in slots)
+            else:
+                seen = set()
+                for slot in slots:
+                    if self.counterparties[slot]:
+                        seen |= self.counterparties[slot]
+                result[(metric, window)] = len(seen)
+        return result
+
+
+def empty_summary(queries):
+    return {(metric, window): 0 for metric, window in queries}
+
+
+class InMemoryVelocityStore:
+
+    def __init__(self, max_window=3600, max_accounts=100000):
+        self.size = window_buckets(max_window)
+        self.max_accounts = max_accounts
+        self.rings = OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, account, amount, counterparty=None, timestamp=None):
+        minute = int((timestamp or time.time()) // BUCKET_SECONDS)
+        with self.lock:
+            ring = self.rings.get(account)
+            if ring is None:
+                ring = self.rings[account] = VelocityRing(self.size)
+                if self.max_accounts and len(self.rings) > self.max_accounts:
+                    # least recently active accounts go first
+                    self.rings.popitem(last=False)
+            else:
+                self.rings.move_to_end(account)
+            ring.add(minute, float(amount), counterparty)
+
+    def query(self, account, queries, now=None):
+        minute = int((now or time.time()) // BUCKET_SECONDS)
+        with self.lock:
+            ring = self.rings.get(account)
+            if ring is None or ring.latest < minute - self.size + 1:
+                return empty_summary(queries)
+            return ring.summarize(queries, minute)
+
+    def query_and_record(self, account, queries, amount, counterparty=None, timestamp=None):
+        """Velocity before this transaction, then count it"""
+        timestamp = timestamp or time.time()
+        velocity = self.query(account, queries, timestamp)
+        self.record(account, amount, counterparty, timestamp)
+        return velocity
+
+    def query_many(self, accounts, queries, now=None):
+        return {account: self.query(account, queries, now) for account in accounts}
+
+    def clear(self):
+        with self.lock:
+            self.rings.clear()
+
+
+# KEYS[1] ring hash of the account, slot fields m:<slot> (minute), c:<slot> (count), a:<slot> (amount);
+# counterparty sets live at KEYS[1]..':r:'..slot
+# ARGV: minute, ring size, ttl, record (0/1), amount, counterparty, then metric, window minutes pairs
+VELOCITY_SCRIPT = """
+local key = KEYS[1]
+local minute = tonumber(ARGV[1])
+local size = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+
+local ring = redis.call('HGETALL', key)
+local minutes, counts, amounts = {}, {}, {}
+for i = 1, #ring, 2 do
+    local kind, slot = string.sub(ring[i], 1, 1), tonumber(string.sub(ring[i], 3))
+    if kind == 'm' then minutes[slot] = tonumber(ring[i + 1])
+    elseif kind == 'c' then counts[slot] = tonumber(ring[i + 1])
+    else amounts[slot] = tonumber(ring[i + 1]) end
+end
+
+local result = {}
+for i = 7, #ARGV, 2 do
+    local metric, oldest = ARGV[i], minute - tonumber(ARGV[i + 1]) + 1
+    local total, sets = 0, {}
+    for slot, bucket_minute in pairs(minutes) do
+        if bucket_minute >= oldest and bucket_minute <= minute then
+            if metric == 'count' then total = total + (counts[slot] or 0)
+            elseif metric == 'amount' then total = total + (amounts[slot] or 0)
+            else table.insert(sets, key .. ':r:' .. slot) end
+        end
+    end
+    if metric == 'recipients' then
+        total = #sets > 0 and #redis.call('SUNION', unpack(sets)) or 0
+    end
+    table.insert(result, tostring(total))
+end
+
+if ARGV[4] == '1' then
+    local slot = minute % size
+    local current = minutes[slot]
+    if current == nil or current < minute then
+        redis.call('HSET', key, 'm:' .. slot, minute, 'c:' .. slot, 0, 'a:' .. slot, 0)
+        redis.call('DEL', key .. ':r:' .. slot)
+        current = minute
+    end
+    if current == minute then
+        redis.call('HINCRBY', key, 'c:' .. slot, 1)
+        redis.call('HINCRBYFLOAT', key, 'a:' .. slot, ARGV[5])
+        if ARGV[6] ~= '' then
+            redis.call('SADD', key .. ':r:' .. slot, ARGV[6])
+            redis.call('EXPIRE', key .. ':r:' .. slot, ttl)
+        end
+    end
+    redis.call('EXPIRE', key, ttl)
+end
+return result
+"""
+
+
+class RedisVelocityStore:
+
+    def __init__(self, redis_url, max_window=3600, prefix='fraud:velocity'):
+        import redis
+
+        self.client = redis.Redis.from_url(redis_url)
+        self.size = window_buckets(max_window)
+        self.ttl = self.size * BUCKET_SECONDS
+        self.prefix = prefix
+        self.script = self.client.register_script(VELOCITY_SCRIPT)
+
+    def key(self, account):
+        # braces keep an account's hash and sets in one cluster slot
+        return f"{self.prefix}:{{{account}}}"
+
+    def arguments(self, queries, timestamp, record, amount=0, counterparty=None):
+        args = [int(timestamp // BUCKET_SECONDS), self.size, self.ttl, 1 if record else 0, float(amount), counterparty or '']
+        for metric, window in queries:
+            args += [metric, window_buckets(window)]
+        return args
+
+    def parse(self, queries, values):
+        return {
+            (metric, window): float(value) if metric == AMOUNT else int(value)
+            for (metric, window), value in zip(queries, values)
+        }
+
+    def record(self, account, amount, counterparty=None, timestamp=None):
+        self.script(keys=[self.key(account)], args=self.arguments((), timestamp or time.time(), True, amount, counterparty))
+
+    def query(self, account, queries, now=None):
+        queries = list(queries)
+        values = self.script(keys=[self.key(account)], args=self.arguments(queries, now or time.time(), False))
+        return self.parse(queries, values)
+
+    def query_and_record(self, account, queries, amount, counterparty=None, timestamp=None):
+        """Velocity before this transaction, then count it, in one round trip"""
+        queries = list(queries)
+        args = self.arguments(queries, timestamp or time.time(), True, amount, counterparty)
+        return self.parse(queries, self.script(keys=[self.key(account)], args=args))
+
+    def query_many(self, accounts, queries, now=None):
+        """Velocity of several accounts in one pipelined round trip"""
+        queries = list(queries)
+        accounts = list(accounts)
+        args = self.arguments(queries, now or time.time(), False)
+        pipe = self.client.pipeline(transaction=False)
+        for account in accounts:
+            self.script(keys=[self.key(account)], args=args, client=pipe)
+        return {account: self.parse(queries, values) for account, values in zip(accounts, pipe.execute())}
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}:*"):
+            self.client.delete(key)
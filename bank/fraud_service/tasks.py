@@ -0,0 +1,11 @@
+from celery import shared_task
+from .services import risk
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def rollup_fraud_checks_task():
+    """Refresh the per-account risk rollup from recent fraud checks, scheduled through celery beat"""
+    return risk.rollup_checks()
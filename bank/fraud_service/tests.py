@@ -1,3 +1,476 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from asgiref.sync import async_to_sync
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import csv
+import io
+import os
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from accounts.models import Account, AccountType, AccountLimit, AccountHold
+from auth_service.models import Role, User
+from auth_service.services.tokens import issue_tokens, revocation_list
+from transactions.models import Transaction, TransactionType
+from transactions.tests import create_customer_account
+from transactions.views import HandleInternalTransactionAsync
+from .models import AccountRiskRollup, FraudCase, FraudDetection, FraudRule
+from .services import backtest, cases, risk
+from .services.engine import fraud_engine
+from .services.rules import DEFAULT_RULES
+from .services.velocity import AMOUNT, COUNT, RECIPIENTS, InMemoryVelocityStore, RedisVelocityStore
+
+
+def at_hour(hour):
+    return timezone.make_aware(datetime(2026, 1, 15, hour, 30))
+
+
+class FraudEngineTest(TestCase):
+    """Test suite for the in-process fraud rules engine"""
+
+    def setUp(self):
+        fraud_engine.invalidate()
+        fraud_engine.velocity.clear()
+
+    def test_default_rules_score_like_go_service(self):
+        """Test the default rules give the Go service's scores and decisions"""
+        result = fraud_engine.check('ACC-1', 500, 'INTERNAL_TRANSFER', timestamp=at_hour(12), record=False)
+        self.assertEqual(result['risk_score'], 5)
+        self.assertEqual(result['decision'], 'APPROVE')
+        self.assertEqual(result['engine'], 'local')
+
+        # 600000 > 500000 (40) + round 100000 (20) + 03:30 (30) + withdrawal (10)
+        result = fraud_engine.check('ACC-1', 600000, 'WITHDRAWAL', timestamp=at_hour(3), record=False)
+        self.assertEqual(result['risk_score'], 100)
+        self.assertEqual(result['decision'], 'BLOCK')
+        self.assertEqual(result['breakdown']['amount_risk'], 40)
+        self.assertEqual(result['breakdown']['time_risk'], 30)
+        self.assertEqual(result['flags'], ['high_amount', 'round_amount', 'unusual_time'])
+
+    def test_velocity_flags_repeated_transactions(self):
+        """Test the count and recipient rules see the account's recent checks"""
+        now = timezone.now()
+        for number in range(11):
+            result = fraud_engine.check('ACC-1', 100, 'DEPOSIT', counterparty=f"DEST-{number}", timestamp=now)
+        # 10 earlier checks in 10 minutes and 10 recipients in the hour
+        self.assertEqual(result['breakdown']['velocity_risk'], 40 + 25)
+        self.assertIn('rapid_transactions', result['flags'])
+        self.assertIn('multiple_recipients', result['flags'])
+
+        other = fraud_engine.check('ACC-2', 100, 'DEPOSIT', timestamp=now)
+        self.assertEqual(other['breakdown'].get('velocity_risk', 0), 0)
+
+    def test_database_rules_replace_defaults(self):
+        """Test saved FraudRule rows are used on the next check"""
+        FraudRule.objects.create(name='tiny', rule_type='AMOUNT', flag='tiny_amount', params={'tiers': [[10, 90]]})
+
+        result = fraud_engine.check('ACC-1', 50, 'DEPOSIT', timestamp=at_hour(3), record=False)
+        self.assertEqual(result['risk_score'], 90)
+        self.assertEqual(result['flags'], ['tiny_amount'])
+
+        FraudRule.objects.filter(name='tiny').update(is_active=False)
+        fraud_engine.invalidate()
+        result = fraud_engine.check('ACC-1', 50, 'DEPOSIT', timestamp=at_hour(3), record=False)
+        self.assertEqual(result['risk_score'], 30)
+
+    def test_score_batch_matches_check(self):
+        """Test the vectorized scores equal one-by-one checks"""
+        rows = [
+            (500, 12, 'INTERNAL_TRANSFER', 0, 0.0, 0),
+            (600000, 3, 'WITHDRAWAL', 6, 20000.0, 2),
+            (50000, 23, 'MPESA_WITHDRAWAL', 12, 2100000.0, 11),
+            (250000, 6, 'DEPOSIT', 3, 0.0, 3),
+        ]
+        result = fraud_engine.score_batch({
+            'amount': [row[0] for row in rows],
+            'hour': [row[1] for row in rows],
+            'transaction_type': [row[2] for row in rows],
+            'count_600': [row[3] for row in rows],
+            'count_3600': [row[3] for row in rows],
+            'amount_3600': [row[4] for row in rows],
+            'recipients_3600': [row[5] for row in rows],
+        })
+
+        rules = fraud_engine.ruleset()
+        for index, (amount, hour, transaction_type, count, total, recipients) in enumerate(rows):
+            velocity = {('count', 600): count, ('count', 3600): count, ('amount', 3600): total, ('recipients', 3600): recipients}
+            txn = {'amount': float(amount), 'hour': hour, 'transaction_type': transaction_type}
+            expected = sum(rule.score(txn, velocity)[0] for rule in rules)
+            self.assertEqual(result['risk_score'][index], expected)
+        self.assertEqual(list(result['decision']), ['APPROVE', 'BLOCK', 'BLOCK', 'FLAG'])
+
+
+class VelocityStoreTest(TestCase):
+    """Test suite for the per-minute ring buffer velocity store"""
+
+    def test_windows_over_minute_buckets(self):
+        """Test count, sum and distinct counterparties only see buckets inside the window"""
+        store = InMemoryVelocityStore(max_window=3600)
+        start = 1_800_000_000
+        store.record('ACC-1', 100, 'DEST-1', start)
+        store.record('ACC-1', 50, 'DEST-1', start + 30 * 60)
+        store.record('ACC-1', 25, 'DEST-2', start + 55 * 60)
+        store.record('ACC-1', 10, None, start + 59 * 60)
+
+        now = start + 59 * 60 + 10
+        queries = [(COUNT, 600), (AMOUNT, 600), (COUNT, 3600), (AMOUNT, 3600), (RECIPIENTS, 3600), (RECIPIENTS, 600)]
+        velocity = store.query('ACC-1', queries, now)
+        self.assertEqual(velocity[(COUNT, 600)], 2)
+        self.assertEqual(velocity[(AMOUNT, 600)], 35)
+        self.assertEqual(velocity[(COUNT, 3600)], 4)
+        self.assertEqual(velocity[(AMOUNT, 3600)], 185)
+        self.assertEqual(velocity[(RECIPIENTS, 3600)], 2)
+        self.assertEqual(velocity[(RECIPIENTS, 600)], 1)
+
+        # an hour later the first bucket's slot is reused, the rest has aged out
+        store.record('ACC-1', 5, 'DEST-3', start + 60 * 60)
+        velocity = store.query('ACC-1', queries, start + 60 * 60)
+        self.assertEqual(velocity[(COUNT, 3600)], 4)
+        self.assertEqual(velocity[(AMOUNT, 3600)], 90)
+        self.assertEqual(store.query('ACC-1', queries, start + 3 * 3600)[(COUNT, 3600)], 0)
+
+    def test_query_and_record_and_account_cap(self):
+        """Test velocity is read before the transaction is counted and idle accounts are evicted"""
+        store = InMemoryVelocityStore(max_window=600, max_accounts=2)
+        now = 1_800_000_000
+        self.assertEqual(store.query_and_record('ACC-1', [(COUNT, 600)], 10, timestamp=now)[(COUNT, 600)], 0)
+        self.assertEqual(store.query_and_record('ACC-1', [(COUNT, 600)], 10, timestamp=now)[(COUNT, 600)], 1)
+
+        store.record('ACC-2', 10, timestamp=now)
+        store.record('ACC-3', 10, timestamp=now)
+        self.assertEqual(store.query('ACC-1', [(COUNT, 600)], now)[(COUNT, 600)], 0)
+        self.assertEqual(store.query_many(['ACC-2', 'ACC-3'], [(COUNT, 600)], now)['ACC-3'][(COUNT, 600)], 1)
+
+
+class RedisVelocityStoreTest(TestCase):
+    """Test suite for the Redis velocity store and its Lua script"""
+
+    def test_script_arguments_and_parsing(self):
+        """Test a query and record is one script call with the ring, window and transaction arguments"""
+        store = RedisVelocityStore('redis://localhost:6379/15', max_window=3600)
+        now = 1_800_000_000
+        queries = [(COUNT, 600), (AMOUNT, 600), (RECIPIENTS, 3600)]
+        with mock.patch.object(store, 'script', return_value=[b'2', b'35.5', b'1']) as script:
+            velocity = store.query_and_record('ACC-1', queries, 25, 'DEST-1', now)
+
+        script.assert_called_once_with(
+            keys=['fraud:velocity:{ACC-1}'],
+            args=[now // 60, 60, 3600, 1, 25.0, 'DEST-1', COUNT, 10, AMOUNT, 10, RECIPIENTS, 60]
+        )
+        self.assertEqual(velocity, {(COUNT, 600): 2, (AMOUNT, 600): 35.5, (RECIPIENTS, 3600): 1})
+
+    @unittest.skipUnless(os.environ.get('TEST_REDIS_URL'), "TEST_REDIS_URL is not set")
+    def test_script_matches_in_memory_store(self):
+        """Test the Lua ring answers every window like the in-process ring"""
+        store = RedisVelocityStore(os.environ['TEST_REDIS_URL'], max_window=3600, prefix='fraud:velocity:test')
+        reference = InMemoryVelocityStore(max_window=3600)
+        self.addCleanup(store.clear)
+        store.clear()
+
+        start = 1_800_000_000
+        activity = [
+            ('ACC-1', 100, 'DEST-1', start),
+            ('ACC-1', 50, 'DEST-1', start + 30 * 60),
+            ('ACC-1', 25, 'DEST-2', start + 55 * 60),
+            ('ACC-1', 10, None, start + 59 * 60),
+            ('ACC-2', 70, 'DEST-1', start + 59 * 60),
+        ]
+        for account, amount, counterparty, timestamp in activity:
+            store.record(account, amount, counterparty, timestamp)
+            reference.record(account, amount, counterparty, timestamp)
+
+        queries = [(COUNT, 600), (AMOUNT, 600), (COUNT, 3600), (AMOUNT, 3600), (RECIPIENTS, 3600), (RECIPIENTS, 600)]
+        for now in (start + 59 * 60 + 10, start + 3 * 3600):
+            self.assertEqual(
+                store.query_many(['ACC-1', 'ACC-2'], queries, now),
+                reference.query_many(['ACC-1', 'ACC-2'], queries, now)
+            )
+
+        # the first bucket's slot is reused an hour later
+        self.assertEqual(
+            store.query_and_record('ACC-1', queries, 5, 'DEST-3', start + 60 * 60),
+            reference.query_and_record('ACC-1', queries, 5, 'DEST-3', start + 60 * 60)
+        )
+        self.assertEqual(store.query('ACC-1', queries, start + 60 * 60), reference.query('ACC-1', queries, start + 60 * 60))
+
+
+class FraudCheckTransferTest(TestCase):
+    """Test suite for the fraud check on internal transfers"""
+
+    def setUp(self):
+        fraud_engine.invalidate()
+        fraud_engine.velocity.clear()
+        savings = AccountType.objects.create(name='SAVINGS', code='SAV', description='Savings')
+        self.source = create_customer_account('payer@test.com', savings, balance=Decimal('5000000.00'))
+        self.destination = create_customer_account('payee@test.com', savings)
+        AccountLimit.objects.create(
+            account=self.source,
+            daily_debit_limit=Decimal('5000000.00'),
+            daily_credit_limit=Decimal('5000000.00'),
+            single_transaction_debit_limit=Decimal('5000000.00'),
+            single_transaction_credit_limit=Decimal('5000000.00')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.source.customer.user)
+
+    def transfer(self, amount, key):
+        return self.client.post(
+            reverse('internal_transfer'),
+            {
+                'account_number': self.source.account_number,
+                'destination_account_number': self.destination.account_number,
+                'amount': amount,
+                'transaction_type': 'internal_transfer'
+            },
+            format='json',
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    @override_settings(FRAUD_ENGINE_MODE='remote', FRAUD_SERVICE_URL='http://127.0.0.1:9/api/v1.0/fraud/check')
+    def test_unreachable_service_falls_back_to_local_rules(self):
+        """Test a transfer is still scored, and blocked, when the Go service does not answer"""
+        FraudRule.objects.create(name='block_all', rule_type='AMOUNT', flag='blocked', params={'tiers': [[0, 100]]})
+
+        response = self.transfer(100, 'fraud-remote-1')
+
+        self.assertEqual(response.status_code, 403)
+        log = FraudDetection.objects.get(account_number=self.source.account_number)
+        self.assertEqual(log.decision, 'BLOCK')
+        self.assertEqual(log.transaction_type, 'INTERNAL_TRANSFER')
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('5000000.00'))
+
+
+    @override_settings(FRAUD_ENGINE_MODE='remote', FRAUD_SERVICE_URL='http://127.0.0.1:9/api/v1.0/fraud/check')
+    def test_async_transfer_falls_back_and_posts(self):
+        """Test the async transfer view awaits the fraud service, falls back to local rules and posts"""
+        request = APIRequestFactory().post(
+            reverse('internal_transfer'),
+            {
+                'account_number': self.source.account_number,
+                'destination_account_number': self.destination.account_number,
+                'amount': 100,
+                'transaction_type': 'internal_transfer'
+            },
+            format='json',
+            HTTP_IDEMPOTENCY_KEY='fraud-async-1'
+        )
+        force_authenticate(request, user=self.source.customer.user)
+
+        response = async_to_sync(HandleInternalTransactionAsync.as_view())(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(FraudDetection.objects.get(account_number=self.source.account_number).decision, 'APPROVE')
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('4999900.00'))
+
+
+class FraudBacktestTest(TestCase):
+    """Test suite for re-scoring historical transactions with candidate rules"""
+
+    def setUp(self):
+        savings = AccountType.objects.create(name='SAVINGS', code='SAV', description='Savings')
+        self.source = create_customer_account('payer@test.com', savings)
+        self.destination = create_customer_account('payee@test.com', savings)
+
+    def create_transaction(self, ref, amount, created_at, transaction_type=TransactionType.INTERNAL_TRANSFER):
+        trans = Transaction.objects.create(
+            transaction_ref=ref,
+            transaction_type=transaction_type,
+            source_account=self.source,
+            destination_account=self.destination,
+            amount=amount,
+            initiated_by=self.source.customer.user,
+            idempotency_key=ref
+        )
+        Transaction.objects.filter(id=trans.id).update(created_at=created_at)
+
+    def test_reports_changed_decisions_with_replayed_velocity(self):
+        """Test decisions are compared with the velocity each transaction saw, including the day before"""
+        day = date(2026, 1, 15)
+        midnight = timezone.make_aware(datetime(2026, 1, 15, 0, 0))
+        # warm-up activity just before the first day counts towards velocity but is not scored
+        self.create_transaction('TXN-WARM', Decimal('100.00'), midnight - timedelta(minutes=2))
+        for minute in range(6):
+            self.create_transaction(f"TXN-{minute}", Decimal('100.00'), midnight + timedelta(minutes=minute))
+        self.create_transaction('TXN-LATE', Decimal('100.00'), midnight + timedelta(days=2))
+        # postings the live engine never scores neither count towards velocity nor get scored
+        self.create_transaction('TXN-FEE', Decimal('100.00'), midnight + timedelta(minutes=1), TransactionType.FEE)
+        self.create_transaction('TXN-MPESA', Decimal('100.00'), midnight + timedelta(minutes=2), TransactionType.MPESA_WITHDRAWAL)
+
+        candidate = DEFAULT_RULES + [
+            {'name': 'burst', 'rule_type': 'VELOCITY_COUNT', 'flag': '', 'params': {'window': 600, 'tiers': [[5, 60, 'burst']]}},
+        ]
+        report = io.StringIO()
+        summary = backtest.run_backtest(candidate, day, day, report, baseline=DEFAULT_RULES, batch_size=4)
+
+        self.assertEqual(summary['transactions'], 6)
+        # the fifth and sixth transfers saw 5 or more in 10 minutes: type 5 + time 20 + velocity 25 (+ burst 60)
+        self.assertEqual(summary['changed'], 2)
+        self.assertEqual(summary['transitions'], {'FLAG->BLOCK': 2})
+        rows = list(csv.DictReader(io.StringIO(report.getvalue())))
+        self.assertEqual([row['transaction_ref'] for row in rows], ['TXN-4', 'TXN-5'])
+        self.assertEqual(rows[0]['baseline_score'], '50')
+        self.assertEqual(rows[0]['candidate_score'], '110')
+
+    def test_process_pool_matches_inline_scoring(self):
+        """Test scoring on worker processes gives the same report"""
+        noon = timezone.make_aware(datetime(2026, 1, 15, 12, 0))
+        for minute in range(12):
+            self.create_transaction(f"TXN-{minute}", Decimal('150000.00'), noon + timedelta(minutes=minute, days=minute % 2))
+        candidate = [{'name': 'amount', 'rule_type': 'AMOUNT', 'flag': 'high_amount', 'params': {'tiers': [[100000, 80]]}}]
+
+        inline, pooled = io.StringIO(), io.StringIO()
+        expected = backtest.run_backtest(candidate, date(2026, 1, 15), date(2026, 1, 16), inline, baseline=DEFAULT_RULES)
+        summary = backtest.run_backtest(
+            candidate, date(2026, 1, 15), date(2026, 1, 16), pooled, baseline=DEFAULT_RULES, workers=2, batch_size=3
+        )
+
+        self.assertEqual(summary, expected)
+        self.assertEqual(summary['transactions'], 12)
+        self.assertEqual(pooled.getvalue(), inline.getvalue())
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class FraudCaseTest(TestCase):
+    """Test suite for the fraud alert queue, cases and risk rollup"""
+
+    def setUp(self):
+        revocation_list.filter = None
+        admin_role = Role.objects.create(role_name='Administrator', category='SYSTEM')
+        self.analyst = User.objects.create_superuser(email='analyst@test.com', password='testpass123', role=admin_role)
+        savings = AccountType.objects.create(name='SAVINGS', code='SAV', description='Savings')
+        self.first = create_customer_account('first@test.com', savings, balance=Decimal('1000.00'))
+        self.second = create_customer_account('second@test.com', savings, balance=Decimal('500.00'))
+        self.headers = {'HTTP_AUTHORIZATION': f"Bearer {issue_tokens(self.analyst).access_token}"}
+
+    def create_checks(self, account, decisions, start=None):
+        start = start or timezone.now() - timedelta(hours=1)
+        checks = FraudDetection.objects.bulk_create([
+            FraudDetection(
+                account_number=account.account_number, amount=Decimal('100.00'), transaction_type='INTERNAL_TRANSFER',
+                risk_score={'APPROVE': 10, 'CHALLENGE': 45, 'FLAG': 60, 'BLOCK': 90}[decision], decision=decision, reason=''
+            )
+            for decision in decisions
+        ])
+        for index, check in enumerate(checks):
+            FraudDetection.objects.filter(id=check.id).update(checked_at=start + timedelta(minutes=index))
+        return [FraudDetection.objects.get(id=check.id) for check in checks]
+
+    def test_queue_pages_untaken_alerts_newest_first(self):
+        """Test the queue only holds FLAG/BLOCK checks nobody took, and keyset pages do not overlap"""
+        checks = self.create_checks(self.first, ['APPROVE', 'FLAG', 'BLOCK', 'CHALLENGE', 'FLAG', 'BLOCK'])
+        alerts = [check for check in checks if check.decision in ('FLAG', 'BLOCK')]
+
+        page, next_cursor = cases.alert_queue(page_size=3)
+        self.assertEqual([alert.id for alert in page], [alert.id for alert in reversed(alerts)][:3])
+        rest, last_cursor = cases.alert_queue(page_size=3, cursor=next_cursor)
+        self.assertEqual([alert.id for alert in rest], [alerts[0].id])
+        self.assertIsNone(last_cursor)
+
+        self.assertEqual(len(cases.alert_queue(decision='BLOCK')[0]), 2)
+        cases.open_cases(self.analyst, [alerts[0].id])
+        self.assertEqual(len(cases.alert_queue()[0]), 3)
+        self.assertEqual(len(cases.alert_queue(include_taken=True)[0]), 4)
+        with self.assertRaises(cases.FraudCaseError):
+            cases.alert_queue(decision='APPROVE')
+
+    def test_alerts_grouped_into_one_case_per_account(self):
+        """Test taking alerts opens one case per account and reuses it for later alerts"""
+        first_alerts = self.create_checks(self.first, ['FLAG', 'BLOCK'])
+        second_alerts = self.create_checks(self.second, ['BLOCK'])
+        approved = self.create_checks(self.second, ['APPROVE'])[0]
+
+        opened, skipped = cases.open_cases(self.analyst, [first_alerts[0].id, second_alerts[0].id, approved.id])
+        self.assertEqual(len(opened), 2)
+        self.assertEqual(skipped, [{'alert_id': str(approved.id), 'error': 'Not an alert or already taken'}])
+        self.assertTrue(all(case.assigned_to == self.analyst for case in opened))
+
+        again, _ = cases.open_cases(self.analyst, [first_alerts[1].id])
+        self.assertEqual(FraudCase.objects.count(), 2)
+        self.assertEqual(again[0].alerts.count(), 2)
+
+    def test_bulk_hold_freeze_and_close(self):
+        """Test holds take available funds, freezes stop the accounts and a false positive gives the holds back"""
+        alerts = self.create_checks(self.first, ['FLAG']) + self.create_checks(self.second, ['BLOCK'])
+        opened, _ = cases.open_cases(self.analyst, [alert.id for alert in alerts])
+        case_ids = [case.id for case in opened]
+
+        applied, skipped = cases.bulk_action(self.analyst, case_ids, 'HOLD', reason='Suspected takeover', amount='600.00')
+        self.assertEqual(len(applied), 2)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.available_balance, Decimal('400.00'))
+        # capped at what the account has available
+        self.assertEqual(self.second.available_balance, Decimal('0.00'))
+        self.assertEqual(AccountHold.objects.filter(hold_type='FRAUD', is_released=False).count(), 2)
+
+        cases.bulk_action(self.analyst, [opened[1].id], 'FREEZE', reason='Confirmed mule account')
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.status, 'FROZEN')
+        self.assertFalse(self.second.allow_debit)
+
+        cases.bulk_action(self.analyst, [opened[0].id], 'CLOSE', resolution='FALSE_POSITIVE')
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.available_balance, Decimal('1000.00'))
+        self.assertEqual(FraudCase.objects.get(id=opened[0].id).status, 'CLOSED')
+
+        applied, skipped = cases.bulk_action(self.analyst, [opened[0].id], 'HOLD', reason='Again')
+        self.assertEqual(applied, [])
+        self.assertEqual(skipped[0]['error'], 'Not an open case')
+        with self.assertRaises(cases.FraudCaseError):
+            cases.bulk_action(self.analyst, [opened[1].id], 'CLOSE', resolution='MAYBE')
+
+    def test_rollup_summaries(self):
+        """Test the rollup is idempotent and summaries and rankings come from it"""
+        self.create_checks(self.first, ['APPROVE', 'FLAG', 'BLOCK'])
+        self.create_checks(self.second, ['FLAG', 'APPROVE'])
+        self.create_checks(self.second, ['BLOCK'], start=timezone.now() - timedelta(days=40))
+
+        risk.rollup_checks()
+        risk.rollup_checks()
+        self.assertEqual(AccountRiskRollup.objects.count(), 3)
+
+        summary = risk.account_risk_summary(self.first.account_number, days=30)
+        self.assertEqual((summary['checks'], summary['flagged'], summary['blocked']), (3, 1, 1))
+        self.assertEqual(summary['max_score'], 90)
+        self.assertEqual(summary['average_score'], round(160 / 3, 2))
+        self.assertEqual(risk.account_risk_summary(self.second.account_number, days=30)['blocked'], 0)
+
+        ranked = risk.riskiest_accounts(days=7)
+        self.assertEqual([row['account_number'] for row in ranked], [self.first.account_number, self.second.account_number])
+
+    def test_api_queue_case_and_action(self):
+        """Test analysts work alerts through the API and customers are refused"""
+        alert = self.create_checks(self.first, ['BLOCK'])[0]
+
+        response = self.client.get('/api/v1.0/fraud/alerts/', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['id'], str(alert.id))
+
+        response = self.client.post('/api/v1.0/fraud/cases/', {'alert_ids': [str(alert.id)]}, content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        case_id = response.data['cases'][0]['id']
+
+        response = self.client.post('/api/v1.0/fraud/cases/actions/', {
+            'case_ids': [case_id], 'action': 'HOLD', 'reason': 'Investigating'
+        }, content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['applied'], [case_id])
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.available_balance, Decimal('0.00'))
+
+        response = self.client.post('/api/v1.0/fraud/cases/assign/', {
+            'case_ids': [case_id], 'assigned_to': str(self.first.customer.user.id)
+        }, content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 400)
+
+        risk.rollup_checks()
+        response = self.client.get(f"/api/v1.0/fraud/risk/{self.first.account_number}/", **self.headers)
+        self.assertEqual(response.data['blocked'], 1)
+
+        customer_headers = {'HTTP_AUTHORIZATION': f"Bearer {issue_tokens(self.first.customer.user).access_token}"}
+        self.assertEqual(self.client.get('/api/v1.0/fraud/alerts/', **customer_headers).status_code, 403)
@@ -2,4 +2,10 @@ from .views import *
 from django.urls import path
 
 urlpatterns = [
-]
\ No newline at end of file
+    path('alerts/', FraudAlertQueueView.as_view(), name='fraud_alert_queue'),
+    path('cases/', FraudCaseOpenView.as_view(), name='fraud_case_open'),
+    path('cases/assign/', FraudCaseAssignView.as_view(), name='fraud_case_assign'),
+    path('cases/actions/', FraudCaseBulkActionView.as_view(), name='fraud_case_actions'),
+    path('risk/', AccountRiskView.as_view(), name='fraud_risky_accounts'),
+    path('risk/<str:account_number>/', AccountRiskView.as_view(), name='fraud_account_risk'),
+]
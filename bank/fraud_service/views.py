@@ -1,3 +1,157 @@
-from django.shortcuts import render
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from auth_service.models import User
+from bank.routers import ReplicaReadMixin
+import logging
 
-# Create your views here.
+from .permissions import CanReviewFraudAlerts
+from .serializers import FraudAlertSerializer, FraudCaseSerializer
+from .services.cases import FraudCaseError, alert_queue, assign_cases, bulk_action, open_cases
+from .services.risk import account_risk_summary, riskiest_accounts
+
+logger = logging.getLogger(__name__)
+
+
+def get_assignee(user_id):
+    if not user_id:
+        return None
+    assignee = User.objects.filter(
+        Q(is_superuser=True) | Q(role__permissions__codename__in=CanReviewFraudAlerts.required_permissions),
+        id=user_id
+    ).first()
+    if not assignee:
+        raise FraudCaseError("Assignee must be allowed to review fraud alerts")
+    return assignee
+
+
+class FraudAlertQueueView(APIView):
+    """
+    FLAG/BLOCK checks not yet taken into a case, newest first, with keyset pagination.
+    ?decision=FLAG|BLOCK, ?account_number=, ?all=true to include taken alerts, ?cursor= from next_cursor.
+    """
+    permission_classes = [IsAuthenticated, CanReviewFraudAlerts]
+
+    def get(self, request):
+        try:
+            page_size = min(int(request.query_params.get('page_size', 50)), 200)
+            alerts, next_cursor = alert_queue(
+                decision=request.query_params.get('decision'),
+                cursor=request.query_params.get('cursor'),
+                page_size=page_size,
+                account_number=request.query_params.get('account_number'),
+                include_taken=request.query_params.get('all') == 'true',
+            )
+            return Response({
+                "results": FraudAlertSerializer(alerts, many=True).data,
+                "next_cursor": next_cursor,
+            }, status=status.HTTP_200_OK)
+
+        except (FraudCaseError, ValueError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error fetching fraud alert queue: {str(e)}")
+            return Response({"error": "Unable to fetch fraud alert queue"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class FraudCaseOpenView(APIView):
+    """POST {"alert_ids": [...], "assigned_to": user id (defaults to me)} takes alerts into one case per account"""
+    permission_classes = [IsAuthenticated, CanReviewFraudAlerts]
+
+    def post(self, request):
+        alert_ids = request.data.get('alert_ids')
+        if not alert_ids or not isinstance(alert_ids, list):
+            return Response({"error": "alert_ids must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            cases, skipped = open_cases(request.user, alert_ids, get_assignee(request.data.get('assigned_to')))
+            return Response({
+                "cases": FraudCaseSerializer(cases, many=True).data,
+                "skipped": skipped,
+            }, status=status.HTTP_200_OK)
+
+        except (FraudCaseError, ValidationError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error opening fraud cases: {str(e)}")
+            return Response({"error": "Unable to open fraud cases"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class FraudCaseAssignView(APIView):
+    """POST {"case_ids": [...], "assigned_to": user id (defaults to me)} hands open cases to an analyst"""
+    permission_classes = [IsAuthenticated, CanReviewFraudAlerts]
+
+    def post(self, request):
+        case_ids = request.data.get('case_ids')
+        if not case_ids or not isinstance(case_ids, list):
+            return Response({"error": "case_ids must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            assignee = get_assignee(request.data.get('assigned_to')) or request.user
+            assigned = assign_cases(case_ids, assignee)
+            return Response({"assigned": assigned, "assigned_to": str(assignee.id)}, status=status.HTTP_200_OK)
+
+        except (FraudCaseError, ValidationError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error assigning fraud cases: {str(e)}")
+            return Response({"error": "Unable to assign fraud cases"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class FraudCaseBulkActionView(APIView):
+    """
+    POST {"case_ids": [...], "action": HOLD|FREEZE|CLOSE, "reason", "amount" (HOLD, defaults to everything available),
+    "resolution": CONFIRMED_FRAUD|FALSE_POSITIVE (CLOSE), "notes"}
+    """
+    permission_classes = [IsAuthenticated, CanReviewFraudAlerts]
+
+    def post(self, request):
+        data = request.data
+        case_ids = data.get('case_ids')
+        if not case_ids or not isinstance(case_ids, list):
+            return Response({"error": "case_ids must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            applied, skipped = bulk_action(
+                request.user,
+                case_ids,
+                data.get('action'),
+                reason=data.get('reason', '').strip(),
+                amount=data.get('amount'),
+                resolution=data.get('resolution'),
+                notes=data.get('notes', '')
+            )
+            return Response({
+                "applied": applied,
+                "skipped": skipped,
+            }, status=status.HTTP_200_OK)
+
+        except (FraudCaseError, ValidationError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error applying fraud case action: {str(e)}")
+            return Response({"error": "Unable to apply fraud case action"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AccountRiskView(ReplicaReadMixin, APIView):
+    """
+    risk summary from the daily rollup, ?days= (default 30).
+    Without an account number, the riskiest accounts over ?days= (default 7), ?limit= (default 50)
+    """
+    permission_classes = [IsAuthenticated, CanReviewFraudAlerts]
+
+    def get(self, request, account_number=None):
+        try:
+            if account_number:
+                days = min(int(request.query_params.get('days', 30)), 366)
+                return Response(account_risk_summary(account_number, days), status=status.HTTP_200_OK)
+
+            days = min(int(request.query_params.get('days', 7)), 366)
+            limit = min(int(request.query_params.get('limit', 50)), 500)
+            return Response({"days": days, "results": riskiest_accounts(days, limit)}, status=status.HTTP_200_OK)
+
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
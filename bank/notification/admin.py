@@ -1,3 +1,9 @@
 from django.contrib import admin
+from .models import Notification
 
-# Register your models here.
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('recipient', 'channel', 'template', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('channel', 'status', 'template')
+    search_fields = ('recipient', 'provider_message_id')
@@ -1,3 +1,43 @@
 from django.db import models
+from auth_service.models import BaseModel, User
 
-# Create your models here.
+
+class Notification(BaseModel):
+    """
+    One templated EMAIL / SMS message to one recipient and its delivery status.
+    Rows are written on the request path (or in bulk by a worker) and sent later
+    by the dispatcher, which claims QUEUED rows whose next_attempt_at has passed.
+    """
+    CHANNEL_CHOICES = (
+        ('EMAIL', 'Email'),
+        ('SMS', 'SMS'),
+    )
+    STATUS_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('SENDING', 'Sending'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications', null=True, blank=True)
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    template = models.CharField(max_length=50)
+    # email address or phone number, captured when the notification is queued
+    recipient = models.CharField(max_length=254)
+    context = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='QUEUED')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    provider_message_id = models.CharField(max_length=100, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.channel} {self.template} to {self.recipient} - {self.status}"
+
+    class Meta:
+        db_table = 'notification'
+        indexes = [
+            models.Index(fields=['status', 'channel', 'next_attempt_at']),
+            models.Index(fields=['user', 'created_at']),
+        ]
@@ -0,0 +1,313 @@
+"""
+Templated EMAIL / SMS notifications.
+
+notify() and notify_bulk() only write Notification rows, the channel picked from
+the customer's preferred_communication_channel, and hand off to celery. Workers
+claim QUEUED rows per channel with SKIP LOCKED, so several of them drain a bulk
+send in parallel without sending anything twice. A batch goes out over one SMTP
+connection (or one keep-alive HTTP session for SMS), throttled by a per channel
+token bucket, and its outcome is written back with a single bulk_update. Failed
+sends are retried with exponential backoff up to NOTIFICATION_MAX_ATTEMPTS.
+Secrets in the context (one-time codes, verification links) are only kept until
+the notification is sent or fails for good, then scrubbed from the stored row.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.utils import DNS_NAME
+from django.db import transaction
+from django.db.models import Q
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.html import strip_tags
+from email.utils import make_msgid
+from accounts.services.daraja import RateLimiter
+from ..models import Notification
+from .sms import SmsError, get_sms_gateway
+import logging
+import random
+import smtplib
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+CHANNELS = ('EMAIL', 'SMS')
+# preferred_communication_channel -> channel; there is no voice channel, PHONE customers get SMS
+PREFERENCE_CHANNELS = {'EMAIL': 'EMAIL', 'SMS': 'SMS', 'PHONE': 'SMS'}
+BULK_CREATE_BATCH_SIZE = 1000
+# context keys that are credentials, dropped from the row once it needs no more rendering
+SENSITIVE_CONTEXT_KEYS = ('otp', 'verification_url')
+
+
+class NotificationError(Exception):
+    """Raised when a notification cannot be queued"""
+
+
+def template_name(template, part):
+    return f"notifications/{template}/{part}"
+
+
+def has_template(template, part):
+    try:
+        get_template(template_name(template, part))
+        return True
+    except TemplateDoesNotExist:
+        return False
+
+
+def pick_channel(template, preferred, phone_number, channel=None):
+    """Requested or preferred channel, falling back to EMAIL when SMS is not possible"""
+    channel = channel or PREFERENCE_CHANNELS.get(preferred, 'EMAIL')
+    if channel == 'SMS' and (not phone_number or not has_template(template, 'sms.txt')):
+        return 'EMAIL'
+    return channel
+
+
+def schedule_dispatch(channel, workers=1):
+    from ..tasks import dispatch_notifications_task
+
+    for _ in range(workers):
+        try:
+            dispatch_notifications_task.delay(channel)
+        except Exception as e:
+            # rows stay QUEUED, the periodic dispatch sends them
+            logger.warning(f"Could not schedule {channel} notification dispatch: {str(e)}")
+
+
+def notify(user, template, context=None, channel=None):
+    """
+    Queue `template` for `user` on their preferred channel (or `channel`).
+    Sending starts once the surrounding transaction commits.
+    """
+    if not has_template(template, 'subject.txt'):
+        raise NotificationError(f"Unknown notification template '{template}'")
+
+    profile = getattr(user, 'customer_profile', None)
+    phone_number = profile.phone_number if profile else None
+    preferred = profile.preferred_communication_channel if profile else 'EMAIL'
+    channel = pick_channel(template, preferred, phone_number, channel)
+
+    notification = Notification.objects.create(
+        user=user,
+        channel=channel,
+        template=template,
+        recipient=phone_number if channel == 'SMS' else user.email,
+        context={'first_name': user.first_name, **(context or {})},
+        next_attempt_at=timezone.now()
+    )
+    transaction.on_commit(lambda: schedule_dispatch(channel))
+    return notification
+
+
+def notify_bulk(users, template, context=None, channel=None):
+    """
+    Queue `template` for every user in the `users` queryset, written with
+    bulk_create and streamed so memory stays flat for any audience size.
+    Returns the number queued per channel.
+    """
+    if not has_template(template, 'subject.txt'):
+        raise NotificationError(f"Unknown notification template '{template}'")
+
+    context = context or {}
+    can_sms = has_template(template, 'sms.txt')
+    now = timezone.now()
+    counts = {name: 0 for name in CHANNELS}
+    pending = []
+
+    rows = users.values_list(
+        'id', 'email', 'first_name',
+        'customer_profile__phone_number', 'customer_profile__preferred_communication_channel'
+    ).iterator(chunk_size=BULK_CREATE_BATCH_SIZE)
+
+    for user_id, email, first_name, phone_number, preferred in rows:
+        user_channel = channel or PREFERENCE_CHANNELS.get(preferred, 'EMAIL')
+        if user_channel == 'SMS' and not (phone_number and can_sms):
+            user_channel = 'EMAIL'
+        pending.append(Notification(
+            user_id=user_id,
+            channel=user_channel,
+            template=template,
+            recipient=phone_number if user_channel == 'SMS' else email,
+            context={'first_name': first_name, **context},
+            next_attempt_at=now
+        ))
+        counts[user_channel] += 1
+        if len(pending) >= BULK_CREATE_BATCH_SIZE:
+            Notification.objects.bulk_create(pending)
+            pending = []
+    if pending:
+        Notification.objects.bulk_create(pending)
+
+    for name, count in counts.items():
+        if count:
+            batches = -(-count // settings.NOTIFICATION_BATCH_SIZE)
+            schedule_dispatch(name, workers=min(batches, settings.NOTIFICATION_DISPATCH_PARALLELISM))
+
+    logger.info(f"Queued '{template}' for {sum(counts.values())} users: {counts}")
+    return counts
+
+
+def render(notification):
+    """(subject, text body, html body) for EMAIL, (None, text, None) for SMS"""
+    context = notification.context
+    if notification.channel == 'SMS':
+        return None, get_template(template_name(notification.template, 'sms.txt')).render(context).strip(), None
+
+    subject = get_template(template_name(notification.template, 'subject.txt')).render(context).strip()
+    html = get_template(template_name(notification.template, 'email.html')).render(context)
+    return subject, strip_tags(html).strip(), html
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def scrub_context(context):
+    return {key: value for key, value in context.items() if key not in SENSITIVE_CONTEXT_KEYS}
+
+
+def rate_limiter(channel):
+    """Process wide token bucket for a channel, every batch this worker sends shares it"""
+    limiter = _rate_limiters.get(channel)
+    if limiter is None:
+        with _rate_limiters_lock:
+            limiter = _rate_limiters.get(channel)
+            if limiter is None:
+                rate = getattr(settings, f"NOTIFICATION_{channel}_RATE_PER_SECOND")
+                limiter = _rate_limiters[channel] = RateLimiter(rate)
+    return limiter
+
+
+class EmailSender:
+    """Sends every message of a batch over one SMTP connection, reopened only after an error"""
+
+    def __init__(self):
+        self.connection = None
+
+    def send(self, notification):
+        subject, text, html = render(notification)
+        if self.connection is None:
+            self.connection = get_connection()
+            self.connection.open()
+
+        message_id = make_msgid(domain=DNS_NAME)
+        message = EmailMultiAlternatives(
+            subject, text, settings.DEFAULT_FROM_EMAIL, [notification.recipient],
+            headers={'Message-ID': message_id}, connection=self.connection
+        )
+        message.attach_alternative(html, 'text/html')
+        try:
+            message.send()
+        except Exception:
+            self.close()
+            raise
+        return message_id
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+class SmsSender:
+
+    def __init__(self):
+        self.gateway = get_sms_gateway()
+
+    def send(self, notification):
+        _, text, _ = render(notification)
+        return self.gateway.send(notification.recipient, text)
+
+    def close(self):
+        pass
+
+
+SENDERS = {'EMAIL': EmailSender, 'SMS': SmsSender}
+
+
+def is_permanent(error):
+    """Failures a retry cannot fix"""
+    if isinstance(error, SmsError):
+        return not error.retryable
+    return isinstance(error, (TemplateDoesNotExist, smtplib.SMTPRecipientsRefused))
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, capped at NOTIFICATION_RETRY_MAX_DELAY"""
+    delay = min(settings.NOTIFICATION_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.NOTIFICATION_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim_batch(channel, batch_size):
+    """
+    Move up to `batch_size` due notifications to SENDING. Rows stuck in SENDING
+    longer than NOTIFICATION_SENDING_TIMEOUT (a worker died) are claimed again.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.NOTIFICATION_SENDING_TIMEOUT)
+    with transaction.atomic():
+        claimed_ids = list(
+            Notification.objects.select_for_update(skip_locked=True).filter(
+                Q(status='QUEUED', next_attempt_at__lte=now) | Q(status='SENDING', updated_at__lt=stale),
+                channel=channel
+            ).order_by('next_attempt_at').values_list('id', flat=True)[:batch_size]
+        )
+        Notification.objects.filter(id__in=claimed_ids).update(status='SENDING', updated_at=now)
+
+    return list(Notification.objects.filter(id__in=claimed_ids))
+
+
+def dispatch_batch(channel, batch_size=None):
+    """Claim and send one batch of `channel` notifications"""
+    batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    summary = {'claimed': 0, 'sent': 0, 'retrying': 0, 'failed': 0}
+
+    notifications = claim_batch(channel, batch_size)
+    if not notifications:
+        return summary
+    summary['claimed'] = len(notifications)
+
+    limiter = rate_limiter(channel)
+    sender = SENDERS[channel]()
+    try:
+        for notification in notifications:
+            limiter.acquire()
+            notification.attempts += 1
+            try:
+                notification.provider_message_id = sender.send(notification) or ''
+            except Exception as e:
+                notification.last_error = str(e)
+                if is_permanent(e) or notification.attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+                    notification.status = 'FAILED'
+                    summary['failed'] += 1
+                    logger.error(f"{channel} notification {notification.id} failed: {str(e)}")
+                else:
+                    notification.status = 'QUEUED'
+                    notification.next_attempt_at = timezone.now() + retry_delay(notification.attempts)
+                    summary['retrying'] += 1
+                continue
+
+            notification.status = 'SENT'
+            notification.sent_at = timezone.now()
+            notification.last_error = ''
+            summary['sent'] += 1
+    finally:
+        sender.close()
+        now = timezone.now()
+        for notification in notifications:
+            if notification.status == 'SENDING':
+                # interrupted before its turn, hand it straight back
+                notification.status = 'QUEUED'
+            elif notification.status in ('SENT', 'FAILED'):
+                notification.context = scrub_context(notification.context)
+            notification.updated_at = now
+        Notification.objects.bulk_update(notifications, [
+            'status', 'attempts', 'next_attempt_at', 'last_error', 'provider_message_id', 'sent_at', 'context', 'updated_at'
+        ])
+
+    return summary
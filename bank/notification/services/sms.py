@@ -0,0 +1,80 @@
+"""
+HTTP SMS gateway client.
+
+The provider takes a JSON POST of {from, to, message} with a bearer API key and
+answers with the message id. The dispatcher sends a whole batch through one
+process wide gateway, so every message after the first reuses a keep-alive
+connection from the session's pool.
+"""
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+import logging
+import requests
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_TIMEOUT = (3.05, 15)
+
+
+class SmsError(Exception):
+    """Raised when the SMS provider cannot be reached or rejects a message"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class SmsGateway:
+
+    def __init__(self, api_url=None, api_key=None, sender_id=None, pool_size=10, timeout=DEFAULT_TIMEOUT):
+        self.api_url = api_url or settings.SMS_API_URL
+        self.api_key = api_key if api_key is not None else settings.SMS_API_KEY
+        self.sender_id = sender_id or settings.SMS_SENDER_ID
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def send(self, phone_number, message):
+        """Send one SMS, returns the provider's message id"""
+        if not self.api_url:
+            raise SmsError("SMS_API_URL is not configured", retryable=False)
+
+        try:
+            response = self.session.post(
+                self.api_url,
+                json={'from': self.sender_id, 'to': phone_number, 'message': message},
+                headers={'Authorization': f"Bearer {self.api_key}"},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise SmsError(f"SMS provider unreachable: {str(e)}")
+
+        if response.status_code >= 500 or response.status_code == 429:
+            raise SmsError(f"SMS provider error: {response.status_code} {response.text}")
+        if response.status_code >= 400:
+            # bad number, blocked sender and the like, sending again would not help
+            raise SmsError(f"SMS rejected: {response.status_code} {response.text}", retryable=False)
+
+        try:
+            return str(response.json().get('message_id', ''))
+        except ValueError:
+            return ''
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_sms_gateway():
+    """Process wide gateway, created on first use"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = SmsGateway()
+    return _gateway
@@ -0,0 +1,32 @@
+from celery import shared_task
+from auth_service.models import User
+from .services import dispatch
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def dispatch_notifications_task(channel=None, batch_size=None, max_batches=50):
+    """
+    Send due notifications batch by batch until none are left. Scheduled per channel
+    whenever notifications are queued and periodically through celery beat for retries.
+    """
+    totals = {'claimed': 0, 'sent': 0, 'retrying': 0, 'failed': 0}
+    for name in [channel] if channel else dispatch.CHANNELS:
+        for _ in range(max_batches):
+            summary = dispatch.dispatch_batch(name, batch_size=batch_size)
+            for key in totals:
+                totals[key] += summary[key]
+            if not summary['claimed']:
+                break
+    return totals
+
+
+@shared_task
+def notify_customers_task(template, context=None, marketing_only=False):
+    """Queue `template` for every active customer, e.g. statement-ready or rate change notices"""
+    customers = User.objects.filter(is_active=True, customer_profile__isnull=False)
+    if marketing_only:
+        customers = customers.filter(customer_profile__marketing_preferences=True)
+    return dispatch.notify_bulk(customers, template, context)
@@ -1,3 +1,203 @@
-from django.test import TestCase
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
 
-# Create your tests here.
+from auth_service.models import Role, User, CustomerProfile
+from .models import Notification
+from .services import dispatch, sms
+from .services.sms import SmsGateway
+
+
+class CountingEmailBackend(EmailBackend):
+    """locmem backend that counts the connections opened"""
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+
+class SmsStubHandler(BaseHTTPRequestHandler):
+    """Minimal local SMS provider, answers with the status code set on the server"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.stats['connections'] += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.messages.append(payload)
+            message_id = f"SM{len(self.server.messages)}"
+        data = json.dumps({'message_id': message_id}).encode()
+        self.send_response(self.server.status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@override_settings(
+    EMAIL_BACKEND='notification.tests.CountingEmailBackend',
+    NOTIFICATION_RETRY_BASE_DELAY=30,
+    NOTIFICATION_MAX_ATTEMPTS=3,
+    PASSWORD_HASH_ITERATIONS=1000
+)
+class NotificationDispatchTest(TestCase):
+    """Test suite for queued EMAIL / SMS notifications"""
+
+    def setUp(self):
+        self.role = Role.objects.create(role_name='Customer', category='Customer')
+        CountingEmailBackend.opened = 0
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SmsStubHandler)
+        self.server.lock = threading.Lock()
+        self.server.stats = {'connections': 0}
+        self.server.messages = []
+        self.server.status_code = 200
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.gateway = SmsGateway(api_url=f"http://127.0.0.1:{self.server.server_port}/sms", api_key='key')
+        self.previous_gateway, sms._gateway = sms._gateway, self.gateway
+
+    def tearDown(self):
+        sms._gateway = self.previous_gateway
+        self.gateway.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_customer(self, index, channel='EMAIL'):
+        user = User.objects.create_user(
+            email=f"customer{index}@example.com", password='Secret123!', first_name=f"Name{index}", role=self.role
+        )
+        CustomerProfile.objects.create(
+            user=user, customer_id=f"CUST{index:05d}", phone_number=f"07000{index:05d}",
+            preferred_communication_channel=channel
+        )
+        return user
+
+    def test_channel_follows_customer_preference(self):
+        """Test the preferred channel is used, PHONE maps to SMS and templates without SMS fall back to EMAIL"""
+        email_user = self.create_customer(1, 'EMAIL')
+        sms_user = self.create_customer(2, 'SMS')
+        phone_user = self.create_customer(3, 'PHONE')
+
+        self.assertEqual(dispatch.notify(email_user, 'password_reset', {'otp': '1234'}).channel, 'EMAIL')
+        sms_notification = dispatch.notify(sms_user, 'password_reset', {'otp': '1234'})
+        self.assertEqual(sms_notification.channel, 'SMS')
+        self.assertEqual(sms_notification.recipient, '0700000002')
+        self.assertEqual(dispatch.notify(phone_user, 'password_reset', {'otp': '1234'}).channel, 'SMS')
+        self.assertEqual(dispatch.notify(sms_user, 'verify_email', {'verification_url': 'x'}).channel, 'EMAIL')
+
+    def test_unknown_template_is_rejected(self):
+        """Test queueing a template that does not exist raises"""
+        user = self.create_customer(1)
+        with self.assertRaises(dispatch.NotificationError):
+            dispatch.notify(user, 'no_such_template')
+
+    def test_email_batch_shares_one_connection(self):
+        """Test a batch of emails is rendered, sent over one connection and marked SENT"""
+        users = [self.create_customer(i) for i in range(5)]
+        for user in users:
+            dispatch.notify(user, 'password_reset', {'otp': '4321'})
+
+        summary = dispatch.dispatch_batch('EMAIL')
+
+        self.assertEqual(summary['sent'], 5)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].subject, 'Reset your EverGreen password')
+        self.assertIn('4321', mail.outbox[0].body)
+        self.assertFalse(Notification.objects.exclude(status='SENT').exists())
+        self.assertTrue(all(Notification.objects.values_list('provider_message_id', flat=True)))
+        # the code is not kept once sent
+        self.assertFalse(any('otp' in context for context in Notification.objects.values_list('context', flat=True)))
+
+    def test_sms_sent_through_gateway(self):
+        """Test SMS notifications reuse one connection and store the provider message id"""
+        for i in range(3):
+            dispatch.notify(self.create_customer(i, 'SMS'), 'statement_ready', {'period': 'May 2025'})
+
+        summary = dispatch.dispatch_batch('SMS')
+
+        self.assertEqual(summary['sent'], 3)
+        self.assertEqual(self.server.stats['connections'], 1)
+        self.assertIn('May 2025', self.server.messages[0]['message'])
+        self.assertEqual(
+            set(Notification.objects.values_list('provider_message_id', flat=True)), {'SM1', 'SM2', 'SM3'}
+        )
+
+    def test_failed_send_backs_off_then_fails(self):
+        """Test provider errors are retried later and fail for good after the last attempt"""
+        notification = dispatch.notify(self.create_customer(1, 'SMS'), 'password_reset', {'otp': '1'})
+        self.server.status_code = 503
+
+        summary = dispatch.dispatch_batch('SMS')
+        notification.refresh_from_db()
+        self.assertEqual(summary['retrying'], 1)
+        self.assertEqual(notification.status, 'QUEUED')
+        self.assertEqual(notification.attempts, 1)
+        self.assertGreater(notification.next_attempt_at, timezone.now())
+        self.assertEqual(notification.context['otp'], '1')
+
+        # not due yet
+        self.assertEqual(dispatch.dispatch_batch('SMS')['claimed'], 0)
+
+        Notification.objects.filter(id=notification.id).update(next_attempt_at=timezone.now())
+        dispatch.dispatch_batch('SMS')
+        Notification.objects.filter(id=notification.id).update(next_attempt_at=timezone.now())
+        summary = dispatch.dispatch_batch('SMS')
+        notification.refresh_from_db()
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(notification.status, 'FAILED')
+        self.assertEqual(notification.attempts, 3)
+        self.assertNotIn('otp', notification.context)
+
+    def test_rejected_sms_is_not_retried(self):
+        """Test a 4xx from the provider fails the notification straight away"""
+        notification = dispatch.notify(self.create_customer(1, 'SMS'), 'password_reset', {'otp': '1'})
+        self.server.status_code = 400
+
+        dispatch.dispatch_batch('SMS')
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, 'FAILED')
+        self.assertEqual(notification.attempts, 1)
+
+    def test_bulk_notify_splits_by_channel(self):
+        """Test bulk queueing writes one row per customer on their channel and is drained by the task"""
+        from .tasks import dispatch_notifications_task, notify_customers_task
+
+        for i in range(6):
+            self.create_customer(i, 'SMS' if i % 3 == 0 else 'EMAIL')
+
+        counts = notify_customers_task('rate_change', {
+            'product': 'savings', 'old_rate': '4.0', 'new_rate': '4.5', 'effective_date': '1 July'
+        })
+        self.assertEqual(counts, {'EMAIL': 4, 'SMS': 2})
+        self.assertEqual(Notification.objects.filter(status='QUEUED').count(), 6)
+
+        totals = dispatch_notifications_task()
+        self.assertEqual(totals['sent'], 6)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertIn('4.0% to 4.5%', self.server.messages[0]['message'])
+
+    def test_verification_email_is_queued(self):
+        """Test registration's verification email becomes an EMAIL notification with the link"""
+        from auth_service.task import send_verification_email
+
+        user = self.create_customer(1, 'SMS')
+        send_verification_email(user.id)
+
+        notification = Notification.objects.get(user=user, template='verify_email')
+        self.assertEqual(notification.channel, 'EMAIL')
+        self.assertIn(f"uid={user.id}", notification.context['verification_url'])
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from datetime import date
+from transactions.services import interest
+
+
+class Command(BaseCommand):
+    help = 'Accrue daily interest and optionally post month-end interest, resumable by account id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', type=date.fromisoformat, help='Accrual date (YYYY-MM-DD), defaults to today')
+        parser.add_argument('--start-after', help='Resume after this account id')
+        parser.add_argument('--stop-at', help='Stop at this account id (inclusive)')
+        parser.add_argument('--chunk-size', type=int, default=interest.DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--post', action='store_true', help='Post accumulated interest instead of accruing')
+
+    def handle(self, *args, **options):
+        kwargs = {
+            'start_after': options['start_after'],
+            'stop_at': options['stop_at'],
+            'chunk_size': options['chunk_size'],
+        }
+
+        if options['post']:
+            result = interest.post_month_end_interest(period_end=options['as_of'], **kwargs)
+            self.stdout.write(self.style.SUCCESS(
+                f"Posted interest for {result['accounts']} accounts ({result['total_posted']}) for {result['period']}"
+            ))
+        else:
+            result = interest.accrue_daily_interest(as_of=options['as_of'], **kwargs)
+            self.stdout.write(self.style.SUCCESS(
+                f"Accrued {result['total_accrued']} across {result['accounts']} accounts for {result['as_of']}"
+            ))
+
+        self.stdout.write(f"Last account id: {result['last_account_id']}")
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from transactions.services import partitions
+
+
+class Command(BaseCommand):
+    help = 'Create monthly partitions of transactions and ledger_entries ahead of time and archive old ones (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', action='append', choices=partitions.PARTITIONED_TABLES,
+                            help='Only this table, may be repeated, defaults to all partitioned tables')
+        parser.add_argument('--convert', action='store_true',
+                            help='Turn the plain tables into partitioned ones first (locks them, run in a maintenance window)')
+        parser.add_argument('--months-ahead', type=int, default=settings.PARTITION_MONTHS_AHEAD)
+        parser.add_argument('--archive', action='store_true', help='Detach and archive partitions older than --keep-months')
+        parser.add_argument('--keep-months', type=int, default=settings.PARTITION_ARCHIVE_AFTER_MONTHS,
+                            help='Months kept attached, the current one included')
+        parser.add_argument('--archive-to', choices=partitions.ARCHIVE_MODES, default='table',
+                            help="'table' moves them to the archive schema, 'parquet' writes a file and drops them")
+        parser.add_argument('--archive-dir', default=settings.PARTITION_ARCHIVE_DIR)
+
+    def handle(self, *args, **options):
+        tables = options['table'] or partitions.PARTITIONED_TABLES
+        try:
+            for table in tables:
+                if options['convert']:
+                    first_month = partitions.convert_table(table, months_ahead=options['months_ahead'])
+                    self.stdout.write(f"{table} partitioned from {first_month:%Y-%m}, older rows in {table}_legacy")
+                else:
+                    created = partitions.ensure_partitions(table, months_ahead=options['months_ahead'])
+                    self.stdout.write(f"{table}: created {', '.join(created) or 'no partitions'}")
+
+                if options['archive']:
+                    archived = partitions.archive_partitions(
+                        table,
+                        options['keep_months'],
+                        mode=options['archive_to'],
+                        archive_dir=options['archive_dir']
+                    )
+                    for partition in archived:
+                        self.stdout.write(f"  archived {partition['partition']} to {partition['archived_to']}")
+        except partitions.PartitionError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS("Partitions up to date"))
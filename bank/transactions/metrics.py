@@ -37,4 +37,11 @@ fraud_check_duration_seconds = Histogram(
     'fraud_check_duration_seconds',
     'Time spent checking for fraud',
     ['fraud_type']
-)
\ No newline at end of file
+)
+# time spent waiting for account row locks in execute_transaction
+transaction_lock_wait_seconds = Histogram(
+    'transaction_lock_wait_seconds',
+    'Time spent acquiring account locks for a transaction',
+    ['transaction_type'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
@@ -1,10 +1,13 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from auth_service.models import *
 from accounts.models import *
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from decimal import Decimal
 import uuid
+from bank.cache import cached_query, invalidate
 
 
 
@@ -39,6 +42,9 @@ class LedgerEntryType(models.TextChoices):
     DEBIT = 'DEBIT', 'Debit'
     CREDIT = 'CREDIT', 'Credit'
 
+FEE_RULES_CACHE = 'fee-rules'
+
+
 class FeeRule(BaseModel):
     transaction_type = models.CharField(max_length=30, choices=TransactionType.choices, db_index=True)
     min_amount = models.DecimalField(max_digits=12, decimal_places=2)
@@ -53,6 +59,17 @@ class FeeRule(BaseModel):
             'max_amount'
         )
 
+    @classmethod
+    def active_bands(cls, transaction_type):
+        """(min_amount, max_amount, fee_amount) of the type's active rules by min_amount, from the shared cache"""
+        return cached_query(
+            FEE_RULES_CACHE,
+            transaction_type,
+            lambda: list(cls.objects.filter(transaction_type=transaction_type, is_active=True).values_list(
+                'min_amount', 'max_amount', 'fee_amount'
+            ))
+        )
+
 class Transaction(BaseModel):
     """Main transaction model - immutable after creation"""
     transaction_ref = models.CharField(max_length=50, unique=True, db_index=True, help_text="Unique transaction reference for external systems")
@@ -70,10 +87,10 @@ class Transaction(BaseModel):
     description = models.TextField(blank=True)
     metadata = models.JSONField(default=dict, blank=True)
     external_ref = models.CharField(max_length=100, blank=True, db_index=True, help_text="External system reference (M-Pesa, card processor)")
-    # card = models.ForeignKey('cards.Card', on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
+    card = models.ForeignKey('card.Card', on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
     batch_transfer = models.ForeignKey('BatchTransfer', on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
     initiated_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='initiated_transactions')
-    reversed_transaction = models.OneToOneField('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='reversal')
+    reversed_transaction = models.OneToOneField('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='reversal', db_constraint=False)
     idempotency_key = models.CharField(max_length=255, unique=True, db_index=True, help_text="Unique key for duplicate request prevention")
     completed_at = models.DateTimeField(null=True, blank=True)
     retry_count = models.IntegerField(default=0)
@@ -81,7 +98,7 @@ class Transaction(BaseModel):
     version = models.IntegerField(default=0)
 
     class Meta:
-        db_table = 'transactions'
+        db_table = 'transactions'  # partitioned by month on created_at on Postgres, see services/partitions.py
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['-created_at', 'trans_status']),
@@ -110,7 +127,7 @@ class Transaction(BaseModel):
 
 class LedgerEntry(BaseModel):
     """Double-entry bookkeeping ledger"""
-    transaction = models.ForeignKey(Transaction, on_delete=models.PROTECT, related_name='ledger_entries')
+    transaction = models.ForeignKey(Transaction, on_delete=models.PROTECT, related_name='ledger_entries', db_constraint=False)
     account = models.ForeignKey('accounts.Account', on_delete=models.PROTECT, related_name='ledger_entries', db_index=True)
     entry_type = models.CharField(max_length=10, choices=LedgerEntryType.choices, db_index=True)
     amount = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
@@ -118,7 +135,7 @@ class LedgerEntry(BaseModel):
     description = models.TextField()
 
     class Meta:
-        db_table = 'ledger_entries'
+        db_table = 'ledger_entries'  # partitioned by month on created_at on Postgres, see services/partitions.py
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['account', '-created_at']),
@@ -133,7 +150,7 @@ class LedgerEntry(BaseModel):
 class IdempotencyKey(BaseModel):
     """Idempotency key storage for duplicate request prevention"""
     key = models.CharField(max_length=255, db_index=True, unique=True)
-    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='idempotency_keys')
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='idempotency_keys', db_constraint=False)
     request_params = models.JSONField(help_text="Original request parameters for comparison")
     expires_at = models.DateTimeField(db_index=True)
 
@@ -166,8 +183,8 @@ class ReversalRequest(BaseModel):
         REJECTED = 'REJECTED', 'Rejected'
         FAILED = 'FAILED', 'Failed'
 
-    original_transaction = models.ForeignKey(Transaction, on_delete=models.PROTECT, related_name='reversal_requests')
-    reversal_transaction = models.OneToOneField(Transaction, on_delete=models.PROTECT, null=True, blank=True, related_name='reversal_request_record')
+    original_transaction = models.ForeignKey(Transaction, on_delete=models.PROTECT, related_name='reversal_requests', db_constraint=False)
+    reversal_transaction = models.OneToOneField(Transaction, on_delete=models.PROTECT, null=True, blank=True, related_name='reversal_request_record', db_constraint=False)
     reason = models.CharField(max_length=30, choices=ReversalReason.choices)
     status = models.CharField(max_length=20, choices=ReversalStatus.choices, default=ReversalStatus.PENDING, db_index=True)
     amount = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))], help_text="Amount to reverse (can be partial)")
@@ -182,7 +199,8 @@ class ReversalRequest(BaseModel):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['status', '-created_at']),
-            models.Index(fields=['original_transaction']),
+            # covers the cumulative reversed amount aggregate per original transaction
+            models.Index(fields=['original_transaction', 'status']),
         ]
 
     def __str__(self):
@@ -243,7 +261,7 @@ class BatchTransferItem(BaseModel):
     description = models.TextField(blank=True)
     reference = models.CharField(max_length=100, blank=True)
     status = models.CharField(max_length=20, choices=ItemStatus.choices, default=ItemStatus.PENDING, db_index=True)
-    transaction = models.OneToOneField(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='batch_item')
+    transaction = models.OneToOneField(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='batch_item', db_constraint=False)
     error_message = models.TextField(blank=True)
     retry_count = models.IntegerField(default=0)
     processed_at = models.DateTimeField(null=True, blank=True)
@@ -316,7 +334,7 @@ class TransactionWebhook(BaseModel):
         FAILED = 'FAILED', 'Failed'
         RETRYING = 'RETRYING', 'Retrying'
 
-    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='webhooks')
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='webhooks', db_constraint=False)
     url = models.URLField()
     event_type = models.CharField(max_length=50)
     status = models.CharField(max_length=20, choices=WebhookStatus.choices, default=WebhookStatus.PENDING)
@@ -338,3 +356,8 @@ class TransactionWebhook(BaseModel):
 
     def __str__(self):
         return f"Webhook {self.id} - {self.transaction.transaction_ref}"
+
+
+@receiver([post_save, post_delete], sender=FeeRule)
+def reload_fee_rules(sender, **kwargs):
+    invalidate(FEE_RULES_CACHE)
@@ -0,0 +1,21 @@
+from rest_framework.permissions import BasePermission
+
+
+class CanApproveReversals(BasePermission):
+    """
+    staff with approve_transfer can approve and execute reversal requests
+    """
+    required_permissions = ['approve_transfer']
+
+    def has_permission(self, request, view):
+        user = request.user
+
+        # Allow superuser
+        if user.is_superuser:
+            return True
+
+        # Ensure the user has a role
+        if not user.role:
+            return False
+
+        return user.role.has_any_permission(*self.required_permissions)
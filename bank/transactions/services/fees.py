@@ -0,0 +1,170 @@
+"""
+Monthly maintenance fee sweep.
+
+Fees are charged per account type in chunks: the chunk is locked in id order,
+eligible accounts are debited with a single UPDATE, and the FEE transactions and
+ledger entries are inserted in bulk. Each (account, period) pair maps to one
+idempotency key so re-running a sweep never charges an account twice.
+"""
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from accounts.models import Account, AccountType
+from accounts.services.balances import refresh_after_commit
+from ..models import Transaction, LedgerEntry, LedgerEntryType, TransactionType
+from .posting import SYSTEM_FEE_ACCOUNT, get_internal_account, get_system_user, system_transaction
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def fee_floor(account_type):
+    """Lowest available balance an account may be left with after the fee"""
+    if account_type.overdraft_allowed:
+        return -account_type.overdraft_limit
+    return account_type.minimum_balance
+
+
+def fee_idempotency_key(account_id, period):
+    return f"FEE-{account_id}-{period}"
+
+
+def sweep_maintenance_fees(account_type, period=None, start_after=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Charge `account_type.monthly_maintenance_fee` to every active customer account of that type.
+    `period` is the billing month as YYYY-MM (defaults to the current month).
+    """
+    if not isinstance(account_type, AccountType):
+        account_type = AccountType.objects.get(name=account_type)
+
+    period = period or timezone.localdate().strftime('%Y-%m')
+    fee = account_type.monthly_maintenance_fee
+    summary = {
+        'account_type': account_type.name,
+        'period': period,
+        'charged': 0,
+        'already_charged': 0,
+        'insufficient_funds': 0,
+        'total_fees': '0.00',
+        'last_account_id': str(start_after) if start_after else None,
+    }
+
+    if fee <= Decimal('0.00'):
+        logger.info(f"No maintenance fee configured for {account_type.name}, skipping sweep")
+        return summary
+
+    floor = fee_floor(account_type)
+    initiated_by = get_system_user()
+    total_fees = Decimal('0.00')
+    last_id = start_after
+    logger.info(f"Starting maintenance fee sweep for {account_type.name} period {period}, fee {fee}")
+
+    base_queryset = Account.objects.filter(
+        account_type=account_type,
+        category='CUSTOMER',
+        status='ACTIVE',
+    ).order_by('id')
+
+    while True:
+        chunk_qs = base_queryset.filter(id__gt=last_id) if last_id else base_queryset
+        ids = list(chunk_qs.values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            break
+
+        with transaction.atomic():
+            # eligibility is checked again under the lock, an account frozen or closed since it was listed is skipped
+            rows = list(
+                base_queryset.select_for_update().filter(id__in=ids).values(
+                    'id', 'account_number', 'balance', 'available_balance', 'currency'
+                )
+            )
+            fee_account = get_internal_account(SYSTEM_FEE_ACCOUNT, lock=True)
+
+            already_charged = set(
+                Transaction.objects.filter(
+                    idempotency_key__in=[fee_idempotency_key(row['id'], period) for row in rows]
+                ).values_list('idempotency_key', flat=True)
+            )
+
+            eligible = []
+            for row in rows:
+                if fee_idempotency_key(row['id'], period) in already_charged:
+                    summary['already_charged'] += 1
+                elif row['available_balance'] - fee < floor:
+                    summary['insufficient_funds'] += 1
+                else:
+                    eligible.append(row)
+
+            if eligible:
+                now = timezone.now()
+                # single set-based debit for the whole chunk, rows are already locked
+                base_queryset.filter(id__in=[row['id'] for row in eligible]).update(
+                    balance=F('balance') - fee,
+                    available_balance=F('available_balance') - fee,
+                    updated_at=now
+                )
+
+                fee_balance = fee_account.balance
+                transactions_to_create = []
+                entries = []
+                for row in eligible:
+                    balance_after = row['balance'] - fee
+                    fee_before = fee_balance
+                    fee_balance += fee
+
+                    txn = system_transaction(
+                        TransactionType.FEE,
+                        fee,
+                        fee_idempotency_key(row['id'], period),
+                        initiated_by,
+                        source_account_id=row['id'],
+                        destination_account=fee_account,
+                        currency=row['currency'],
+                        source_balance_before=row['balance'],
+                        source_balance_after=balance_after,
+                        destination_balance_before=fee_before,
+                        destination_balance_after=fee_balance,
+                        description=f"Monthly maintenance fee {period}",
+                        metadata={'period': period, 'account_type': account_type.name},
+                    )
+                    transactions_to_create.append(txn)
+                    entries.append(LedgerEntry(
+                        transaction=txn,
+                        account_id=row['id'],
+                        entry_type=LedgerEntryType.DEBIT,
+                        amount=fee,
+                        balance_after=balance_after,
+                        description=f"Monthly maintenance fee {period}"
+                    ))
+                    entries.append(LedgerEntry(
+                        transaction=txn,
+                        account=fee_account,
+                        entry_type=LedgerEntryType.CREDIT,
+                        amount=fee,
+                        balance_after=fee_balance,
+                        description=f"Maintenance fee from {row['account_number']}"
+                    ))
+
+                chunk_total = fee * len(eligible)
+                Transaction.objects.bulk_create(transactions_to_create, batch_size=chunk_size)
+                LedgerEntry.objects.bulk_create(entries, batch_size=chunk_size * 2)
+                Account.objects.filter(id=fee_account.id).update(
+                    balance=F('balance') + chunk_total,
+                    available_balance=F('available_balance') + chunk_total,
+                    updated_at=now
+                )
+                refresh_after_commit([row['id'] for row in eligible] + [fee_account.id])
+                summary['charged'] += len(eligible)
+                total_fees += chunk_total
+
+        last_id = ids[-1]
+        summary['last_account_id'] = str(last_id)
+        logger.debug(f"Fee sweep chunk done for {account_type.name}, last account {last_id}")
+
+    summary['total_fees'] = str(total_fees)
+    logger.info(f"Maintenance fee sweep finished: {summary}")
+    return summary
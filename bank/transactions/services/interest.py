@@ -0,0 +1,237 @@
+"""
+Interest accrual and month-end posting.
+
+Accrual runs daily and only writes `accumulated_interest` / `last_interest_date`.
+Each chunk is locked in id order (the order transfers lock in) and re-read before
+it is written, so a month-end posting or an overlapping run is never overwritten
+with a stale value. At month end the
+accumulated interest is paid out as INTEREST transactions from the system
+interest account, with double-entry ledger rows written in bulk.
+
+Both jobs walk accounts in primary-key order in chunks and commit per chunk,
+so a failed run can be resumed from the last account id it reported.
+"""
+from decimal import Decimal, ROUND_HALF_EVEN, localcontext
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from accounts.models import Account
+from accounts.services.balances import refresh_after_commit
+from ..models import Transaction, LedgerEntry, LedgerEntryType, TransactionType
+from .posting import CENT, SYSTEM_INTEREST_ACCOUNT, get_internal_account, get_system_user, system_transaction
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CHUNK_SIZE = 2000
+DAYS_IN_YEAR = Decimal('365')
+
+
+def eligible_interest_accounts(as_of):
+    """Active customer accounts with a positive balance on an interest bearing product"""
+    return Account.objects.filter(
+        category='CUSTOMER',
+        status='ACTIVE',
+        is_active=True,
+        balance__gt=0,
+        account_type__interest_rate__gt=0,
+    ).exclude(last_interest_date__gte=as_of)
+
+
+def compute_accruals(rows, as_of):
+    """
+    Compute the interest accrued for a chunk of (balance, annual_rate, last_interest_date) rows.
+    Uses one decimal context for the whole chunk, banker's rounding to the cent.
+    """
+    accruals = []
+    with localcontext() as ctx:
+        ctx.prec = 28
+        for balance, rate, last_date in rows:
+            days = (as_of - last_date).days if last_date else 1
+            amount = balance * rate * days / (DAYS_IN_YEAR * 100)
+            accruals.append(amount.quantize(CENT, rounding=ROUND_HALF_EVEN))
+    return accruals
+
+
+def _iter_chunks(queryset, start_after, stop_at, chunk_size):
+    """Keyset iteration over accounts ordered by id"""
+    if stop_at:
+        queryset = queryset.filter(id__lte=stop_at)
+    last_id = start_after
+    while True:
+        chunk_qs = queryset.order_by('id')
+        if last_id:
+            chunk_qs = chunk_qs.filter(id__gt=last_id)
+        chunk = list(chunk_qs[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
+def accrue_daily_interest(as_of=None, start_after=None, stop_at=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Accrue interest for every eligible account up to `as_of` (defaults to today).
+    Re-running for the same day is a no-op because accounts already accrued are excluded.
+    """
+    as_of = as_of or timezone.localdate()
+    logger.info(f"Starting interest accrual for {as_of}, start_after={start_after}, stop_at={stop_at}")
+
+    queryset = eligible_interest_accounts(as_of).select_related('account_type').only(
+        'id', 'balance', 'accumulated_interest', 'last_interest_date', 'account_type__interest_rate'
+    )
+
+    processed = 0
+    total_accrued = Decimal('0.00')
+    last_account_id = start_after
+
+    for chunk in _iter_chunks(eligible_interest_accounts(as_of).only('id'), start_after, stop_at, chunk_size):
+        ids = [acc.id for acc in chunk]
+        with transaction.atomic():
+            # lock in id order, same as transfers, and re-read: a month-end posting or
+            # another accrual run may have changed the chunk since it was listed
+            accounts = list(
+                queryset.select_for_update(of=('self',)).filter(id__in=ids).order_by('id')
+            )
+            accruals = compute_accruals(
+                [(acc.balance, acc.account_type.interest_rate, acc.last_interest_date) for acc in accounts],
+                as_of
+            )
+            now = timezone.now()
+            for account, amount in zip(accounts, accruals):
+                account.accumulated_interest += amount
+                account.last_interest_date = as_of
+                account.updated_at = now
+
+            Account.objects.bulk_update(
+                accounts,
+                ['accumulated_interest', 'last_interest_date', 'updated_at'],
+                batch_size=chunk_size
+            )
+
+        processed += len(accounts)
+        total_accrued += sum(accruals, Decimal('0.00'))
+        last_account_id = ids[-1]
+        logger.debug(f"Accrued interest for {len(chunk)} accounts, last account {last_account_id}")
+
+    logger.info(f"Interest accrual done for {as_of}: {processed} accounts, {total_accrued} accrued")
+    return {
+        'as_of': str(as_of),
+        'accounts': processed,
+        'total_accrued': str(total_accrued),
+        'last_account_id': str(last_account_id) if last_account_id else None,
+    }
+
+
+def post_month_end_interest(period_end=None, start_after=None, stop_at=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Pay accumulated interest into each account as an INTEREST transaction.
+    Idempotent per (account, month) through the transaction idempotency key.
+    """
+    period_end = period_end or timezone.localdate()
+    period = period_end.strftime('%Y-%m')
+    initiated_by = get_system_user()
+    logger.info(f"Posting month-end interest for {period}")
+
+    queryset = Account.objects.filter(category='CUSTOMER', accumulated_interest__gt=0).only('id')
+
+    posted = 0
+    total_posted = Decimal('0.00')
+    last_account_id = start_after
+
+    for chunk in _iter_chunks(queryset, start_after, stop_at, chunk_size):
+        ids = [acc.id for acc in chunk]
+        with transaction.atomic():
+            # lock in id order, same as transfers, then the interest account last
+            accounts = list(
+                Account.objects.select_for_update().filter(id__in=ids, accumulated_interest__gt=0).order_by('id')
+            )
+            interest_account = get_internal_account(SYSTEM_INTEREST_ACCOUNT, lock=True)
+
+            keys = {acc.id: f"INTEREST-{acc.id}-{period}" for acc in accounts}
+            already_posted = set(
+                Transaction.objects.filter(idempotency_key__in=keys.values()).values_list('idempotency_key', flat=True)
+            )
+
+            now = timezone.now()
+            interest_balance = interest_account.balance
+            transactions_to_create = []
+            entries = []
+            updated_accounts = []
+
+            for account in accounts:
+                if keys[account.id] in already_posted:
+                    continue
+                amount = account.accumulated_interest
+                balance_before = account.balance
+                source_before = interest_balance
+                interest_balance -= amount
+
+                account.balance += amount
+                account.available_balance += amount
+                account.accumulated_interest = Decimal('0.00')
+                account.updated_at = now
+                updated_accounts.append(account)
+
+                txn = system_transaction(
+                    TransactionType.INTEREST,
+                    amount,
+                    keys[account.id],
+                    initiated_by,
+                    source_account=interest_account,
+                    destination_account=account,
+                    currency=account.currency,
+                    source_balance_before=source_before,
+                    source_balance_after=interest_balance,
+                    destination_balance_before=balance_before,
+                    destination_balance_after=account.balance,
+                    description=f"Interest for {period}",
+                    metadata={'period': period},
+                )
+                transactions_to_create.append(txn)
+                entries.append(LedgerEntry(
+                    transaction=txn,
+                    account=interest_account,
+                    entry_type=LedgerEntryType.DEBIT,
+                    amount=amount,
+                    balance_after=interest_balance,
+                    description=f"Interest paid to {account.account_number}"
+                ))
+                entries.append(LedgerEntry(
+                    transaction=txn,
+                    account=account,
+                    entry_type=LedgerEntryType.CREDIT,
+                    amount=amount,
+                    balance_after=account.balance,
+                    description=f"Interest for {period}"
+                ))
+
+            if updated_accounts:
+                chunk_total = interest_account.balance - interest_balance
+                Transaction.objects.bulk_create(transactions_to_create, batch_size=chunk_size)
+                LedgerEntry.objects.bulk_create(entries, batch_size=chunk_size * 2)
+                Account.objects.bulk_update(
+                    updated_accounts,
+                    ['balance', 'available_balance', 'accumulated_interest', 'updated_at'],
+                    batch_size=chunk_size
+                )
+                Account.objects.filter(id=interest_account.id).update(
+                    balance=F('balance') - chunk_total,
+                    available_balance=F('available_balance') - chunk_total,
+                    updated_at=now
+                )
+                refresh_after_commit([account.id for account in updated_accounts] + [interest_account.id])
+                posted += len(updated_accounts)
+                total_posted += chunk_total
+
+        last_account_id = chunk[-1].id
+        logger.debug(f"Posted interest for chunk ending at account {last_account_id}")
+
+    logger.info(f"Month-end interest posted for {period}: {posted} accounts, {total_posted} total")
+    return {
+        'period': period,
+        'accounts': posted,
+        'total_posted': str(total_posted),
+        'last_account_id': str(last_account_id) if last_account_id else None,
+    }
@@ -0,0 +1,442 @@
+"""
+Monthly range partitions of `transactions` and `ledger_entries` on created_at
+(PostgreSQL only, SQLite keeps plain tables).
+
+convert_table() turns the table Django created into a partitioned parent once,
+in a maintenance window: the old table is kept, renamed <table>_legacy, as the
+partition for everything before next month, and new months get their own
+partitions from then on. Each month's indexes stay the size of one month, so
+inserts and index maintenance cost the same in year five as in month one.
+
+Postgres only allows unique indexes that contain the partition key, so the
+primary key becomes (id, created_at). The other unique indexes
+(transaction_ref, idempotency_key, reversed_transaction) must stay unique
+across all months, so the parent gets them as plain indexes for lookups and a
+row trigger claims each row's values in partition_unique_keys, a plain table
+with a global primary key, in the inserting transaction. A second insert of the
+same key waits on the first and then fails with an IntegrityError, exactly as
+with a unique index. Keys outlive archiving, so an archived idempotency key or
+reference can never be reused. Foreign keys into a partitioned table would need
+the same (id, created_at) pair, so models referencing Transaction use
+db_constraint=False.
+
+ensure_partitions() creates the coming months ahead of time (a daily beat
+task). There is no default partition, so creating a month never scans one.
+archive_partitions() detaches months older than N: moved to the `archive`
+schema without their secondary indexes, or streamed to a zstd-compressed
+Parquet file and dropped. <table>_legacy is archived the same way once every
+month it covers (everything before the conversion month) is older than N.
+
+date_bounded() filters on created_at with constant bounds, which lets the
+planner skip every month outside the range.
+"""
+from datetime import date, datetime, time, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+
+PARTITION_KEY = 'created_at'
+UNIQUE_KEYS_TABLE = 'partition_unique_keys'
+PARTITIONED_TABLES = ('transactions', 'ledger_entries')
+ARCHIVE_MODES = ('table', 'parquet')
+ARCHIVE_SCHEMA = 'archive'
+
+
+class PartitionError(Exception):
+    """Raised when partitions cannot be converted, created or archived"""
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def partition_month(table, name):
+    """The month of a partition named by partition_name(), None for any other table"""
+    suffix = name.removeprefix(f"{table}_p")
+    if suffix == name or len(suffix) != 6 or not suffix.isdigit():
+        return None
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+def month_bound(month):
+    """Partition bounds are UTC midnights"""
+    return datetime.combine(month, time.min, tzinfo=dt_timezone.utc)
+
+
+def as_bound(value):
+    if isinstance(value, datetime):
+        return value
+    return timezone.make_aware(datetime.combine(value, time.min))
+
+
+def date_bounded(queryset, start=None, end=None, field=PARTITION_KEY):
+    """`start` <= field < `end`, dates meaning their midnight. Bounding created_at prunes partitions."""
+    if start is not None:
+        queryset = queryset.filter(**{f"{field}__gte": as_bound(start)})
+    if end is not None:
+        queryset = queryset.filter(**{f"{field}__lt": as_bound(end)})
+    return queryset
+
+
+def unique_index_columns(indexdef):
+    """(index name, [columns]) of a unique index, None for any other index"""
+    if not indexdef.startswith('CREATE UNIQUE INDEX'):
+        return None
+    match = re.fullmatch(r'CREATE UNIQUE INDEX (\S+) ON \S+ USING \w+ \(([^()]*)\)', indexdef)
+    if not match:
+        raise PartitionError(f"Cannot keep unique index across partitions: {indexdef}")
+    return match.group(1), [column.strip() for column in match.group(2).split(',')]
+
+
+def parent_index_sql(indexdef):
+    """
+    The CREATE INDEX of an existing index, for the partitioned parent of the
+    same name. Unique indexes become plain ones, their uniqueness is kept by
+    the partition_unique_keys trigger.
+    """
+    if unique_index_columns(indexdef) is None:
+        return indexdef
+    return indexdef.replace('CREATE UNIQUE INDEX', 'CREATE INDEX', 1)
+
+
+def sql_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def key_value(row, columns):
+    """The claimed value of a unique key, as text"""
+    return f"json_build_array({', '.join(f'{row}.{column}' for column in columns)})::text"
+
+
+def key_present(row, columns):
+    # like a unique index, a key with a NULL column claims nothing
+    return ' AND '.join(f"{row}.{column} IS NOT NULL" for column in columns)
+
+
+def unique_keys_trigger_sql(table, unique_indexes):
+    """
+    CREATE FUNCTION and CREATE TRIGGER keeping partition_unique_keys in step
+    with the rows of `table`, for unique_indexes [(index name, [columns])]
+    """
+    claim, release, update = [], [], []
+    for name, columns in unique_indexes:
+        where = f"table_name = {sql_literal(table)} AND index_name = {sql_literal(name)}"
+        insert = (
+            f"IF {key_present('NEW', columns)} THEN INSERT INTO {UNIQUE_KEYS_TABLE} VALUES "
+            f"({sql_literal(table)}, {sql_literal(name)}, {key_value('NEW', columns)}); END IF;"
+        )
+        delete = (
+            f"IF {key_present('OLD', columns)} THEN DELETE FROM {UNIQUE_KEYS_TABLE} "
+            f"WHERE {where} AND value = {key_value('OLD', columns)}; END IF;"
+        )
+        claim.append(insert)
+        release.append(delete)
+        update.append(f"IF {key_value('NEW', columns)} IS DISTINCT FROM {key_value('OLD', columns)} THEN {delete} {insert} END IF;")
+
+    function = f"{table}_unique_keys"
+    return [
+        f"CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+        f"IF TG_OP = 'INSERT' THEN {' '.join(claim)} "
+        f"ELSIF TG_OP = 'UPDATE' THEN {' '.join(update)} "
+        f"ELSE {' '.join(release)} END IF; "
+        f"RETURN NULL; END $$",
+        f"CREATE TRIGGER {function} AFTER INSERT OR UPDATE OR DELETE ON {table} FOR EACH ROW EXECUTE FUNCTION {function}()",
+    ]
+
+
+def backfill_unique_keys_sql(table, source, name, columns):
+    """Claim the keys of the rows already in `source`"""
+    return (
+        f"INSERT INTO {UNIQUE_KEYS_TABLE} SELECT {sql_literal(table)}, {sql_literal(name)}, {key_value(source, columns)} "
+        f"FROM {source} WHERE {key_present(source, columns)}"
+    )
+
+
+def postgres(alias='default'):
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        raise PartitionError("Table partitioning needs PostgreSQL")
+    return connection
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+    return cursor.fetchone() is not None
+
+
+def partitions(cursor, table):
+    """[(name, month)] of the monthly partitions, oldest first"""
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(%s)",
+        [table]
+    )
+    named = [(name, partition_month(table, name)) for (name,) in cursor.fetchall()]
+    return sorted((name, month) for name, month in named if month)
+
+
+def legacy_bound(cursor, table):
+    """The month <table>_legacy ends before, None once it is gone"""
+    cursor.execute(
+        "SELECT pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(%s) AND child.relname = %s",
+        [table, f"{table}_legacy"]
+    )
+    row = cursor.fetchone()
+    match = re.search(r"TO \('(\d{4})-(\d{2})-(\d{2})", row[0]) if row else None
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def create_partition(cursor, table, month):
+    quote = cursor.db.ops.quote_name
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {quote(partition_name(table, month))} PARTITION OF {quote(table)} "
+        f"FOR VALUES FROM ('{month_bound(month).isoformat()}') TO ('{month_bound(add_months(month, 1)).isoformat()}')"
+    )
+
+
+def convert_table(table, months_ahead=None, today=None):
+    """
+    Make `table` a partitioned parent. Everything before next month stays in
+    <table>_legacy; holds an exclusive lock on the table until it commits.
+    """
+    months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    first_month = add_months(month_start(today or timezone.now()), 1)
+    legacy = f"{table}_legacy"
+    connection = postgres()
+    quote = connection.ops.quote_name
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            raise PartitionError(f"{table} is already partitioned")
+        cursor.execute(
+            "SELECT conname, conrelid::regclass::text FROM pg_constraint WHERE contype = 'f' AND confrelid = to_regclass(%s)",
+            [table]
+        )
+        references = cursor.fetchall()
+        if references:
+            names = ', '.join(f"{name} on {referencing}" for name, referencing in references)
+            raise PartitionError(f"Foreign keys still reference {table} ({names}), migrate the db_constraint=False models first")
+
+        cursor.execute(
+            "SELECT index_class.relname, pg_get_indexdef(pg_index.indexrelid), pg_index.indisprimary "
+            "FROM pg_index JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid WHERE pg_index.indrelid = to_regclass(%s)",
+            [table]
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE contype = 'f' AND conrelid = to_regclass(%s)",
+            [table]
+        )
+        foreign_keys = cursor.fetchall()
+
+        # the parent takes over the table's name and its index names
+        cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(legacy)}")
+        for name, _, _ in indexes:
+            cursor.execute(f"ALTER INDEX {quote(name)} RENAME TO {quote(name[:56] + '_legacy')}")
+        cursor.execute(
+            f"CREATE TABLE {quote(table)} (LIKE {quote(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) "
+            f"PARTITION BY RANGE ({quote(PARTITION_KEY)})"
+        )
+        cursor.execute(f"ALTER TABLE {quote(table)} ADD PRIMARY KEY (id, {quote(PARTITION_KEY)})")
+        unique_indexes = []
+        for _, indexdef, primary in indexes:
+            if not primary:
+                cursor.execute(parent_index_sql(indexdef))
+                unique = unique_index_columns(indexdef)
+                if unique:
+                    unique_indexes.append(unique)
+        if unique_indexes:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {UNIQUE_KEYS_TABLE} (table_name text NOT NULL, index_name text NOT NULL, "
+                f"value text NOT NULL, PRIMARY KEY (table_name, index_name, value))"
+            )
+            for name, columns in unique_indexes:
+                cursor.execute(backfill_unique_keys_sql(table, quote(legacy), name, columns))
+            for statement in unique_keys_trigger_sql(table, unique_indexes):
+                cursor.execute(statement)
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}")
+
+        # a validated CHECK matching the bound lets ATTACH skip its own scan
+        bound = month_bound(first_month).isoformat()
+        check = quote(f"{legacy}_bound")
+        cursor.execute(
+            f"ALTER TABLE {quote(legacy)} ADD CONSTRAINT {check} "
+            f"CHECK ({quote(PARTITION_KEY)} IS NOT NULL AND {quote(PARTITION_KEY)} < '{bound}')"
+        )
+        cursor.execute(f"ALTER TABLE {quote(table)} ATTACH PARTITION {quote(legacy)} FOR VALUES FROM (MINVALUE) TO ('{bound}')")
+        cursor.execute(f"ALTER TABLE {quote(legacy)} DROP CONSTRAINT {check}")
+
+        for offset in range(months_ahead + 1):
+            create_partition(cursor, table, add_months(first_month, offset))
+
+    logger.info(f"{table} partitioned by month from {first_month}, older rows in {legacy}")
+    return first_month
+
+
+def ensure_partitions(table, months_ahead=None, today=None):
+    """Create this month's and the next `months_ahead` partitions that are missing. Returns their names."""
+    months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    with postgres().cursor() as cursor:
+        if not is_partitioned(cursor, table):
+            raise PartitionError(f"{table} is not partitioned, run partition_tables --convert first")
+        existing = {month for _, month in partitions(cursor, table)}
+        start = month_start(today or timezone.now())
+        if existing:
+            # months before the first partition belong to <table>_legacy
+            start = max(start, min(existing))
+        created = []
+        for offset in range(months_ahead + 1):
+            month = add_months(start, offset)
+            if month not in existing:
+                create_partition(cursor, table, month)
+                created.append(partition_name(table, month))
+
+    if created:
+        logger.info(f"Created partitions {', '.join(created)}")
+    return created
+
+
+def archive_partitions(table, keep_months, mode='table', archive_dir=None, today=None):
+    """
+    Detach the partitions of months older than the last `keep_months` and
+    archive them, <table>_legacy (month None) too once all of it is older.
+    Returns [{'partition', 'month', 'archived_to'}].
+    """
+    if mode not in ARCHIVE_MODES:
+        raise PartitionError(f"Archive mode must be one of: {', '.join(ARCHIVE_MODES)}")
+    if keep_months < 1:
+        raise PartitionError("At least the current month must be kept")
+    cutoff = add_months(month_start(today or timezone.now()), -(keep_months - 1))
+    connection = postgres()
+    quote = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        old = [(name, month) for name, month in partitions(cursor, table) if month < cutoff]
+        bound = legacy_bound(cursor, table)
+        if bound is not None and bound <= cutoff:
+            old.insert(0, (f"{table}_legacy", None))
+
+    archived = []
+    for name, month in old:
+        # CONCURRENTLY takes no lock that blocks inserts, it cannot run inside a transaction
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)} CONCURRENTLY")
+        if mode == 'parquet':
+            archived_to = str(export_parquet(name, Path(archive_dir or settings.PARTITION_ARCHIVE_DIR)))
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {quote(name)}")
+        else:
+            archived_to = f"{ARCHIVE_SCHEMA}.{name}"
+            archive_table(connection, name)
+        logger.info(f"Archived partition {name} to {archived_to}")
+        archived.append({'partition': name, 'month': month, 'archived_to': archived_to})
+    return archived
+
+
+def archive_table(connection, name):
+    """Keep a detached partition in the archive schema, without its secondary indexes"""
+    quote = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {quote(ARCHIVE_SCHEMA)}")
+        cursor.execute(f"ALTER TABLE {quote(name)} SET SCHEMA {quote(ARCHIVE_SCHEMA)}")
+        cursor.execute(
+            "SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = to_regclass(%s) AND NOT indisprimary",
+            [f"{ARCHIVE_SCHEMA}.{name}"]
+        )
+        for (index,) in cursor.fetchall():
+            cursor.execute(f"DROP INDEX {index}")
+        if settings.PARTITION_ARCHIVE_TABLESPACE:
+            cursor.execute(f"ALTER TABLE {quote(ARCHIVE_SCHEMA)}.{quote(name)} SET TABLESPACE {quote(settings.PARTITION_ARCHIVE_TABLESPACE)}")
+
+
+PARQUET_TYPES = {
+    'uuid': 'string',
+    'character varying': 'string',
+    'text': 'string',
+    'jsonb': 'string',
+    'json': 'string',
+    'integer': 'int64',
+    'bigint': 'int64',
+    'smallint': 'int64',
+    'boolean': 'bool',
+    'date': 'date32',
+}
+
+
+def parquet_schema(pa, columns):
+    fields = []
+    for name, data_type, precision, scale in columns:
+        if data_type == 'numeric':
+            field_type = pa.decimal128(precision or 38, scale or 0)
+        elif data_type.startswith('timestamp'):
+            field_type = pa.timestamp('us', tz='UTC')
+        else:
+            field_type = getattr(pa, PARQUET_TYPES.get(data_type, 'string'))()
+        fields.append(pa.field(name, field_type))
+    return pa.schema(fields)
+
+
+def parquet_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if value is None or isinstance(value, (bool, int, str, Decimal, datetime, date)):
+        return value
+    return str(value)
+
+
+def export_parquet(name, archive_dir, chunk_size=50000):
+    """Stream a detached partition into <archive_dir>/<name>.parquet, returns the path"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise PartitionError("Parquet archives need pyarrow installed")
+
+    connection = postgres(settings.DATABASE_EXPORT_ALIAS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT column_name, data_type, numeric_precision, numeric_scale FROM information_schema.columns "
+            "WHERE table_name = %s ORDER BY ordinal_position",
+            [name]
+        )
+        columns = cursor.fetchall()
+    schema = parquet_schema(pa, columns)
+
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"{name}.parquet"
+    partial = path.with_suffix('.parquet.partial')
+    rows = 0
+    with pq.ParquetWriter(partial, schema, compression='zstd') as writer:
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(f"SELECT * FROM {connection.ops.quote_name(name)}")
+            while batch := cursor.fetchmany(chunk_size):
+                values = {
+                    column: [parquet_value(row[position]) for row in batch]
+                    for position, (column, _, _, _) in enumerate(columns)
+                }
+                writer.write_table(pa.Table.from_pydict(values, schema=schema))
+                rows += len(batch)
+    # only a complete file replaces a previous one
+    os.replace(partial, path)
+    logger.info(f"Wrote {rows} rows of {name} to {path}")
+    return path
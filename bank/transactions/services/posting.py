@@ -0,0 +1,76 @@
+from decimal import Decimal
+from django.utils import timezone
+from django.core.exceptions import ImproperlyConfigured
+from .utility import generate_transaction_ref
+
+
+# internal (category=INTERNAL) accounts the system posts against
+SYSTEM_FEE_ACCOUNT = 'SYSTEM_FEE_ACCOUNT'
+SYSTEM_INTEREST_ACCOUNT = 'SYSTEM_INTEREST_ACCOUNT'
+SYSTEM_MPESA_ACCOUNT = 'SYSTEM_MPESA_ACCOUNT'
+SYSTEM_CARD_ACCOUNT = 'SYSTEM_CARD_ACCOUNT'
+
+CENT = Decimal('0.01')
+
+
+def get_system_user():
+    """
+    User recorded as `initiated_by` for jobs that are not triggered by a person
+    (interest, fees, reversals). Uses the first superuser created by setup_permission.
+    """
+    from auth_service.models import User
+
+    user = User.objects.filter(is_superuser=True).order_by('date_joined').first()
+    if not user:
+        raise ImproperlyConfigured("No superuser found to run system postings, run setup_permission first")
+    return user
+
+
+def get_internal_account(account_number, lock=False):
+    """
+    Fetch an internal system account, optionally locking it for the current transaction
+    """
+    from accounts.models import Account
+
+    queryset = Account.objects.filter(account_number=account_number, category='INTERNAL')
+    if lock:
+        queryset = queryset.select_for_update()
+
+    account = queryset.first()
+    if not account:
+        raise ImproperlyConfigured(f"Internal account {account_number} is not configured")
+    return account
+
+
+def system_transaction(transaction_type, amount, idempotency_key, initiated_by, **fields):
+    """
+    Build (unsaved) a completed transaction for a system posting.
+    The caller is expected to persist it with bulk_create alongside its ledger entries.
+    """
+    from transactions.models import Transaction, TransactionStatus
+
+    now = timezone.now()
+    return Transaction(
+        transaction_ref=generate_transaction_ref(),
+        transaction_type=transaction_type,
+        trans_status=TransactionStatus.COMPLETED,
+        amount=amount,
+        idempotency_key=idempotency_key,
+        initiated_by=initiated_by,
+        completed_at=now,
+        **fields
+    )
+
+
+def lock_accounts(*account_ids):
+    """
+    Lock accounts with SELECT ... FOR UPDATE in primary key order so that two
+    postings touching the same pair of accounts can never deadlock.
+    Returns a dict of account id -> locked Account.
+    """
+    from accounts.models import Account
+    from bank.routers import PRIMARY
+
+    ordered_ids = sorted({account_id for account_id in account_ids if account_id})
+    accounts = Account.objects.using(PRIMARY).select_for_update().filter(id__in=ordered_ids).order_by('id')
+    return {account.id: account for account in accounts}
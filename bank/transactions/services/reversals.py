@@ -0,0 +1,201 @@
+"""
+Reversal execution for ReversalRequest.
+
+A reversal moves (part of) the original amount back from the original
+destination to the original source as a REVERSAL transaction with mirrored
+ledger entries. Accounts are locked in the same id order as transfers, and the
+cumulative amount already reversed is checked with an aggregate over the
+(original_transaction, status) index before money moves.
+"""
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from accounts.services.balances import refresh_after_commit
+from ..models import Transaction, LedgerEntry, LedgerEntryType, TransactionType, TransactionStatus, ReversalRequest
+from .posting import get_system_user, lock_accounts, system_transaction
+import logging
+
+logger = logging.getLogger(__name__)
+
+ReversalStatus = ReversalRequest.ReversalStatus
+
+
+class ReversalError(Exception):
+    """Raised when a reversal request cannot be executed"""
+
+
+def approve_reversals(request_ids, approved_by):
+    """
+    Approve many PENDING reversal requests in one statement.
+    Returns the ids that were actually moved to APPROVED.
+    """
+    pending = ReversalRequest.objects.filter(id__in=request_ids, status=ReversalStatus.PENDING)
+    approved_ids = list(pending.values_list('id', flat=True))
+
+    ReversalRequest.objects.filter(id__in=approved_ids, status=ReversalStatus.PENDING).update(
+        status=ReversalStatus.APPROVED,
+        approved_by=approved_by,
+        approved_at=timezone.now(),
+        updated_at=timezone.now()
+    )
+    logger.info(f"{len(approved_ids)} reversal requests approved by {approved_by.id}")
+    return approved_ids
+
+
+def reversed_amount(original_transaction_id):
+    """Total already reversed for a transaction (completed reversals only)"""
+    return ReversalRequest.objects.filter(
+        original_transaction_id=original_transaction_id,
+        status=ReversalStatus.COMPLETED
+    ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+
+
+@transaction.atomic
+def process_reversal(request_id, initiated_by=None):
+    """
+    Execute one APPROVED (or claimed PROCESSING) reversal request.
+    Raises ReversalError when the request is not valid, leaving balances untouched.
+    """
+    reversal = ReversalRequest.objects.select_for_update().select_related('original_transaction').get(id=request_id)
+
+    if reversal.status not in (ReversalStatus.APPROVED, ReversalStatus.PROCESSING):
+        raise ReversalError(f"Reversal {reversal.id} is {reversal.status}, expected APPROVED")
+
+    original = reversal.original_transaction
+    if original.trans_status != TransactionStatus.COMPLETED:
+        raise ReversalError(f"Original transaction {original.transaction_ref} is {original.trans_status}")
+
+    if not original.source_account_id or not original.destination_account_id:
+        raise ReversalError(f"Original transaction {original.transaction_ref} has no counterparty to reverse")
+
+    # money goes back from the original destination to the original source
+    locked = lock_accounts(original.source_account_id, original.destination_account_id)
+    debit_account = locked[original.destination_account_id]
+    credit_account = locked[original.source_account_id]
+
+    already_reversed = reversed_amount(original.id)
+    if already_reversed + reversal.amount > original.amount:
+        raise ReversalError(
+            f"Reversal amount {reversal.amount} exceeds remaining reversible amount "
+            f"{original.amount - already_reversed}"
+        )
+
+    if debit_account.available_balance < reversal.amount:
+        raise ReversalError(
+            f"Insufficient funds on {debit_account.account_number} to reverse {reversal.amount}"
+        )
+
+    fully_reversed = already_reversed + reversal.amount == original.amount
+    now = timezone.now()
+
+    reversal_txn = system_transaction(
+        TransactionType.REVERSAL,
+        reversal.amount,
+        f"REVERSAL-{reversal.id}",
+        initiated_by or reversal.approved_by or get_system_user(),
+        source_account=debit_account,
+        destination_account=credit_account,
+        currency=original.currency,
+        source_balance_before=debit_account.balance,
+        source_balance_after=debit_account.balance - reversal.amount,
+        destination_balance_before=credit_account.balance,
+        destination_balance_after=credit_account.balance + reversal.amount,
+        description=f"Reversal of {original.transaction_ref} ({reversal.get_reason_display()})",
+        metadata={
+            'original_transaction_ref': original.transaction_ref,
+            'reversal_request_id': str(reversal.id),
+            'partial': not fully_reversed,
+        },
+        # reversed_transaction is one-to-one, so only the reversal that completes it links back
+        reversed_transaction=original if fully_reversed else None,
+    )
+    reversal_txn.save()
+
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(
+            transaction=reversal_txn,
+            account=debit_account,
+            entry_type=LedgerEntryType.DEBIT,
+            amount=reversal.amount,
+            balance_after=reversal_txn.source_balance_after,
+            description=f"Reversal of {original.transaction_ref}"
+        ),
+        LedgerEntry(
+            transaction=reversal_txn,
+            account=credit_account,
+            entry_type=LedgerEntryType.CREDIT,
+            amount=reversal.amount,
+            balance_after=reversal_txn.destination_balance_after,
+            description=f"Reversal of {original.transaction_ref}"
+        ),
+    ])
+
+    type(debit_account).objects.filter(id=debit_account.id).update(
+        balance=F('balance') - reversal.amount,
+        available_balance=F('available_balance') - reversal.amount,
+        updated_at=now
+    )
+    type(credit_account).objects.filter(id=credit_account.id).update(
+        balance=F('balance') + reversal.amount,
+        available_balance=F('available_balance') + reversal.amount,
+        updated_at=now
+    )
+    refresh_after_commit([debit_account.id, credit_account.id])
+
+    if fully_reversed:
+        Transaction.objects.filter(id=original.id).update(
+            trans_status=TransactionStatus.REVERSED,
+            version=F('version') + 1,
+            updated_at=now
+        )
+
+    reversal.status = ReversalStatus.COMPLETED
+    reversal.reversal_transaction = reversal_txn
+    reversal.completed_at = now
+    reversal.save(update_fields=['status', 'reversal_transaction', 'completed_at', 'updated_at'])
+
+    logger.info(f"Reversal {reversal.id} completed with transaction {reversal_txn.transaction_ref}")
+    return reversal_txn
+
+
+def process_reversal_batch(request_ids=None, limit=500):
+    """
+    Claim a batch of APPROVED reversals and execute them one by one.
+    Each reversal commits on its own so one failure does not roll back the batch.
+    """
+    approved = ReversalRequest.objects.filter(status=ReversalStatus.APPROVED).order_by('approved_at')
+    if request_ids:
+        approved = approved.filter(id__in=request_ids)
+
+    # the claim commits on its own: rows another batch holds are skipped, not processed twice
+    with transaction.atomic():
+        # locked and still APPROVED, so the update below matches every one of them
+        claimed_ids = list(approved.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+        ReversalRequest.objects.filter(id__in=claimed_ids, status=ReversalStatus.APPROVED).update(
+            status=ReversalStatus.PROCESSING,
+            updated_at=timezone.now()
+        )
+
+    results = {'completed': [], 'failed': []}
+
+    for request_id in claimed_ids:
+        try:
+            process_reversal(request_id)
+            results['completed'].append(str(request_id))
+        except Exception as e:
+            # the atomic block rolled back, so no money moved for this request
+            if isinstance(e, ReversalError):
+                logger.warning(f"Reversal {request_id} failed: {str(e)}")
+            else:
+                logger.exception(f"Unexpected error processing reversal {request_id}: {str(e)}")
+            # only our claim: a reversal that completed elsewhere keeps its status
+            ReversalRequest.objects.filter(id=request_id, status=ReversalStatus.PROCESSING).update(
+                status=ReversalStatus.FAILED,
+                notes=str(e),
+                updated_at=timezone.now()
+            )
+            results['failed'].append({'id': str(request_id), 'error': str(e)})
+
+    logger.info(f"Reversal batch done: {len(results['completed'])} completed, {len(results['failed'])} failed")
+    return results
@@ -0,0 +1,130 @@
+from celery import shared_task
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+from datetime import timedelta
+from .models import Transaction, TransactionStatus
+from .metrics import transactions_failed_total
+from .services import interest, fees, partitions, reversals
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def accrue_interest_task(start_after=None):
+    """
+    Daily interest job, schedule through celery beat.
+    On the last day of the month the accrued interest is also posted.
+    """
+    today = timezone.localdate()
+    result = interest.accrue_daily_interest(as_of=today, start_after=start_after)
+
+    if (today + timedelta(days=1)).day == 1:
+        result['posting'] = interest.post_month_end_interest(period_end=today)
+
+    return result
+
+
+@shared_task
+def post_interest_task(start_after=None):
+    """Re-run (or resume) the month-end interest posting"""
+    return interest.post_month_end_interest(start_after=start_after)
+
+
+@shared_task
+def sweep_maintenance_fees_task(account_type=None, period=None):
+    """
+    Monthly maintenance fee sweep, for one account type or every type with a fee configured
+    """
+    from accounts.models import AccountType
+
+    account_types = AccountType.objects.filter(monthly_maintenance_fee__gt=0, is_active=True)
+    if account_type:
+        account_types = account_types.filter(name=account_type)
+
+    return [fees.sweep_maintenance_fees(acc_type, period=period) for acc_type in account_types]
+
+
+@shared_task
+def process_reversals_task(request_ids=None):
+    """Execute approved reversal requests, all pending approvals when no ids are given"""
+    return reversals.process_reversal_batch(request_ids=request_ids)
+
+
+@shared_task
+def ensure_partitions_task():
+    """Create the coming months' partitions of the partitioned tables, nothing to do off Postgres"""
+    if connection.vendor != 'postgresql':
+        return {}
+    created = {}
+    for table in partitions.PARTITIONED_TABLES:
+        try:
+            created[table] = partitions.ensure_partitions(table)
+        except partitions.PartitionError as e:
+            logger.warning(f"Partitions of {table} not ensured: {str(e)}")
+    return created
+
+
+def transfer_lane(source_account_id):
+    """
+    Lane for a source account. crc32 rather than hash() so every web process
+    agrees on the lane regardless of PYTHONHASHSEED.
+    """
+    return zlib.crc32(str(source_account_id).encode()) % settings.TRANSFER_LANES
+
+
+def transfer_queue(source_account_id):
+    """Lane queue for a queued transfer, every account always maps to the same lane"""
+    return f"transfers.lane.{transfer_lane(source_account_id)}"
+
+
+def enqueue_transfer(transaction_obj):
+    """Hand a persisted PENDING transfer to the transfer workers"""
+    return execute_transaction_task.apply_async(
+        args=[str(transaction_obj.id)],
+        queue=transfer_queue(transaction_obj.source_account_id)
+    )
+
+
+@shared_task(bind=True, acks_late=True, max_retries=3)
+def execute_transaction_task(self, transaction_id):
+    """
+    Execute a queued transfer. The row is locked before its status is checked,
+    so a redelivered message waits for the first delivery and then finds the
+    transfer no longer PENDING.
+    """
+    # views imports this module, so import the executor lazily
+    from .views import execute_transaction
+
+    try:
+        with transaction.atomic():
+            transaction_obj = Transaction.objects.select_for_update().filter(id=transaction_id).first()
+            if not transaction_obj:
+                logger.warning(f"Queued transaction {transaction_id} not found")
+                return {'transaction_id': transaction_id, 'status': None}
+
+            if transaction_obj.trans_status != TransactionStatus.PENDING:
+                logger.info(f"Queued transaction {transaction_id} already {transaction_obj.trans_status}, skipping")
+                return {'transaction_id': transaction_id, 'status': transaction_obj.trans_status}
+
+            execute_transaction(transaction_obj)
+    except OperationalError as e:
+        # lock timeout / deadlock victim, the atomic block rolled back so it is still PENDING
+        logger.warning(f"Transient database error executing {transaction_id}: {str(e)}")
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+    except Exception as e:
+        logger.error(f"Queued transaction {transaction_id} failed: {str(e)}")
+        Transaction.objects.filter(id=transaction_id, trans_status=TransactionStatus.PENDING).update(
+            trans_status=TransactionStatus.FAILED,
+            last_error=str(e),
+            updated_at=timezone.now()
+        )
+        transactions_failed_total.labels(
+            transaction_type=transaction_obj.transaction_type,
+            failure_reason='execution_error'
+        ).inc()
+        return {'transaction_id': transaction_id, 'status': TransactionStatus.FAILED}
+
+    return {'transaction_id': transaction_id, 'status': TransactionStatus.COMPLETED}
@@ -1,3 +1,650 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connections, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from auth_service.models import Role, User, CustomerProfile
+from accounts.models import Account, AccountType, AccountLimit
+from .models import *
+from .views import calculate_transaction_fee
+from .tasks import execute_transaction_task, transfer_lane, transfer_queue
+from .services import interest, fees, partitions, reversals
+from bank import cache as shared_cache
+from bank.routers import PRIMARY, PrimaryReplicaRouter, choose_replica, pin_to_primary, read_alias, replica_lag
+from unittest import mock
+import time
+
+
+def create_customer_account(email, account_type, balance=Decimal('0.00'), **extra):
+    """Create a customer with one active account"""
+    role, _ = Role.objects.get_or_create(role_name='Customer', category='Customer')
+    user = User.objects.create_user(email=email, password='testpass123', role=role)
+    customer = CustomerProfile.objects.create(
+        user=user,
+        customer_id=f"CUST-{email}",
+        phone_number=f"+2547{abs(hash(email)) % 10**8:08d}"
+    )
+    return Account.objects.create(
+        customer=customer,
+        account_type=account_type,
+        balance=balance,
+        available_balance=balance,
+        status='ACTIVE',
+        **extra
+    )
+
+
+def create_internal_account(account_number, account_type, balance=Decimal('0.00')):
+    return Account.objects.create(
+        account_number=account_number,
+        category='INTERNAL',
+        account_type=account_type,
+        balance=balance,
+        available_balance=balance,
+        status='ACTIVE'
+    )
+
+
+class InterestAccrualTest(TestCase):
+    """Test suite for daily interest accrual and month-end posting"""
+
+    def setUp(self):
+        admin_role = Role.objects.create(role_name='Administrator', category='SYSTEM')
+        self.admin = User.objects.create_superuser(email='admin@test.com', password='testpass123', role=admin_role)
+        self.savings = AccountType.objects.create(
+            name='SAVINGS', code='SAV', description='Savings', interest_rate=Decimal('3.65')
+        )
+        self.business = AccountType.objects.create(
+            name='BUSINESS', code='BUS', description='Business', interest_rate=Decimal('0.00')
+        )
+        self.interest_account = create_internal_account(
+            'SYSTEM_INTEREST_ACCOUNT', self.business, balance=Decimal('1000000.00')
+        )
+        self.account = create_customer_account('saver@test.com', self.savings, balance=Decimal('100000.00'))
+        self.no_interest = create_customer_account('biz@test.com', self.business, balance=Decimal('100000.00'))
+
+    def test_compute_accruals_rounds_to_cent(self):
+        """Test decimal accrual for a single day and several days"""
+        as_of = date(2026, 1, 10)
+        accruals = interest.compute_accruals([
+            (Decimal('100000.00'), Decimal('3.65'), None),
+            (Decimal('100000.00'), Decimal('3.65'), date(2026, 1, 7)),
+            (Decimal('1.00'), Decimal('3.65'), None),
+        ], as_of)
+        self.assertEqual(accruals, [Decimal('10.00'), Decimal('30.00'), Decimal('0.00')])
+
+    def test_accrual_updates_eligible_accounts_only(self):
+        """Test accrual skips zero-rate products and is idempotent per day"""
+        as_of = date(2026, 1, 10)
+        result = interest.accrue_daily_interest(as_of=as_of)
+        self.assertEqual(result['accounts'], 1)
+
+        self.account.refresh_from_db()
+        self.no_interest.refresh_from_db()
+        self.assertEqual(self.account.accumulated_interest, Decimal('10.00'))
+        self.assertEqual(self.account.last_interest_date, as_of)
+        self.assertEqual(self.no_interest.accumulated_interest, Decimal('0.00'))
+
+        # second run for the same day does nothing
+        result = interest.accrue_daily_interest(as_of=as_of)
+        self.assertEqual(result['accounts'], 0)
+
+    def test_accrual_resumes_after_account_id(self):
+        """Test resuming accrual after the last processed account"""
+        second = create_customer_account('saver2@test.com', self.savings, balance=Decimal('100000.00'))
+        first_id = min(self.account.id, second.id)
+
+        result = interest.accrue_daily_interest(as_of=date(2026, 1, 10), start_after=first_id)
+        self.assertEqual(result['accounts'], 1)
+        self.assertEqual(result['last_account_id'], str(max(self.account.id, second.id)))
+
+    def test_month_end_posting_creates_balanced_ledger(self):
+        """Test posting pays interest with a debit/credit pair and only once per month"""
+        self.account.accumulated_interest = Decimal('310.00')
+        self.account.save()
+
+        result = interest.post_month_end_interest(period_end=date(2026, 1, 31))
+        self.assertEqual(result['accounts'], 1)
+
+        self.account.refresh_from_db()
+        self.interest_account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('100310.00'))
+        self.assertEqual(self.account.available_balance, Decimal('100310.00'))
+        self.assertEqual(self.account.accumulated_interest, Decimal('0.00'))
+        self.assertEqual(self.interest_account.balance, Decimal('999690.00'))
+
+        txn = Transaction.objects.get(transaction_type=TransactionType.INTEREST)
+        self.assertEqual(txn.idempotency_key, f"INTEREST-{self.account.id}-2026-01")
+        entries = txn.ledger_entries.all()
+        self.assertEqual(entries.filter(entry_type=LedgerEntryType.DEBIT).get().account, self.interest_account)
+        self.assertEqual(entries.filter(entry_type=LedgerEntryType.CREDIT).get().account, self.account)
+
+        # accumulate again in the same month: the period key prevents a second payout
+        self.account.accumulated_interest = Decimal('5.00')
+        self.account.save()
+        result = interest.post_month_end_interest(period_end=date(2026, 1, 31))
+        self.assertEqual(result['accounts'], 0)
+
+
+class MaintenanceFeeSweepTest(TestCase):
+    """Test suite for the monthly maintenance fee sweep"""
+
+    def setUp(self):
+        admin_role = Role.objects.create(role_name='Administrator', category='SYSTEM')
+        User.objects.create_superuser(email='admin@test.com', password='testpass123', role=admin_role)
+        self.savings = AccountType.objects.create(
+            name='SAVINGS', code='SAV', description='Savings',
+            monthly_maintenance_fee=Decimal('50.00'), minimum_balance=Decimal('100.00')
+        )
+        self.fee_account = create_internal_account('SYSTEM_FEE_ACCOUNT', self.savings)
+        self.rich = create_customer_account('rich@test.com', self.savings, balance=Decimal('1000.00'))
+        self.poor = create_customer_account('poor@test.com', self.savings, balance=Decimal('120.00'))
+
+    def test_sweep_charges_and_respects_minimum_balance(self):
+        """Test eligible accounts are debited and the fee account credited"""
+        result = fees.sweep_maintenance_fees(self.savings, period='2026-01')
+        self.assertEqual(result['charged'], 1)
+        self.assertEqual(result['insufficient_funds'], 1)
+
+        self.rich.refresh_from_db()
+        self.poor.refresh_from_db()
+        self.fee_account.refresh_from_db()
+        self.assertEqual(self.rich.balance, Decimal('950.00'))
+        self.assertEqual(self.poor.balance, Decimal('120.00'))
+        self.assertEqual(self.fee_account.balance, Decimal('50.00'))
+
+        txn = Transaction.objects.get(transaction_type=TransactionType.FEE)
+        self.assertEqual(txn.source_account, self.rich)
+        self.assertEqual(txn.ledger_entries.count(), 2)
+
+    def test_sweep_is_idempotent_per_period(self):
+        """Test the same period is never charged twice"""
+        fees.sweep_maintenance_fees(self.savings, period='2026-01')
+        result = fees.sweep_maintenance_fees(self.savings, period='2026-01')
+        self.assertEqual(result['charged'], 0)
+        self.assertEqual(result['already_charged'], 1)
+
+        result = fees.sweep_maintenance_fees(self.savings, period='2026-02')
+        self.assertEqual(result['charged'], 1)
+
+    def test_account_frozen_after_listing_is_skipped(self):
+        """Test eligibility is checked again once the chunk is locked"""
+        atomic = transaction.atomic
+
+        def freeze_then_lock(*args, **kwargs):
+            # the account is frozen after the chunk ids were read, before they are locked
+            Account.objects.filter(id=self.rich.id).update(status='FROZEN')
+            return atomic(*args, **kwargs)
+
+        with mock.patch.object(fees.transaction, 'atomic', freeze_then_lock):
+            result = fees.sweep_maintenance_fees(self.savings, period='2026-01')
+        self.assertEqual(result['charged'], 0)
+        self.rich.refresh_from_db()
+        self.assertEqual(self.rich.balance, Decimal('1000.00'))
+        self.assertFalse(Transaction.objects.filter(transaction_type=TransactionType.FEE).exists())
+
+    def test_overdraft_limit_allows_negative_balance(self):
+        """Test overdraft accounts may be charged down to the overdraft limit"""
+        self.savings.overdraft_allowed = True
+        self.savings.overdraft_limit = Decimal('40.00')
+        self.savings.save()
+        self.poor.balance = self.poor.available_balance = Decimal('10.00')
+        self.poor.save()
+
+        result = fees.sweep_maintenance_fees(self.savings, period='2026-01')
+        self.assertEqual(result['charged'], 2)
+        self.poor.refresh_from_db()
+        self.assertEqual(self.poor.balance, Decimal('-40.00'))
+
+
+class ReversalProcessingTest(TestCase):
+    """Test suite for reversal approval and execution"""
+
+    def setUp(self):
+        admin_role = Role.objects.create(role_name='Administrator', category='SYSTEM')
+        self.admin = User.objects.create_superuser(email='admin@test.com', password='testpass123', role=admin_role)
+        self.savings = AccountType.objects.create(name='SAVINGS', code='SAV', description='Savings')
+        self.sender = create_customer_account('sender@test.com', self.savings, balance=Decimal('500.00'))
+        self.receiver = create_customer_account('receiver@test.com', self.savings, balance=Decimal('1500.00'))
+        self.original = Transaction.objects.create(
+            transaction_ref='TXN-ORIGINAL',
+            transaction_type=TransactionType.INTERNAL_TRANSFER,
+            trans_status=TransactionStatus.COMPLETED,
+            source_account=self.sender,
+            destination_account=self.receiver,
+            amount=Decimal('1000.00'),
+            initiated_by=self.sender.customer.user,
+            idempotency_key='original-transfer',
+            completed_at=timezone.now()
+        )
+
+    def request_reversal(self, amount):
+        return ReversalRequest.objects.create(
+            original_transaction=self.original,
+            reason=ReversalRequest.ReversalReason.FRAUD,
+            amount=amount,
+            requested_by=self.admin
+        )
+
+    def test_partial_then_full_reversal(self):
+        """Test partial reversals accumulate and the final one marks the original reversed"""
+        first = self.request_reversal(Decimal('400.00'))
+        second = self.request_reversal(Decimal('600.00'))
+        reversals.approve_reversals([first.id, second.id], self.admin)
+
+        reversals.process_reversal(first.id)
+        self.original.refresh_from_db()
+        self.assertEqual(self.original.trans_status, TransactionStatus.COMPLETED)
+        self.assertEqual(reversals.reversed_amount(self.original.id), Decimal('400.00'))
+
+        reversal_txn = reversals.process_reversal(second.id)
+        self.original.refresh_from_db()
+        self.sender.refresh_from_db()
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.original.trans_status, TransactionStatus.REVERSED)
+        self.assertEqual(reversal_txn.reversed_transaction, self.original)
+        self.assertEqual(self.sender.balance, Decimal('1500.00'))
+        self.assertEqual(self.receiver.balance, Decimal('500.00'))
+
+        entries = reversal_txn.ledger_entries.all()
+        self.assertEqual(entries.get(entry_type=LedgerEntryType.DEBIT).account, self.receiver)
+        self.assertEqual(entries.get(entry_type=LedgerEntryType.CREDIT).account, self.sender)
+
+    def test_reversal_over_remaining_amount_fails(self):
+        """Test the cumulative reversed amount cannot exceed the original"""
+        first = self.request_reversal(Decimal('800.00'))
+        second = self.request_reversal(Decimal('300.00'))
+        reversals.approve_reversals([first.id, second.id], self.admin)
+        reversals.process_reversal(first.id)
+
+        result = reversals.process_reversal_batch()
+        self.assertEqual(result['completed'], [])
+        self.assertEqual(result['failed'][0]['id'], str(second.id))
+
+        second.refresh_from_db()
+        self.assertEqual(second.status, ReversalRequest.ReversalStatus.FAILED)
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.receiver.balance, Decimal('700.00'))
+
+    def test_batch_only_processes_its_claims(self):
+        """Test a batch skips reversals it did not claim and never fails one that completed"""
+        claimed_elsewhere = self.request_reversal(Decimal('100.00'))
+        reversal = self.request_reversal(Decimal('200.00'))
+        reversals.approve_reversals([claimed_elsewhere.id, reversal.id], self.admin)
+        ReversalRequest.objects.filter(id=claimed_elsewhere.id).update(status=ReversalRequest.ReversalStatus.PROCESSING)
+
+        def completed_by_overlapping_batch(request_id):
+            ReversalRequest.objects.filter(id=request_id).update(status=ReversalRequest.ReversalStatus.COMPLETED)
+            raise reversals.ReversalError("Reversal is COMPLETED")
+
+        with mock.patch.object(reversals, 'process_reversal', side_effect=completed_by_overlapping_batch) as process:
+            result = reversals.process_reversal_batch()
+        process.assert_called_once_with(reversal.id)
+        self.assertEqual(result['failed'][0]['id'], str(reversal.id))
+
+        reversal.refresh_from_db()
+        claimed_elsewhere.refresh_from_db()
+        self.assertEqual(reversal.status, ReversalRequest.ReversalStatus.COMPLETED)
+        self.assertEqual(claimed_elsewhere.status, ReversalRequest.ReversalStatus.PROCESSING)
+
+    def test_only_pending_requests_are_approved(self):
+        """Test bulk approval skips requests that are no longer pending"""
+        pending = self.request_reversal(Decimal('100.00'))
+        rejected = self.request_reversal(Decimal('100.00'))
+        rejected.status = ReversalRequest.ReversalStatus.REJECTED
+        rejected.save()
+
+        approved_ids = reversals.approve_reversals([pending.id, rejected.id], self.admin)
+        self.assertEqual(approved_ids, [pending.id])
+        pending.refresh_from_db()
+        self.assertEqual(pending.approved_by, self.admin)
+
+
+class QueuedTransferTest(TestCase):
+    """Test suite for queued transfer execution"""
+
+    def setUp(self):
+        self.savings = AccountType.objects.create(name='SAVINGS', code='SAV', description='Savings')
+        self.source = create_customer_account('payer@test.com', self.savings, balance=Decimal('1000.00'))
+        self.destination = create_customer_account('payee@test.com', self.savings, balance=Decimal('0.00'))
+        AccountLimit.objects.create(
+            account=self.source,
+            daily_debit_limit=Decimal('50000.00'),
+            daily_credit_limit=Decimal('50000.00'),
+            single_transaction_debit_limit=Decimal('10000.00'),
+            single_transaction_credit_limit=Decimal('10000.00')
+        )
+        self.user = self.source.customer.user
+
+    def create_pending(self, amount, key='queued-1'):
+        return Transaction.objects.create(
+            transaction_ref=f"TXN-{key}",
+            transaction_type=TransactionType.INTERNAL_TRANSFER,
+            source_account=self.source,
+            destination_account=self.destination,
+            amount=amount,
+            initiated_by=self.user,
+            idempotency_key=key
+        )
+
+    def test_task_executes_pending_transfer_once(self):
+        """Test the worker completes a PENDING transfer and ignores redelivery"""
+        trans = self.create_pending(Decimal('250.00'))
+
+        result = execute_transaction_task(str(trans.id))
+        self.assertEqual(result['status'], TransactionStatus.COMPLETED)
+
+        result = execute_transaction_task(str(trans.id))
+        self.assertEqual(result['status'], TransactionStatus.COMPLETED)
+
+        self.source.refresh_from_db()
+        self.destination.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('750.00'))
+        self.assertEqual(self.destination.balance, Decimal('250.00'))
+        self.assertEqual(LedgerEntry.objects.filter(transaction=trans).count(), 2)
+
+    def test_task_marks_failed_on_insufficient_funds(self):
+        """Test a transfer that fails re-validation under lock is marked FAILED"""
+        trans = self.create_pending(Decimal('5000.00'))
+
+        execute_transaction_task(str(trans.id))
+        trans.refresh_from_db()
+        self.assertEqual(trans.trans_status, TransactionStatus.FAILED)
+        self.assertIn('Insufficient funds', trans.last_error)
+
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('1000.00'))
+
+    def test_task_revalidates_daily_limit_under_lock(self):
+        """Test usage recorded after the transfer was accepted fails it at execution"""
+        trans = self.create_pending(Decimal('250.00'))
+        limit = TransactionLimit.objects.get(
+            account=self.source, transaction_type=TransactionType.INTERNAL_TRANSFER, limit_type='DAILY'
+        )
+        TransactionLimit.objects.filter(id=limit.id).update(current_amount=limit.max_amount - Decimal('100.00'))
+
+        execute_transaction_task(str(trans.id))
+        trans.refresh_from_db()
+        self.assertEqual(trans.trans_status, TransactionStatus.FAILED)
+        self.assertIn('Daily limit exceeded', trans.last_error)
+
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('1000.00'))
+
+    @override_settings(TRANSFER_LANES=4)
+    def test_same_account_always_maps_to_same_lane(self):
+        """Test lane hashing is stable and within the configured lanes"""
+        lanes = {transfer_lane(self.source.id) for _ in range(5)}
+        self.assertEqual(len(lanes), 1)
+        self.assertIn(lanes.pop(), range(4))
+        self.assertEqual(
+            transfer_queue(self.source.id),
+            f"transfers.lane.{transfer_lane(self.source.id)}"
+        )
+
+    @override_settings(TRANSFER_EXECUTION_MODE='queued')
+    def test_queued_mode_returns_202_with_status_url(self):
+        """Test the API persists a PENDING transfer and returns a status URL"""
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+
+        response = client.post(
+            reverse('internal_transfer'),
+            {
+                'account_number': self.source.account_number,
+                'destination_account_number': self.destination.account_number,
+                'amount': 100,
+                'transaction_type': 'internal_transfer'
+            },
+            format='json',
+            HTTP_IDEMPOTENCY_KEY='queued-api-1'
+        )
+        self.assertEqual(response.status_code, 202)
+        trans = Transaction.objects.get(idempotency_key='queued-api-1')
+        self.assertEqual(trans.trans_status, TransactionStatus.PENDING)
+
+        status_response = client.get(response.data['status_url'])
+        self.assertEqual(status_response.status_code, 200)
+        self.assertEqual(status_response.data['status'], TransactionStatus.PENDING)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_REPLICA_MAX_LAG=5, READ_YOUR_WRITES_SECONDS=5)
+class ReplicaRoutingTest(TestCase):
+    """Test suite for read replica routing"""
+
+    def setUp(self):
+        cache.clear()
+        # measured just now, so no lag query runs
+        replica_lag.lags = {'replica': (time.monotonic(), 0.0)}
+        self.savings = AccountType.objects.create(name='SAVINGS', code='SAV', description='Savings')
+        self.account = create_customer_account('reader@test.com', self.savings, balance=Decimal('500.00'))
+        self.user = self.account.customer.user
+
+    def tearDown(self):
+        replica_lag.clear()
+
+    def test_fresh_replica_is_chosen(self):
+        """Test reads go to a replica within the allowed lag"""
+        self.assertEqual(choose_replica(self.user), 'replica')
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        """Test a replica behind by more than the allowed lag is skipped"""
+        replica_lag.lags['replica'] = (time.monotonic(), 30.0)
+        self.assertIsNone(choose_replica(self.user))
+
+    def test_user_is_pinned_to_primary_after_write(self):
+        """Test a user reads from the primary right after writing"""
+        pin_to_primary(self.user)
+        self.assertIsNone(choose_replica(self.user))
+        self.assertEqual(choose_replica(None), 'replica')
+
+    def test_transfer_pins_user(self):
+        """Test a successful write through the API pins the user to the primary"""
+        destination = create_customer_account('payee@test.com', self.savings)
+        AccountLimit.objects.create(
+            account=self.account,
+            daily_debit_limit=Decimal('50000.00'),
+            daily_credit_limit=Decimal('50000.00'),
+            single_transaction_debit_limit=Decimal('10000.00'),
+            single_transaction_credit_limit=Decimal('10000.00')
+        )
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+
+        response = client.post(
+            reverse('internal_transfer'),
+            {
+                'account_number': self.account.account_number,
+                'destination_account_number': destination.account_number,
+                'amount': 100,
+                'transaction_type': 'internal_transfer'
+            },
+            format='json',
+            HTTP_IDEMPOTENCY_KEY='replica-pin-1'
+        )
+        self.assertLess(response.status_code, 400)
+        self.assertIsNone(choose_replica(self.user))
+
+    def test_history_resets_read_alias(self):
+        """Test a history request leaves no replica selected behind it"""
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+
+        response = client.get(reverse('transaction_history', args=[self.account.account_number]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(read_alias.get())
+
+
+class PrimaryReplicaRouterTest(SimpleTestCase):
+    """Test suite for the primary/replica database router"""
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_follow_selected_replica(self):
+        """Test reads use the request's replica and writes the primary"""
+        token = read_alias.set('replica')
+        try:
+            self.assertEqual(self.router.db_for_read(Transaction), 'replica')
+            self.assertEqual(self.router.db_for_write(Transaction), PRIMARY)
+        finally:
+            read_alias.reset(token)
+        self.assertEqual(self.router.db_for_read(Transaction), PRIMARY)
+
+    def test_reads_inside_transaction_use_primary(self):
+        """Test reads inside an atomic block on the primary never go to a replica"""
+        token = read_alias.set('replica')
+        try:
+            with mock.patch.object(connections[PRIMARY], 'in_atomic_block', True):
+                self.assertEqual(self.router.db_for_read(Transaction), PRIMARY)
+        finally:
+            read_alias.reset(token)
+
+    def test_migrations_only_on_primary(self):
+        """Test replicas are never migrated"""
+        self.assertTrue(self.router.allow_migrate(PRIMARY, 'transactions'))
+        self.assertFalse(self.router.allow_migrate('replica', 'transactions'))
+
+
+class PartitionHelpersTest(SimpleTestCase):
+    """Test suite for monthly partition helpers"""
+
+    def test_months_roll_over_years(self):
+        """Test month arithmetic and partition naming across a year end"""
+        self.assertEqual(partitions.add_months(date(2026, 11, 1), 3), date(2027, 2, 1))
+        self.assertEqual(partitions.add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(partitions.partition_name('transactions', date(2027, 2, 1)), 'transactions_p202702')
+        self.assertEqual(partitions.partition_month('transactions', 'transactions_p202702'), date(2027, 2, 1))
+        self.assertIsNone(partitions.partition_month('transactions', 'transactions_legacy'))
+
+    def test_unique_indexes_stay_global(self):
+        """Test unique indexes become plain parent indexes with their keys claimed by the trigger"""
+        unique = 'CREATE UNIQUE INDEX transactions_transaction_ref_key ON public.transactions USING btree (transaction_ref)'
+        self.assertEqual(
+            partitions.parent_index_sql(unique),
+            'CREATE INDEX transactions_transaction_ref_key ON public.transactions USING btree (transaction_ref)'
+        )
+        self.assertEqual(partitions.unique_index_columns(unique), ('transactions_transaction_ref_key', ['transaction_ref']))
+        plain = 'CREATE INDEX transactions_external_idx ON public.transactions USING btree (external_ref)'
+        self.assertEqual(partitions.parent_index_sql(plain), plain)
+        with self.assertRaises(partitions.PartitionError):
+            partitions.parent_index_sql('CREATE UNIQUE INDEX upper_ref ON public.transactions USING btree (upper(transaction_ref))')
+
+        function, trigger = partitions.unique_keys_trigger_sql('transactions', [('transactions_transaction_ref_key', ['transaction_ref'])])
+        self.assertIn(
+            "IF NEW.transaction_ref IS NOT NULL THEN INSERT INTO partition_unique_keys VALUES "
+            "('transactions', 'transactions_transaction_ref_key', json_build_array(NEW.transaction_ref)::text); END IF;",
+            function
+        )
+        self.assertIn("value = json_build_array(OLD.transaction_ref)::text", function)
+        self.assertIn('AFTER INSERT OR UPDATE OR DELETE ON transactions FOR EACH ROW', trigger)
+
+    def test_date_bounded_filters_partition_key(self):
+        """Test date bounds become constant created_at filters"""
+        sql = str(partitions.date_bounded(Transaction.objects.all(), date(2026, 1, 1), date(2026, 2, 1)).query)
+        self.assertIn('"transactions"."created_at" >= 2026-01-01', sql)
+        self.assertIn('"transactions"."created_at" < 2026-02-01', sql)
+
+    def test_command_needs_postgres(self):
+        """Test the partition command refuses to run on SQLite"""
+        with self.assertRaises(CommandError):
+            call_command('partition_tables')
+
+
+class CachedQueryTest(TestCase):
+    """Test suite for the shared read-through cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def loader(self):
+        self.calls += 1
+        return self.calls
+
+    def test_results_cached_until_invalidated(self):
+        """Test the loader runs once per generation of the namespace"""
+        self.assertEqual(shared_cache.cached_query('test', 'key', self.loader), 1)
+        self.assertEqual(shared_cache.cached_query('test', 'key', self.loader), 1)
+        shared_cache.invalidate('test')
+        self.assertEqual(shared_cache.cached_query('test', 'key', self.loader), 2)
+
+    def test_evicted_generation_invalidates_entries(self):
+        """Test entries left behind by a lost generation counter are not served"""
+        shared_cache.cached_query('test', 'key', self.loader)
+        cache.delete(shared_cache.generation_key('test'))
+        self.assertEqual(shared_cache.cached_query('test', 'key', self.loader), 2)
+
+    def test_early_expiration_grows_near_expiry(self):
+        """Test entries are refreshed early only when expiry is close relative to the load time"""
+        now = time.time()
+        entry = {'value': 1, 'generation': 1, 'delta': 0.1}
+        self.assertTrue(shared_cache.fresh(dict(entry, expires=now + 60), 1))
+        self.assertFalse(shared_cache.fresh(dict(entry, expires=now - 1), 1))
+        self.assertFalse(shared_cache.fresh(dict(entry, expires=now + 60), 2))
+        with mock.patch('bank.cache.random.random', return_value=0.99999):
+            # ln(1 - 0.99999) * 10s load time puts the recompute 115s early
+            self.assertFalse(shared_cache.fresh(dict(entry, delta=10, expires=now + 60), 1))
+
+    @override_settings(CACHE_LOCK_WAIT=0.2)
+    def test_rolled_back_writes_are_never_cached(self):
+        """Test a transaction reads its own invalidated namespace uncached, and a rollback keeps the entries"""
+        shared_cache.cached_query('test', 'key', self.loader)
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            shared_cache.invalidate('test')
+            # loaded from the uncommitted write, not stored for anyone else
+            self.assertEqual(shared_cache.cached_query('test', 'key', self.loader), 2)
+            self.assertEqual(shared_cache.cached_query('test', 'key', self.loader), 3)
+            raise RuntimeError
+
+        self.assertEqual(shared_cache.cached_query('test', 'key', self.loader), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            shared_cache.invalidate('test')
+        self.assertEqual(shared_cache.cached_query('test', 'key', self.loader), 4)
+        self.assertEqual(shared_cache.cached_query('test', 'key', self.loader), 4)
+
+    def test_single_flight(self):
+        """Test readers that miss the lock serve the previous value, or wait for the reload"""
+        shared_cache.cached_query('test', 'key', self.loader, timeout=0)
+        lock = f"{shared_cache.entry_key('test', 'key')}:lock"
+        cache.add(lock, True)
+
+        self.assertEqual(shared_cache.cached_query('test', 'key', self.loader, timeout=0), 1)
+        self.assertEqual(self.calls, 1)
+
+        # invalidated, nothing to serve: waits out CACHE_LOCK_WAIT, then loads itself
+        shared_cache.bump_generation('test')
+        self.assertEqual(shared_cache.cached_query('test', 'key', self.loader), 2)
+
+
+class FeeRuleCacheTest(TestCase):
+    """Test suite for cached fee rule lookups"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_fee_follows_rule_changes(self):
+        """Test fee lookups are served from the cache and reloaded when rules change"""
+        self.assertEqual(calculate_transaction_fee(Decimal('500'), TransactionType.INTERNAL_TRANSFER), Decimal('0.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            rule = FeeRule.objects.create(
+                transaction_type=TransactionType.INTERNAL_TRANSFER,
+                min_amount=Decimal('100'),
+                max_amount=Decimal('1000'),
+                fee_amount=Decimal('15.00')
+            )
+        self.assertEqual(calculate_transaction_fee(Decimal('500'), TransactionType.INTERNAL_TRANSFER), Decimal('15.00'))
+        with self.assertNumQueries(0):
+            self.assertEqual(calculate_transaction_fee(Decimal('1000'), TransactionType.INTERNAL_TRANSFER), Decimal('15.00'))
+            self.assertEqual(calculate_transaction_fee(Decimal('1001'), TransactionType.INTERNAL_TRANSFER), Decimal('0.00'))
+
+        rule.is_active = False
+        rule.save()
+        self.assertEqual(calculate_transaction_fee(Decimal('500'), TransactionType.INTERNAL_TRANSFER), Decimal('0.00'))
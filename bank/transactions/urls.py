@@ -1,7 +1,13 @@
 from django.urls import path,include
+from django.conf import settings
 from .views import *
 
+# the async transfer view only pays off on the uvicorn workers (bank.asgi)
+internal_transfer_view = HandleInternalTransactionAsync if settings.ASYNC_VIEWS else HandleInternalTransaction
+
 urlpatterns = [
-    path('internal_transfer/',HandleInternalTransaction.as_view(),name="internal_transfer" ),
-    path('history/<int:account_number>/', HandleTransactionHistory.as_view(), name="transaction_history")
+    path('internal_transfer/',internal_transfer_view.as_view(),name="internal_transfer" ),
+    path('status/<uuid:transaction_id>/', TransactionStatusView.as_view(), name="transaction_status"),
+    path('history/<int:account_number>/', HandleTransactionHistory.as_view(), name="transaction_history"),
+    path('reversals/approve/', ReversalApprovalView.as_view(), name="approve_reversals")
 ]
@@ -12,7 +12,7 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.exceptions import AuthenticationFailed,APIException
 from rest_framework.permissions import IsAuthenticated,BasePermission
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.utils import timezone
@@ -23,7 +23,15 @@ from .metrics import *
 from .documentation import v1
 from .tasks import *
 from .services import utility,validations
+from .services.posting import lock_accounts
+from .services.reversals import approve_reversals
+from fraud_service.services.engine import fraud_engine
 from django.db import transaction as db_transaction
+from django.conf import settings
+from django.urls import reverse
+from bank.routers import ReplicaReadMixin
+from bank.async_views import AsyncAPIView, http_client
+from asgiref.sync import sync_to_async
 import logging
 import requests
 
@@ -262,19 +270,13 @@ def validate_accounts(source_id, destination_id):
 def calculate_transaction_fee(amount, transaction_type):
     logger.debug(f"Calculating fee for amount={amount}, type={transaction_type}")
     
-    rule = FeeRule.objects.filter(
-        transaction_type=transaction_type,
-        min_amount__lte=amount,
-        max_amount__gte=amount,
-        is_active=True
-    ).first()
+    for min_amount, max_amount, fee_amount in FeeRule.active_bands(transaction_type):
+        if min_amount <= amount <= max_amount:
+            logger.debug(f"Fee calculated: {fee_amount}")
+            return fee_amount
 
-    if not rule:
-        logger.debug(f"No fee rule found, returning 0")
-        return Decimal('0.00')
-
-    logger.debug(f"Fee calculated: {rule.fee_amount}")
-    return rule.fee_amount
+    logger.debug(f"No fee rule found, returning 0")
+    return Decimal('0.00')
 
 
 def check_available_balance(account, amount, fee):
@@ -381,18 +383,47 @@ def create_ledger_entries(transaction, source_account, dest_account):
     
     return entries
 
-def update_transaction_limits(transaction):
+def lock_transaction_limit(transaction):
     """
-    Increments current usage in TransactionLimit
+    Locks the daily TransactionLimit and re-validates it, the check made before
+    the lock may be stale by the time the transaction executes
     """
-    logger.debug(f"Updating transaction limits for transaction {transaction.id}")
+    logger.debug(f"Locking transaction limits for transaction {transaction.id}")
     
     limit = TransactionLimit.objects.select_for_update().get(
-        account=transaction.source_account,
+        account_id=transaction.source_account_id,
         transaction_type=transaction.transaction_type,
         limit_type='DAILY'
     )
     
+    if timezone.now() > limit.reset_at:
+        logger.info(f"Resetting daily limit for account {transaction.source_account_id}")
+        limit.current_amount = Decimal('0.00')
+        limit.current_count = 0
+        limit.reset_at = timezone.now().replace(hour=0, minute=0) + timedelta(days=1)
+        limit.save(update_fields=['current_amount', 'current_count', 'reset_at', 'updated_at'])
+    
+    if limit.is_active:
+        if (limit.current_amount + transaction.amount) > limit.max_amount:
+            logger.warning(f"Daily limit exceeded under lock for account {transaction.source_account_id}")
+            raise LimitExceeded(
+                f"Daily limit exceeded. Used: {limit.current_amount}, "
+                f"Requesting: {transaction.amount}, Limit: {limit.max_amount}"
+            )
+        if (limit.current_count + 1) > limit.max_count:
+            logger.warning(f"Daily transaction count exceeded under lock for account {transaction.source_account_id}")
+            raise LimitExceeded(
+                f"Daily transaction count exceeded. "
+                f"Count: {limit.current_count}/{limit.max_count}"
+            )
+    
+    return limit
+
+def update_transaction_limits(limit, transaction):
+    """
+    Increments current usage in the TransactionLimit locked by lock_transaction_limit
+    """
+    logger.debug(f"Updating transaction limits for transaction {transaction.id}")
     logger.debug(f"Previous limit usage: {limit.current_amount}, count: {limit.current_count}")
     
     # Atomic increment
@@ -416,14 +447,14 @@ def execute_transaction(transaction_obj):
     
     # Step 1: Lock accounts (order by ID to prevent deadlock)
     logger.debug(f"Acquiring locks on accounts")
-        
-    source_account = Account.objects.select_for_update().get(
-        id=transaction_obj.source_account_id
-    )
 
-    destination_account = Account.objects.select_for_update().get(
-        id=transaction_obj.destination_account_id
-    )
+    with transaction_lock_wait_seconds.labels(transaction_type=transaction_obj.transaction_type).time():
+        locked = lock_accounts(
+            transaction_obj.source_account_id,
+            transaction_obj.destination_account_id
+        )
+    source_account = locked[transaction_obj.source_account_id]
+    destination_account = locked[transaction_obj.destination_account_id]
 
     logger.debug(f"Locks acquired on accounts {source_account.id} and {destination_account.id}")
     
@@ -434,6 +465,8 @@ def execute_transaction(transaction_obj):
         transaction_obj.amount, 
         transaction_obj.fee
     )
+    logger.debug(f"Re-validating daily limits after lock")
+    limit = lock_transaction_limit(transaction_obj)
     
     # Step 3: Update transaction to PROCESSING
     logger.debug(f"Updating transaction {transaction_obj.id} to PROCESSING")
@@ -485,7 +518,7 @@ def execute_transaction(transaction_obj):
     
     # Step 10: Update transaction limits
     logger.debug(f"Updating transaction limits")
-    update_transaction_limits(transaction_obj)
+    update_transaction_limits(limit, transaction_obj)
     
     # Step 11: Mark transaction as completed
     logger.info(f"Marking transaction {transaction_obj.id} as COMPLETED")
@@ -526,6 +559,15 @@ class HandleInternalTransaction(APIView):
     permission_classes = [IsAuthenticated, IsCustomer]
     
     def post(self,request):
+        transfer = self.prepare(request)
+        if isinstance(transfer, Response):
+            return transfer
+
+        fraud_data = self.remote_fraud_check(transfer) if settings.FRAUD_ENGINE_MODE == 'remote' else None
+        return self.complete(request, transfer, fraud_data)
+
+    def prepare(self, request):
+        """Validate the request, returns the transfer to run or an error Response"""
         logger.info(f"Internal transaction request from user {request.user.id}")
         
         user = request.user
@@ -585,51 +627,88 @@ class HandleInternalTransaction(APIView):
         fee = calculate_transaction_fee(amount, transaction_type)
         logger.debug(f"Transaction fee calculated: {fee}")
 
-        fraud_log = None
-        fraud_data = None
+        return {
+            'user': user,
+            'source_acc': source_acc,
+            'dest_acc': dest_acc,
+            'amount': amount,
+            'fee': fee,
+            'transaction_type': transaction_type,
+            'idempotency_key': idempotency_Key,
+        }
+
+    def fraud_request(self, transfer):
+        return {
+            'amount':float(transfer['amount']),
+            'account_id':transfer['source_acc'].account_number,
+            'destination_account':transfer['dest_acc'].account_number,
+            'transaction_type':transfer['transaction_type']
+        }
+
+    def fraud_check_failed(self, transfer, error):
+        logger.error(f"Error checking fraud detection, using local rules: {str(error)}")
+        #update failed metrics counnt for fraud
+        fraud_detection_failed_total.labels(
+            fraud_type=transfer['transaction_type'],
+            failure_reason='service_unavailable'
+        ).inc()
 
+    def remote_fraud_check(self, transfer):
+        """Decision of the fraud service, None when it errors or times out"""
         try:
             fraud_response = requests.post(
-                'http://localhost:8080/api/v1.0/fraud/check',
-
-                json = {
-                    'amount':float(amount),
-                    'account_id':source_acc.account_number,
-                    'destination_account':dest_acc.account_number,
-                    'transaction_type':transaction_type
-                },
-                timeout=0.1 
+                settings.FRAUD_SERVICE_URL,
+                json = self.fraud_request(transfer),
+                timeout=settings.FRAUD_SERVICE_TIMEOUT
             )
-
             fraud_data = fraud_response.json()
+            if 'decision' not in fraud_data:
+                raise ValueError(f"Unexpected fraud service response: {fraud_response.status_code}")
+            return fraud_data
+
+        except Exception as e:
+            self.fraud_check_failed(transfer, e)
+            return None
+
+    def complete(self, request, transfer, fraud_data):
+        """Record the fraud check and post or queue the transfer"""
+        user = transfer['user']
+        source_acc = transfer['source_acc']
+        dest_acc = transfer['dest_acc']
+        amount = transfer['amount']
+        fee = transfer['fee']
+        transaction_type = transfer['transaction_type']
+        idempotency_Key = transfer['idempotency_key']
+        fraud_log = None
+
+        # in-process rules: the primary check in local mode, the fallback instead of failing open in remote mode
+        if fraud_data is None:
+            with fraud_check_duration_seconds.labels(fraud_type=transaction_type).time():
+                fraud_data = fraud_engine.check(
+                    source_acc.account_number, amount, transaction_type, counterparty=dest_acc.account_number
+                )
 
-            # save the response from the fr
+        try:
+            # save the response from the fraud check
             from fraud_service.models import FraudDetection
             fraud_log = FraudDetection.objects.create(
                 account_number = source_acc.account_number,
                 amount = amount,
+                transaction_type = transaction_type,
                 risk_score = fraud_data.get('risk_score',0),
                 decision = fraud_data.get('decision','APPROVE'),
                 reason = fraud_data.get('reason',''),
                 flags = fraud_data.get('flags',[]),
-                processing_time_ms = int(fraud_data.get('processing_time_ms','0ms').replace('ms',''))                       
+                processing_time_ms = int(str(fraud_data.get('processing_time_ms','0ms')).replace('ms',''))
             )
             logger.info(f'fraud log created and saved {fraud_data}')
-
-            if fraud_data['decision'] == 'BLOCK':
-                return Response({
-                    "error":fraud_data['reason']
-                }, status=status.HTTP_403_FORBIDDEN)
-
-        
         except Exception as e:
-            logger.error(f"Error checking fraud detection: {str(e)}")
-            #update failed metrics counnt for fraud
-            fraud_detection_failed_total.labels(
-                fraud_type=transaction_type,
-                failure_reason='service_unavailable'
-            ).inc()
-            pass
+            logger.error(f"Error saving fraud check: {str(e)}")
+
+        if fraud_data['decision'] == 'BLOCK':
+            return Response({
+                "error":fraud_data['reason']
+            }, status=status.HTTP_403_FORBIDDEN)
         
         try:
             # check available balance
@@ -675,6 +754,9 @@ class HandleInternalTransaction(APIView):
                             trans.trans_status = TransactionStatus.PENDING
                             trans.retry_count += 1
                             trans.save()
+                            if settings.TRANSFER_EXECUTION_MODE == 'queued':
+                                retry_trans = trans
+                                transaction.on_commit(lambda: enqueue_transfer(retry_trans))
                             return Response({
                                 "message": "Transaction failed, retrying",
                                 "transaction_id": trans.id,
@@ -690,23 +772,47 @@ class HandleInternalTransaction(APIView):
                 
                 # create transaction object
                 logger.debug(f"Creating transaction object")
-                trans = Transaction.objects.create(
-                    source_account=source_acc,
-                    destination_account=dest_acc,
-                    amount=amount,
-                    transaction_type=transaction_type,
-                    idempotency_key=idempotency_Key,
-                    trans_status=TransactionStatus.PENDING,
-                    metadata={'request_params': request.data},
-                    initiated_by=user,
-                    transaction_ref=generate_transaction_ref(),
-                    fee = fee
-                )
+                try:
+                    # the lookup above locks nothing for a new key: a concurrent request with
+                    # the same key waits on this insert and then fails on the unique key
+                    with transaction.atomic():
+                        trans = Transaction.objects.create(
+                            source_account=source_acc,
+                            destination_account=dest_acc,
+                            amount=amount,
+                            transaction_type=transaction_type,
+                            idempotency_key=idempotency_Key,
+                            trans_status=TransactionStatus.PENDING,
+                            metadata={'request_params': request.data},
+                            initiated_by=user,
+                            transaction_ref=generate_transaction_ref(),
+                            fee = fee
+                        )
+                except IntegrityError:
+                    logger.info(f"Concurrent request with idempotency key {idempotency_Key}")
+                    return Response({
+                        "message": "Transaction is still processing",
+                    }, status=status.HTTP_409_CONFLICT)
                 logger.debug(f"Transaction object created: {trans.id}")
 
                 if fraud_log:
                     fraud_log.transaction = trans
                     fraud_log.save(update_fields=['transaction'])
+
+                if settings.TRANSFER_EXECUTION_MODE == 'queued':
+                    # publish only once the PENDING row is committed and visible to the worker
+                    queued_trans = trans
+                    transaction.on_commit(lambda: enqueue_transfer(queued_trans))
+
+                    logger.info(f"Transaction queued for execution: {trans.id}")
+                    return Response({
+                        "message": "Transaction accepted for processing",
+                        "transaction_id": trans.id,
+                        "transaction_ref": trans.transaction_ref,
+                        "status": trans.trans_status,
+                        "status_url": reverse('transaction_status', args=[trans.id]),
+                        "fraud_check": fraud_data['reason'] if fraud_data else None
+                    }, status=status.HTTP_202_ACCEPTED)
                 
                 # execute transaction
                 logger.debug(f"Executing transaction")
@@ -728,8 +834,66 @@ class HandleInternalTransaction(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class HandleInternalTransactionAsync(AsyncAPIView, HandleInternalTransaction):
+    """
+    internal transfer with the fraud service awaited on the event loop,
+    only the validation reads and the posting run in a thread
+    """
+
+    async def post(self, request):
+        transfer = await sync_to_async(self.prepare)(request)
+        if isinstance(transfer, Response):
+            return transfer
+
+        fraud_data = await self.aremote_fraud_check(transfer) if settings.FRAUD_ENGINE_MODE == 'remote' else None
+        return await sync_to_async(self.complete)(request, transfer, fraud_data)
+
+    async def aremote_fraud_check(self, transfer):
+        client = http_client('fraud', timeout=settings.FRAUD_SERVICE_TIMEOUT)
+        try:
+            fraud_response = await client.post(settings.FRAUD_SERVICE_URL, json=self.fraud_request(transfer))
+            fraud_data = fraud_response.json()
+            if 'decision' not in fraud_data:
+                raise ValueError(f"Unexpected fraud service response: {fraud_response.status_code}")
+            return fraud_data
+
+        except Exception as e:
+            self.fraud_check_failed(transfer, e)
+            return None
 
-class HandleTransactionHistory(APIView):
+
+class TransactionStatusView(APIView):
+    """
+    poll the status of a transaction, used for queued transfers
+    """
+    permission_classes = [IsAuthenticated, IsCustomer]
+
+    def get(self, request, transaction_id):
+        trans = get_object_or_404(
+            Transaction.objects.select_related('source_account__customer__user'),
+            id=transaction_id
+        )
+
+        if trans.initiated_by_id != request.user.id:
+            try:
+                authorize_user(request.user, trans.source_account)
+            except PermissionDenied as e:
+                return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
+
+        return Response({
+            "transaction_id": trans.id,
+            "transaction_ref": trans.transaction_ref,
+            "status": trans.trans_status,
+            "amount": trans.amount,
+            "fee": trans.fee,
+            "currency": trans.currency,
+            "error": trans.last_error or None,
+            "created_at": trans.created_at,
+            "completed_at": trans.completed_at,
+        }, status=status.HTTP_200_OK)
+
+
+class HandleTransactionHistory(ReplicaReadMixin, APIView):
     
     permission_classes = [IsAuthenticated, IsCustomer]
     
@@ -856,3 +1020,34 @@ class HandleTransactionHistory(APIView):
         
         return queryset
 
+
+class ReversalApprovalView(APIView):
+    """
+    bank staff approve many reversal requests at once, execution runs in one worker batch
+    """
+    permission_classes = [IsAuthenticated, CanApproveReversals]
+
+    def post(self, request):
+        reversal_ids = request.data.get('reversal_ids') or []
+
+        if not isinstance(reversal_ids, list) or not reversal_ids:
+            return Response({"error": "reversal_ids must be a non empty list"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with db_transaction.atomic():
+                approved_ids = approve_reversals(reversal_ids, request.user)
+                batch_ids = [str(reversal_id) for reversal_id in approved_ids]
+                if batch_ids:
+                    db_transaction.on_commit(lambda: process_reversals_task.delay(batch_ids))
+
+            return Response({
+                "message": f"{len(batch_ids)} reversals approved and queued for processing",
+                "approved": batch_ids,
+                "skipped": len(reversal_ids) - len(batch_ids),
+            }, status=status.HTTP_202_ACCEPTED)
+
+        except (ValidationError, ValueError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Reversal approval failed: {str(e)}", exc_info=True)
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)